@@ -6,19 +6,86 @@ FIXED: Uses the working publish_position.sh method for position reporting
 
 import requests
 import os
+import io
+import sys
 import time
+import asyncio
 import threading
 import subprocess
 import logging
+import re
 import json
+import gzip
+import bisect
+import sqlite3
+import hashlib
+import uuid
+import queue
+import mmap
+import struct
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+from collections import namedtuple, OrderedDict
 from datetime import datetime
 from flask import Flask, Response, send_file, jsonify, request
 import paho.mqtt.client as mqtt
 
+# Optional ASGI server, only needed for SERVER_MODE = "asgi"
+try:
+    import uvicorn
+except ImportError:
+    uvicorn = None
+
+# Optional NumPy, needed for the fitted calibration model
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+# Optional JPEG decoders for on-device image analysis, OpenCV is preferred
+try:
+    import cv2
+except ImportError:
+    cv2 = None
+
+try:
+    from PIL import Image
+except ImportError:
+    Image = None
+
+# Optional Brotli for precompressed UI assets, gzip is always available
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+# Optional Picamera2, lets the stream change the lens position without a restart
+try:
+    from picamera2 import Picamera2, MappedArray
+    from picamera2.encoders import MJPEGEncoder
+    from picamera2.outputs import Output as Picamera2Output
+except ImportError:
+    Picamera2 = None
+
+# Optional Moonraker websocket client (websocket-client package)
+try:
+    import websocket
+except ImportError:
+    websocket = None
+
 
 # Tool management configuration
 TOOLS_CONFIG_FILE = "/home/pi/tools_config.json"
 tools_config = {"tools": [], "camera_reference": None}
+# tools_config is authoritative in memory, changes are written out once no
+# further change arrived for this many seconds
+TOOLS_SAVE_DELAY = 1.0
+tools_config_lock = threading.RLock()
+tools_config_version = 0
+# Version last written to TOOLS_CONFIG_FILE, writes are serialised by the lock
+tools_saved_version = 0
+tools_write_lock = threading.Lock()
+tools_save_timer = None
 
 # Configure logging with more detailed output
 logging.basicConfig(
@@ -32,18 +99,95 @@ logger = logging.getLogger("camera_flask_mqtt")
 
 # Camera settings
 CAPTURE_DIR = "/home/pi/captures"
+CAPTURE_INDEX_FILE = os.path.join(CAPTURE_DIR, "captures.db")
+THUMBNAIL_DIR = os.path.join(CAPTURE_DIR, "thumbs")
 CALIBRATION_DIR = "/home/pi/calibration"
+FOCUS_CACHE_FILE = os.path.join(CALIBRATION_DIR, "focus_cache.json")
+CAPTURE_PROFILES_FILE = os.path.join(CALIBRATION_DIR, "capture_profiles.json")
 HTTP_PORT = 8080
+# "threaded" runs the Flask development server with one thread per request,
+# "asgi" serves the same routes from uvicorn with native async streams
+SERVER_MODE = os.environ.get("DAKASH_SERVER_MODE", "threaded")
+ASGI_EXECUTOR_WORKERS = 4
 STREAM_ACTIVE = False
 STREAM_WIDTH = 1280
 STREAM_HEIGHT = 720
 CAPTURE_WIDTH = 4656
 CAPTURE_HEIGHT = 3496
 STREAM_QUALITY = "medium"
+# JPEG quality the backend encodes the stream at for each STREAM_QUALITY
+STREAM_QUALITY_SETTINGS = {"low": 60, "medium": 75, "high": 90}
+
+# Named capture profiles, selectable per capture request
+#   width/height: output size, None means CAPTURE_WIDTH/CAPTURE_HEIGHT
+#   roi: [x, y, width, height] sensor crop as fractions of the full frame
+#   mode: libcamera sensor mode "W:H:bit-depth:packing", e.g. a 2x2 binned mode
+#   quality: JPEG quality, encoding: jpg, png or yuv420, raw: also save a DNG
+CAPTURE_PROFILES = {
+    "full": {"width": None, "height": None, "roi": None, "mode": None, "quality": 93,
+             "encoding": "jpg", "raw": False},
+    "binned": {"width": 2328, "height": 1748, "roi": None, "mode": "2328:1748:10:P", "quality": 90,
+               "encoding": "jpg", "raw": False},
+    "nozzle": {"width": 1164, "height": 874, "roi": [0.375, 0.375, 0.25, 0.25], "mode": "2328:1748:10:P",
+               "quality": 90, "encoding": "jpg", "raw": False},
+    "raw": {"width": None, "height": None, "roi": None, "mode": None, "quality": 93,
+            "encoding": "jpg", "raw": True},
+    "yuv": {"width": None, "height": None, "roi": None, "mode": None, "quality": None,
+            "encoding": "yuv420", "raw": False}
+}
+CAPTURE_PROFILE = "full"
+# Profile whose roi/mode the stream uses, None streams the full sensor
+STREAM_PROFILE = None
 
 # Focus settings
 FOCUS_MODE = "auto"
 FOCUS_POSITION = 13.5
+FOCUS_MIN = 0.0
+FOCUS_MAX = 30.0
+
+# Focus sweep: coarse steps over the lens range, then a finer pass around the best
+FOCUS_SWEEP_STEPS = 11
+FOCUS_SWEEP_REFINE_STEPS = 5
+# Time for the lens to settle after a position change before a frame is scored
+FOCUS_SETTLE_TIME = 0.1
+FOCUS_SHARPNESS_DOWNSCALE = 4
+FOCUS_ROI_FRACTION = 0.5
+# Window (stream pixels) over which per-pixel sharpness is averaged when stacking
+FOCUS_STACK_WINDOW = 9
+
+# Lens position and exposure remembered per (tool, Z bucket), used instead of
+# autofocus/auto exposure while captures stay as sharp as when they were cached
+FOCUS_CACHE_Z_BUCKET_MM = 0.5
+FOCUS_CACHE_MIN_SHARPNESS_RATIO = 0.7
+CAPTURE_TIMEOUT_MS = 2000
+# Nothing has to converge with cached settings, so the still is taken almost at once
+CAPTURE_CACHED_TIMEOUT_MS = 300
+
+# Stream backend settings
+# "libcamera-vid" keeps one MJPEG encoder process running for the whole stream,
+# "file" replays JPEGs from FAKE_FRAME_DIR so the stream can be tested without a camera
+STREAM_BACKEND = os.environ.get("DAKASH_STREAM_BACKEND", "libcamera-vid")
+STREAM_FRAMERATE = 30
+STREAM_RING_SIZE = 4
+# Variants offered to stream viewers, best first: name -> (downscale, JPEG
+# quality). "full" is the backend stream itself, the others are transcoded
+# once per frame while at least one viewer is on them.
+STREAM_TIERS = OrderedDict([("full", (1, None)), ("medium", (2, 70)), ("low", (4, 50))])
+# Seconds of send timing collected before a viewer's tier is reconsidered
+STREAM_ADAPT_INTERVAL = 2.0
+# A viewer moves up a tier only if it drains this much faster than the tier needs
+STREAM_ADAPT_HEADROOM = 1.5
+# ...and moves down once sending takes more than this share of its time
+STREAM_ADAPT_BUSY_FRACTION = 0.6
+# Luma (Y plane) frames for analysis, kept in a shared memory ring so other
+# processes can map them too. A consumer's array stays valid until
+# LUMA_RING_SLOTS - 1 newer frames were published.
+LUMA_SHM_PATH = "/dev/shm/dakash_luma"
+LUMA_RING_SLOTS = 3
+# Backends without a native YUV output decode JPEGs to luma only while
+# someone asked for luma within this many seconds
+LUMA_DEMAND_WINDOW = 2.0
+FAKE_FRAME_DIR = os.environ.get("DAKASH_FAKE_FRAME_DIR", "/home/pi/fake_frames")
 
 # MQTT Settings
 MQTT_BROKER = "192.168.1.89"
@@ -54,6 +198,49 @@ MQTT_STATUS_TOPIC = "dakash/camera/status"
 MQTT_KLIPPER_GCODE_TOPIC = "dakash/klipper/gcode"
 MQTT_KLIPPER_POSITION_RESPONSE = "dakash/klipper/position/response"
 MQTT_CALIBRATION_TOPIC = "dakash/camera/calibration"
+MQTT_FIDUCIAL_TOPIC = "dakash/camera/fiducial"
+MQTT_CAPTURE_TOPIC = "dakash/camera/capture"
+# Status messages are coalesced and sent at most once per this many seconds,
+# as deltas of the fields that changed plus a retained full snapshot every
+# STATUS_FULL_INTERVAL seconds
+STATUS_MIN_INTERVAL = 1.0
+STATUS_FULL_INTERVAL = 60.0
+
+# Klipper (Moonraker) API settings
+KLIPPER_API_HOST = "192.168.1.89"
+KLIPPER_API_TIMEOUT = 3
+# Default staleness budget for position reads, a cached position younger than
+# this is returned from memory without asking Klipper
+POSITION_MAX_AGE_MS = 200
+# Background refresh interval in seconds, 0 disables polling
+POSITION_POLL_INTERVAL = 0.5
+# Moonraker websocket subscription, pushes printer state changes to us
+MOONRAKER_WS_URL = f"ws://{KLIPPER_API_HOST}/websocket"
+MOONRAKER_RECONNECT_DELAY = 5
+PRINTER_SUBSCRIBE_OBJECTS = {
+    "toolhead": ["position", "homed_axes", "extruder", "print_time"],
+    "gcode_move": ["gcode_position", "position", "homing_origin"],
+    "motion_report": ["live_position", "live_velocity"],
+    "print_stats": None,
+    "gcode_macro VARIABLES_LIST": ["active_tool"],
+    "save_variables": ["variables"]
+}
+# Every Klipper object starting with this prefix is subscribed as well
+ATC_SWITCH_PREFIX = "atc_switch "
+
+# G-code scripts sent through Moonraker wait for the moves to finish
+KLIPPER_GCODE_TIMEOUT = 120
+# Push changed tool offsets into Klipper's save_variables as
+# <tool>_offset_x/_y/_z whenever the tools are saved
+KLIPPER_OFFSET_PUSH = True
+
+# Time-indexed toolhead position history used to tag frames with the
+# position at exposure time
+POSITION_HISTORY_SIZE = 4096
+# Delay between exposure and a frame reaching capture_frame() (sensor readout
+# plus MJPEG encode), and between exposure and libcamera-still exiting
+STREAM_FRAME_LATENCY = 0.05
+STILL_CAPTURE_LATENCY = 0.4
 
 # Calibration settings
 calibration_data = {
@@ -64,12 +251,85 @@ calibration_data = {
     "scaler_measurements": []
 }
 
+# Scale and model settings live in a small JSON file, the reference point and
+# scale measurement histories in an append-only JSONL log next to it
+CALIBRATION_FILE = os.path.join(CALIBRATION_DIR, "calibration.json")
+CALIBRATION_HISTORY_FILE = os.path.join(CALIBRATION_DIR, "calibration_history.jsonl")
+# Newest entries kept per history, the log is compacted once it holds twice
+# as many lines as could be kept
+CALIBRATION_HISTORY_LIMIT = 500
+# History log record type -> calibration_data list
+CALIBRATION_HISTORY_KINDS = {"reference_point": "reference_points", "scaler_measurement": "scaler_measurements"}
+calibration_history_lock = threading.Lock()
+calibration_history_lines = 0
+
+# Calibration model fitted over all reference points
+# "affine" needs 3 points, "homography" needs 4 and falls back to affine
+CALIBRATION_MODEL = "affine"
+# Also fit a single radial distortion coefficient (needs 5 points)
+CALIBRATION_RADIAL_DISTORTION = False
+calibration_version = 0
+
+# Fiducial detection settings, sizes are in stream frame pixels
+FIDUCIAL_RADIUS_PX = 20
+FIDUCIAL_POLARITY = "dark"
+FIDUCIAL_DOWNSCALE = 2
+# Centre fraction of the frame searched when no ROI is given
+FIDUCIAL_ROI_FRACTION = 0.5
+FIDUCIAL_MIN_SCORE = 0.5
+
+# Automated tool offset calibration
+AUTO_CALIBRATION_TOLERANCE_MM = 0.02
+AUTO_CALIBRATION_MAX_ITERATIONS = 6
+AUTO_CALIBRATION_FEEDRATE = 6000
+# Time to let vibrations settle after a move before a frame is used
+AUTO_CALIBRATION_SETTLE_TIME = 0.15
+# Detections below this match score stop the tool instead of moving on them
+AUTO_CALIBRATION_MIN_SCORE = 0.8
+# False: the camera is the docked C0 tool, so only the camera tool itself can
+# be centred on a fixed target. True: a fixed upward-facing camera looks at
+# each loaded tool's nozzle and every non-camera tool can be calibrated.
+AUTO_CALIBRATION_FIXED_CAMERA = False
+
+# Finished capture jobs kept for /api/capture/<job>
+CAPTURE_JOB_HISTORY = 200
+# Longest ?wait=<seconds> a request may hold its server thread
+CAPTURE_MAX_WAIT = 60.0
+# Requests allowed to sit in ?wait at once, further ones get a 503. The ASGI
+# pool has this many threads on top of ASGI_EXECUTOR_WORKERS, so waiters can
+# never take the threads other routes need
+CAPTURE_MAX_WAITERS = 2
+
+# Burst and timelapse frames come from the running stream, not libcamera-still
+BURST_MAX_FRAMES = 100
+TIMELAPSE_LAYER_INTERVAL = 1
+
+# Web UI assets, served with content-hashed names from memory
+STATIC_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "static")
+STATIC_ASSETS = ("app.css", "app.js")
+STATIC_MIMETYPES = {".css": "text/css; charset=utf-8",
+                    ".js": "application/javascript; charset=utf-8",
+                    ".html": "text/html; charset=utf-8"}
+STATIC_MAX_AGE = 31536000
+
+# Downscaled copies made for every capture, tier -> longest edge in pixels
+THUMBNAIL_TIERS = {"thumb": 320, "preview": 1280}
+THUMBNAIL_QUALITY = 80
+THUMBNAIL_WORKERS = 2
+
+# Capture retention, oldest captures are deleted first once either quota is
+# exceeded (0 disables that quota)
+CAPTURE_RETENTION_MAX_BYTES = 8 * 1024 ** 3
+CAPTURE_RETENTION_MAX_AGE_DAYS = 30
+CAPTURE_RETENTION_INTERVAL = 600
+
 # Ensure directories exist
 os.makedirs(CAPTURE_DIR, exist_ok=True)
+os.makedirs(THUMBNAIL_DIR, exist_ok=True)
 os.makedirs(CALIBRATION_DIR, exist_ok=True)
 
 # Create Flask app
-app = Flask(__name__)
+app = Flask(__name__, static_folder=None)
 
 # Global variables
 streaming_thread = None
@@ -78,31 +338,67 @@ current_frame = None
 frame_lock = threading.Lock()
 mqtt_client = None
 frame_count = 0
+stream_backend = None
+# Guards replacing, suspending and restarting stream_backend. The resume
+# event is cleared while a still capture has borrowed the camera.
+stream_backend_lock = threading.RLock()
+stream_resume_event = threading.Event()
+stream_resume_event.set()
+# Only one libcamera-still at a time
+still_capture_lock = threading.Lock()
+last_capture_info = None
+capture_store = None
+thumbnail_executor = ThreadPoolExecutor(max_workers=THUMBNAIL_WORKERS, thread_name_prefix="thumbnail")
+retention_manager = None
 
 # FIXED: Better position tracking with thread safety
 current_printer_position = {"x": 0.0, "y": 0.0, "z": 0.0}
 position_lock = threading.Lock()
 position_request_pending = False
 position_request_timestamp = 0
+position_updated_at = None
+# True while the Moonraker subscription is live, the cache is then pushed to
+# us on every change and never needs a network refresh
+position_push_live = False
+
+# Printer state snapshot maintained by the Moonraker subscription
+printer_state = {}
+printer_state_lock = threading.Lock()
+printer_subscriber = None
 
 
 def load_calibration_data():
     """Load calibration data from file"""
     global calibration_data
     try:
-        cal_file = os.path.join(CALIBRATION_DIR, "calibration.json")
-        if os.path.exists(cal_file):
-            with open(cal_file, 'r') as f:
+        if os.path.exists(CALIBRATION_FILE):
+            with open(CALIBRATION_FILE, 'r') as f:
                 loaded_data = json.load(f)
                 
-                # FORCE enabled to True - ignore saved value
-                loaded_data["enabled"] = True
-                
-                calibration_data = loaded_data
-                logger.info("Calibration data loaded with enabled forced to True")
+            # FORCE enabled to True - ignore saved value
+            loaded_data["enabled"] = True
+            
+            # Older files carry the histories inline, move them to the log
+            legacy = any(key in loaded_data for key in CALIBRATION_HISTORY_KINDS.values())
+            for key in CALIBRATION_HISTORY_KINDS.values():
+                loaded_data[key] = loaded_data.get(key, [])[-CALIBRATION_HISTORY_LIMIT:]
+            
+            calibration_data = loaded_data
+            if legacy:
+                compact_calibration_history()
+                save_calibration_data()
+                logger.info("Calibration history migrated to the append-only log")
+            else:
+                load_calibration_history()
+            mark_calibration_changed()
+            logger.info("Calibration data loaded with enabled forced to True")
         else:
             # Ensure default is enabled when no file exists
             calibration_data["enabled"] = True
+            # The history log stands on its own, keep the reference points
+            # even when the settings snapshot is gone
+            load_calibration_history()
+            mark_calibration_changed()
             
     except Exception as e:
         logger.error(f"Failed to load calibration data: {e}")
@@ -110,62 +406,564 @@ def load_calibration_data():
         calibration_data["enabled"] = True
 
 
+def mark_calibration_changed():
+    """Invalidate the cached calibration model"""
+    global calibration_version
+    calibration_version += 1
+
+
+def _write_file_atomic(path, text):
+    """Replace a file so readers and crashes only ever see old or new content
+    
+    Every call writes its own temp file, so concurrent writers never share
+    one. Callers that care which version ends up on disk serialise calls.
+    """
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path) or ".",
+                                    prefix=os.path.basename(path) + ".", suffix=".tmp")
+    try:
+        os.fchmod(fd, 0o644)
+        with os.fdopen(fd, 'w') as f:
+            f.write(text)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+    except BaseException:
+        try:
+            os.remove(tmp_path)
+        except OSError:
+            pass
+        raise
+
+
 def save_calibration_data():
-    """Save calibration data to file"""
+    """Save calibration settings to file, the histories are in the log"""
+    mark_calibration_changed()
+    status_publisher.request(calibration=True)
     try:
-        cal_file = os.path.join(CALIBRATION_DIR, "calibration.json")
-        with open(cal_file, 'w') as f:
-            json.dump(calibration_data, f, indent=2)
+        current = {key: value for key, value in calibration_data.items()
+                   if key not in CALIBRATION_HISTORY_KINDS.values()}
+        _write_file_atomic(CALIBRATION_FILE, json.dumps(current, indent=2))
         logger.info("Calibration data saved")
         return True
     except Exception as e:
         logger.error(f"Failed to save calibration data: {e}")
         return False
 
-def request_printer_position():
-    """Get printer position directly from Klipper API - much faster than MQTT"""
-    global current_printer_position, position_request_pending
+
+def load_calibration_history():
+    """Replay the history log into calibration_data
     
-    logger.debug("request_printer_position() called - using direct API")
+    A line cut short by a crash is skipped, the log is then compacted so the
+    next append starts on a clean line.
+    """
+    global calibration_history_lines
+    histories = {key: [] for key in CALIBRATION_HISTORY_KINDS.values()}
+    lines = 0
+    damaged = False
+    
+    if os.path.exists(CALIBRATION_HISTORY_FILE):
+        with open(CALIBRATION_HISTORY_FILE, 'r') as f:
+            for line in f:
+                lines += 1
+                try:
+                    record = json.loads(line)
+                    histories[CALIBRATION_HISTORY_KINDS[record["type"]]].append(record["data"])
+                except (ValueError, KeyError, TypeError):
+                    damaged = True
+    
+    with calibration_history_lock:
+        for key, entries in histories.items():
+            calibration_data[key] = entries[-CALIBRATION_HISTORY_LIMIT:]
+        calibration_history_lines = lines
+    
+    if damaged:
+        logger.warning("Calibration history log had damaged lines, compacting")
+    if damaged or lines > 2 * CALIBRATION_HISTORY_LIMIT * len(CALIBRATION_HISTORY_KINDS):
+        compact_calibration_history()
+
+
+def compact_calibration_history():
+    """Rewrite the history log with only the entries still kept"""
+    global calibration_history_lines
+    with calibration_history_lock:
+        records = [json.dumps({"type": kind, "data": entry})
+                   for kind, key in CALIBRATION_HISTORY_KINDS.items()
+                   for entry in calibration_data.get(key, [])]
+        try:
+            _write_file_atomic(CALIBRATION_HISTORY_FILE, "".join(record + "\n" for record in records))
+            calibration_history_lines = len(records)
+            return True
+        except OSError as e:
+            logger.error(f"Failed to compact calibration history: {e}")
+            return False
+
+
+def add_calibration_history(kind, entry):
+    """Append a reference point or scale measurement to its history
     
-    try:
-        # Get position directly from Klipper API
-        klipper_ip = "192.168.1.89"
-        url = f"http://{klipper_ip}/printer/objects/query?gcode_move"
-        
-        response = requests.get(url, timeout=3)
-        
-        if response.status_code == 200:
-            data = response.json()
-            gcode_pos = data['result']['status']['gcode_move']['gcode_position']
-            
-            with position_lock:
-                current_printer_position = {
-                    "x": round(float(gcode_pos[0]), 3),
-                    "y": round(float(gcode_pos[1]), 3),
-                    "z": round(float(gcode_pos[2]), 3)
-                }
-                position_request_pending = False
+    The entry is appended to the log as one line, only every few hundred
+    appends the log is compacted down to the newest CALIBRATION_HISTORY_LIMIT
+    entries per history.
+    """
+    global calibration_history_lines
+    key = CALIBRATION_HISTORY_KINDS[kind]
+    with calibration_history_lock:
+        entries = calibration_data.setdefault(key, [])
+        entries.append(entry)
+        del entries[:-CALIBRATION_HISTORY_LIMIT]
+        try:
+            with open(CALIBRATION_HISTORY_FILE, 'a') as f:
+                f.write(json.dumps({"type": kind, "data": entry}) + "\n")
+                f.flush()
+                os.fsync(f.fileno())
+            calibration_history_lines += 1
+        except OSError as e:
+            logger.error(f"Failed to append calibration history: {e}")
+            return False
+        compact = calibration_history_lines > 2 * CALIBRATION_HISTORY_LIMIT * len(CALIBRATION_HISTORY_KINDS)
+    
+    if compact:
+        compact_calibration_history()
+    mark_calibration_changed()
+    status_publisher.request(calibration=True)
+    return True
+
+def update_printer_position(x, y, z, timestamp=None):
+    """Store a new printer position in the shared position cache"""
+    global current_printer_position, position_request_pending, position_updated_at
+    
+    with position_lock:
+        current_printer_position = {
+            "x": round(float(x), 3),
+            "y": round(float(y), 3),
+            "z": round(float(z), 3)
+        }
+        position_updated_at = timestamp if timestamp is not None else time.monotonic()
+        position_request_pending = False
+    
+    # With a live subscription the history is fed from motion_report instead,
+    # gcode_position is the commanded end point and runs ahead of the toolhead
+    if not position_push_live:
+        position_history.record(position_updated_at, x, y, z)
+
+
+def get_cached_printer_position():
+    """Return (position, age_ms) from the cache without any network I/O"""
+    with position_lock:
+        position = current_printer_position.copy()
+        updated_at = position_updated_at
+    
+    if position_push_live:
+        return position, 0.0
+    if updated_at is None:
+        return position, float("inf")
+    return position, (time.monotonic() - updated_at) * 1000.0
+
+
+class PositionHistory:
+    """Time-indexed history of toolhead positions
+
+    Samples are (monotonic time, x, y, z) in G-code coordinates, appended in
+    time order. position_at() interpolates linearly between the two samples
+    around the requested time and holds the nearest sample outside the
+    recorded range, which matches a toolhead that was standing still.
+    """
+
+    def __init__(self, capacity=POSITION_HISTORY_SIZE):
+        self.capacity = capacity
+        self._times = []
+        self._positions = []
+        self._lock = threading.Lock()
+
+    def record(self, timestamp, x, y, z):
+        with self._lock:
+            if self._times and timestamp < self._times[-1]:
+                return
+            self._times.append(timestamp)
+            self._positions.append((float(x), float(y), float(z)))
+            # Trim in blocks so appends stay amortised O(1)
+            if len(self._times) > 2 * self.capacity:
+                del self._times[:-self.capacity]
+                del self._positions[:-self.capacity]
+
+    def position_at(self, timestamp):
+        """Return the interpolated position at a monotonic timestamp or None"""
+        with self._lock:
+            if not self._times:
+                return None
+            index = bisect.bisect_left(self._times, timestamp)
+            if index == 0:
+                x, y, z = self._positions[0]
+            elif index == len(self._times):
+                x, y, z = self._positions[-1]
+            else:
+                t0, t1 = self._times[index - 1], self._times[index]
+                p0, p1 = self._positions[index - 1], self._positions[index]
+                fraction = (timestamp - t0) / (t1 - t0) if t1 > t0 else 1.0
+                x, y, z = (a + (b - a) * fraction for a, b in zip(p0, p1))
+        return {"x": round(x, 3), "y": round(y, 3), "z": round(z, 3)}
+
+    def clear(self):
+        with self._lock:
+            self._times = []
+            self._positions = []
+
+
+position_history = PositionHistory(POSITION_HISTORY_SIZE)
+
+
+def record_live_position(status, received_at):
+    """Printer state listener feeding motion_report positions into the history
+
+    live_position is in toolhead coordinates, the G-code offset between
+    gcode_move.position and gcode_move.gcode_position converts it to the
+    coordinates used everywhere else in the camera service.
+    """
+    live = status.get("motion_report", {}).get("live_position")
+    if not live:
+        return
+    
+    with printer_state_lock:
+        gcode_move = printer_state.get("gcode_move", {})
+        commanded = gcode_move.get("position")
+        gcode_pos = gcode_move.get("gcode_position")
+    
+    offset = [0.0, 0.0, 0.0]
+    if commanded and gcode_pos:
+        offset = [commanded[i] - gcode_pos[i] for i in range(3)]
+    position_history.record(received_at, *(live[i] - offset[i] for i in range(3)))
+
+
+def get_position_at(timestamp):
+    """Position at a monotonic timestamp, falls back to the current position"""
+    position = position_history.position_at(timestamp)
+    if position is None:
+        position = get_cached_printer_position()[0]
+    return position
+
+
+class KlipperPositionClient:
+    """Klipper position client with a pooled keep-alive session
+
+    Positions are cached in current_printer_position. refresh() only goes to
+    the network when the cached value is older than the caller's staleness
+    budget, and concurrent callers share a single in-flight request.
+    """
+
+    def __init__(self, host=KLIPPER_API_HOST, timeout=KLIPPER_API_TIMEOUT):
+        self.url = f"http://{host}/printer/objects/query"
+        self.timeout = timeout
+        self.session = requests.Session()
+        self.session.mount("http://", requests.adapters.HTTPAdapter(pool_connections=1, pool_maxsize=4))
+        self._fetch_lock = threading.Lock()
+        self._poll_thread = None
+        self._polling = False
+
+    def fetch(self):
+        """Query Klipper for the current position and update the cache"""
+        try:
+            response = self.session.get(self.url, params={"gcode_move": "gcode_position"},
+                                        timeout=self.timeout)
+            if response.status_code != 200:
+                logger.error(f"Klipper API request failed: {response.status_code}")
+                return False
             
-            logger.info(f"Got position from Klipper API: {current_printer_position}")
+            gcode_pos = response.json()['result']['status']['gcode_move']['gcode_position']
+            update_printer_position(gcode_pos[0], gcode_pos[1], gcode_pos[2])
+            logger.debug(f"Got position from Klipper API: {gcode_pos[:3]}")
             return True
-        else:
-            logger.error(f"Klipper API request failed: {response.status_code}")
+        except Exception as e:
+            logger.error(f"Error getting position from Klipper API: {e}")
+            return False
+
+    def refresh(self, max_age_ms=POSITION_MAX_AGE_MS):
+        """Make sure the cached position is no older than max_age_ms
+
+        Returns True if the cache satisfies the budget afterwards.
+        """
+        if get_cached_printer_position()[1] <= max_age_ms:
+            return True
+        
+        with self._fetch_lock:
+            # Another caller may have refreshed the cache while we waited
+            if get_cached_printer_position()[1] <= max_age_ms:
+                return True
+            return self.fetch()
+
+    def start_polling(self, interval=POSITION_POLL_INTERVAL):
+        """Keep the cache fresh from a background thread"""
+        if self._polling or interval <= 0:
+            return
+        self._polling = True
+        self._poll_thread = threading.Thread(target=self._poll, args=(interval,))
+        self._poll_thread.daemon = True
+        self._poll_thread.start()
+        logger.info(f"Position polling started every {interval}s")
+
+    def _poll(self, interval):
+        while self._polling:
+            self.refresh(max_age_ms=interval * 1000.0)
+            time.sleep(interval)
+
+    def stop_polling(self):
+        self._polling = False
+
+
+position_client = KlipperPositionClient()
+
+
+def apply_printer_status(status, received_at=None):
+    """Merge a Klipper status update into the printer state snapshot"""
+    with printer_state_lock:
+        for name, fields in status.items():
+            if isinstance(fields, dict):
+                printer_state.setdefault(name, {}).update(fields)
+    
+    gcode_pos = status.get("gcode_move", {}).get("gcode_position")
+    if gcode_pos:
+        update_printer_position(gcode_pos[0], gcode_pos[1], gcode_pos[2], received_at)
+
+
+def get_printer_state():
+    """Return a copy of the printer state snapshot"""
+    with printer_state_lock:
+        return {name: dict(fields) for name, fields in printer_state.items()}
+
+
+def get_printer_state_summary():
+    """Small printer state summary for status payloads"""
+    with printer_state_lock:
+        toolhead = printer_state.get("toolhead", {})
+        print_stats = printer_state.get("print_stats", {})
+        variables = printer_state.get("gcode_macro VARIABLES_LIST", {})
+        switches = {
+            name[len(ATC_SWITCH_PREFIX):]: fields.get("state")
+            for name, fields in printer_state.items()
+            if name.startswith(ATC_SWITCH_PREFIX)
+        }
+        return {
+            "connected": position_push_live,
+            "print_state": print_stats.get("state"),
+            "print_filename": print_stats.get("filename"),
+            "homed_axes": toolhead.get("homed_axes"),
+            "extruder": toolhead.get("extruder"),
+            "active_tool": variables.get("active_tool"),
+            "atc_switches": switches
+        }
+
+
+class MoonrakerSubscriber:
+    """Single Moonraker websocket feeding the printer state snapshot
+
+    Subscribes to toolhead, gcode_move, motion_report, print_stats and every
+    atc_switch object, then merges each notify_status_update into
+    printer_state. Reconnects and resubscribes automatically when Moonraker
+    or Klippy restarts. call() runs other JSON-RPC methods over the same
+    connection.
+    """
+
+    def __init__(self, url=MOONRAKER_WS_URL):
+        self.url = url
+        self.subscribed = False
+        self._ws = None
+        self._running = False
+        self._thread = None
+        self._send_lock = threading.Lock()
+        self._pending = {}
+        self._pending_lock = threading.Lock()
+        self._next_id = 0
+        self._listeners = []
+
+    def add_listener(self, callback):
+        """Register callback(status, received_at) for every status update"""
+        self._listeners.append(callback)
+
+    def start(self):
+        if websocket is None:
+            logger.error("websocket-client is not installed, Moonraker subscription disabled")
             return False
+        if self._running:
+            return True
+        self._running = True
+        self._thread = threading.Thread(target=self._run)
+        self._thread.daemon = True
+        self._thread.start()
+        return True
+
+    def stop(self):
+        self._running = False
+        ws = self._ws
+        if ws:
+            try:
+                ws.close()
+            except Exception:
+                pass
+
+    def _send_request(self, method, params=None, callback=None):
+        """Send a JSON-RPC request, callback(result, error) runs on the reader thread"""
+        with self._pending_lock:
+            self._next_id += 1
+            request_id = self._next_id
+            if callback:
+                self._pending[request_id] = callback
+        
+        message = {"jsonrpc": "2.0", "method": method, "id": request_id}
+        if params is not None:
+            message["params"] = params
+        
+        ws = self._ws
+        if ws is None:
+            raise ConnectionError("Moonraker websocket is not connected")
+        with self._send_lock:
+            ws.send(json.dumps(message))
+        return request_id
+
+    def call(self, method, params=None, timeout=5.0):
+        """Run a JSON-RPC method and wait for its result"""
+        done = threading.Event()
+        reply = {}
+        
+        def on_reply(result, error):
+            reply["result"] = result
+            reply["error"] = error
+            done.set()
+        
+        request_id = self._send_request(method, params, on_reply)
+        if not done.wait(timeout):
+            with self._pending_lock:
+                self._pending.pop(request_id, None)
+            raise TimeoutError(f"Moonraker call {method} timed out")
+        if reply["error"]:
+            raise RuntimeError(f"Moonraker call {method} failed: {reply['error'].get('message')}")
+        return reply["result"]
+
+    def _run(self):
+        global position_push_live
+        
+        while self._running:
+            try:
+                self._ws = websocket.create_connection(self.url, timeout=10)
+                self._ws.settimeout(None)
+                logger.info(f"Connected to Moonraker at {self.url}")
+                self._subscribe()
+                
+                while self._running:
+                    raw = self._ws.recv()
+                    if not raw:
+                        break
+                    self._handle_message(json.loads(raw))
+            except Exception as e:
+                if self._running:
+                    logger.error(f"Moonraker connection error: {e}")
+            finally:
+                self.subscribed = False
+                position_push_live = False
+                self._fail_pending("connection closed")
+                if self._ws:
+                    try:
+                        self._ws.close()
+                    except Exception:
+                        pass
+                self._ws = None
             
-    except Exception as e:
-        logger.error(f"Error getting position from Klipper API: {e}")
+            if self._running:
+                time.sleep(MOONRAKER_RECONNECT_DELAY)
+
+    def _fail_pending(self, reason):
+        with self._pending_lock:
+            pending, self._pending = self._pending, {}
+        for callback in pending.values():
+            callback(None, {"message": reason})
+
+    def _subscribe(self):
+        """List Klipper objects, then subscribe to the ones we track"""
+        self._send_request("printer.objects.list", callback=self._on_object_list)
+
+    def _on_object_list(self, result, error):
+        if error:
+            logger.warning(f"Klippy not ready, waiting to subscribe: {error.get('message')}")
+            return
+        
+        objects = dict(PRINTER_SUBSCRIBE_OBJECTS)
+        for name in result.get("objects", []):
+            if name.startswith(ATC_SWITCH_PREFIX):
+                objects[name] = None
+        self._send_request("printer.objects.subscribe", {"objects": objects},
+                           callback=self._on_subscribed)
+
+    def _on_subscribed(self, result, error):
+        global position_push_live
+        
+        if error:
+            logger.error(f"Moonraker subscription failed: {error.get('message')}")
+            return
+        
+        with printer_state_lock:
+            printer_state.clear()
+        self._dispatch(result.get("status", {}))
+        self.subscribed = True
+        position_push_live = True
+        logger.info("Subscribed to printer state updates")
+
+    def _handle_message(self, message):
+        global position_push_live
+        
+        if "id" in message:
+            with self._pending_lock:
+                callback = self._pending.pop(message["id"], None)
+            if callback:
+                callback(message.get("result"), message.get("error"))
+            return
+        
+        method = message.get("method")
+        if method == "notify_status_update":
+            self._dispatch(message["params"][0])
+        elif method == "notify_klippy_ready":
+            self._subscribe()
+        elif method in ("notify_klippy_shutdown", "notify_klippy_disconnected"):
+            logger.warning(f"Klippy unavailable ({method}), position falls back to polling")
+            self.subscribed = False
+            position_push_live = False
+
+    def _dispatch(self, status):
+        received_at = time.monotonic()
+        apply_printer_status(status, received_at)
+        for callback in self._listeners:
+            try:
+                callback(status, received_at)
+            except Exception as e:
+                logger.error(f"Printer state listener failed: {e}")
+
+
+def run_gcode_script(script, timeout=KLIPPER_GCODE_TIMEOUT):
+    """Run a G-code script through Moonraker, returns once Klipper finished it"""
+    if printer_subscriber and printer_subscriber.subscribed:
+        printer_subscriber.call("printer.gcode.script", {"script": script}, timeout)
+        return True
+    
+    response = position_client.session.post(f"http://{KLIPPER_API_HOST}/printer/gcode/script",
+                                            params={"script": script}, timeout=timeout)
+    if response.status_code != 200:
+        raise RuntimeError(f"G-code script failed ({response.status_code}): {response.text}")
+    return True
+
+
+def request_printer_position(max_age_ms=POSITION_MAX_AGE_MS):
+    """Get printer position, served from cache when it is fresh enough"""
+    global position_request_pending
+    
+    logger.debug(f"request_printer_position() called - max age {max_age_ms} ms")
+    
+    success = position_client.refresh(max_age_ms)
+    if not success:
         with position_lock:
             position_request_pending = False
-        return False
+    return success
 
 
 
-def pixel_to_printer_coordinates(pixel_x, pixel_y, reference_printer_x, reference_printer_y):
-    """Convert pixel coordinates to printer coordinates using calibration"""
-    if not calibration_data["enabled"] or len(calibration_data["reference_points"]) == 0:
-        return None
-    
+def legacy_pixel_to_printer_coordinates(pixel_x, pixel_y):
+    """Scalar conversion from the most recent reference point and microns per pixel"""
     # Use the most recent reference point for simple linear conversion
     ref_point = calibration_data["reference_points"][-1]
     
@@ -184,11 +982,612 @@ def pixel_to_printer_coordinates(pixel_x, pixel_y, reference_printer_x, referenc
     return {
         "x": round(printer_x, 3),
         "y": round(printer_y, 3),
+        "model": "legacy",
         "reference_point": ref_point,
         "pixel_offset": {"x": pixel_offset_x, "y": pixel_offset_y},
         "printer_offset": {"x": printer_offset_x, "y": printer_offset_y}
     }
 
+
+class CalibrationModel:
+    """Pixel to printer transform fitted over all calibration reference points
+
+    Fits an affine transform (or a homography) with least squares, optionally
+    after removing one radial lens distortion term. When every point records
+    the camera position it was taken at, the model maps pixels to an offset
+    from the camera and conversions add the current camera position,
+    otherwise it maps pixels to absolute printer coordinates.
+    """
+
+    def __init__(self):
+        self.kind = None
+        self.matrix = None
+        self.k1 = 0.0
+        self.center = (0.0, 0.0)
+        self.scale = 1.0
+        self.relative = False
+        self.residuals = []
+        self.rms = None
+        self.version = None
+
+    @property
+    def fitted(self):
+        return self.matrix is not None
+
+    def fit(self, points, kind="affine", radial=False, center=None, version=None):
+        """Fit the model to reference points, returns True on success"""
+        self.version = version
+        self.matrix = None
+        self.kind = None
+        self.k1 = 0.0
+        self.residuals = []
+        self.rms = None
+        
+        if len(points) < 3:
+            return False
+        
+        pixels = np.array([[p["pixel_x"], p["pixel_y"]] for p in points], dtype=float)
+        targets = np.array([[p["printer_x"], p["printer_y"]] for p in points], dtype=float)
+        self.relative = all("camera_x" in p and "camera_y" in p for p in points)
+        if self.relative:
+            targets -= np.array([[p["camera_x"], p["camera_y"]] for p in points], dtype=float)
+        
+        if center is None:
+            center = (STREAM_WIDTH / 2.0, STREAM_HEIGHT / 2.0)
+        self.center = center
+        self.scale = float(np.hypot(*center)) or 1.0
+        
+        if kind == "homography" and len(points) >= 4:
+            fitter = self._fit_homography
+        else:
+            kind = "affine"
+            fitter = self._fit_affine
+        
+        matrix = fitter(pixels, targets)
+        if matrix is None:
+            return False
+        
+        if radial and len(points) >= 5:
+            # One-dimensional search for k1, the inner fit is linear
+            best_k1, best_matrix = 0.0, matrix
+            best_error = self._error(matrix, 0.0, pixels, targets)
+            for k1 in np.linspace(-0.3, 0.3, 61):
+                candidate = fitter(self._undistort(pixels, k1), targets)
+                if candidate is None:
+                    continue
+                error = self._error(candidate, k1, pixels, targets)
+                if error < best_error:
+                    best_k1, best_matrix, best_error = float(k1), candidate, error
+            self.k1, matrix = best_k1, best_matrix
+        
+        self.kind = kind
+        self.matrix = matrix
+        errors = self._apply(pixels) - targets
+        distances = np.hypot(errors[:, 0], errors[:, 1])
+        self.rms = float(np.sqrt(np.mean(distances ** 2)))
+        self.residuals = [
+            {"index": i, "dx": round(float(dx), 4), "dy": round(float(dy), 4),
+             "error": round(float(d), 4)}
+            for i, ((dx, dy), d) in enumerate(zip(errors, distances))
+        ]
+        return True
+
+    @staticmethod
+    def _fit_affine(pixels, targets):
+        design = np.column_stack([pixels, np.ones(len(pixels))])
+        solution, _, rank, _ = np.linalg.lstsq(design, targets, rcond=None)
+        if rank < 3:
+            return None
+        return np.vstack([solution.T, [0.0, 0.0, 1.0]])
+
+    @staticmethod
+    def _normalise(coords):
+        """Hartley normalisation, returns normalised coords and the 3x3 transform"""
+        mean = coords.mean(axis=0)
+        spread = np.sqrt(((coords - mean) ** 2).sum(axis=1)).mean() or 1.0
+        factor = np.sqrt(2.0) / spread
+        transform = np.array([[factor, 0, -factor * mean[0]],
+                              [0, factor, -factor * mean[1]],
+                              [0, 0, 1.0]])
+        return (coords - mean) * factor, transform
+
+    @classmethod
+    def _fit_homography(cls, pixels, targets):
+        src, src_t = cls._normalise(pixels)
+        dst, dst_t = cls._normalise(targets)
+        rows = []
+        for (x, y), (u, v) in zip(src, dst):
+            rows.append([-x, -y, -1, 0, 0, 0, u * x, u * y, u])
+            rows.append([0, 0, 0, -x, -y, -1, v * x, v * y, v])
+        _, singular, vt = np.linalg.svd(np.array(rows))
+        if singular[-2] < 1e-12:
+            return None
+        matrix = np.linalg.inv(dst_t) @ vt[-1].reshape(3, 3) @ src_t
+        if abs(matrix[2, 2]) < 1e-12:
+            return None
+        return matrix / matrix[2, 2]
+
+    def _undistort(self, pixels, k1):
+        offset = (pixels - self.center) / self.scale
+        r2 = (offset ** 2).sum(axis=1, keepdims=True)
+        return self.center + offset * (1.0 + k1 * r2) * self.scale
+
+    def _error(self, matrix, k1, pixels, targets):
+        projected = self._project(matrix, self._undistort(pixels, k1))
+        return float(((projected - targets) ** 2).sum())
+
+    @staticmethod
+    def _project(matrix, pixels):
+        homogeneous = np.column_stack([pixels, np.ones(len(pixels))]) @ matrix.T
+        return homogeneous[:, :2] / homogeneous[:, 2:3]
+
+    def _apply(self, pixels):
+        if self.k1:
+            pixels = self._undistort(pixels, self.k1)
+        return self._project(self.matrix, pixels)
+
+    def transform(self, pixels, camera_x=0.0, camera_y=0.0):
+        """Convert an (N, 2) array of pixels to printer coordinates"""
+        result = self._apply(np.asarray(pixels, dtype=float).reshape(-1, 2))
+        if self.relative:
+            result += (camera_x, camera_y)
+        return result
+
+    def to_dict(self):
+        return {
+            "kind": self.kind or "legacy",
+            "relative": self.relative,
+            "matrix": self.matrix.round(8).tolist() if self.fitted else None,
+            "k1": self.k1,
+            "rms_error": round(self.rms, 4) if self.rms is not None else None,
+            "residuals": self.residuals
+        }
+
+
+calibration_model = CalibrationModel()
+calibration_model_lock = threading.Lock()
+
+
+def get_calibration_model():
+    """Return the fitted model, refitting only when the calibration changed
+
+    Returns None when NumPy is missing or there are too few usable points,
+    callers then fall back to the legacy scalar conversion.
+    """
+    if np is None:
+        return None
+    
+    with calibration_model_lock:
+        if calibration_model.version != calibration_version:
+            points = calibration_data["reference_points"]
+            if calibration_model.fit(points, CALIBRATION_MODEL, CALIBRATION_RADIAL_DISTORTION,
+                                     version=calibration_version):
+                logger.info(f"Calibration model fitted: {calibration_model.kind} over {len(points)} points, "
+                            f"RMS {calibration_model.rms:.4f} mm")
+        return calibration_model if calibration_model.fitted else None
+
+
+def pixel_to_printer_coordinates(pixel_x, pixel_y, reference_printer_x, reference_printer_y):
+    """Convert pixel coordinates to printer coordinates using calibration"""
+    if not calibration_data["enabled"] or len(calibration_data["reference_points"]) == 0:
+        return None
+    
+    model = get_calibration_model()
+    if model is None:
+        return legacy_pixel_to_printer_coordinates(pixel_x, pixel_y)
+    
+    printer_x, printer_y = model.transform([[pixel_x, pixel_y]], reference_printer_x, reference_printer_y)[0]
+    return {
+        "x": round(float(printer_x), 3),
+        "y": round(float(printer_y), 3),
+        "model": model.kind,
+        "rms_error": round(model.rms, 4)
+    }
+
+
+def pixel_to_printer_batch(pixels, reference_printer_x, reference_printer_y, as_array=False):
+    """Convert many pixel coordinates at once
+
+    Returns an (N, 2) list, or a NumPy array with as_array, or None when no
+    calibration is available.
+    """
+    if not calibration_data["enabled"] or len(calibration_data["reference_points"]) == 0:
+        return None
+    
+    model = get_calibration_model()
+    if model is not None:
+        points = model.transform(pixels, reference_printer_x, reference_printer_y)
+        return points if as_array else points.round(3).tolist()
+    
+    converted = []
+    for pixel_x, pixel_y in pixels:
+        result = legacy_pixel_to_printer_coordinates(pixel_x, pixel_y)
+        converted.append([result["x"], result["y"]])
+    return converted
+
+def decode_jpeg_gray(jpeg_data, downscale=1, dtype=None):
+    """Decode a JPEG to a float32 grayscale array
+
+    Downscaling happens inside the JPEG decoder where possible (OpenCV reduced
+    modes, PIL draft mode), which is far cheaper than decoding at full size.
+    Returns (image, scale) where scale is full-size pixels per decoded pixel.
+    """
+    if np is None:
+        raise RuntimeError("Image analysis requires NumPy")
+    
+    if cv2 is not None:
+        reduced_modes = {
+            2: cv2.IMREAD_REDUCED_GRAYSCALE_2,
+            4: cv2.IMREAD_REDUCED_GRAYSCALE_4,
+            8: cv2.IMREAD_REDUCED_GRAYSCALE_8
+        }
+        flag = reduced_modes.get(downscale, cv2.IMREAD_GRAYSCALE)
+        image = cv2.imdecode(np.frombuffer(jpeg_data, dtype=np.uint8), flag)
+        if image is None:
+            raise ValueError("Could not decode JPEG")
+        return image.astype(dtype or np.float32, copy=False), float(downscale if downscale in reduced_modes else 1)
+    
+    if Image is not None:
+        with Image.open(io.BytesIO(jpeg_data)) as picture:
+            full_width = picture.width
+            if downscale > 1:
+                picture.draft('L', (picture.width // downscale, picture.height // downscale))
+            gray = picture.convert('L')
+            return np.asarray(gray, dtype=dtype or np.float32), full_width / float(gray.width)
+    
+    raise RuntimeError("No JPEG decoder available, install opencv-python or Pillow")
+
+
+def _gray_image(image, downscale=1):
+    """(float32 grayscale, scale) from JPEG bytes or a luma_frames array
+
+    Luma arrays are box-averaged by the downscale factor without a decode.
+    """
+    if np is not None and isinstance(image, np.ndarray):
+        if downscale > 1:
+            height = image.shape[0] // downscale * downscale
+            width = image.shape[1] // downscale * downscale
+            gray = image[:height, :width].reshape(height // downscale, downscale, width // downscale, downscale)
+            return gray.mean(axis=(1, 3), dtype=np.float32), float(downscale)
+        return image.astype(np.float32), 1.0
+    return decode_jpeg_gray(image, downscale)
+
+
+def _box_sum(image, height, width):
+    """Sum over every height x width window, 'valid' positions only"""
+    # float32 running sums over a full frame lose the low bits the window
+    # variance depends on, so integrate in float64
+    integral = np.pad(image.astype(np.float64), ((1, 0), (1, 0))).cumsum(axis=0).cumsum(axis=1)
+    return (integral[height:, width:] - integral[:-height, width:]
+            - integral[height:, :-width] + integral[:-height, :-width])
+
+
+def _disk_template(radius, polarity):
+    """Zero-mean disk template, dark disks get a negative sign"""
+    half = int(np.ceil(radius * 1.6))
+    yy, xx = np.mgrid[-half:half + 1, -half:half + 1]
+    template = (np.hypot(xx, yy) <= radius).astype(np.float32)
+    if polarity == "dark":
+        template = -template
+    return template - template.mean()
+
+
+def _match_template(region, template):
+    """Normalised cross-correlation over all valid template positions"""
+    if cv2 is not None:
+        return cv2.matchTemplate(region, template, cv2.TM_CCOEFF_NORMED)
+    
+    th, tw = template.shape
+    region = region.astype(np.float64)
+    template = template.astype(np.float64)
+    spectrum = np.fft.rfft2(region) * np.conj(np.fft.rfft2(template, s=region.shape))
+    correlation = np.fft.irfft2(spectrum, s=region.shape)[:region.shape[0] - th + 1, :region.shape[1] - tw + 1]
+    
+    count = th * tw
+    window_sum = _box_sum(region, th, tw)
+    window_sq = _box_sum(region * region, th, tw)
+    variance = window_sq - window_sum * window_sum / count
+    # Flat windows (under 0.03 grey levels of deviation) have no usable
+    # correlation, flooring their variance keeps them near zero
+    denominator = np.sqrt(np.maximum(variance, count * 1e-3)) * np.sqrt((template * template).sum())
+    return correlation / denominator
+
+
+def _subpixel_offset(left, centre, right):
+    """Vertex of the parabola through three neighbouring samples"""
+    denominator = left - 2.0 * centre + right
+    if denominator >= 0:
+        return 0.0
+    return float(np.clip(0.5 * (left - right) / denominator, -0.5, 0.5))
+
+
+def detect_fiducial(image, roi=None, radius=None, polarity=None, downscale=None):
+    """Locate a circular fiducial in a JPEG frame or luma array with sub-pixel accuracy
+
+    roi is (x, y, width, height) in frame pixels, by default the centre
+    FIDUCIAL_ROI_FRACTION of the frame. Returns a dict with the fiducial
+    centre in frame pixels, the match score (normalised correlation, 1.0 is a
+    perfect match) and the processing time.
+    """
+    started = time.perf_counter()
+    radius = radius or FIDUCIAL_RADIUS_PX
+    polarity = polarity or FIDUCIAL_POLARITY
+    downscale = downscale or FIDUCIAL_DOWNSCALE
+    
+    gray, scale = _gray_image(image, downscale)
+    height, width = gray.shape
+    frame_width, frame_height = int(round(width * scale)), int(round(height * scale))
+    
+    if roi is None:
+        roi_w, roi_h = frame_width * FIDUCIAL_ROI_FRACTION, frame_height * FIDUCIAL_ROI_FRACTION
+        roi = ((frame_width - roi_w) / 2, (frame_height - roi_h) / 2, roi_w, roi_h)
+    x0 = max(0, int(roi[0] / scale))
+    y0 = max(0, int(roi[1] / scale))
+    x1 = min(width, int((roi[0] + roi[2]) / scale))
+    y1 = min(height, int((roi[1] + roi[3]) / scale))
+    
+    template = _disk_template(radius / scale, polarity)
+    th, tw = template.shape
+    region = np.ascontiguousarray(gray[y0:y1, x0:x1])
+    if region.shape[0] < th or region.shape[1] < tw:
+        raise ValueError("Region of interest is smaller than the fiducial")
+    
+    response = _match_template(region, template)
+    peak_y, peak_x = np.unravel_index(int(np.argmax(response)), response.shape)
+    score = float(response[peak_y, peak_x])
+    
+    dx = dy = 0.0
+    if 0 < peak_x < response.shape[1] - 1:
+        dx = _subpixel_offset(*response[peak_y, peak_x - 1:peak_x + 2])
+    if 0 < peak_y < response.shape[0] - 1:
+        dy = _subpixel_offset(*response[peak_y - 1:peak_y + 2, peak_x])
+    
+    # Template centre in decoded pixels, then back to frame pixel centres
+    centre_x = x0 + peak_x + dx + tw // 2
+    centre_y = y0 + peak_y + dy + th // 2
+    
+    # Normalised correlation cannot exceed 1, a higher peak means the
+    # response is numerically broken and its position meaningless
+    valid = score <= 1.0 + 1e-3
+    if not valid:
+        logger.warning(f"Fiducial match score {score:.3f} is out of range, rejecting detection")
+    
+    return {
+        "found": valid and score >= FIDUCIAL_MIN_SCORE,
+        "valid": valid,
+        "pixel_x": round(float((centre_x + 0.5) * scale - 0.5), 2),
+        "pixel_y": round(float((centre_y + 0.5) * scale - 0.5), 2),
+        "score": round(min(max(score, -1.0), 1.0), 4),
+        "frame_width": frame_width,
+        "frame_height": frame_height,
+        "elapsed_ms": round((time.perf_counter() - started) * 1000.0, 1)
+    }
+
+
+def detect_fiducial_in_stream(roi=None, radius=None, polarity=None, display_size=None):
+    """Detect the fiducial in the newest stream frame and convert it to printer coordinates
+
+    display_size (width, height) scales the detection into the pixel space
+    the calibration points were clicked in, when that differs from the frame.
+    """
+    frame = latest_luma_frame()
+    if frame is None:
+        raise RuntimeError("No stream frame available, start the stream first")
+    
+    result = detect_fiducial(frame.array, roi, radius, polarity)
+    camera_pos = get_position_at(frame.timestamp)
+    result["luma_seq"] = frame.seq
+    result["camera_position"] = camera_pos
+    
+    pixel_x, pixel_y = result["pixel_x"], result["pixel_y"]
+    if display_size:
+        pixel_x *= display_size[0] / float(result["frame_width"])
+        pixel_y *= display_size[1] / float(result["frame_height"])
+    
+    result["printer"] = None
+    if result["found"]:
+        conversion = pixel_to_printer_coordinates(pixel_x, pixel_y, camera_pos["x"], camera_pos["y"])
+        if conversion:
+            result["printer"] = {"x": conversion["x"], "y": conversion["y"]}
+    return result
+
+
+def _laplacian(image):
+    """4-neighbour Laplacian of the interior pixels"""
+    return (image[:-2, 1:-1] + image[2:, 1:-1] + image[1:-1, :-2] + image[1:-1, 2:]
+            - 4.0 * image[1:-1, 1:-1])
+
+
+def frame_sharpness(image, roi=None, downscale=None):
+    """Variance of the Laplacian over a region, higher is sharper
+
+    roi is (x, y, width, height) in frame pixels, by default the centre
+    FOCUS_ROI_FRACTION of the frame. The image is scored downscaled, which
+    also suppresses sensor noise that would otherwise dominate the score.
+    """
+    gray, scale = _gray_image(image, downscale or FOCUS_SHARPNESS_DOWNSCALE)
+    height, width = gray.shape
+    if roi is None:
+        x0, y0 = int(width * (1 - FOCUS_ROI_FRACTION) / 2), int(height * (1 - FOCUS_ROI_FRACTION) / 2)
+        x1, y1 = width - x0, height - y0
+    else:
+        x0, y0 = max(0, int(roi[0] / scale)), max(0, int(roi[1] / scale))
+        x1, y1 = min(width, int((roi[0] + roi[2]) / scale)), min(height, int((roi[1] + roi[3]) / scale))
+    region = gray[y0:y1, x0:x1]
+    if region.shape[0] < 3 or region.shape[1] < 3:
+        raise ValueError("Region of interest is too small")
+    return float(_laplacian(region).var())
+
+
+def decode_jpeg_color(jpeg_data):
+    """Decode a JPEG to an (H, W, 3) uint8 array in the decoder's channel order"""
+    if cv2 is not None:
+        image = cv2.imdecode(np.frombuffer(jpeg_data, dtype=np.uint8), cv2.IMREAD_COLOR)
+        if image is None:
+            raise ValueError("Could not decode JPEG")
+        return image
+    if Image is not None:
+        with Image.open(io.BytesIO(jpeg_data)) as picture:
+            return np.asarray(picture.convert('RGB'))
+    raise RuntimeError("No JPEG decoder available, install opencv-python or Pillow")
+
+
+def encode_jpeg_color(image, quality=95):
+    """Inverse of decode_jpeg_color"""
+    if cv2 is not None:
+        ok, encoded = cv2.imencode(".jpg", image, [cv2.IMWRITE_JPEG_QUALITY, quality])
+        if not ok:
+            raise ValueError("Could not encode JPEG")
+        return encoded.tobytes()
+    buffer = io.BytesIO()
+    Image.fromarray(image).save(buffer, "JPEG", quality=quality)
+    return buffer.getvalue()
+
+
+def focus_stack(jpeg_frames, window=None):
+    """Merge frames taken at different lens positions into one sharp image
+
+    Every output pixel comes from the frame with the highest local contrast
+    (absolute Laplacian averaged over a window x window box). Frames are
+    folded in one at a time, so memory stays at a couple of frames however
+    long the sweep was.
+    """
+    window = window or FOCUS_STACK_WINDOW
+    composite = best = None
+    
+    for jpeg_data in jpeg_frames:
+        color = decode_jpeg_color(jpeg_data)
+        gray = color.astype(np.float32).mean(axis=2)
+        contrast = np.pad(np.abs(_laplacian(gray)), 1 + window // 2, mode='edge')
+        contrast = _box_sum(contrast, window, window)[:gray.shape[0], :gray.shape[1]]
+        
+        if composite is None:
+            composite, best = color.copy(), contrast
+            continue
+        sharper = contrast > best
+        composite[sharper] = color[sharper]
+        best = np.maximum(best, contrast)
+    
+    if composite is None:
+        raise ValueError("No frames to stack")
+    return encode_jpeg_color(composite)
+
+
+def set_lens_position(position):
+    """Move the lens to a manual position, returns the first luma frame that reflects it"""
+    control_autofocus("manual", position)
+    frame = luma_frames.wait_for_frame_after(time.monotonic() + FOCUS_SETTLE_TIME)
+    if frame is None:
+        raise RuntimeError("No stream frame after moving the lens")
+    return frame
+
+
+def focus_sweep_range(start=None, stop=None, steps=None):
+    """(start, stop, steps) of a sweep clamped to the lens range
+
+    Raises ValueError for an empty range or fewer than two steps.
+    """
+    start = FOCUS_MIN if start is None else max(FOCUS_MIN, float(start))
+    stop = FOCUS_MAX if stop is None else min(FOCUS_MAX, float(stop))
+    steps = FOCUS_SWEEP_STEPS if steps is None else int(steps)
+    if not start < stop:
+        raise ValueError(f"Focus sweep start {start} must be below stop {stop}")
+    if steps < 2:
+        raise ValueError(f"Focus sweep needs at least 2 steps, got {steps}")
+    return start, stop, steps
+
+
+def focus_sweep(start=None, stop=None, steps=None, roi=None, refine=True, stack=False):
+    """Score sharpness across lens positions and leave the lens at the best one
+
+    Runs on the warm stream pipeline. With the Picamera2 backend each step is
+    a live control change; other backends restart per step. The best
+    position is refined with a finer pass and a parabola through the best
+    three scores. With stack=True the coarse pass frames are also merged
+    into a focus-stacked capture. The focus mode in use before the sweep is
+    restored afterwards, in auto mode captures then pick the best position
+    up from the focus cache.
+    """
+    started = time.perf_counter()
+    start, stop, steps = focus_sweep_range(start, stop, steps)
+    previous_mode = FOCUS_MODE
+    was_streaming = ensure_stream_running()
+    if stream_backend and not stream_backend.supports_lens_control:
+        logger.warning(f"Stream backend '{stream_backend.name}' restarts for each lens position")
+    
+    scores = []
+    frames = []
+    
+    def measure(positions):
+        for position in positions:
+            frame = set_lens_position(position)
+            score = frame_sharpness(frame.array, roi)
+            scores.append({"position": round(float(position), 3), "score": round(score, 3)})
+            if stack:
+                # Stacking needs colour, so it uses the matching JPEG frame
+                jpeg_frame = wait_for_frame_after(frame.timestamp)
+                if jpeg_frame is not None:
+                    frames.append(bytes(jpeg_frame.data))
+    
+    try:
+        step = (stop - start) / (steps - 1)
+        measure([start + i * step for i in range(steps)])
+        stack_frames = list(frames)
+        
+        if refine and FOCUS_SWEEP_REFINE_STEPS > 1:
+            best = max(scores, key=lambda entry: entry["score"])["position"]
+            low, high = max(start, best - step), min(stop, best + step)
+            fine_step = (high - low) / (FOCUS_SWEEP_REFINE_STEPS + 1)
+            measure([low + fine_step * (i + 1) for i in range(FOCUS_SWEEP_REFINE_STEPS)])
+        
+        ordered = sorted(scores, key=lambda entry: entry["position"])
+        best_index = max(range(len(ordered)), key=lambda i: ordered[i]["score"])
+        best_position = ordered[best_index]["position"]
+        if 0 < best_index < len(ordered) - 1:
+            left, centre, right = ordered[best_index - 1:best_index + 2]
+            spacing = (right["position"] - left["position"]) / 2.0
+            best_position += spacing * _subpixel_offset(left["score"], centre["score"], right["score"])
+        best_position = round(max(start, min(stop, best_position)), 3)
+        
+        best_frame = set_lens_position(best_position)
+        result = {
+            "best_position": best_position,
+            "best_score": round(frame_sharpness(best_frame.array, roi), 3),
+            "scores": ordered,
+            "backend": stream_backend.name if stream_backend else None
+        }
+        
+        # Stream frames are scored differently from stills, so the cached
+        # sharpness is left for the next still capture to fill in
+        tool, z = current_focus_target()
+        result["cache"] = focus_cache.put(tool, z, best_position)
+        
+        if stack:
+            stacked = focus_stack(stack_frames)
+            filename = f"{CAPTURE_DIR}/capture_{capture_timestamp()}_stack.jpg"
+            with open(filename, 'wb') as f:
+                f.write(stacked)
+            result["stacked"] = save_capture_metadata(filename, best_frame.timestamp, series="focus_stack")
+    finally:
+        # The sweep drives the lens in manual mode, leaving it there would
+        # bypass the focus cache for every later capture
+        if previous_mode == "auto":
+            control_autofocus("auto")
+        if not was_streaming:
+            stop_stream()
+    
+    result["elapsed_ms"] = round((time.perf_counter() - started) * 1000.0, 1)
+    logger.info(f"Focus sweep: best lens position {best_position} ({len(scores)} frames, "
+                f"{result['elapsed_ms']} ms)")
+    return result
+
+
+def submit_focus_sweep(tag=None, **options):
+    """Queue a focus sweep, the range is checked before anything is queued"""
+    focus_sweep_range(options.get("start"), options.get("stop"), options.get("steps"))
+    return capture_jobs.submit(focus_sweep, kind="focus_sweep", tag=tag, **options)
+
+
 def get_focus_info():
     """Get current focus mode and position"""
     global FOCUS_MODE, FOCUS_POSITION
@@ -207,12 +1606,14 @@ def control_autofocus(mode="auto", position=None):
         if mode == "auto":
             FOCUS_MODE = "auto"
             FOCUS_POSITION = 10
+            apply_stream_focus()
             return True
             
         elif mode == "manual" and position is not None:
-            pos = max(0, min(30, float(position)))
+            pos = max(FOCUS_MIN, min(FOCUS_MAX, float(position)))
             FOCUS_MODE = "manual"
             FOCUS_POSITION = pos
+            apply_stream_focus()
             return True
         else:
             logger.error(f"Invalid focus parameters: mode={mode}, position={position}")
@@ -221,73 +1622,900 @@ def control_autofocus(mode="auto", position=None):
         logger.error(f"Failed to control focus: {e}")
         return False
 
-def capture_frame():
-    """Capture a single frame for the stream with Safari-compatible JPEG encoding"""
-    global current_frame, frame_lock, FOCUS_MODE, FOCUS_POSITION, frame_count
-    
-    try:
-        temp_file = "/tmp/stream_frame.jpg"
-        
+class CaptureBackend:
+    """Base class for long-lived stream capture backends
+
+    A backend owns the camera for as long as the stream runs and hands out
+    complete JPEG frames through read_frame(), so the stream never pays for
+    process startup or sensor re-initialisation per frame.
+    """
+
+    name = "base"
+    # Backends that can move the lens while running avoid a restart per position
+    supports_lens_control = False
+    # Backends that publish luma_frames themselves, others are decoded on demand
+    provides_luma = False
+
+    def __init__(self):
+        self._frame_cond = threading.Condition()
+        self._latest_frame = None
+        self._latest_seq = 0
+        self._read_seq = 0
+        self._running = False
+        # Serialises start/stop so two threads can never open the camera twice
+        self._lifecycle_lock = threading.RLock()
+
+    def start(self):
+        with self._lifecycle_lock:
+            if self._running:
+                return True
+            return self._start()
+
+    def stop(self):
+        with self._lifecycle_lock:
+            return self._stop()
+
+    def _start(self):
+        raise NotImplementedError
+
+    def _stop(self):
+        raise NotImplementedError
+
+    def restart(self):
+        """Restart the backend so new stream/focus settings take effect"""
+        with self._lifecycle_lock:
+            self.stop()
+            return self.start()
+
+    def apply_focus(self):
+        """Apply FOCUS_MODE/FOCUS_POSITION, by restarting unless overridden"""
+        return self.restart()
+
+    def is_running(self):
+        return self._running
+
+    def _publish_frame(self, frame_data):
+        """Called by the backend reader with each complete JPEG frame"""
+        with self._frame_cond:
+            self._latest_frame = frame_data
+            self._latest_seq += 1
+            self._frame_cond.notify_all()
+
+    def read_frame(self, timeout=1.0):
+        """Block until a frame newer than the last one read is available
+
+        Returns the newest JPEG bytes, or None on timeout or when the backend
+        stopped. Frames produced while nobody was reading are dropped, so the
+        caller always gets the most recent image.
+        """
+        deadline = time.monotonic() + timeout
+        with self._frame_cond:
+            while self._latest_seq == self._read_seq:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0 or not self._running:
+                    return None
+                self._frame_cond.wait(remaining)
+            self._read_seq = self._latest_seq
+            return self._latest_frame
+
+
+class LibcameraVidBackend(CaptureBackend):
+    """Persistent libcamera-vid process producing MJPEG on stdout"""
+
+    name = "libcamera-vid"
+    READ_CHUNK = 65536
+
+    def __init__(self):
+        super().__init__()
+        self._process = None
+        self._reader_thread = None
+
+    def _build_command(self):
         cmd = [
-            "libcamera-still",
-            "--output", temp_file,
-            "--timeout", "1",
+            "libcamera-vid",
+            "--codec", "mjpeg",
+            "--output", "-",
+            "--timeout", "0",
             "--width", str(STREAM_WIDTH),
             "--height", str(STREAM_HEIGHT),
-            "--immediate",
+            "--framerate", str(STREAM_FRAMERATE),
+            "--quality", str(STREAM_QUALITY_SETTINGS.get(STREAM_QUALITY, 75)),
             "--nopreview",
-            "--quality", "85",
-            "--encoding", "jpg"
+            "--flush"
         ]
-        
+        cmd.extend(profile_sensor_args(STREAM_PROFILE))
+
+        # A single autofocus cycle at startup is useless for a live stream,
+        # so auto mode maps onto continuous autofocus here
         if FOCUS_MODE == "auto":
-            cmd.extend(["--autofocus-mode", "auto"])
+            cmd.extend(["--autofocus-mode", "continuous"])
         else:
             cmd.extend(["--autofocus-mode", "manual", "--lens-position", str(FOCUS_POSITION)])
-        
-        result = subprocess.run(cmd, stderr=subprocess.PIPE, stdout=subprocess.PIPE)
-        
-        if result.returncode == 0 and os.path.exists(temp_file):
-            with open(temp_file, 'rb') as f:
-                frame_data = f.read()
-                with frame_lock:
-                    current_frame = frame_data
-                    frame_count += 1
-            return True
-        else:
-            logger.error(f"Failed to capture frame: {result.stderr.decode()}")
+        return cmd
+
+    def _start(self):
+        cmd = self._build_command()
+        logger.info(f"Starting stream backend: {' '.join(cmd)}")
+        try:
+            self._process = subprocess.Popen(
+                cmd,
+                stdout=subprocess.PIPE,
+                stderr=subprocess.DEVNULL,
+                bufsize=0
+            )
+        except Exception as e:
+            logger.error(f"Failed to start libcamera-vid: {e}")
+            self._process = None
             return False
-    except Exception as e:
-        logger.error(f"Error capturing frame: {e}")
-        return False
 
-def streaming_worker():
-    """Background thread for continuous frame capture - Safari optimized"""
-    global keep_streaming, STREAM_ACTIVE
-    
-    logger.info("Streaming worker started")
-    consecutive_failures = 0
-    max_failures = 5
-    
-    while keep_streaming:
-        if capture_frame():
-            consecutive_failures = 0
-            time.sleep(1/12)
-        else:
-            consecutive_failures += 1
-            if consecutive_failures >= max_failures:
-                logger.error("Too many consecutive capture failures, pausing")
-                time.sleep(2)
-                consecutive_failures = 0
-            else:
-                time.sleep(0.5)
+        self._running = True
+        self._reader_thread = threading.Thread(target=self._reader, args=(self._process,))
+        self._reader_thread.daemon = True
+        self._reader_thread.start()
+        return True
+
+    def _reader(self, process):
+        """Split the MJPEG byte stream into JPEG frames on SOI/EOI markers"""
+        buffer = bytearray()
+        fd = process.stdout.fileno()
+
+        while self._running:
+            try:
+                chunk = os.read(fd, self.READ_CHUNK)
+            except OSError:
+                break
+            if not chunk:
+                break
+            buffer.extend(chunk)
+
+            while True:
+                soi = buffer.find(b'\xff\xd8')
+                if soi < 0:
+                    buffer.clear()
+                    break
+                eoi = buffer.find(b'\xff\xd9', soi + 2)
+                if eoi < 0:
+                    if soi > 0:
+                        del buffer[:soi]
+                    break
+                self._publish_frame(bytes(buffer[soi:eoi + 2]))
+                del buffer[:eoi + 2]
+
+        # A restart may already have replaced this process, leave the new one alone
+        if self._process is not process:
+            return
+        if self._running:
+            logger.error(f"libcamera-vid exited unexpectedly (code {process.poll()})")
+        self._running = False
+        with self._frame_cond:
+            self._frame_cond.notify_all()
+
+    def _stop(self):
+        self._running = False
+        process = self._process
+        self._process = None
+
+        if process and process.poll() is None:
+            process.terminate()
+            try:
+                process.wait(timeout=2)
+            except subprocess.TimeoutExpired:
+                process.kill()
+                process.wait()
+
+        if self._reader_thread and self._reader_thread.is_alive():
+            self._reader_thread.join(timeout=2)
+        self._reader_thread = None
+
+        with self._frame_cond:
+            self._frame_cond.notify_all()
+        return True
+
+
+class FileFrameBackend(CaptureBackend):
+    """Fake backend that replays JPEG files from a directory at STREAM_FRAMERATE"""
+
+    name = "file"
+
+    def __init__(self, frame_dir=None):
+        super().__init__()
+        self.frame_dir = frame_dir or FAKE_FRAME_DIR
+        self._thread = None
+
+    def _start(self):
+        frames = []
+        try:
+            for name in sorted(os.listdir(self.frame_dir)):
+                if name.lower().endswith((".jpg", ".jpeg")):
+                    with open(os.path.join(self.frame_dir, name), 'rb') as f:
+                        frames.append(f.read())
+        except Exception as e:
+            logger.error(f"Failed to load fake frames from {self.frame_dir}: {e}")
+            return False
+
+        if not frames:
+            logger.error(f"No JPEG frames found in {self.frame_dir}")
+            return False
+
+        self._running = True
+        self._thread = threading.Thread(target=self._replay, args=(frames,))
+        self._thread.daemon = True
+        self._thread.start()
+        return True
+
+    def _replay(self, frames):
+        index = 0
+        interval = 1.0 / STREAM_FRAMERATE
+        while self._running:
+            self._publish_frame(frames[index % len(frames)])
+            index += 1
+            time.sleep(interval)
+
+    def _stop(self):
+        self._running = False
+        if self._thread and self._thread.is_alive():
+            self._thread.join(timeout=2)
+        self._thread = None
+        with self._frame_cond:
+            self._frame_cond.notify_all()
+        return True
+
+
+class Picamera2Backend(CaptureBackend):
+    """In-process Picamera2 pipeline with a hardware MJPEG encoder
+
+    Lens position and autofocus mode are plain controls on the running
+    camera, so focus sweeps move the lens without restarting the sensor.
+    """
+
+    name = "picamera2"
+    supports_lens_control = True
+    provides_luma = True
+
+    def __init__(self):
+        super().__init__()
+        self._camera = None
+
+    def _focus_controls(self):
+        # AfMode: 0 manual, 2 continuous
+        if FOCUS_MODE == "auto":
+            return {"AfMode": 2}
+        return {"AfMode": 0, "LensPosition": float(FOCUS_POSITION)}
+
+    def _start(self):
+        if Picamera2 is None:
+            logger.error("picamera2 is not installed, use the libcamera-vid backend")
+            return False
+
+        backend = self
+
+        class FrameOutput(Picamera2Output):
+            def outputframe(self, frame, keyframe=True, timestamp=None, *args, **kwargs):
+                backend._publish_frame(bytes(frame))
+
+        try:
+            self._camera = Picamera2()
+            controls = {"FrameRate": STREAM_FRAMERATE}
+            profile = get_capture_profile(STREAM_PROFILE) if STREAM_PROFILE else None
+            if profile and profile["roi"]:
+                sensor_width, sensor_height = self._camera.camera_properties["PixelArraySize"]
+                x, y, w, h = profile["roi"]
+                controls["ScalerCrop"] = (int(x * sensor_width), int(y * sensor_height),
+                                          int(w * sensor_width), int(h * sensor_height))
+            # The YUV lores stream feeds luma_frames straight from the ISP
+            config = self._camera.create_video_configuration(
+                main={"size": (STREAM_WIDTH, STREAM_HEIGHT)},
+                lores={"size": (STREAM_WIDTH, STREAM_HEIGHT), "format": "YUV420"},
+                controls=controls
+            )
+            self._camera.configure(config)
+            self._camera.set_controls(self._focus_controls())
+            self._camera.post_callback = self._publish_luma
+            self._running = True
+            self._camera.start_recording(MJPEGEncoder(), FrameOutput())
+        except Exception as e:
+            logger.error(f"Failed to start Picamera2: {e}")
+            self._running = False
+            self._close()
+            return False
+        return True
+
+    def apply_focus(self):
+        if not self._running:
+            return True
+        self._camera.set_controls(self._focus_controls())
+        return True
+
+    def _publish_luma(self, request):
+        try:
+            with MappedArray(request, "lores") as mapped:
+                # YUV420 planes are stacked vertically, Y is the first height rows
+                luma_frames.publish(mapped.array[:STREAM_HEIGHT, :STREAM_WIDTH],
+                                    time.monotonic() - STREAM_FRAME_LATENCY)
+        except Exception as e:
+            # Runs in the camera's request callback, never let analysis stop the stream
+            logger.error(f"Error publishing luma frame: {e}")
+
+    def _close(self):
+        if self._camera is not None:
+            try:
+                self._camera.close()
+            except Exception as e:
+                logger.error(f"Error closing Picamera2: {e}")
+            self._camera = None
+
+    def _stop(self):
+        self._running = False
+        if self._camera is not None:
+            try:
+                self._camera.stop_recording()
+            except Exception as e:
+                logger.error(f"Error stopping Picamera2: {e}")
+        self._close()
+        with self._frame_cond:
+            self._frame_cond.notify_all()
+        return True
+
+
+STREAM_BACKENDS = {
+    LibcameraVidBackend.name: LibcameraVidBackend,
+    FileFrameBackend.name: FileFrameBackend,
+    Picamera2Backend.name: Picamera2Backend,
+}
+
+
+StreamFrame = namedtuple("StreamFrame", ["seq", "timestamp", "data", "part_header"])
+
+
+class FrameRingBuffer:
+    """Bounded ring of recent JPEG frames shared by every stream client
+
+    Frames are stored once as memoryviews over the backend's bytes together
+    with a prebuilt multipart header, so serving a frame to N clients never
+    copies the JPEG. Waiting clients are woken once per published frame and
+    always receive the newest one, so a slow client skips frames instead of
+    building a backlog. Memory is bounded by the ring size regardless of how
+    many clients are connected.
+    """
+
+    def __init__(self, capacity=STREAM_RING_SIZE):
+        self.capacity = capacity
+        self._slots = [None] * capacity
+        self._seq = 0
+        self._cond = threading.Condition()
+        self._async_waiters = {}
+
+    def publish(self, frame_data, timestamp=None):
+        """Store a new frame and wake all waiting clients, returns its sequence number"""
+        data = memoryview(frame_data)
+        part_header = (b'--frame\r\n'
+                       b'Content-Type: image/jpeg\r\n'
+                       b'Content-Length: ' + str(len(data)).encode() + b'\r\n'
+                       b'Cache-Control: no-cache, no-store, must-revalidate\r\n'
+                       b'Pragma: no-cache\r\n'
+                       b'Expires: 0\r\n'
+                       b'\r\n')
+        with self._cond:
+            self._seq += 1
+            frame = StreamFrame(self._seq, timestamp or time.monotonic(), data, part_header)
+            self._slots[self._seq % self.capacity] = frame
+            self._cond.notify_all()
+            async_waiters, self._async_waiters = self._async_waiters, {}
+
+        # One thread-safe callback per event loop releases all its waiters
+        for loop, futures in async_waiters.items():
+            try:
+                loop.call_soon_threadsafe(self._release_futures, futures)
+            except RuntimeError:
+                pass
+        return frame.seq
+
+    @staticmethod
+    def _release_futures(futures):
+        for future in futures:
+            if not future.done():
+                future.set_result(None)
+
+    def latest(self):
+        """Return the newest frame or None if the ring is empty"""
+        with self._cond:
+            return self._slots[self._seq % self.capacity]
+
+    def get(self, seq):
+        """Return the frame with the given sequence number if it is still in the ring"""
+        with self._cond:
+            frame = self._slots[seq % self.capacity]
+            if frame is not None and frame.seq == seq:
+                return frame
+            return None
+
+    def frames(self):
+        """Return the buffered frames, oldest first"""
+        with self._cond:
+            return sorted((f for f in self._slots if f is not None), key=lambda f: f.seq)
+
+    def wait_for_frame(self, last_seq, timeout=1.0):
+        """Block until a frame newer than last_seq exists and return the newest one"""
+        with self._cond:
+            if self._seq <= last_seq:
+                self._cond.wait(timeout)
+            frame = self._slots[self._seq % self.capacity]
+            if frame is None or frame.seq <= last_seq:
+                return None
+            return frame
+
+    async def wait_for_frame_async(self, last_seq, timeout=1.0):
+        """Coroutine version of wait_for_frame() for the ASGI server"""
+        loop = asyncio.get_running_loop()
+        with self._cond:
+            if self._seq <= last_seq:
+                future = loop.create_future()
+                self._async_waiters.setdefault(loop, []).append(future)
+            else:
+                future = None
+
+        if future is not None:
+            try:
+                await asyncio.wait_for(future, timeout)
+            except asyncio.TimeoutError:
+                pass
+
+        frame = self.latest()
+        if frame is None or frame.seq <= last_seq:
+            return None
+        return frame
+
+    def clear(self):
+        """Drop buffered frames, sequence numbers keep increasing"""
+        with self._cond:
+            self._slots = [None] * self.capacity
+            self._cond.notify_all()
+
+    def wake_all(self):
+        """Wake every waiting client, e.g. so they notice the stream stopped"""
+        with self._cond:
+            self._cond.notify_all()
+            async_waiters, self._async_waiters = self._async_waiters, {}
+        for loop, futures in async_waiters.items():
+            try:
+                loop.call_soon_threadsafe(self._release_futures, futures)
+            except RuntimeError:
+                pass
+
+
+stream_frames = FrameRingBuffer(STREAM_RING_SIZE)
+
+
+def transcode_jpeg(jpeg_data, downscale, quality):
+    """Smaller, lower quality copy of a JPEG frame
+
+    The decoders' reduced-size modes scale in the DCT domain, so the full
+    frame is never decoded at full resolution.
+    """
+    if cv2 is not None:
+        flags = {2: cv2.IMREAD_REDUCED_COLOR_2, 4: cv2.IMREAD_REDUCED_COLOR_4, 8: cv2.IMREAD_REDUCED_COLOR_8}
+        image = cv2.imdecode(np.frombuffer(jpeg_data, dtype=np.uint8), flags.get(downscale, cv2.IMREAD_COLOR))
+        if image is None:
+            raise ValueError("Could not decode JPEG")
+        ok, encoded = cv2.imencode(".jpg", image, [cv2.IMWRITE_JPEG_QUALITY, quality])
+        return encoded.tobytes()
+    if Image is not None:
+        with Image.open(io.BytesIO(jpeg_data)) as picture:
+            size = (picture.width // downscale, picture.height // downscale)
+            picture.draft('RGB', size)
+            picture = picture.convert('RGB')
+            if picture.size != size:
+                picture = picture.resize(size)
+            buffer = io.BytesIO()
+            picture.save(buffer, "JPEG", quality=quality)
+            return buffer.getvalue()
+    raise RuntimeError("No JPEG codec available, install opencv-python or Pillow")
+
+
+class StreamTier:
+    """One stream variant shared by every viewer on it
+
+    The full tier is stream_frames itself. Lower tiers run one transcoder
+    thread while they have viewers, publishing into their own ring, so the
+    encode cost depends on the number of tiers in use and not the number of
+    viewers.
+    """
+
+    def __init__(self, name, downscale, quality):
+        self.name = name
+        self.downscale = downscale
+        self.quality = quality
+        self.frames = stream_frames if downscale == 1 else FrameRingBuffer(STREAM_RING_SIZE)
+        self.frame_size = None
+        self._viewers = 0
+        self._lock = threading.Lock()
+        self._thread = None
+
+    def acquire(self):
+        with self._lock:
+            self._viewers += 1
+            if self.frames is not stream_frames and self._thread is None:
+                self._thread = threading.Thread(target=self._transcode, name=f"stream-tier-{self.name}")
+                self._thread.daemon = True
+                self._thread.start()
+        return self
+
+    def release(self):
+        with self._lock:
+            self._viewers = max(0, self._viewers - 1)
+
+    @property
+    def viewers(self):
+        return self._viewers
+
+    def expected_frame_size(self):
+        """Average frame size, estimated from the full stream when not running"""
+        if self.frame_size:
+            return self.frame_size
+        latest = stream_frames.latest()
+        if latest is None:
+            return None
+        return len(latest.data) / float(self.downscale * self.downscale)
+
+    def _transcode(self):
+        """Runs until the last viewer left, waiting out stream stops
+        
+        The thread clears itself under the lock, so acquire() either sees it
+        still running with a viewer to serve or starts a new one.
+        """
+        last_seq = 0
+        while True:
+            with self._lock:
+                if self._viewers == 0:
+                    self._thread = None
+                    break
+            frame = stream_frames.wait_for_frame(last_seq, timeout=1.0)
+            if frame is None:
+                continue
+            last_seq = frame.seq
+            try:
+                data = transcode_jpeg(frame.data, self.downscale, self.quality)
+            except Exception as e:
+                logger.error(f"Stream tier {self.name} transcode failed: {e}")
+                time.sleep(0.5)
+                continue
+            self.frame_size = len(data) if self.frame_size is None else 0.9 * self.frame_size + 0.1 * len(data)
+            self.frames.publish(data, frame.timestamp)
+        self.frames.wake_all()
+
+
+stream_tiers = [StreamTier(name, downscale, quality) for name, (downscale, quality) in STREAM_TIERS.items()]
+
+
+class StreamViewer:
+    """Picks the stream tier for one viewer from how fast it drains frames
+
+    Every sent frame records its size and how long the send blocked. Over
+    each STREAM_ADAPT_INTERVAL the viewer drops a tier when sending kept it
+    busy more than STREAM_ADAPT_BUSY_FRACTION of the time, and rises a tier
+    when its measured drain rate covers the better tier at the target frame
+    rate with STREAM_ADAPT_HEADROOM to spare.
+
+    The tier is only acquired by open(), from inside the response body, so a
+    response that is never iterated holds no tier and no transcoder.
+    """
+
+    def __init__(self, quality="auto"):
+        self.fixed = quality if quality in STREAM_TIERS else None
+        names = list(STREAM_TIERS)
+        self.index = names.index(self.fixed) if self.fixed else 0
+        self.tier = None
+        self._reset()
+
+    def open(self):
+        """Acquire the starting tier, pair with close()"""
+        self.tier = stream_tiers[self.index].acquire()
+        self._reset()
+        return self.tier
+
+    def _reset(self):
+        self._window_start = time.monotonic()
+        self._bytes = 0
+        self._busy = 0.0
+
+    def record(self, nbytes, send_seconds):
+        """Account one sent frame, returns the tier to use for the next one"""
+        self._bytes += nbytes
+        self._busy += send_seconds
+        elapsed = time.monotonic() - self._window_start
+        if self.fixed or elapsed < STREAM_ADAPT_INTERVAL:
+            return self.tier
+        
+        busy_fraction = self._busy / elapsed
+        drain_rate = self._bytes / max(self._busy, 1e-3)
+        new_index = self.index
+        if busy_fraction > STREAM_ADAPT_BUSY_FRACTION and self.index < len(stream_tiers) - 1:
+            new_index = self.index + 1
+        elif self.index > 0:
+            better_size = stream_tiers[self.index - 1].expected_frame_size()
+            if better_size and drain_rate > better_size * STREAM_FRAMERATE * STREAM_ADAPT_HEADROOM:
+                new_index = self.index - 1
+        
+        if new_index != self.index:
+            logger.info(f"Stream viewer moving from {self.tier.name} to {stream_tiers[new_index].name} "
+                        f"({drain_rate / 1024:.0f} KB/s, busy {busy_fraction:.0%})")
+            self.tier.release()
+            self.index = new_index
+            self.tier = stream_tiers[new_index].acquire()
+        self._reset()
+        return self.tier
+
+    def close(self):
+        if self.tier is not None:
+            self.tier.release()
+            self.tier = None
+
+
+def get_stream_tier_summary():
+    return {tier.name: {"viewers": tier.viewers, "downscale": tier.downscale,
+                        "frame_size": round(tier.expected_frame_size() or 0)} for tier in stream_tiers}
+
+
+LumaFrame = namedtuple("LumaFrame", ["seq", "timestamp", "array"])
+
+
+class LumaFrameBuffer:
+    """Ring of grayscale luma planes in one memory-mapped buffer
+
+    publish() copies the backend's Y plane into the next slot once; every
+    consumer then gets a NumPy view onto that slot, so analysis needs no
+    JPEG decode and no per-consumer copy. The mapping is backed by a file in
+    /dev/shm when available, whose header lets other processes follow along:
+
+        magic "LUMA", slots, width, height, current slot, seq, timestamp
+
+    followed by the slots. seq is written last, so a reader that sees the
+    same seq before and after copying a slot has a consistent frame. A new
+    frame size replaces the file, the old mapping's magic becomes "DEAD" so
+    readers know to reopen it. Frames handed out earlier stay valid, they
+    keep the old mapping alive until they are dropped.
+    """
+
+    HEADER = struct.Struct("<4sIIIIQd")
+
+    def __init__(self, path=LUMA_SHM_PATH, slots=LUMA_RING_SLOTS):
+        self.path = path
+        self.slots = slots
+        self.width = self.height = 0
+        self._map = None
+        self._frames = [None] * slots
+        self._seq = 0
+        self._cond = threading.Condition()
+        self._requested_at = 0.0
+
+    def _allocate(self, width, height):
+        """(Re)create the mapping for a new frame size"""
+        size = self.HEADER.size + self.slots * width * height
+        # Views into the old mapping must go before it can be closed
+        self._frames = [None] * self.slots
+        if self._map is not None:
+            old_map, self._map = self._map, None
+            old_map[:4] = b"DEAD"
+            try:
+                old_map.close()
+            except BufferError:
+                # A consumer still holds an old frame, the mapping is freed
+                # with its last view
+                pass
+            # Truncating the file under a live mapping would fault its readers
+            try:
+                os.unlink(self.path)
+            except OSError:
+                pass
+        try:
+            fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o644)
+            try:
+                os.ftruncate(fd, size)
+                self._map = mmap.mmap(fd, size)
+            finally:
+                os.close(fd)
+        except OSError:
+            # No /dev/shm, the buffer is still shared by every consumer in this process
+            self._map = mmap.mmap(-1, size)
+        self.width, self.height = width, height
+
+    def publish(self, plane, timestamp=None):
+        """Copy a 2D uint8 luma plane into the ring, returns its sequence number"""
+        height, width = plane.shape[:2]
+        with self._cond:
+            if (width, height) != (self.width, self.height):
+                self._allocate(width, height)
+            seq = self._seq + 1
+            slot = seq % self.slots
+            offset = self.HEADER.size + slot * width * height
+            array = np.frombuffer(self._map, dtype=np.uint8, count=width * height,
+                                  offset=offset).reshape(height, width)
+            np.copyto(array, plane)
+            timestamp = timestamp or time.monotonic()
+            self.HEADER.pack_into(self._map, 0, b"LUMA", self.slots, width, height, slot, seq, timestamp)
+            self._seq = seq
+            self._frames[slot] = LumaFrame(seq, timestamp, array)
+            self._cond.notify_all()
+        return seq
+
+    def latest(self):
+        with self._cond:
+            return self._frames[self._seq % self.slots]
+
+    def wait_for_frame(self, last_seq, timeout=1.0):
+        """Block until a frame newer than last_seq exists and return the newest one"""
+        self.request()
+        with self._cond:
+            if self._seq <= last_seq:
+                self._cond.wait(timeout)
+            frame = self._frames[self._seq % self.slots]
+            if frame is None or frame.seq <= last_seq:
+                return None
+            return frame
+
+    def wait_for_frame_after(self, timestamp, timeout=3.0):
+        """Return the first luma frame exposed at or after a monotonic timestamp"""
+        deadline = time.monotonic() + timeout
+        last_seq = 0
+        while True:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return None
+            frame = self.wait_for_frame(last_seq, remaining)
+            if frame is None:
+                continue
+            if frame.timestamp >= timestamp:
+                return frame
+            last_seq = frame.seq
+
+    def request(self):
+        """Note that a consumer wants luma frames"""
+        self._requested_at = time.monotonic()
+
+    def wanted(self):
+        return time.monotonic() - self._requested_at < LUMA_DEMAND_WINDOW
+
+    def clear(self):
+        with self._cond:
+            self._frames = [None] * self.slots
+            self._cond.notify_all()
+
+
+luma_frames = LumaFrameBuffer()
+
+
+def latest_luma_frame(timeout=1.0):
+    """Newest luma frame, waiting for a fresh one if none is current"""
+    luma_frames.request()
+    frame = luma_frames.latest()
+    if frame is not None and time.monotonic() - frame.timestamp < 2.0 / STREAM_FRAMERATE + STREAM_FRAME_LATENCY:
+        return frame
+    return luma_frames.wait_for_frame(frame.seq if frame else 0, timeout)
+
+
+def create_stream_backend():
+    """Instantiate the configured stream backend"""
+    backend_class = STREAM_BACKENDS.get(STREAM_BACKEND)
+    if backend_class is None:
+        logger.error(f"Unknown stream backend '{STREAM_BACKEND}', falling back to libcamera-vid")
+        backend_class = LibcameraVidBackend
+    return backend_class()
+
+
+def restart_stream_backend():
+    """Apply changed stream or focus settings to a running backend"""
+    if stream_backend and stream_backend.is_running():
+        logger.info("Restarting stream backend to apply new settings")
+        # Frames from the old settings may have another size
+        luma_frames.clear()
+        return stream_backend.restart()
+    return True
+
+
+def apply_stream_focus():
+    """Apply the focus settings to a running backend, live where supported"""
+    if stream_backend and stream_backend.is_running():
+        return stream_backend.apply_focus()
+    return True
+
+
+def suspend_stream_backend():
+    """Release the camera for a still capture, returns True if it was running
+    
+    While suspended the streaming worker waits instead of restarting the
+    backend, only resume_stream_backend() hands the camera back to it.
+    """
+    with stream_backend_lock:
+        if stream_backend and stream_backend.is_running() and stream_backend.name != FileFrameBackend.name:
+            stream_resume_event.clear()
+            stream_backend.stop()
+            return True
+        return False
+
+
+def resume_stream_backend(was_running):
+    """Restart the stream backend after a still capture"""
+    with stream_backend_lock:
+        try:
+            if was_running and keep_streaming and stream_backend:
+                stream_backend.start()
+        finally:
+            stream_resume_event.set()
+
+
+def capture_frame():
+    """Pull the next frame from the persistent stream backend"""
+    global current_frame, frame_lock, frame_count
+    
+    try:
+        # A stopped backend is restarted here after a crash, but never while
+        # a still capture has borrowed the camera
+        with stream_backend_lock:
+            if stream_backend is None or not stream_resume_event.is_set():
+                return False
+            backend = stream_backend
+            if not backend.is_running() and not backend.start():
+                return False
+
+        frame_data = backend.read_frame(timeout=2.0)
+        if frame_data is None:
+            # Stopped underneath us by a still capture, not a failure
+            if not stream_resume_event.is_set():
+                return True
+            logger.error("Timed out waiting for a frame from the stream backend")
+            return False
+
+        with frame_lock:
+            current_frame = frame_data
+            frame_count += 1
+        timestamp = time.monotonic() - STREAM_FRAME_LATENCY
+        stream_frames.publish(frame_data, timestamp)
+    except Exception as e:
+        logger.error(f"Error capturing frame: {e}")
+        return False
+    
+    # One decode per frame however many analysis consumers there are. The
+    # stream frame is already out, an analysis failure must not fail it
+    if not backend.provides_luma and luma_frames.wanted() and np is not None:
+        try:
+            gray, _ = decode_jpeg_gray(frame_data, dtype=np.uint8)
+            luma_frames.publish(gray, timestamp)
+        except Exception as e:
+            logger.error(f"Error publishing luma frame: {e}")
+    return True
+
+def streaming_worker():
+    """Background thread for continuous frame capture - Safari optimized"""
+    global keep_streaming, STREAM_ACTIVE
+    
+    logger.info("Streaming worker started")
+    consecutive_failures = 0
+    max_failures = 5
+    
+    while keep_streaming:
+        # The camera is lent to a still capture, wait for it to come back
+        if not stream_resume_event.wait(1.0):
+            continue
+        
+        # capture_frame() blocks until the sensor delivers the next frame,
+        # so the frame rate is set by the backend rather than a sleep here
+        if capture_frame():
+            consecutive_failures = 0
+        else:
+            consecutive_failures += 1
+            if consecutive_failures >= max_failures:
+                logger.error("Too many consecutive capture failures, pausing")
+                time.sleep(2)
+                consecutive_failures = 0
+            else:
+                time.sleep(0.5)
     
     logger.info("Streaming worker stopped")
     STREAM_ACTIVE = False
 
 def start_stream():
     """Start the streaming thread"""
-    global streaming_thread, keep_streaming, STREAM_ACTIVE, current_frame, frame_count
+    global streaming_thread, keep_streaming, STREAM_ACTIVE, current_frame, frame_count, stream_backend
     
     if STREAM_ACTIVE:
         logger.info("Stream already active")
@@ -296,6 +2524,15 @@ def start_stream():
     with frame_lock:
         current_frame = None
         frame_count = 0
+    stream_frames.clear()
+    luma_frames.clear()
+    
+    with stream_backend_lock:
+        stream_backend = create_stream_backend()
+        if not stream_backend.start():
+            logger.error("Stream backend failed to start")
+            stream_backend = None
+            return False
     
     keep_streaming = True
     STREAM_ACTIVE = True
@@ -317,131 +2554,1199 @@ def stop_stream():
     
     keep_streaming = False
     
+    with stream_backend_lock:
+        if stream_backend:
+            stream_backend.stop()
+    
     if streaming_thread and streaming_thread.is_alive():
         streaming_thread.join(timeout=3)
     
     STREAM_ACTIVE = False
+    stream_frames.wake_all()
     streaming_thread = None
     logger.info("Stream stopped")
     publish_status()
     return True
 
-def capture_image():
-    """Capture a high-quality image and save it to disk"""
+class FocusCache:
+    """Last good lens position and exposure per (tool, Z bucket)
+
+    Entries are saved to FOCUS_CACHE_FILE so they survive restarts. Each one
+    keeps the sharpness of the capture that produced it, so a later capture
+    that comes out noticeably softer can invalidate the entry.
+    """
+
+    def __init__(self, path=FOCUS_CACHE_FILE, bucket_mm=FOCUS_CACHE_Z_BUCKET_MM):
+        self.path = path
+        self.bucket_mm = bucket_mm
+        self._lock = threading.Lock()
+        self._entries = {}
+        self.hits = 0
+        self.misses = 0
+        try:
+            with open(path, 'r') as f:
+                self._entries = json.load(f).get("entries", {})
+        except (OSError, ValueError):
+            pass
+
+    def key(self, tool, z):
+        bucket = round(float(z or 0.0) / self.bucket_mm) * self.bucket_mm
+        return f"{tool or 'none'}@{bucket:.2f}"
+
+    def get(self, tool, z):
+        with self._lock:
+            entry = self._entries.get(self.key(tool, z))
+            if entry:
+                self.hits += 1
+            else:
+                self.misses += 1
+            return dict(entry) if entry else None
+
+    def put(self, tool, z, lens_position, sharpness=None, exposure=None, profile=None):
+        key = self.key(tool, z)
+        with self._lock:
+            self._entries[key] = {
+                "tool": tool,
+                "z_bucket": float(key.rsplit("@", 1)[1]),
+                "lens_position": round(float(lens_position), 3),
+                "sharpness": sharpness,
+                "profile": profile,
+                "exposure": exposure,
+                "updated": datetime.now().isoformat()
+            }
+            self._save()
+        return self._entries[key]
+
+    def invalidate(self, tool=None, z=None):
+        """Drop one entry, every entry for a tool, or everything"""
+        with self._lock:
+            if z is not None:
+                removed = 1 if self._entries.pop(self.key(tool, z), None) else 0
+            else:
+                keys = [k for k, e in self._entries.items() if tool is None or e["tool"] == tool]
+                for k in keys:
+                    del self._entries[k]
+                removed = len(keys)
+            self._save()
+        return removed
+
+    def _save(self):
+        """Write the cache, callers hold self._lock"""
+        try:
+            _write_file_atomic(self.path, json.dumps({"entries": self._entries}, indent=2))
+        except OSError as e:
+            logger.error(f"Failed to save focus cache: {e}")
+
+    def to_dict(self):
+        with self._lock:
+            return {"entries": list(self._entries.values()), "hits": self.hits, "misses": self.misses,
+                    "z_bucket_mm": self.bucket_mm}
+
+
+focus_cache = FocusCache()
+
+
+def current_focus_target():
+    """(tool, z) the camera is looking at, used as the focus cache key"""
+    tool = get_printer_state_summary().get("active_tool")
+    position = get_cached_printer_position()[0]
+    return tool, position.get("z", 0.0)
+
+
+CAPTURE_EXTENSIONS = {"jpg": ".jpg", "png": ".png", "yuv420": ".yuv"}
+CAPTURE_MIMETYPES = {".jpg": "image/jpeg", ".png": "image/png", ".yuv": "application/octet-stream"}
+
+
+def capture_mimetype(filename):
+    return CAPTURE_MIMETYPES.get(os.path.splitext(filename)[1], "application/octet-stream")
+
+
+capture_name_lock = threading.Lock()
+capture_name_last = None
+capture_name_repeat = 0
+
+
+def capture_timestamp():
+    """Timestamp for capture file names, unique within this process
+
+    Millisecond resolution, a second capture in the same millisecond gets
+    a _001, _002, ... suffix so queued and burst captures never overwrite
+    and names still sort in capture order.
+    """
+    global capture_name_last, capture_name_repeat
+    stamp = datetime.now().strftime("%Y%m%d_%H%M%S_%f")[:-3]
+    with capture_name_lock:
+        if stamp == capture_name_last:
+            capture_name_repeat += 1
+            return f"{stamp}_{capture_name_repeat:03d}"
+        capture_name_last, capture_name_repeat = stamp, 0
+        return stamp
+
+
+# Serialises profile updates with the file write that persists them
+capture_profiles_lock = threading.Lock()
+
+
+def load_capture_profiles():
+    """Merge profiles saved through the API over the built-in ones"""
+    try:
+        with open(CAPTURE_PROFILES_FILE, 'r') as f:
+            CAPTURE_PROFILES.update(json.load(f))
+    except (OSError, ValueError):
+        pass
+
+
+def save_capture_profile(name, settings):
+    """Validate, store and persist a capture profile, returns it"""
+    profile = dict(CAPTURE_PROFILES["full"])
+    profile.update({k: v for k, v in settings.items() if k in profile})
+    if profile["encoding"] not in CAPTURE_EXTENSIONS:
+        raise ValueError(f"Unsupported encoding: {profile['encoding']}")
+    if profile["roi"] is not None:
+        roi = [float(v) for v in profile["roi"]]
+        if len(roi) != 4 or min(roi) < 0 or roi[0] + roi[2] > 1 or roi[1] + roi[3] > 1:
+            raise ValueError("roi must be [x, y, width, height] fractions inside the frame")
+        profile["roi"] = roi
+    
+    with capture_profiles_lock:
+        CAPTURE_PROFILES[name] = profile
+        custom = {k: v for k, v in CAPTURE_PROFILES.items() if k not in ("full", "binned", "nozzle", "raw", "yuv")}
+        _write_file_atomic(CAPTURE_PROFILES_FILE, json.dumps(custom, indent=2))
+    return profile
+
+
+def get_capture_profile(name=None):
+    name = name or CAPTURE_PROFILE
+    if name not in CAPTURE_PROFILES:
+        raise ValueError(f"Unknown capture profile: {name}")
+    return CAPTURE_PROFILES[name]
+
+
+def profile_sensor_args(name):
+    """Sensor crop and mode arguments shared by libcamera-still and libcamera-vid"""
+    if not name:
+        return []
+    profile = get_capture_profile(name)
+    args = []
+    if profile["roi"]:
+        args.extend(["--roi", ",".join(f"{v:.4f}" for v in profile["roi"])])
+    if profile["mode"]:
+        args.extend(["--mode", profile["mode"]])
+    return args
+
+
+def profile_still_args(name):
+    """libcamera-still output arguments for a capture profile"""
+    profile = get_capture_profile(name)
+    args = [
+        "--width", str(profile["width"] or CAPTURE_WIDTH),
+        "--height", str(profile["height"] or CAPTURE_HEIGHT),
+        "--encoding", profile["encoding"]
+    ]
+    if profile["quality"] and profile["encoding"] == "jpg":
+        args.extend(["--quality", str(profile["quality"])])
+    if profile["raw"]:
+        args.append("--raw")
+    return args + profile_sensor_args(name)
+
+
+def _run_still(filename, timeout_ms, focus_args, profile=None):
+    """Run libcamera-still once, returns (ok, exposure_time, still metadata)"""
+    metadata_path = os.path.splitext(filename)[0] + ".meta.json"
+    cmd = [
+        "libcamera-still",
+        "--output", filename,
+        "--timeout", str(timeout_ms),
+        "--nopreview",
+        "--metadata", metadata_path,
+        "--metadata-format", "json"
+    ] + profile_still_args(profile) + focus_args
+    
+    # libcamera-still cannot open the sensor while the stream backend holds it
+    with still_capture_lock:
+        stream_was_running = suspend_stream_backend()
+        try:
+            result = subprocess.run(cmd, stderr=subprocess.PIPE, stdout=subprocess.PIPE)
+            exposure_time = time.monotonic() - STILL_CAPTURE_LATENCY
+        finally:
+            resume_stream_backend(stream_was_running)
+    
+    # Lens position and exposure the camera actually settled on
+    still_metadata = {}
+    try:
+        with open(metadata_path, 'r') as f:
+            still_metadata = json.load(f)
+        os.remove(metadata_path)
+    except (OSError, ValueError):
+        pass
+    
+    if result.returncode != 0:
+        logger.error(f"Failed to capture image: {result.stderr.decode()}")
+        return False, exposure_time, still_metadata
+    return True, exposure_time, still_metadata
+
+
+def _still_exposure(still_metadata):
+    """Shutter and gain from libcamera-still metadata, None if missing"""
+    if still_metadata.get("ExposureTime") and still_metadata.get("AnalogueGain"):
+        return {"shutter_us": int(still_metadata["ExposureTime"]),
+                "gain": round(float(still_metadata["AnalogueGain"]), 3)}
+    return None
+
+
+def capture_image(profile=None):
+    """Capture a still with the named capture profile and save it to disk
+
+    In auto focus mode the focus cache is consulted first: a hit captures in
+    manual focus with the cached exposure and a short timeout. A miss, or a
+    hit whose capture is clearly softer than the cached one, runs full
+    autofocus and refreshes the cache.
+    """
     global FOCUS_MODE, FOCUS_POSITION
     
     try:
-        timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-        filename = f"{CAPTURE_DIR}/capture_{timestamp}.jpg"
+        profile = profile or CAPTURE_PROFILE
+        settings = get_capture_profile(profile)
+        timestamp = capture_timestamp()
+        filename = f"{CAPTURE_DIR}/capture_{timestamp}{CAPTURE_EXTENSIONS[settings['encoding']]}"
+        # Sharpness is only comparable between captures of the same JPEG profile
+        scored = settings["encoding"] == "jpg"
         
-        cmd = [
-            "libcamera-still",
-            "--output", filename,
-            "--timeout", "2000",
-            "--width", str(CAPTURE_WIDTH),
-            "--height", str(CAPTURE_HEIGHT),
-            "--nopreview"
-        ]
+        if FOCUS_MODE != "auto":
+            focus_args = ["--autofocus-mode", "manual", "--lens-position", str(FOCUS_POSITION)]
+            ok, exposure_time, _ = _run_still(filename, CAPTURE_TIMEOUT_MS, focus_args, profile)
+            if not ok:
+                return False
+            logger.info(f"Image captured: {filename}")
+            save_capture_metadata(filename, exposure_time, profile=profile)
+            return filename
         
-        if FOCUS_MODE == "auto":
-            cmd.extend(["--autofocus-mode", "auto"])
-        else:
-            cmd.extend(["--autofocus-mode", "manual", "--lens-position", str(FOCUS_POSITION)])
+        tool, z = current_focus_target()
+        cached = focus_cache.get(tool, z)
+        focus = {"mode": "auto", "cache": "miss"}
         
-        result = subprocess.run(cmd, stderr=subprocess.PIPE, stdout=subprocess.PIPE)
+        if cached:
+            focus_args = ["--autofocus-mode", "manual", "--lens-position", str(cached["lens_position"])]
+            exposure = cached.get("exposure") or {}
+            timeout_ms = CAPTURE_TIMEOUT_MS
+            if exposure.get("shutter_us") and exposure.get("gain"):
+                focus_args += ["--shutter", str(exposure["shutter_us"]), "--gain", str(exposure["gain"])]
+                timeout_ms = CAPTURE_CACHED_TIMEOUT_MS
+            ok, exposure_time, still_metadata = _run_still(filename, timeout_ms, focus_args, profile)
+            if not ok:
+                return False
+            
+            sharpness = capture_sharpness(filename) if scored else None
+            same_profile = cached.get("profile") in (None, profile)
+            if same_profile and cached.get("sharpness") and sharpness is not None and \
+                    sharpness < cached["sharpness"] * FOCUS_CACHE_MIN_SHARPNESS_RATIO:
+                logger.info(f"Focus cache regression for {tool} at Z{z}: {sharpness:.1f} < "
+                            f"{cached['sharpness']:.1f}, refocusing")
+                focus_cache.invalidate(tool, z)
+                focus["cache"] = "regressed"
+            else:
+                focus.update({"cache": "hit", "position": cached["lens_position"], "sharpness": sharpness})
+                # Entries from a focus sweep get their still sharpness and exposure here
+                if cached.get("sharpness") is None and sharpness is not None:
+                    focus_cache.put(tool, z, cached["lens_position"], sharpness,
+                                    exposure or _still_exposure(still_metadata), profile)
         
-        if result.returncode == 0:
-            logger.info(f"Image captured: {filename}")
-            return filename
-        else:
-            logger.error(f"Failed to capture image: {result.stderr.decode()}")
-            return False
+        if focus["cache"] != "hit":
+            ok, exposure_time, still_metadata = _run_still(filename, CAPTURE_TIMEOUT_MS,
+                                                           ["--autofocus-mode", "auto"], profile)
+            if not ok:
+                return False
+            sharpness = capture_sharpness(filename) if scored else None
+            lens_position = still_metadata.get("LensPosition")
+            focus.update({"position": lens_position, "sharpness": sharpness})
+            if lens_position is not None:
+                focus_cache.put(tool, z, lens_position, sharpness, _still_exposure(still_metadata),
+                                profile if scored else None)
+        
+        logger.info(f"Image captured: {filename} (profile {profile}, focus cache {focus['cache']})")
+        save_capture_metadata(filename, exposure_time, focus=focus, profile=profile)
+        return filename
             
     except Exception as e:
         logger.error(f"Error in capture_image: {e}")
         return False
 
-def update_camera_config(config):
-    """Update camera configuration"""
-    global STREAM_WIDTH, STREAM_HEIGHT, CAPTURE_WIDTH, CAPTURE_HEIGHT, STREAM_QUALITY
-    
+
+def capture_sharpness(filename):
+    """Sharpness score of a saved still, None if it cannot be computed"""
+    if np is None:
+        return None
     try:
-        if "stream_width" in config and isinstance(config["stream_width"], int):
-            STREAM_WIDTH = config["stream_width"]
-        
-        if "stream_height" in config and isinstance(config["stream_height"], int):
-            STREAM_HEIGHT = config["stream_height"]
-            
-        if "capture_width" in config and isinstance(config["capture_width"], int):
-            CAPTURE_WIDTH = config["capture_width"]
-            
-        if "capture_height" in config and isinstance(config["capture_height"], int):
-            CAPTURE_HEIGHT = config["capture_height"]
-            
-        if "stream_quality" in config and config["stream_quality"] in ["low", "medium", "high"]:
-            STREAM_QUALITY = config["stream_quality"]
-            
-        logger.info(f"Camera config updated: stream={STREAM_WIDTH}x{STREAM_HEIGHT}, "
-                    f"capture={CAPTURE_WIDTH}x{CAPTURE_HEIGHT}, quality={STREAM_QUALITY}")
-        
-        publish_status()
-        return True
+        with open(filename, 'rb') as f:
+            return round(frame_sharpness(f.read(), downscale=8), 3)
     except Exception as e:
-        logger.error(f"Error updating camera config: {e}")
-        return False
+        logger.error(f"Could not score capture sharpness: {e}")
+        return None
 
-def publish_status():
-    """Publish camera status to MQTT"""
-    global mqtt_client, STREAM_ACTIVE, STREAM_WIDTH, STREAM_HEIGHT, CAPTURE_WIDTH, CAPTURE_HEIGHT
-    
-    if mqtt_client and mqtt_client.is_connected():
-        focus_info = get_focus_info()
+class CaptureStore:
+    """SQLite index of saved captures with the latest entry kept in memory
+
+    capture_image() adds a row per photo, so latest() is a memory read and
+    time range queries use the index on created instead of listing and
+    stat'ing CAPTURE_DIR. A new index imports the captures already on disk
+    (and their old .json sidecars) once. The total size of all captures is
+    summed once on open and then kept up to date by add() and remove().
+    """
+
+    def __init__(self, path=CAPTURE_INDEX_FILE, capture_dir=CAPTURE_DIR):
+        self.path = path
+        self.capture_dir = capture_dir
+        self._lock = threading.Lock()
+        self._latest = None
         
-        with position_lock:
-            current_pos = current_printer_position.copy()
+        is_new = not os.path.exists(path)
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._db.row_factory = sqlite3.Row
+        with self._db:
+            self._db.execute("PRAGMA journal_mode=WAL")
+            self._db.execute("""
+                CREATE TABLE IF NOT EXISTS captures (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    filename TEXT UNIQUE NOT NULL,
+                    created REAL NOT NULL,
+                    timestamp TEXT NOT NULL,
+                    x REAL, y REAL, z REAL,
+                    tool TEXT,
+                    focus TEXT,
+                    size INTEGER,
+                    series TEXT,
+                    layer INTEGER,
+                    profile TEXT
+                )""")
+            # Indexes created before burst/timelapse series were added
+            columns = {row[1] for row in self._db.execute("PRAGMA table_info(captures)")}
+            for column, column_type in (("series", "TEXT"), ("layer", "INTEGER"), ("profile", "TEXT")):
+                if column not in columns:
+                    self._db.execute(f"ALTER TABLE captures ADD COLUMN {column} {column_type}")
+            self._db.execute("CREATE INDEX IF NOT EXISTS captures_created ON captures (created)")
+            self._db.execute("CREATE INDEX IF NOT EXISTS captures_series ON captures (series, created)")
+        self._total_size = self._db.execute("SELECT COALESCE(SUM(size), 0) FROM captures").fetchone()[0]
         
-        status = {
-            "timestamp": datetime.now().isoformat(),
-            "streaming": STREAM_ACTIVE,
-            "focus_mode": focus_info.get("mode", "auto"),
-            "focus_position": focus_info.get("position", 10),
-            "stream_width": STREAM_WIDTH,
-            "stream_height": STREAM_HEIGHT,
-            "capture_width": CAPTURE_WIDTH,
-            "capture_height": CAPTURE_HEIGHT,
-            "stream_quality": STREAM_QUALITY,
-            "calibration": calibration_data,
-            "current_position": current_pos
+        if is_new:
+            self._import_existing()
+        self._latest = self._query_one("SELECT * FROM captures ORDER BY created DESC, id DESC LIMIT 1")
+
+    def _row_to_info(self, row):
+        if row is None:
+            return None
+        position = None
+        if row["x"] is not None:
+            position = {"x": row["x"], "y": row["y"], "z": row["z"]}
+        return {
+            "id": row["id"],
+            "filename": row["filename"],
+            "created": row["created"],
+            "timestamp": row["timestamp"],
+            "position": position,
+            "tool": row["tool"],
+            "focus": json.loads(row["focus"]) if row["focus"] else None,
+            "size": row["size"],
+            "series": row["series"],
+            "layer": row["layer"],
+            "profile": row["profile"]
         }
-        
-        mqtt_client.publish(MQTT_STATUS_TOPIC, json.dumps(status))
-        logger.debug(f"Published status: {status}")
-        return True
-    return False
 
-# MQTT Callback functions
-def on_connect(client, userdata, flags, rc):
-    if rc == 0:
-        logger.info("Connected to MQTT broker")
-        client.subscribe(MQTT_COMMAND_TOPIC)
-        client.subscribe(MQTT_CONFIG_TOPIC)
-        client.subscribe(MQTT_KLIPPER_POSITION_RESPONSE)
-        logger.info(f"Subscribed to topics: {MQTT_COMMAND_TOPIC}, {MQTT_CONFIG_TOPIC}, {MQTT_KLIPPER_POSITION_RESPONSE}")
-        publish_status()
-    else:
-        logger.error(f"Failed to connect to MQTT broker, return code {rc}")
+    def _query_one(self, sql, args=()):
+        with self._lock:
+            row = self._db.execute(sql, args).fetchone()
+        return self._row_to_info(row)
 
-def on_message(client, userdata, msg):
-    """FIXED: Handle received MQTT messages with better debugging"""
-    global current_printer_position, position_request_pending
-    
-    try:
-        topic = msg.topic
-        payload_str = msg.payload.decode()
-        logger.debug(f"Raw MQTT message: {topic} = {payload_str}")
+    def _import_existing(self):
+        """One-off import of captures saved before the index existed"""
+        try:
+            names = sorted(f for f in os.listdir(self.capture_dir)
+                           if f.startswith("capture_") and f.endswith(".jpg"))
+        except OSError:
+            return
         
-        payload = json.loads(payload_str)
-        logger.info(f"Parsed MQTT message: {topic} = {payload}")
+        for name in names:
+            path = os.path.join(self.capture_dir, name)
+            info = {"filename": name}
+            try:
+                with open(os.path.splitext(path)[0] + ".json", 'r') as f:
+                    info.update(json.load(f))
+            except (OSError, ValueError):
+                pass
+            try:
+                stat = os.stat(path)
+            except OSError:
+                continue
+            info.setdefault("timestamp", datetime.fromtimestamp(stat.st_mtime).isoformat())
+            self.add(info, created=stat.st_mtime, size=stat.st_size)
+        if names:
+            logger.info(f"Imported {len(names)} existing captures into {self.path}")
+
+    def add(self, info, created=None, size=None):
+        """Record a capture, returns the stored entry"""
+        if created is None:
+            created = time.time()
+        if size is None:
+            try:
+                size = os.path.getsize(os.path.join(self.capture_dir, info["filename"]))
+            except OSError:
+                size = None
+        position = info.get("position") or {}
+        
+        with self._lock:
+            # A re-added filename replaces its row and its size
+            replaced = self._db.execute("SELECT size FROM captures WHERE filename = ?",
+                                        (info["filename"],)).fetchone()
+            with self._db:
+                cursor = self._db.execute(
+                    "INSERT OR REPLACE INTO captures "
+                    "(filename, created, timestamp, x, y, z, tool, focus, size, series, layer, profile) "
+                    "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                    (info["filename"], created, info["timestamp"],
+                     position.get("x"), position.get("y"), position.get("z"),
+                     info.get("tool"), json.dumps(info["focus"]) if info.get("focus") else None, size,
+                     info.get("series"), info.get("layer"), info.get("profile")))
+            row = self._db.execute("SELECT * FROM captures WHERE id = ?", (cursor.lastrowid,)).fetchone()
+            self._total_size += (size or 0) - ((replaced["size"] or 0) if replaced else 0)
+        
+            entry = self._row_to_info(row)
+            if self._latest is None or created >= self._latest["created"]:
+                self._latest = entry
+        return entry
+
+    def latest(self):
+        return self._latest
+
+    def get(self, key):
+        """Look up a capture by id or filename"""
+        if isinstance(key, int) or str(key).isdigit():
+            return self._query_one("SELECT * FROM captures WHERE id = ?", (int(key),))
+        return self._query_one("SELECT * FROM captures WHERE filename = ?", (os.path.basename(str(key)),))
+
+    def query(self, start=None, end=None, limit=100, tool=None, series=None, newest_first=True):
+        """Captures created within [start, end] (epoch seconds)"""
+        sql = "SELECT * FROM captures WHERE created >= ? AND created <= ?"
+        args = [start if start is not None else 0.0, end if end is not None else float("inf")]
+        if tool is not None:
+            sql += " AND tool = ?"
+            args.append(tool)
+        if series is not None:
+            sql += " AND series = ?"
+            args.append(series)
+        sql += f" ORDER BY created {'DESC' if newest_first else 'ASC'}, id LIMIT ?"
+        args.append(int(limit))
+        with self._lock:
+            rows = self._db.execute(sql, args).fetchall()
+        return [self._row_to_info(row) for row in rows]
+
+    def total_size(self):
+        return self._total_size
+
+    def oldest(self, limit=100):
+        return self.query(limit=limit, newest_first=False)
+
+    def compact(self):
+        """Reclaim space left by deleted rows and fold the WAL into the database"""
+        with self._lock:
+            self._db.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+            self._db.execute("VACUUM")
+
+    def remove(self, filename):
+        """Drop a capture from the index, the file itself is left alone"""
+        with self._lock:
+            removed = self._db.execute("SELECT size FROM captures WHERE filename = ?", (filename,)).fetchone()
+            with self._db:
+                self._db.execute("DELETE FROM captures WHERE filename = ?", (filename,))
+            if removed:
+                self._total_size -= removed["size"] or 0
+            if self._latest and self._latest["filename"] == filename:
+                row = self._db.execute("SELECT * FROM captures ORDER BY created DESC, id DESC LIMIT 1").fetchone()
+                self._latest = self._row_to_info(row)
+
+
+def get_capture_store():
+    """Open the capture index on first use"""
+    global capture_store
+    if capture_store is None:
+        capture_store = CaptureStore()
+    return capture_store
+
+
+class CaptureJobQueue:
+    """Serialises camera work on a single camera-owner thread
+
+    submit() returns a job dict straight away. Jobs run one at a time, so
+    concurrent HTTP and MQTT requests never race for the sensor. Each job's
+    outcome is published on MQTT_CAPTURE_TOPIC and kept for lookup by id.
+    """
+
+    def __init__(self, history=CAPTURE_JOB_HISTORY):
+        self.history = history
+        self._queue = queue.Queue()
+        self._jobs = OrderedDict()
+        self._functions = {}
+        self._condition = threading.Condition()
+        self._thread = None
+
+    def submit(self, function, *args, kind="capture", tag=None, **kwargs):
+        """Queue function(*args, **kwargs) to run as a job"""
+        job = {
+            "id": uuid.uuid4().hex[:12],
+            "kind": kind,
+            "tag": tag,
+            "state": "queued",
+            "submitted": datetime.now().isoformat(),
+            "started": None,
+            "finished": None,
+            "result": None,
+            "error": None
+        }
+        with self._condition:
+            self._jobs[job["id"]] = job
+            self._functions[job["id"]] = (function, args, kwargs)
+            while len(self._jobs) > self.history:
+                oldest_id, oldest = next(iter(self._jobs.items()))
+                if oldest["state"] in ("queued", "running"):
+                    break
+                del self._jobs[oldest_id]
+            job["queued_ahead"] = self._queue.qsize()
+        self._queue.put(job["id"])
+        self.start()
+        return dict(job)
+
+    def get(self, job_id):
+        with self._condition:
+            job = self._jobs.get(job_id)
+            return dict(job) if job else None
+
+    def wait(self, job_id, timeout=None):
+        """Block until a job finishes, returns the job or None if unknown"""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with self._condition:
+            while job_id in self._jobs and self._jobs[job_id]["state"] in ("queued", "running"):
+                remaining = None if deadline is None else deadline - time.monotonic()
+                if remaining is not None and remaining <= 0:
+                    break
+                self._condition.wait(remaining)
+            job = self._jobs.get(job_id)
+            return dict(job) if job else None
+
+    def pending(self):
+        return self._queue.qsize()
+
+    def _set(self, job_id, **fields):
+        with self._condition:
+            job = self._jobs.get(job_id)
+            if job is None:
+                return None
+            job.update(fields)
+            self._condition.notify_all()
+            return dict(job)
+
+    def _run(self):
+        while True:
+            job_id = self._queue.get()
+            with self._condition:
+                function, args, kwargs = self._functions.pop(job_id)
+            self._set(job_id, state="running", started=datetime.now().isoformat())
+            try:
+                result = function(*args, **kwargs)
+                if result is False or result is None:
+                    job = self._set(job_id, state="failed", error="Camera operation failed")
+                else:
+                    job = self._set(job_id, state="done", result=result)
+            except Exception as e:
+                logger.error(f"Capture job {job_id} failed: {e}")
+                job = self._set(job_id, state="failed", error=str(e))
+            
+            job = self._set(job_id, finished=datetime.now().isoformat()) or job
+            if mqtt_client and job:
+                mqtt_client.publish(MQTT_CAPTURE_TOPIC, json.dumps(job))
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name="camera-owner")
+            self._thread.daemon = True
+            self._thread.start()
+
+
+def run_capture_job(profile=None):
+    """Job body for a still capture, returns the capture's index entry"""
+    filename = capture_image(profile)
+    if not filename:
+        return False
+    return load_capture_metadata(filename) or {"filename": os.path.basename(filename)}
+
+
+def submit_capture(tag=None, profile=None):
+    """Queue a still capture, returns the job"""
+    get_capture_profile(profile)
+    return capture_jobs.submit(run_capture_job, profile, kind="capture", tag=tag)
+
+
+capture_jobs = CaptureJobQueue()
+capture_wait_slots = threading.BoundedSemaphore(CAPTURE_MAX_WAITERS)
+
+
+def thumbnail_path(filename, tier):
+    return os.path.join(THUMBNAIL_DIR, f"{os.path.splitext(os.path.basename(filename))[0]}_{tier}.jpg")
+
+
+def generate_thumbnails(filename):
+    """Write every THUMBNAIL_TIERS copy of a capture, largest first
+
+    Each tier is downscaled from the previous one, and the first decode uses
+    the JPEG decoder's reduced-size modes, so the full sensor image is never
+    decoded at full resolution.
+    """
+    source = os.path.join(CAPTURE_DIR, os.path.basename(filename))
+    tiers = sorted(THUMBNAIL_TIERS.items(), key=lambda item: item[1], reverse=True)
+    
+    if Image is not None:
+        with Image.open(source) as picture:
+            picture.draft('RGB', (tiers[0][1], tiers[0][1]))
+            picture = picture.convert('RGB')
+            for tier, size in tiers:
+                picture.thumbnail((size, size))
+                picture.save(thumbnail_path(filename, tier), "JPEG", quality=THUMBNAIL_QUALITY)
+        return True
+    
+    if cv2 is not None:
+        image = cv2.imread(source, cv2.IMREAD_REDUCED_COLOR_2)
+        if image is None:
+            raise ValueError(f"Could not decode {source}")
+        for tier, size in tiers:
+            scale = size / float(max(image.shape[:2]))
+            if scale < 1:
+                image = cv2.resize(image, (int(image.shape[1] * scale), int(image.shape[0] * scale)),
+                                   interpolation=cv2.INTER_AREA)
+            cv2.imwrite(thumbnail_path(filename, tier), image, [cv2.IMWRITE_JPEG_QUALITY, THUMBNAIL_QUALITY])
+        return True
+    
+    logger.warning("No image library available for thumbnails, install Pillow or opencv-python")
+    return False
+
+
+def _generate_thumbnails_logged(filename):
+    try:
+        return generate_thumbnails(filename)
+    except Exception as e:
+        logger.error(f"Failed to create thumbnails for {filename}: {e}")
+        return False
+
+
+def get_thumbnail(filename, tier):
+    """Path of a capture's thumbnail tier, generated on demand if missing"""
+    path = thumbnail_path(filename, tier)
+    if not os.path.exists(path):
+        thumbnail_executor.submit(_generate_thumbnails_logged, filename).result()
+    return path if os.path.exists(path) else None
+
+
+def delete_capture(filename):
+    """Remove a capture, its thumbnails and its index entry"""
+    paths = [os.path.join(CAPTURE_DIR, filename), os.path.join(CAPTURE_DIR, os.path.splitext(filename)[0] + ".dng")]
+    paths += [thumbnail_path(filename, tier) for tier in THUMBNAIL_TIERS]
+    for path in paths:
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+    get_capture_store().remove(filename)
+
+
+class RetentionManager:
+    """Background thread enforcing the capture size and age quotas
+
+    Deletes the oldest captures until the indexed total is under
+    CAPTURE_RETENTION_MAX_BYTES and nothing is older than
+    CAPTURE_RETENTION_MAX_AGE_DAYS. The newest capture is always kept. The
+    index is compacted after a pass that deleted anything.
+    """
+
+    def __init__(self, max_bytes=CAPTURE_RETENTION_MAX_BYTES, max_age_days=CAPTURE_RETENTION_MAX_AGE_DAYS,
+                 interval=CAPTURE_RETENTION_INTERVAL):
+        self.max_bytes = max_bytes
+        self.max_age_days = max_age_days
+        self.interval = interval
+        self.last_run = None
+        self.last_deleted = 0
+        self._wake = threading.Event()
+        self._thread = None
+
+    def enforce(self):
+        """Run one retention pass, returns the number of captures deleted"""
+        store = get_capture_store()
+        cutoff = time.time() - self.max_age_days * 86400 if self.max_age_days else None
+        total = store.total_size()
+        deleted = 0
+        
+        while True:
+            over_size = self.max_bytes and total > self.max_bytes
+            if not over_size and cutoff is None:
+                break
+            batch = store.oldest(limit=100)
+            latest = store.latest()
+            candidates = [c for c in batch if not latest or c["id"] != latest["id"]]
+            if not candidates:
+                break
+            
+            progress = False
+            for capture in candidates:
+                expired = cutoff is not None and capture["created"] < cutoff
+                if not (over_size or expired):
+                    break
+                delete_capture(capture["filename"])
+                total -= capture["size"] or 0
+                deleted += 1
+                progress = True
+                over_size = self.max_bytes and total > self.max_bytes
+            if not progress:
+                break
+        
+        if deleted:
+            store.compact()
+            logger.info(f"Retention removed {deleted} captures, {total / 1024 ** 2:.0f} MB kept")
+        self.last_run = datetime.now().isoformat()
+        self.last_deleted = deleted
+        return deleted
+
+    def _run(self):
+        while True:
+            try:
+                self.enforce()
+            except Exception as e:
+                logger.error(f"Capture retention failed: {e}")
+            self._wake.wait(self.interval)
+            self._wake.clear()
+
+    def trigger(self):
+        """Run a pass soon instead of waiting for the interval"""
+        self._wake.set()
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name="capture-retention")
+            self._thread.daemon = True
+            self._thread.start()
+
+    def status(self):
+        store = get_capture_store()
+        return {
+            "max_bytes": self.max_bytes,
+            "max_age_days": self.max_age_days,
+            "used_bytes": store.total_size(),
+            "last_run": self.last_run,
+            "last_deleted": self.last_deleted
+        }
+
+
+def save_capture_metadata(filename, exposure_time, series=None, layer=None, focus=None, profile=None):
+    """Record the position-tagged metadata for a capture in the capture index"""
+    global last_capture_info
+    
+    info = {
+        "filename": os.path.basename(filename),
+        "timestamp": datetime.now().isoformat(),
+        "position": get_position_at(exposure_time),
+        "focus": focus or get_focus_info(),
+        "tool": get_printer_state_summary().get("active_tool"),
+        "series": series,
+        "layer": layer,
+        "profile": profile
+    }
+    
+    try:
+        info = get_capture_store().add(info)
+    except Exception as e:
+        logger.error(f"Failed to index capture: {e}")
+    last_capture_info = info
+    
+    # Thumbnails and quota checks happen off the capture path
+    if filename.endswith(".jpg"):
+        thumbnail_executor.submit(_generate_thumbnails_logged, filename)
+    if retention_manager:
+        retention_manager.trigger()
+    return info
+
+
+def load_capture_metadata(name):
+    """Load the metadata saved for a capture, None if there is none"""
+    try:
+        return get_capture_store().get(name)
+    except Exception as e:
+        logger.error(f"Failed to read capture index: {e}")
+        return None
+
+
+def save_stream_frame(frame, series=None, layer=None, index=None):
+    """Write a buffered stream frame to CAPTURE_DIR and index it
+
+    The frame is already JPEG encoded at stream resolution, so this is one
+    file write with no sensor restart.
+    """
+    timestamp = capture_timestamp()
+    suffix = f"_{index:03d}" if index is not None else f"_{frame.seq}"
+    filename = f"{CAPTURE_DIR}/capture_{timestamp}{suffix}.jpg"
+    with open(filename, 'wb') as f:
+        f.write(frame.data)
+    return save_capture_metadata(filename, frame.timestamp, series=series, layer=layer)
+
+
+def ensure_stream_running():
+    """Start the stream if needed, returns whether it was already running"""
+    if STREAM_ACTIVE:
+        return True
+    if not start_stream():
+        raise RuntimeError("Could not start the camera stream")
+    return False
+
+
+def run_burst(count, interval, series=None):
+    """Save count stream frames spaced interval seconds apart"""
+    count = max(1, min(int(count), BURST_MAX_FRAMES))
+    series = series or f"burst_{datetime.now().strftime('%Y%m%d_%H%M%S')}"
+    was_streaming = ensure_stream_running()
+    captures = []
+    try:
+        start = time.monotonic()
+        last_seq = 0
+        for index in range(count):
+            frame = wait_for_frame_after(start + index * interval)
+            if frame is None:
+                raise RuntimeError("No stream frame available")
+            # A slow writer must not save the same frame twice
+            if frame.seq == last_seq:
+                frame = stream_frames.wait_for_frame(last_seq, timeout=1.0) or frame
+            last_seq = frame.seq
+            captures.append(save_stream_frame(frame, series=series, index=index))
+    finally:
+        if not was_streaming:
+            stop_stream()
+    logger.info(f"Burst {series}: {len(captures)} frames")
+    return {"series": series, "captures": captures}
+
+
+def submit_burst(count, interval=0.0, series=None, tag=None):
+    return capture_jobs.submit(run_burst, count, interval, series, kind="burst", tag=tag)
+
+
+class TimelapseController:
+    """Event driven timelapse writing stream frames into the capture index
+
+    In "layer" mode a frame is taken whenever print_stats.info.current_layer
+    advances by every_n_layers, straight from the Moonraker subscription. In
+    "event" mode frames are only taken on request, e.g. from the
+    TIMELAPSE_TAKE_FRAME macro. Frames go through the capture job queue so
+    they never interleave with a still capture. The timelapse stops itself
+    when the print finishes.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.active = False
+        self.mode = None
+        self.series = None
+        self.every_n_layers = TIMELAPSE_LAYER_INTERVAL
+        self.frames = 0
+        self.last_layer = None
+        self._was_streaming = True
+
+    def start(self, mode="layer", series=None, every_n_layers=TIMELAPSE_LAYER_INTERVAL):
+        if mode not in ("layer", "event"):
+            raise ValueError(f"Unknown timelapse mode: {mode}")
+        with self._lock:
+            self.active = True
+            self.mode = mode
+            self.series = series or f"timelapse_{datetime.now().strftime('%Y%m%d_%H%M%S')}"
+            self.every_n_layers = max(1, int(every_n_layers))
+            self.frames = 0
+            self.last_layer = None
+        self._was_streaming = ensure_stream_running()
+        logger.info(f"Timelapse {self.series} started ({mode})")
+        return self.status()
+
+    def stop(self):
+        with self._lock:
+            if not self.active:
+                return self.status()
+            self.active = False
+        if not self._was_streaming:
+            # Queued frames finish before the stream goes away
+            capture_jobs.submit(stop_stream, kind="timelapse_stop")
+        logger.info(f"Timelapse {self.series} stopped after {self.frames} frames")
+        return self.status()
+
+    def take_frame(self, layer=None, tag=None):
+        """Queue one timelapse frame, returns the job or None when inactive"""
+        if layer is None:
+            with printer_state_lock:
+                layer = (printer_state.get("print_stats", {}).get("info") or {}).get("current_layer")
+        with self._lock:
+            if not self.active:
+                return None
+            series = self.series
+            self.frames += 1
+        return capture_jobs.submit(self._save_latest, series, layer, kind="timelapse", tag=tag)
+
+    @staticmethod
+    def _save_latest(series, layer):
+        frame = wait_for_frame_after(time.monotonic())
+        if frame is None:
+            raise RuntimeError("No stream frame available")
+        return save_stream_frame(frame, series=series, layer=layer)
+
+    def on_printer_status(self, status, received_at):
+        """Printer state listener driving layer mode"""
+        print_stats = status.get("print_stats")
+        if not print_stats or not self.active:
+            return
+        
+        if print_stats.get("state") in ("complete", "cancelled", "error"):
+            self.stop()
+            return
+        
+        layer = (print_stats.get("info") or {}).get("current_layer")
+        if self.mode != "layer" or layer is None:
+            return
+        with self._lock:
+            due = self.last_layer is None or layer >= self.last_layer + self.every_n_layers
+            if due:
+                self.last_layer = layer
+        if due:
+            self.take_frame(layer=layer)
+
+    def status(self):
+        with self._lock:
+            return {
+                "active": self.active,
+                "mode": self.mode,
+                "series": self.series,
+                "every_n_layers": self.every_n_layers,
+                "frames": self.frames,
+                "last_layer": self.last_layer
+            }
+
+
+timelapse = TimelapseController()
+
+def update_camera_config(config):
+    """Update camera configuration"""
+    global STREAM_WIDTH, STREAM_HEIGHT, CAPTURE_WIDTH, CAPTURE_HEIGHT, STREAM_QUALITY
+    global CAPTURE_PROFILE, STREAM_PROFILE, STATUS_MIN_INTERVAL
+    
+    try:
+        if "stream_width" in config and isinstance(config["stream_width"], int):
+            STREAM_WIDTH = config["stream_width"]
+        
+        if "stream_height" in config and isinstance(config["stream_height"], int):
+            STREAM_HEIGHT = config["stream_height"]
+            
+        if "capture_width" in config and isinstance(config["capture_width"], int):
+            CAPTURE_WIDTH = config["capture_width"]
+            
+        if "capture_height" in config and isinstance(config["capture_height"], int):
+            CAPTURE_HEIGHT = config["capture_height"]
+            
+        if "stream_quality" in config and config["stream_quality"] in STREAM_QUALITY_SETTINGS:
+            STREAM_QUALITY = config["stream_quality"]
+        
+        if "capture_profile" in config and config["capture_profile"] in CAPTURE_PROFILES:
+            CAPTURE_PROFILE = config["capture_profile"]
+        
+        if "stream_profile" in config and (config["stream_profile"] is None or
+                                           config["stream_profile"] in CAPTURE_PROFILES):
+            STREAM_PROFILE = config["stream_profile"]
+        
+        if "status_interval" in config and isinstance(config["status_interval"], (int, float)):
+            STATUS_MIN_INTERVAL = max(0.0, float(config["status_interval"]))
+            
+        logger.info(f"Camera config updated: stream={STREAM_WIDTH}x{STREAM_HEIGHT}, "
+                    f"capture={CAPTURE_WIDTH}x{CAPTURE_HEIGHT}, quality={STREAM_QUALITY}, "
+                    f"capture profile={CAPTURE_PROFILE}, stream profile={STREAM_PROFILE}")
+        
+        restart_stream_backend()
+        
+        publish_status()
+        return True
+    except Exception as e:
+        logger.error(f"Error updating camera config: {e}")
+        return False
+
+def get_calibration_summary():
+    """Fixed size calibration summary for status payloads
+    
+    The reference point and scale measurement histories grow with every
+    calibration, they are published separately on MQTT_CALIBRATION_TOPIC.
+    """
+    model = get_calibration_model()
+    return {
+        "microns_per_pixel_x": calibration_data.get("microns_per_pixel_x"),
+        "microns_per_pixel_y": calibration_data.get("microns_per_pixel_y"),
+        "enabled": calibration_data.get("enabled"),
+        "reference_points": len(calibration_data.get("reference_points", [])),
+        "scaler_measurements": len(calibration_data.get("scaler_measurements", [])),
+        "model": model.kind if model else None,
+        "version": calibration_version,
+        "history_topic": MQTT_CALIBRATION_TOPIC
+    }
+
+
+def build_status():
+    """Current camera status as published on MQTT_STATUS_TOPIC"""
+    focus_info = get_focus_info()
+    
+    with position_lock:
+        current_pos = current_printer_position.copy()
+    
+    return {
+        "streaming": STREAM_ACTIVE,
+        "focus_mode": focus_info.get("mode", "auto"),
+        "focus_position": focus_info.get("position", 10),
+        "stream_width": STREAM_WIDTH,
+        "stream_height": STREAM_HEIGHT,
+        "capture_width": CAPTURE_WIDTH,
+        "capture_height": CAPTURE_HEIGHT,
+        "stream_quality": STREAM_QUALITY,
+        "calibration": get_calibration_summary(),
+        "current_position": current_pos,
+        "printer_state": get_printer_state_summary()
+    }
+
+
+class StatusPublisher:
+    """Coalescing MQTT status publisher
+    
+    request() only marks the status dirty, a worker thread publishes at most
+    once per STATUS_MIN_INTERVAL however many requests arrived meanwhile.
+    Messages carry "type": "delta" with just the top level fields that
+    changed since the previous message, or "type": "full" with everything.
+    Full snapshots are retained, so a new subscriber starts from the last
+    one and applies the deltas that follow. They are sent on connect and
+    every STATUS_FULL_INTERVAL seconds. The calibration history goes to its
+    own retained topic whenever the calibration was saved.
+    """
+    
+    def __init__(self):
+        self._wake = threading.Event()
+        self._lock = threading.Lock()
+        self._dirty = False
+        self._full = True
+        self._calibration = True
+        self._last_status = None
+        self._last_publish = 0.0
+        self._last_full = 0.0
+        self._seq = 0
+        self._thread = None
+    
+    def start(self):
+        if self._thread is None or not self._thread.is_alive():
+            self._thread = threading.Thread(target=self._run, name="status-publisher")
+            self._thread.daemon = True
+            self._thread.start()
+    
+    def request(self, full=False, calibration=False):
+        """Schedule a status message, returns False while MQTT is down"""
+        with self._lock:
+            self._dirty = True
+            self._full = self._full or full
+            self._calibration = self._calibration or calibration
+        self._wake.set()
+        return bool(mqtt_client and mqtt_client.is_connected())
+    
+    def _run(self):
+        while True:
+            self._wake.wait(STATUS_FULL_INTERVAL)
+            self._wake.clear()
+            
+            # Let a burst of requests settle into one message
+            delay = self._last_publish + STATUS_MIN_INTERVAL - time.monotonic()
+            if delay > 0:
+                time.sleep(delay)
+            
+            if not (mqtt_client and mqtt_client.is_connected()):
+                continue
+            
+            with self._lock:
+                full = self._full or time.monotonic() - self._last_full >= STATUS_FULL_INTERVAL
+                dirty = self._dirty or full
+                calibration = self._calibration
+                self._dirty = self._full = self._calibration = False
+            
+            try:
+                if calibration:
+                    self._publish_calibration()
+                if dirty:
+                    self._publish_status(full)
+            except Exception as e:
+                logger.error(f"Error publishing status: {e}")
+                with self._lock:
+                    self._dirty = True
+                    self._full = self._full or full
+                    self._calibration = self._calibration or calibration
+    
+    def _publish_status(self, full):
+        status = build_status()
+        if full or self._last_status is None:
+            message = dict(status, type="full")
+        else:
+            message = {key: value for key, value in status.items() if self._last_status.get(key) != value}
+            if not message:
+                return
+            message["type"] = "delta"
+        
+        self._seq += 1
+        message["seq"] = self._seq
+        message["timestamp"] = datetime.now().isoformat()
+        
+        mqtt_client.publish(MQTT_STATUS_TOPIC, json.dumps(message), retain=message["type"] == "full")
+        self._last_status = status
+        self._last_publish = time.monotonic()
+        if message["type"] == "full":
+            self._last_full = self._last_publish
+        logger.debug(f"Published {message['type']} status: {message}")
+    
+    def _publish_calibration(self):
+        history = {
+            "timestamp": datetime.now().isoformat(),
+            "version": calibration_version,
+            "microns_per_pixel_x": calibration_data.get("microns_per_pixel_x"),
+            "microns_per_pixel_y": calibration_data.get("microns_per_pixel_y"),
+            "reference_points": calibration_data.get("reference_points", []),
+            "scaler_measurements": calibration_data.get("scaler_measurements", [])
+        }
+        mqtt_client.publish(MQTT_CALIBRATION_TOPIC, json.dumps(history), retain=True)
+
+
+status_publisher = StatusPublisher()
+
+
+def publish_status(full=False):
+    """Schedule a camera status message on MQTT"""
+    return status_publisher.request(full=full)
+
+# MQTT Callback functions
+def on_connect(client, userdata, flags, rc):
+    if rc == 0:
+        logger.info("Connected to MQTT broker")
+        client.subscribe(MQTT_COMMAND_TOPIC)
+        client.subscribe(MQTT_CONFIG_TOPIC)
+        client.subscribe(MQTT_KLIPPER_POSITION_RESPONSE)
+        logger.info(f"Subscribed to topics: {MQTT_COMMAND_TOPIC}, {MQTT_CONFIG_TOPIC}, {MQTT_KLIPPER_POSITION_RESPONSE}")
+        status_publisher.request(full=True, calibration=True)
+    else:
+        logger.error(f"Failed to connect to MQTT broker, return code {rc}")
+
+def on_message(client, userdata, msg):
+    """FIXED: Handle received MQTT messages with better debugging"""
+    global current_printer_position, position_request_pending
+    
+    try:
+        topic = msg.topic
+        payload_str = msg.payload.decode()
+        logger.debug(f"Raw MQTT message: {topic} = {payload_str}")
+        
+        payload = json.loads(payload_str)
+        logger.info(f"Parsed MQTT message: {topic} = {payload}")
         
         if topic == MQTT_COMMAND_TOPIC:
             handle_command_message(payload)
@@ -452,13 +3757,7 @@ def on_message(client, userdata, msg):
             # Handle printer position response from publish_position.sh
             if isinstance(payload, dict) and "x" in payload and "y" in payload and "z" in payload:
                 if payload.get("status") == "success":
-                    with position_lock:
-                        current_printer_position = {
-                            "x": float(payload["x"]),
-                            "y": float(payload["y"]),
-                            "z": float(payload["z"])
-                        }
-                        position_request_pending = False
+                    update_printer_position(payload["x"], payload["y"], payload["z"])
                     logger.info(f"Printer position updated to: {current_printer_position}")
                 else:
                     logger.error(f"Position request failed: {payload}")
@@ -489,13 +3788,44 @@ def handle_command_message(payload):
         elif command == "stream_stop":
             stop_stream()
         elif command == "capture":
-            capture_image()
+            submit_capture(tag=payload.get("tag"), profile=payload.get("profile"))
+        elif command == "burst":
+            submit_burst(payload.get("count", 5), float(payload.get("interval", 0.0)),
+                         payload.get("series"), tag=payload.get("tag"))
+        elif command == "timelapse_start":
+            timelapse.start(payload.get("mode", "layer"), payload.get("series"),
+                            payload.get("every_n_layers", TIMELAPSE_LAYER_INTERVAL))
+        elif command == "timelapse_stop":
+            timelapse.stop()
+        elif command == "timelapse_frame":
+            timelapse.take_frame(layer=payload.get("layer"), tag=payload.get("tag"))
         elif command == "focus":
             mode = payload.get("mode", "auto")
             position = payload.get("position", 10)
             control_autofocus(mode, position)
+        elif command == "focus_cache_clear":
+            focus_cache.invalidate(tool=payload.get("tool"))
+        elif command == "push_offsets":
+            schedule_tool_offset_push()
+        elif command == "focus_sweep":
+            submit_focus_sweep(tag=payload.get("tag"), start=payload.get("start"), stop=payload.get("stop"),
+                               steps=payload.get("steps"), roi=payload.get("roi"),
+                               stack=bool(payload.get("stack", False)))
         elif command == "status":
-            publish_status()
+            publish_status(full=True)
+        elif command == "auto_calibrate":
+            start_auto_calibration(tool_ids=payload.get("tools"),
+                                   tolerance=payload.get("tolerance"),
+                                   skip_tool_change=bool(payload.get("skip_tool_change", False)))
+        elif command == "detect_fiducial":
+            try:
+                result = detect_fiducial_in_stream(payload.get("roi"), payload.get("radius"),
+                                                   payload.get("polarity"))
+                result["status"] = "success"
+            except Exception as e:
+                result = {"status": "error", "message": str(e)}
+            if mqtt_client:
+                mqtt_client.publish(MQTT_FIDUCIAL_TOPIC, json.dumps(result))
         else:
             logger.warning(f"Unknown command: {command}")
             return False
@@ -534,11 +3864,16 @@ def setup_mqtt_client():
 #tools configuration
 def load_tools_config():
     """Load tools configuration from file"""
-    global tools_config
+    global tools_config, tools_config_version, tools_saved_version
     try:
         if os.path.exists(TOOLS_CONFIG_FILE):
             with open(TOOLS_CONFIG_FILE, 'r') as f:
-                tools_config = json.load(f)
+                loaded = json.load(f)
+            with tools_config_lock:
+                tools_config = loaded
+                tools_config_version += 1
+                tools_saved_version = tools_config_version
+                tool_registry.rebuild(tools_config.get("tools", []))
         else:
             # Default configuration with fiducials
             tools_config = {
@@ -550,3348 +3885,741 @@ def load_tools_config():
                 ],
                 "reference_tool_id": 0
             }
+            tool_registry.rebuild(tools_config["tools"])
             save_tools_config()
     except Exception as e:
         logger.error(f"Error loading tools config: {e}")
 
 
 def save_tools_config():
-    """Save tools configuration to file"""
+    """Record a tools configuration change and schedule writing it out
+    
+    Bumps the version served as the ETag of /api/tools/load. Changes
+    arriving within TOOLS_SAVE_DELAY of each other are written once.
+    """
+    global tools_config_version, tools_save_timer
+    
+    # Check if directory exists and is writable
+    config_dir = os.path.dirname(TOOLS_CONFIG_FILE)
     try:
-        # Check if directory exists and is writable
-        config_dir = os.path.dirname(TOOLS_CONFIG_FILE)
-        if not os.path.exists(config_dir):
-            os.makedirs(config_dir, exist_ok=True)
-            logger.info(f"Created directory: {config_dir}")
-        
-        # Check write permissions
-        if not os.access(config_dir, os.W_OK):
-            logger.error(f"No write permission for directory: {config_dir}")
-            return False
-        
-        logger.info(f"Saving tools config to {TOOLS_CONFIG_FILE}: {tools_config}")
-        
-        with open(TOOLS_CONFIG_FILE, 'w') as f:
-            json.dump(tools_config, f, indent=2)
-        
-        logger.info("Tools configuration saved successfully")
-        
-        # Verify the save worked
-        if os.path.exists(TOOLS_CONFIG_FILE):
-            with open(TOOLS_CONFIG_FILE, 'r') as f:
-                saved_data = json.load(f)
-            logger.info(f"Verified saved data: {saved_data}")
-        else:
-            logger.error(f"File was not created: {TOOLS_CONFIG_FILE}")
-            return False
-        
-        return True
-    except Exception as e:
-        logger.error(f"Error saving tools config: {e}")
+        os.makedirs(config_dir, exist_ok=True)
+    except OSError as e:
+        logger.error(f"Cannot create directory {config_dir}: {e}")
+        return False
+    if not os.access(config_dir, os.W_OK):
+        logger.error(f"No write permission for directory: {config_dir}")
         return False
-
-
-
-
-
-def calculate_tool_offsets(tool_id):
-    """Calculate automatic offsets for a tool based on the reference tool or 0,0,0 if no reference"""
-    try:
-        reference_tool = None
-        target_tool = None
-        
-        for tool in tools_config["tools"]:
-            if tool.get("isReference", False):
-                reference_tool = tool
-            if tool["id"] == tool_id:
-                target_tool = tool
-        
-        if not target_tool:
-            return {"offsetX": 0, "offsetY": 0, "offsetZ": 0}
-        
-        # If no reference tool is set, use 0,0,0 as reference
-        if not reference_tool:
-            offset_x = target_tool.get("fiducialX", 0)
-            offset_y = target_tool.get("fiducialY", 0)
-            offset_z = target_tool.get("fiducialZ", 0)
-        else:
-            # Calculate offsets: target - reference
-            offset_x = target_tool.get("fiducialX", 0) - reference_tool.get("fiducialX", 0)
-            offset_y = target_tool.get("fiducialY", 0) - reference_tool.get("fiducialY", 0)
-            offset_z = target_tool.get("fiducialZ", 0) - reference_tool.get("fiducialZ", 0)
-        
-        return {
-            "offsetX": round(offset_x, 3),
-            "offsetY": round(offset_y, 3),
-            "offsetZ": round(offset_z, 3)
-        }
-    except Exception as e:
-        logger.error(f"Error calculating tool offsets: {e}")
-        return {"offsetX": 0, "offsetY": 0, "offsetZ": 0}
-
-
-
-
-
-
-#Tool management functions @app.routes
-#tools configuration
-@app.route('/api/tools/save', methods=['POST'])
-def api_save_tools():
-    """Save tools configuration"""
-    try:
-        data = request.json
-        tools_config["tools"] = data.get("tools", [])
-        
-        # Find and set reference tool ID
-        reference_tool = None
-        for tool in tools_config["tools"]:
-            if tool.get("isReference", False):
-                reference_tool = tool["id"]
-                break
-        
-        tools_config["reference_tool_id"] = reference_tool
-        save_tools_config()
-        return jsonify({"status": "success", "message": "Tools configuration saved"})
-    except Exception as e:
-        logger.error(f"Error saving tools: {e}")
-        return jsonify({"status": "error", "message": str(e)})
-
-
-@app.route('/api/tools/load', methods=['GET'])
-def api_load_tools():
-    """Load tools configuration"""
-    try:
-        load_tools_config()
-        return jsonify({
-            "status": "success", 
-            "tools": tools_config["tools"],
-            "reference_tool_id": tools_config.get("reference_tool_id")
-        })
-    except Exception as e:
-        logger.error(f"Error loading tools: {e}")
-        return jsonify({"status": "error", "message": str(e)})
-
-
-
-
-@app.route('/api/printer/get_position', methods=['GET'])
-def api_get_printer_position():
-    """Get current printer position"""
-    try:
-        # Send M114 command to get position
-        position_response = send_gcode("M114")
-        if not position_response:
-            return jsonify({"status": "error", "message": "Failed to get position from printer"})
-        
-        # Parse position (format: "X:123.45 Y:67.89 Z:10.20 E:0.00")
-        try:
-            pos_parts = position_response.strip().split()
-            x, y, z = None, None, None
-            
-            for part in pos_parts:
-                if part.startswith("X:"):
-                    x = float(part[2:])
-                elif part.startswith("Y:"):
-                    y = float(part[2:])
-                elif part.startswith("Z:"):
-                    z = float(part[2:])
-            
-            if x is None or y is None or z is None:
-                return jsonify({"status": "error", "message": "Could not parse position data"})
-                
-            return jsonify({
-                "status": "success",
-                "x": round(x, 3),
-                "y": round(y, 3),
-                "z": round(z, 3),
-                "raw_response": position_response
-            })
-            
-        except (ValueError, IndexError) as e:
-            return jsonify({"status": "error", "message": f"Error parsing position: {e}"})
-            
-    except Exception as e:
-        logger.error(f"Error getting printer position: {e}")
-        return jsonify({"status": "error", "message": str(e)})
-
-
-
-
-# Enhanced Flask routes with calibration functionality
-@app.route('/')
-def index():
-    """Enhanced camera control interface with calibration tools"""
-    html = """
-    <!DOCTYPE html>
-    <html>
-    <head>
-        <title>Rister Camera Controller with Calibration</title>
-        <meta name="viewport" content="width=device-width, initial-scale=1.0">
-        <style>
-            body { 
-                font-family: -apple-system, BlinkMacSystemFont, 'Segoe UI', Roboto, Arial, sans-serif; 
-                margin: 20px; 
-                text-align: center;
-                background-color: #f5f5f5;
-            }
-            .container {
-                max-width: 1000px;
-                margin: 0 auto;
-                background-color: white;
-                padding: 20px;
-                border-radius: 10px;
-                box-shadow: 0 0 10px rgba(0,0,0,0.1);
-            }
-            h1, h2 {
-                color: #333;
-                margin-top: 0;
-            }
-            .controls {
-                margin: 20px 0;
-                display: flex;
-                justify-content: center;
-                flex-wrap: wrap;
-            }
-
-
-.focus-container {
-    display: flex;
-    flex-direction: column;
-    gap: 15px;
-    align-items: center;
-}
-
-.focus-input-group {
-    display: flex;
-    align-items: center;
-    gap: 10px;
-}
-
-.focus-input-group input[type="number"] {
-    width: 80px;
-    padding: 5px;
-    border: 1px solid #ccc;
-    border-radius: 3px;
-}
-
-.slider {
-    width: 300px;
-}
-
-
-
-
-
-.orientation-controls {
-    text-align: center;
-    padding: 20px 0;
-}
-
-.orientation-buttons {
-    display: flex;
-    flex-direction: column;
-    gap: 15px;
-    margin: 20px 0;
-}
-
-.orientation-btn {
-    padding: 12px 20px;
-    font-size: 14px;
-    border-radius: 5px;
-    border: none;
-    background-color: #4CAF50;
-    color: white;
-    cursor: pointer;
-    transition: background-color 0.3s;
-}
-
-.orientation-btn:hover {
-    background-color: #3e8e41;
-}
-
-.orientation-btn.reset {
-    background-color: #ff9800;
-}
-
-.orientation-btn.reset:hover {
-    background-color: #f57c00;
-}
-
-.current-state {
-    margin-top: 20px;
-    padding: 15px;
-    background-color: #f8f9fa;
-    border-radius: 5px;
-    text-align: left;
-}
-
-.current-state p {
-    margin: 5px 0;
-    font-size: 14px;
-}
-
-
-
-/* Consistent header styling */
-.tool-management-container .tool-management-toggle {
-    font-size: 14px;
-}
-
-.tool-selection-section h4 {
-    font-size: 18px !important;
-    font-weight: 600;
-    color: #333;
-    margin: 0 0 15px 0;
-    border-bottom: 2px solid #e9ecef;
-    padding-bottom: 8px;
-}
-
-.calibration-panel h2 {
-    font-size: 18px;
-    font-weight: 600;
-    color: #333;
-    margin-top: 0;
-}
-
-/* Make sure the tool management toggle button has consistent styling */
-.tool-management-toggle {
-    margin: 5px;
-    padding: 10px 20px;
-    border: none;
-    border-radius: 5px;
-    background-color: #4CAF50;
-    color: white;
-    font-weight: bold;
-    cursor: pointer;
-    transition: background-color 0.3s;
-    /* Remove the flex properties that might be causing issues */
-}
-
-.tool-management-toggle:hover {
-    background-color: #3e8e41;
-}
-
-
-.modal-content {
-    background-color: #fefefe;
-    margin: 1% auto; /* Changed from 5% to 1% for higher positioning */
-    padding: 20px;
-    border: 1px solid #888;
-    border-radius: 10px;
-    width: 80%;
-    max-width: 600px;
-    position: relative;
-    max-height: 95vh; /* Increased max height */
-    overflow-y: auto;
-    box-shadow: 0 8px 32px rgba(0,0,0,0.3);
-}
-
-
-.modal {
-    display: none;
-    position: fixed;
-    z-index: 2000; /* Higher than other elements */
-    left: 0;
-    top: 0;
-    width: 100%;
-    height: 100%;
-    overflow: auto;
-    background-color: rgba(0,0,0,0.4);
-}
-
-.modal-content {
-    background-color: #fefefe;
-    margin: 2% auto; /* Reduced from 5% to 2% to position higher */
-    padding: 20px;
-    border: 1px solid #888;
-    border-radius: 10px;
-    width: 80%;
-    max-width: 600px;
-    position: relative;
-    max-height: 90vh; /* Limit height to viewport */
-    overflow-y: auto; /* Allow scrolling if content is too tall */
-    box-shadow: 0 4px 20px rgba(0,0,0,0.3);
-}
-
-/* Ensure modal appears above everything */
-.modal-content {
-    z-index: 2001;
-}
-
-
-
-/* Make all section headers consistent */
-.tool-management-container h4,
-.calibration-panel h2 {
-    font-size: 18px;
-    font-weight: 600;
-    color: #333;
-    margin: 0 0 15px 0;
-    padding: 0;
-    border-bottom: 2px solid #e9ecef;
-    padding-bottom: 8px;
-}
-
-.tool-selection-section h4 {
-    font-size: 16px;
-    font-weight: 600;
-    color: #2c3e50;
-    margin: 0 0 15px 0;
-}
-
-.reference-label {
-    position: fixed;
-    background-color: rgba(255, 255, 0, 0.3);
-    color: black;
-    padding: 3px 8px;
-    border-radius: 3px;
-    font-family: Arial, sans-serif;
-    font-size: 12px;
-    font-weight: bold;
-    border: 1px solid rgba(0, 0, 0, 0.3);
-    pointer-events: none;
-    z-index: 1001;
-    white-space: nowrap;
-    transform: translate(-50%, -100%);
-}
-
-.reference-checkbox-container {
-    display: flex;
-    align-items: center;
-    gap: 8px;
-    margin: 15px 0;
-    padding: 10px;
-    background-color: #e8f4fd;
-    border: 1px solid #bee5eb;
-    border-radius: 4px;
-}
-
-.reference-checkbox-container input[type="checkbox"] {
-    width: auto;
-    margin: 0;
-}
-
-.reference-checkbox-container label {
-    margin: 0;
-    font-weight: bold;
-    color: #0c5460;
-}
-
-.offset-display {
-    background-color: #f8f9fa;
-    border: 1px solid #dee2e6;
-    border-radius: 4px;
-    padding: 10px;
-    margin: 10px 0;
-    font-family: monospace;
-    font-size: 12px;
-}
-
-
-.coordinate-inputs {
-    display: grid;
-    grid-template-columns: 1fr 1fr 1fr;
-    gap: 20px;
-    margin: 15px 0;
-    padding: 15px;
-    background-color: #f8f9fa;
-    border: 1px solid #e9ecef;
-    border-radius: 8px;
-}
-
-.coordinate-inputs .input-group {
-    display: flex;
-    flex-direction: column;
-    gap: 5px;
-}
-
-.coordinate-inputs label {
-    margin: 0;
-    font-weight: 600;
-    color: #495057;
-    font-size: 13px;
-    text-transform: uppercase;
-    letter-spacing: 0.5px;
-}
-
-.coordinate-inputs input {
-    width: 100%;
-    padding: 10px 12px;
-    border: 2px solid #dee2e6;
-    border-radius: 6px;
-    font-size: 14px;
-    font-family: 'Courier New', monospace;
-    text-align: center;
-    background-color: white;
-    transition: all 0.2s ease;
-    box-sizing: border-box;
-}
-
-.coordinate-inputs input:focus {
-    outline: none;
-    border-color: #4CAF50;
-    box-shadow: 0 0 0 3px rgba(76, 175, 80, 0.1);
-    background-color: #fafafa;
-}
-
-.coordinate-inputs input:hover {
-    border-color: #adb5bd;
-}
-
-.tool-form h4 {
-    margin: 20px 0 10px 0;
-    color: #343a40;
-    font-size: 16px;
-    border-bottom: 2px solid #e9ecef;
-    padding-bottom: 5px;
-}
-
-.offset-display {
-    background: linear-gradient(135deg, #f8f9fa 0%, #e9ecef 100%);
-    border: 1px solid #dee2e6;
-    border-radius: 8px;
-    padding: 15px;
-    margin: 15px 0;
-    font-family: 'Courier New', monospace;
-    font-size: 13px;
-    box-shadow: inset 0 1px 3px rgba(0,0,0,0.1);
-}
-
-.offset-display div {
-    margin: 5px 0;
-    padding: 3px 0;
-}
-
-.offset-display span {
-    font-weight: bold;
-    color: #28a745;
-}
-
-
-.modal-buttons {
-    margin-top: 20px;
-    display: flex;
-    gap: 10px;
-    justify-content: flex-end;
-}
-
-.save-btn {
-    background-color: #28a745;
-    color: white;
-}
-
-.cancel-btn {
-    background-color: #6c757d;
-    color: white;
-}
-
-
-
-
-
-
-
-.coordinate-overlay {
-    position: absolute;
-    top: 10px;
-    left: 10px;
-    background-color: rgba(0, 0, 0, 0.8);
-    color: white;
-    padding: 8px 12px;
-    border-radius: 5px;
-    font-family: monospace;
-    font-size: 12px;
-    pointer-events: none;
-    z-index: 1000;
-    white-space: nowrap;
-}
-
-
-
-
-.camera-center {
-    background-color: #3498db !important;  /* Blue color */
-    border: 2px solid #3498db !important;
-}
-
-.camera-center:hover {
-    background-color: #2980b9 !important;  /* Darker blue on hover */
-    border: 2px solid #2980b9 !important;
-}
-
-
-.pixel-calibrate {
-    background-color: #ff6b35 !important;  /* Orange color */
-    border: 2px solid #ff6b35 !important;
-}
-
-.pixel-calibrate:hover {
-    background-color: #e55a2b !important;  /* Darker orange on hover */
-    border: 2px solid #e55a2b !important;
-}
-
-.clickable-image {
-    max-width: 100%;
-    max-height: 600px;
-    border-radius: 5px;
-    display: block;
-    margin: 0 auto;
-    cursor: crosshair;
-    user-select: none;
-    -webkit-user-select: none;
-    -moz-user-select: none;
-    -webkit-user-drag: none;
-    -webkit-touch-callout: none;
-}
-
-
-            button {
-                margin: 5px;
-                padding: 10px 20px;
-                border: none;
-                border-radius: 5px;
-                background-color: #4CAF50;
-                color: white;
-                font-weight: bold;
-                cursor: pointer;
-                transition: background-color 0.3s;
-            }
-            button:hover { background-color: #3e8e41; }
-            button.stop { background-color: #f44336; }
-            button.stop:hover { background-color: #d32f2f; }
-            button.photo { background-color: #2196F3; }
-            button.photo:hover { background-color: #1976D2; }
-            button.focus { background-color: #9C27B0; }
-            button.focus:hover { background-color: #7B1FA2; }
-            button.calibration { background-color: #FF9800; }
-            button.calibration:hover { background-color: #F57C00; }
-            
-            .debug-panel {
-                background-color: #f0f0f0;
-                border: 1px solid #ccc;
-                border-radius: 5px;
-                padding: 15px;
-                margin: 20px 0;
-                text-align: left;
-                font-family: monospace;
-                font-size: 12px;
-            }
-            
-            .calibration-panel {
-                background-color: #fff3cd;
-                border: 1px solid #ffeaa7;
-                border-radius: 5px;
-                padding: 15px;
-                margin: 20px 0;
-                text-align: left;
-            }
-            
-            .input-group {
-                margin: 10px 0;
-                display: flex;
-                align-items: center;
-                gap: 10px;
-            }
-            
-            .input-group label {
-                min-width: 150px;
-                font-weight: bold;
-            }
-            
-            .input-group input {
-                padding: 5px;
-                border: 1px solid #ccc;
-                border-radius: 3px;
-                width: 100px;
-            }
-            
-            .media-container {
-                border: 1px solid #ddd;
-                padding: 10px;
-                border-radius: 5px;
-                margin-bottom: 20px;
-                background: #000;
-                position: relative;
-            }
-            
-            .clickable-image {
-                max-width: 100%;
-                max-height: 600px;
-                border-radius: 5px;
-                display: block;
-                margin: 0 auto;
-                cursor: crosshair;
-            }
-            
-            .coordinates-display {
-                background-color: rgba(0, 0, 0, 0.8);
-                color: white;
-                padding: 5px 10px;
-                border-radius: 3px;
-                position: absolute;
-                top: 10px;
-                left: 10px;
-                font-family: monospace;
-                font-size: 12px;
-            }
-            
-            .status {
-                margin-top: 10px;
-                font-style: italic;
-                color: #666;
-            }
-            
-            .reference-points {
-                max-height: 200px;
-                overflow-y: auto;
-                background-color: #f8f9fa;
-                border: 1px solid #dee2e6;
-                border-radius: 3px;
-                padding: 10px;
-                margin: 10px 0;
-            }
-            
-            .reference-point {
-                background-color: white;
-                border: 1px solid #ccc;
-                border-radius: 3px;
-                padding: 5px;
-                margin: 5px 0;
-                font-family: monospace;
-                font-size: 12px;
-            }
-        </style>
-        <script>
-
-
-
-// Global variable to store reference points
-
-let lastKnownPosition = {x: 0, y: 0};
-
-function showReferenceLabels() {
-    // Remove existing labels
-    document.querySelectorAll('.reference-label').forEach(label => label.remove());
-    
-    if (!calibrationMode || !referencePointsData || referencePointsData.length === 0) {
-        return;
-    }
-    
-    const streamImg = document.getElementById('streamImg');
-    const photoImg = document.getElementById('photoImg');
-    let activeImage = null;
-    
-    if (streamImg && streamImg.offsetParent && document.getElementById('streamContainer').style.display !== 'none') {
-        activeImage = streamImg;
-    } else if (photoImg && photoImg.offsetParent && document.getElementById('photoContainer').style.display !== 'none') {
-        activeImage = photoImg;
-    }
-    
-    if (!activeImage) return;
-    
-    const rect = activeImage.getBoundingClientRect();
-    
-    // Simple static labels only - no API calls, no dynamic positioning
-    referencePointsData.forEach((point, index) => {
-        let displayX = point.pixel_x;
-        let displayY = point.pixel_y;
-        
-        if (imageFlipH) {
-            displayX = rect.width - displayX;
-        }
-        if (imageFlipV) {
-            displayY = rect.height - displayY;
-        }
-        
-        const label = document.createElement('div');
-        label.className = 'reference-label';
-        label.textContent = `P${index + 1}`;
-        label.title = `Point ${index + 1}: X${point.printer_x} Y${point.printer_y}`;
-        
-        label.style.left = (rect.left + displayX) + 'px';
-        label.style.top = (rect.top + displayY) + 'px';
-        
-        document.body.appendChild(label);
-    });
-}
-
-function updateLabelsWithPosition(printerPos) {
-    // Remove existing labels
-    document.querySelectorAll('.reference-label').forEach(label => label.remove());
-    
-    const streamImg = document.getElementById('streamImg');
-    const photoImg = document.getElementById('photoImg');
-    let activeImage = null;
-    
-    if (streamImg && streamImg.offsetParent && document.getElementById('streamContainer').style.display !== 'none') {
-        activeImage = streamImg;
-    } else if (photoImg && photoImg.offsetParent && document.getElementById('photoContainer').style.display !== 'none') {
-        activeImage = photoImg;
-    }
-    
-    if (!activeImage) return;
-    
-    const rect = activeImage.getBoundingClientRect();
-    const currentPrinterX = printerPos.x || 0;
-    const currentPrinterY = printerPos.y || 0;
-    
-    const micronsPerPixelX = parseFloat(document.getElementById('micronPerPixelX')?.value) || 58.98;
-    const micronsPerPixelY = parseFloat(document.getElementById('micronPerPixelY')?.value) || 58.98;
-    
-    referencePointsData.forEach((point, index) => {
-        const deltaX = point.printer_x - currentPrinterX;
-        const deltaY = point.printer_y - currentPrinterY;
-        
-        const pixelOffsetX = (deltaX * 1000) / micronsPerPixelX;
-        const pixelOffsetY = (deltaY * 1000) / micronsPerPixelY;
-        
-        const imageCenterX = rect.width / 2;
-        const imageCenterY = rect.height / 2;
-        
-        let displayX = imageCenterX - pixelOffsetX;
-        let displayY = imageCenterY + pixelOffsetY;
-        
-        if (imageFlipH) {
-            displayX = rect.width - displayX;
-        }
-        if (imageFlipV) {
-            displayY = rect.height - displayY;
-        }
-        
-        if (displayX >= 0 && displayX <= rect.width && displayY >= 0 && displayY <= rect.height) {
-            const label = document.createElement('div');
-            label.className = 'reference-label';
-            label.textContent = `P${index + 1}`;
-            label.title = `Point ${index + 1}: X${point.printer_x} Y${point.printer_y} Z${point.printer_z}`;
-            
-            label.style.left = (rect.left + displayX) + 'px';
-            label.style.top = (rect.top + displayY) + 'px';
-            
-            document.body.appendChild(label);
-        }
-    });
-}
-
-
-
-
-
-function setFocusFromInput(inputValue) {
-    const position = parseFloat(inputValue);
-    if (isNaN(position) || position < 0 || position > 30) {
-        alert('Please enter a valid focus position between 0 and 30');
-        return;
-    }
-    
-    // Update both slider and input to match
-    document.getElementById('focusSlider').value = position;
-    document.getElementById('focusInput').value = position;
-    document.getElementById('focusValue').textContent = position;
-    
-    // Call the API to actually set the focus
-    fetch('/api/focus/manual/' + position)
-        .then(response => response.json())
-        .then(data => {
-            if (data.status === 'success') {
-                // Visual feedback
-                const focusValue = document.getElementById('focusValue');
-                const originalColor = focusValue.style.color;
-                focusValue.style.color = '#4CAF50';
-                setTimeout(() => {
-                    focusValue.style.color = originalColor;
-                }, 500);
-            } else {
-                alert('Failed to set focus: ' + (data.message || 'Unknown error'));
-            }
-        })
-        .catch(error => {
-            console.error('Error setting focus:', error);
-            alert('Error setting focus: ' + error);
-        });
-}
-
-
-
-
-// Add this missing function - it's causing all the console errors
-function updateDebugPanel(status) {
-    const debugElement = document.getElementById('debugPanel');
-    if (debugElement) {
-        if (typeof status === 'string') {
-            debugElement.innerHTML = `<p>Error: ${status}</p>`;
-        } else if (typeof status === 'object') {
-            debugElement.innerHTML = `<pre>${JSON.stringify(status, null, 2)}</pre>`;
-        }
-    }
-    // Don't create debug panel if it doesn't exist - just silently handle it
-}
-
-// Add missing tutorial toggle function
-function toggleTutorial() {
-    const content = document.getElementById('tutorial-content');
-    const arrow = document.getElementById('tutorial-arrow');
-    
-    if (content && content.style.display === 'none') {
-        content.style.display = 'block';
-        if (arrow) arrow.textContent = '▲';
-    } else if (content) {
-        content.style.display = 'none';
-        if (arrow) arrow.textContent = '▼';
-    }
-}
-
-// Fix the updateToolDropdown function
-function updateToolDropdown() {
-    const currentToolSelect = document.getElementById('currentTool');
-    if (!currentToolSelect) {
-        console.warn('currentTool select element not found');
-        return;
-    }
-    
-    const currentValue = currentToolSelect.value;
-    currentToolSelect.innerHTML = '';
-    
-    tools.forEach(tool => {
-        const option = document.createElement('option');
-        option.value = tool.id;
-        option.textContent = tool.name;
-        currentToolSelect.appendChild(option);
-    });
-    
-    // Restore previous selection if still valid
-    if (Array.from(currentToolSelect.options).some(opt => opt.value === currentValue)) {
-        currentToolSelect.value = currentValue;
-    }
-}
-
-function openOrientationModal() {
-    console.log('openOrientationModal called'); // Debug line
-    updateFlipStateDisplay();
-    const modal = document.getElementById('orientationModal');
-    console.log('Modal element found:', modal); // Debug line
-    if (modal) {
-        modal.style.display = 'block';
-        console.log('Modal display set to block'); // Debug line
-    } else {
-        console.error('orientationModal element not found!');
-    }
-}
-
-
-function closeOrientationModal() {
-    document.getElementById('orientationModal').style.display = 'none';
-}
-
-function updateFlipStateDisplay() {
-    document.getElementById('flipStateH').textContent = imageFlipH ? 'Flipped' : 'Normal';
-    document.getElementById('flipStateV').textContent = imageFlipV ? 'Flipped' : 'Normal';
-}
-
-// Update the existing flip functions to also update the display
-function flipImageHorizontal() {
-    imageFlipH = !imageFlipH;
-    applyImageTransforms();
-    updateFlipStateDisplay();
-}
-
-function flipImageVertical() {
-    imageFlipV = !imageFlipV;
-    applyImageTransforms();
-    updateFlipStateDisplay();
-}
-
-function resetImageFlip() {
-    imageFlipH = false;
-    imageFlipV = false;
-    applyImageTransforms();
-    updateFlipStateDisplay();
-}
-
-
-
-
-function updateFormFields() {
-    const toolType = document.getElementById('toolType').value;
-    const isReference = document.getElementById('isReference').checked;
-    
-    const programmedSection = document.getElementById('programmedSection');
-    const actualSection = document.getElementById('actualSection');
-    const dispenserSection = document.getElementById('dispenserSection');
-    
-    // Show/hide sections based on tool type and reference status
-    if (toolType === 'camera' && !isReference) {
-        // Camera tools (not reference) don't need position inputs
-        programmedSection.style.display = 'none';
-        actualSection.style.display = 'none';
-        dispenserSection.style.display = 'none';
-    } else if (toolType === 'camera' && isReference) {
-        // Camera reference tools need fiducial positions (rename labels)
-        programmedSection.style.display = 'block';
-        actualSection.style.display = 'none';
-        dispenserSection.style.display = 'none';
-        
-        // Update labels for camera reference
-        const labels = programmedSection.querySelectorAll('label');
-        if (labels[0]) labels[0].textContent = 'Fiducial X';
-        if (labels[1]) labels[1].textContent = 'Fiducial Y';
-        if (labels[2]) labels[2].textContent = 'Fiducial Z';
-    } else if (isReference) {
-        // Non-camera reference tools only need programmed position
-        programmedSection.style.display = 'block';
-        actualSection.style.display = 'none';
-        dispenserSection.style.display = toolType === 'dispenser' ? 'block' : 'none';
-        
-        // Reset labels for non-camera tools
-        const labels = programmedSection.querySelectorAll('label');
-        if (labels[0]) labels[0].textContent = 'Programmed X';
-        if (labels[1]) labels[1].textContent = 'Programmed Y';
-        if (labels[2]) labels[2].textContent = 'Programmed Z';
-    } else {
-        // Non-reference tools need both programmed positions
-        programmedSection.style.display = 'block';
-        dispenserSection.style.display = toolType === 'dispenser' ? 'block' : 'none';
-        
-        // Check if camera is reference tool to determine if we show actual positions
-        const cameraReference = tools.find(t => t.type === 'camera' && t.isReference);
-        if (cameraReference) {
-            // Technique 2: Camera is reference, hide actual positions
-            actualSection.style.display = 'none';
-        } else {
-            // Technique 1: Show actual positions for offset measurement
-            actualSection.style.display = 'block';
-        }
-        
-        // Reset labels
-        const labels = programmedSection.querySelectorAll('label');
-        if (labels[0]) labels[0].textContent = 'Programmed X';
-        if (labels[1]) labels[1].textContent = 'Programmed Y';
-        if (labels[2]) labels[2].textContent = 'Programmed Z';
-    }
-    
-    updateOffsetDisplay();
-}
-
-
-function updateOffsetDisplay() {
-    const toolTypeElement = document.getElementById('toolType');
-    const isReferenceElement = document.getElementById('isReference');
-    
-    if (!toolTypeElement || !isReferenceElement) {
-        // Fall back to old system logic
-        // (keep existing fallback code)
-        return;
-    }
-    
-    const toolType = toolTypeElement.value;
-    const isReference = isReferenceElement.checked;
-    
-    // Reference tools have no offsets
-    if (isReference) {
-        document.getElementById('calcOffsetX').textContent = '0.000';
-        document.getElementById('calcOffsetY').textContent = '0.000';
-        document.getElementById('calcOffsetZ').textContent = '0.000';
-        return;
-    }
-    
-    // Check if camera is the reference tool (Technique 2)
-    const cameraReference = tools.find(t => t.type === 'camera' && t.isReference);
-    
-    if (cameraReference) {
-        // Technique 2: Offsets = camera_fiducial - tool_programmed
-        const programmedXElement = document.getElementById('programmedX');
-        const programmedYElement = document.getElementById('programmedY');
-        const programmedZElement = document.getElementById('programmedZ');
-        
-        if (!programmedXElement) return;
-        
-        const programmedX = parseFloat(programmedXElement.value) || 0;
-        const programmedY = parseFloat(programmedYElement.value) || 0;
-        const programmedZ = parseFloat(programmedZElement.value) || 0;
-        
-        const cameraFiducialX = cameraReference.programmedX || cameraReference.fiducialX || 0;
-        const cameraFiducialY = cameraReference.programmedY || cameraReference.fiducialY || 0;
-        const cameraFiducialZ = cameraReference.programmedZ || cameraReference.fiducialZ || 0;
-        
-        const offsetX = programmedX - cameraFiducialX;
-        const offsetY = programmedY - cameraFiducialY;
-        const offsetZ = programmedZ - cameraFiducialZ;
-
-
-
-        document.getElementById('calcOffsetX').textContent = offsetX.toFixed(3);
-        document.getElementById('calcOffsetY').textContent = offsetY.toFixed(3);
-        document.getElementById('calcOffsetZ').textContent = offsetZ.toFixed(3);
-    } else {
-        // Technique 1: Use existing actual - programmed logic
-        const programmedXElement = document.getElementById('programmedX');
-        const actualXElement = document.getElementById('actualX');
-        
-        if (!programmedXElement || !actualXElement) return;
-        
-        const programmedX = parseFloat(programmedXElement.value) || 0;
-        const programmedY = parseFloat(document.getElementById('programmedY').value) || 0;
-        const programmedZ = parseFloat(document.getElementById('programmedZ').value) || 0;
-        
-        const actualX = parseFloat(actualXElement.value) || 0;
-        const actualY = parseFloat(document.getElementById('actualY').value) || 0;
-        const zOffsetInput = parseFloat(document.getElementById('zOffset')?.value) || 0;
-        
-        const offsetX = actualX - programmedX;
-        const offsetY = actualY - programmedY;
-        
-        const referenceTool = tools.find(t => t.isReference === true);
-        let offsetZ = zOffsetInput;
-        
-        if (referenceTool && (referenceTool.programmedZ !== undefined || referenceTool.fiducialZ !== undefined)) {
-            const referenceZ = referenceTool.programmedZ || referenceTool.fiducialZ || 0;
-            offsetZ += (referenceZ - programmedZ);
-        }
-        
-        document.getElementById('calcOffsetX').textContent = offsetX.toFixed(3);
-        document.getElementById('calcOffsetY').textContent = offsetY.toFixed(3);
-        document.getElementById('calcOffsetZ').textContent = offsetZ.toFixed(3);
-    }
-}
-
-
-
-function hideCoordinateDisplay(imageElement) {
-    const overlay = imageElement.parentElement.querySelector('.coordinate-overlay');
-    if (overlay) {
-        overlay.style.display = 'none';
-    }
-}
-
-function showCoordinateDisplay(imageElement) {
-    const overlay = imageElement.parentElement.querySelector('.coordinate-overlay');
-    if (overlay) {
-        overlay.style.display = 'block';
-    }
-}
-
-
-
-
-
-// Add these variables at the top of your script section
-let imageFlipH = true;
-let imageFlipV = true;
-
-// Add these functions
-function flipImageHorizontal() {
-    imageFlipH = !imageFlipH;
-    applyImageTransforms();
-}
-
-function flipImageVertical() {
-    imageFlipV = !imageFlipV;
-    applyImageTransforms();
-}
-
-function resetImageFlip() {
-    imageFlipH = false;
-    imageFlipV = false;
-    applyImageTransforms();
-}
-
-
-function applyImageTransforms() {
-    const images = document.querySelectorAll('.clickable-image');
-    let transform = '';
-    
-    if (imageFlipH && imageFlipV) {
-        transform = 'scaleX(-1) scaleY(-1)';
-    } else if (imageFlipH) {
-        transform = 'scaleX(-1)';
-    } else if (imageFlipV) {
-        transform = 'scaleY(-1)';
-    } else {
-        transform = 'none';
-    }
-    
-    images.forEach(img => {
-        img.style.transform = transform;
-        img.style.transformOrigin = 'center';
-    });
-    
-    // Only update crosshair, not labels
-    setTimeout(updateCrosshairPosition, 50);
-}
-
-
-function getCorrectCoordinates(event, imageElement) {
-    const rect = imageElement.getBoundingClientRect();
-    let x = Math.round(event.clientX - rect.left);
-    let y = Math.round(event.clientY - rect.top);
-    
-    // Apply coordinate transformation based on flip state
-    if (imageFlipH) {
-        x = rect.width - x;
-    }
-    if (imageFlipV) {
-        y = rect.height - y;
-    }
-    
-    return { x, y };
-}
-
-
-
-function handleImageClick(event, imageType) {
-    if (!calibrationMode) return;
-
-    console.log('Image clicked in calibration mode - OFFSET VERSION');
-
-    const coords = getCorrectCoordinates(event, event.target);
-    console.log(`Pixel coordinates: (${coords.x}, ${coords.y})`);
-
-    // Get current printer position
-    fetch('/api/printer/position')
-        .then(response => response.json())
-        .then(data => {
-            if (data.status === 'success' || data.status === 'timeout') {
-                const currentX = data.position.x;
-                const currentY = data.position.y;
-                const currentZ = data.position.z;
-
-                // Get calibration values
-                const micronsPerPixelX = parseFloat(document.getElementById('micronPerPixelX').value) || 58.98;
-                const micronsPerPixelY = parseFloat(document.getElementById('micronPerPixelY').value) || 58.98;
-
-                // Calculate offset from image center
-                const imageElement = event.target;
-                const centerX = imageElement.clientWidth / 2;
-                const centerY = imageElement.clientHeight / 2;
-
-                const pixelOffsetX = coords.x - centerX;
-                const pixelOffsetY = coords.y - centerY;
-
-                // Convert to mm offset (fix X direction)
-                const mmOffsetX = -(pixelOffsetX * micronsPerPixelX) / 1000;  // Left = negative, Right = positive
-                const mmOffsetY = (pixelOffsetY * micronsPerPixelY) / 1000;   // Down = positive
-
-                // Calculate target coordinates
-                const targetX = currentX + mmOffsetX;
-                const targetY = currentY + mmOffsetY;
-
-                console.log(`Current position: X${currentX} Y${currentY}`);
-                console.log(`Offset: X${mmOffsetX.toFixed(3)} Y${mmOffsetY.toFixed(3)}`);
-                console.log(`Target coordinates: X${targetX.toFixed(3)} Y${targetY.toFixed(3)}`);
-
-                // Save the reference point with calculated coordinates
-                addReferencePoint(coords.x, coords.y, targetX, targetY, currentZ);
-            }
-        });
-}
-
-
-
-
-function updateCoordinateDisplay(event, imageElement) {
-    let overlay = imageElement.parentElement.querySelector('.coordinate-overlay');
-    if (!overlay) {
-        overlay = document.createElement('div');
-        overlay.className = 'coordinate-overlay';
-        imageElement.parentElement.appendChild(overlay);
-    }
-    
-    // Get corrected coordinates
-    const coords = getCorrectCoordinates(event, imageElement);
-    
-    const micronsPerPixelX = parseFloat(document.getElementById('micronPerPixelX').value) || 200.77730819;
-    const micronsPerPixelY = parseFloat(document.getElementById('micronPerPixelY').value) || 200.77730819;
-    
-    // Calculate offset from center of image (489.5, 275.5)
-    const centerX = 489.5;
-    const centerY = 275.5;
-    const pixelOffsetX = coords.x - centerX;
-    const pixelOffsetY = coords.y - centerY;
-    
-    // Convert to mm offset - FIX THE X-AXIS DIRECTION
-    const mmOffsetX = -(pixelOffsetX * micronsPerPixelX) / 1000;  // Negative sign to flip X direction
-    const mmOffsetY = (pixelOffsetY * micronsPerPixelY) / 1000;   // Y direction stays the same
-    
-    // Get current printer position
-    const currentPrinterX = debugInfo.printer_position?.x || 227.7;
-    const currentPrinterY = debugInfo.printer_position?.y || 150;
-    
-    // Calculate target printer coordinates
-    const targetX = currentPrinterX + mmOffsetX;
-    const targetY = currentPrinterY + mmOffsetY;
-    
-    // Update overlay display
-    overlay.innerHTML = `
-        Pixel: (${coords.x}, ${coords.y})<br>
-        Offset: (${mmOffsetX > 0 ? '+' : ''}${mmOffsetX.toFixed(2)}mm, ${mmOffsetY > 0 ? '+' : ''}${mmOffsetY.toFixed(2)}mm)
-    `;
-}
-
-
-
-
-
-
-// Camera centering functionality
-let centeringMode = false;
-
-function addFiducialCrosshair(imageElement) {
-    // Remove existing crosshair
-    const existing = document.querySelector('.fiducial-crosshair-fixed');
-    if (existing) existing.remove();
-    
-    const rect = imageElement.getBoundingClientRect();
-    
-    const crosshair = document.createElement('div');
-    crosshair.className = 'fiducial-crosshair-fixed';
-    crosshair.innerHTML = '+';
-    crosshair.style.cssText = `
-        position: fixed;
-        left: ${rect.left + rect.width / 2}px;
-        top: ${rect.top + rect.height / 2}px;
-        transform: translate(-50%, -50%);
-        pointer-events: none;
-        z-index: 999;
-        color: #00ff00;
-        font-size: 20px;
-        font-weight: bold;
-        text-shadow: 1px 1px 2px rgba(0,0,0,0.8);
-    `;
-    
-    document.body.appendChild(crosshair);
-}
-
-
-function updateCrosshairPosition() {
-    const crosshair = document.querySelector('.fiducial-crosshair-fixed');
-    const streamImg = document.getElementById('streamImg');
-    const photoImg = document.getElementById('photoImg');
-    
-    if (crosshair && streamImg && streamImg.offsetParent) {
-        const rect = streamImg.getBoundingClientRect();
-        crosshair.style.left = (rect.left + rect.width / 2) + 'px';
-        crosshair.style.top = (rect.top + rect.height / 2) + 'px';
-    } else if (crosshair && photoImg && photoImg.offsetParent) {
-        const rect = photoImg.getBoundingClientRect();
-        crosshair.style.left = (rect.left + rect.width / 2) + 'px';
-        crosshair.style.top = (rect.top + rect.height / 2) + 'px';
-    }
-}
-
-
-
-
-
-
-function debugCrosshairPosition() {
-    const img = document.getElementById('streamImg');
-    if (img) {
-        console.log(`Image dimensions: ${img.width} x ${img.height}`);
-        console.log(`Natural dimensions: ${img.naturalWidth} x ${img.naturalHeight}`);
-        console.log(`Mathematical center should be: (${img.width/2}, ${img.height/2})`);
-        
-        // Test click at mathematical center
-        const rect = img.getBoundingClientRect();
-        const centerX = img.width / 2;
-        const centerY = img.height / 2;
-        console.log(`Click at center would give coordinates: (${centerX}, ${centerY})`);
-    }
-}
-
-
-// Add this function to load tools from the backend
-function loadToolsFromBackend() {
-    fetch('/api/tools/load')
-        .then(response => response.json())
-        .then(data => {
-            if (data.status === 'success') {
-                tools = data.tools || [];
-                cameraReference = data.camera_reference;
-                updateToolDropdown();
-                console.log('Tools loaded from backend:', tools);
-            } else {
-                console.error('Failed to load tools:', data.message);
-            }
-        })
-        .catch(error => {
-            console.error('Error loading tools:', error);
-        });
-}
-
-// Update the existing DOMContentLoaded event listener
-document.addEventListener('DOMContentLoaded', function() {
-    // Hide photo container on page load
-    document.getElementById('photoContainer').style.display = 'none';
-    
-    // Apply default flips immediately
-    applyImageTransforms();
-    
-    // Load tools from backend instead of just rendering the default list
-    loadToolsFromBackend();
-    
-// Initialize crosshair when images load
-const streamImg = document.getElementById('streamImg');
-const photoImg = document.getElementById('photoImg');
-
-if (streamImg) {
-    // Handle both load event and already-loaded images
-    streamImg.addEventListener('load', () => {
-        if (document.getElementById('streamContainer').style.display !== 'none') {
-            applyImageTransforms();
-            setTimeout(() => {
-                addFiducialCrosshair(streamImg);
-                updateCrosshairPosition();
-            }, 100);
-        }
-    });
-    
-    // If image is already loaded, trigger immediately
-    if (streamImg.complete && streamImg.naturalWidth > 0) {
-        setTimeout(() => {
-            if (document.getElementById('streamContainer').style.display !== 'none') {
-                applyImageTransforms();
-                addFiducialCrosshair(streamImg);
-                updateCrosshairPosition();
-            }
-        }, 100);
-    }
-}
-
-if (photoImg) {
-    photoImg.addEventListener('load', () => {
-        if (document.getElementById('photoContainer').style.display !== 'none') {
-            applyImageTransforms();
-            setTimeout(() => {
-                addFiducialCrosshair(photoImg);
-                updateCrosshairPosition();
-            }, 100);
-        }
-    });
-    
-    // If image is already loaded, trigger immediately
-    if (photoImg.complete && photoImg.naturalWidth > 0) {
-        setTimeout(() => {
-            if (document.getElementById('photoContainer').style.display !== 'none') {
-                applyImageTransforms();
-                addFiducialCrosshair(photoImg);
-                updateCrosshairPosition();
-            }
-        }, 100);
-    }
-}
-
-
-
-
-
-    // Add event listeners for fiducial inputs to update offset display
-    const fiducialInputs = ['fiducialX', 'fiducialY', 'fiducialZ', 'isReference'];
-    fiducialInputs.forEach(id => {
-        const element = document.getElementById(id);
-        if (element) {
-            element.addEventListener('input', updateOffsetDisplay);
-            element.addEventListener('change', updateOffsetDisplay);
-        }
-    });
-
-    // ADD THIS: Event listeners for the new position inputs
-    // Event listeners for the new position inputs
-const positionInputs = ['programmedX', 'programmedY', 'programmedZ', 'actualX', 'actualY', 'zOffset'];
-    positionInputs.forEach(id => {
-        const element = document.getElementById(id);
-        if (element) {
-            element.addEventListener('input', updateOffsetDisplay);
-            element.addEventListener('change', updateOffsetDisplay);
-        }
-    });
-
-    window.addEventListener('resize', showReferenceLabels);
-    window.addEventListener('scroll', showReferenceLabels);
-
-});
-
-
-
-
-
-
-
-
-            let calibrationMode = false;
-            let currentImageType = 'stream';
-            let debugInfo = {};
-            
-            window.onload = function() {
-                checkStatus();
-                loadCalibrationData();
-                setInterval(checkStatus, 3000);
-            };
-            
-
-let consecutiveErrors = 0;
-
-function checkStatus() {
-    fetch('/api/status')
-        .then(response => {
-            if (!response.ok) {
-                throw new Error(`HTTP ${response.status}: ${response.statusText}`);
-            }
-            return response.json();
-        })
-        .then(data => {
-            consecutiveErrors = 0; // Reset error counter on success
-            debugInfo = data;
-            updateDebugPanel();
-            
-            if (data.streaming) {
-                document.getElementById('streamContainer').style.display = 'block';
-                document.getElementById('focusControls').style.display = 'flex';
-                refreshStreamImage();
-                setTimeout(() => {
-                    const streamImg = document.getElementById('streamImg');
-                    if (streamImg.complete) {
-                        addFiducialCrosshair(streamImg);
-                        updateCrosshairPosition();
-                    }
-                }, 100);
-            } else {
-                document.getElementById('streamContainer').style.display = 'none';
-                document.getElementById('focusControls').style.display = 'none';
-            }
-            
-            if (data.calibration) {
-                document.getElementById('micronPerPixelX').value = data.calibration.microns_per_pixel_x || 10;
-                document.getElementById('micronPerPixelY').value = data.calibration.microns_per_pixel_y || 10;
-                //updateCalibrationStatus(data.calibration.enabled);
-            }
-        })
-        .catch(error => {
-            consecutiveErrors++;
-            // Only log every 10th error to reduce console spam, but with more detail
-            if (consecutiveErrors % 10 === 1) {
-                console.error('Server connection error details:', {
-                    error: error.message,
-                    consecutiveErrors: consecutiveErrors,
-                    timestamp: new Date().toLocaleTimeString()
-                });
-            }
-            updateDebugPanel('Server connection lost');
-        });
-}
-
-            
-            
-            function refreshStreamImage() {
-                const img = document.getElementById('streamImg');
-                img.src = '/stream?t=' + new Date().getTime();
-            }
-            
-
-
-function startStream() {
-    fetch('/api/stream/start')
-        .then(response => response.json())
-        .then(data => {
-            if (data.streaming) {
-                document.getElementById('streamContainer').style.display = 'block';
-                document.getElementById('focusControls').style.display = 'flex';
-                document.getElementById('photoContainer').style.display = 'none';
-                setTimeout(() => {
-                    refreshStreamImage();
-                    // Add crosshair after stream starts
-                    const streamImg = document.getElementById('streamImg');
-                    if (streamImg) {
-                        addFiducialCrosshair(streamImg);
-                        updateCrosshairPosition();
-                    }
-                }, 1000);
-            }
-        });
-}
-
-
-
-
-
-
-            function stopStream() {
-                fetch('/api/stream/stop')
-                    .then(response => response.json())
-                    .then(data => {
-                        document.getElementById('streamContainer').style.display = 'none';
-                        document.getElementById('focusControls').style.display = 'none';
-                    });
-            }
-            
-
-function capturePhoto() {
-    // Hide stream container when taking photo
-    document.getElementById('streamContainer').style.display = 'none';
-    
-    fetch('/api/capture')
-        .then(response => response.json())
-        .then(data => {
-            if (data.status === 'success') {
-                document.getElementById('photoContainer').style.display = 'block';
-                document.getElementById('photoImg').src = '/latest_photo?t=' + new Date().getTime();
-                currentImageType = 'snapshot';
-                
-                // Add crosshair to photo after it loads
-                const photoImg = document.getElementById('photoImg');
-                photoImg.onload = function() {
-                    addFiducialCrosshair(photoImg);
-                };
-            }
-        })
-        .catch(error => {
-            console.error('Error capturing photo:', error);
-        });
-}
-
-
-
-let labelUpdateInterval = null;
-
-function toggleCalibrationMode() {
-    calibrationMode = !calibrationMode;
-    document.getElementById('calibrationToggle').textContent = 
-        calibrationMode ? 'Disable Image Mapper' : 'Enable Image Mapper';
-    document.getElementById('calibrationPanel').style.display = 
-        calibrationMode ? 'block' : 'none';
-        
-    // Update cursor style
-    const images = document.querySelectorAll('.clickable-image');
-    images.forEach(img => {
-        img.style.cursor = calibrationMode ? 'crosshair' : 'default';
-    });
-    
-    // Stop any existing intervals
-    if (labelUpdateInterval) {
-        clearInterval(labelUpdateInterval);
-        labelUpdateInterval = null;
-    }
-    
-    if (calibrationMode) {
-        // Show crosshair immediately
-        const streamImg = document.getElementById('streamImg');
-        const photoImg = document.getElementById('photoImg');
-        
-        if (streamImg && document.getElementById('streamContainer').style.display !== 'none') {
-            addFiducialCrosshair(streamImg);
-        } else if (photoImg && document.getElementById('photoContainer').style.display !== 'none') {
-            addFiducialCrosshair(photoImg);
-        }
-        
-        // Show labels if we have data
-        if (referencePointsData && referencePointsData.length > 0) {
-            showReferenceLabels();
-        }
-    } else {
-        // Remove everything when disabled
-        document.querySelectorAll('.reference-label').forEach(label => label.remove());
-        document.querySelectorAll('.fiducial-crosshair-fixed').forEach(crosshair => crosshair.remove());
-    }
-}
-
-
-
-
-
-
-            
-            function showCoordinates(imgElement, x, y) {
-                // Remove existing coordinate display
-                const existing = imgElement.parentElement.querySelector('.coordinates-display');
-                if (existing) existing.remove();
-                
-                // Create new coordinate display
-                const coordDiv = document.createElement('div');
-                coordDiv.className = 'coordinates-display';
-                coordDiv.textContent = `Pixel: (${x}, ${y})`;
-                imgElement.parentElement.appendChild(coordDiv);
-                
-                // Remove after 3 seconds
-                setTimeout(() => {
-                    if (coordDiv.parentElement) {
-                        coordDiv.remove();
-                    }
-                }, 3000);
-            }
-            
-            function addReferencePoint(pixelX, pixelY, printerX, printerY, printerZ) {
-                console.log(`Adding reference point: Pixel(${pixelX}, ${pixelY}) -> Printer(${printerX}, ${printerY}, ${printerZ})`);
-                
-                const data = {
-                    pixel_x: pixelX,
-                    pixel_y: pixelY,
-                    printer_x: printerX,
-                    printer_y: printerY,
-                    printer_z: printerZ
-                };
-                
-                fetch('/api/calibration/add_point', {
-                    method: 'POST',
-                    headers: {'Content-Type': 'application/json'},
-                    body: JSON.stringify(data)
-                })
-                .then(response => response.json())
-                .then(result => {
-                    console.log('Add point result:', result);
-                    if (result.status === 'success') {
-                        loadCalibrationData();
-                        alert(`Reference point added successfully!\\nPixel: (${pixelX}, ${pixelY})\\nPrinter: X${printerX} Y${printerY} Z${printerZ}`);
-                    } else {
-                        alert('Failed to add reference point: ' + (result.message || 'Unknown error'));
-                    }
-                })
-                .catch(error => {
-                    console.error('Error adding reference point:', error);
-                    alert('Error adding reference point: ' + error);
-                });
-            }
-            
-            function updateMicronsPerPixel() {
-                const x = parseFloat(document.getElementById('micronPerPixelX').value);
-                const y = parseFloat(document.getElementById('micronPerPixelY').value);
-                
-                fetch('/api/calibration/set_microns', {
-                    method: 'POST',
-                    headers: {'Content-Type': 'application/json'},
-                    body: JSON.stringify({microns_per_pixel_x: x, microns_per_pixel_y: y})
-                })
-                .then(response => response.json())
-                .then(result => {
-                    if (result.status === 'success') {
-                        alert('Microns per pixel updated');
-                    }
-                });
-            }
-            
-            function enableCalibration() {
-                fetch('/api/calibration/enable', {method: 'POST'})
-                    .then(response => response.json())
-                    .then(result => {
-                        if (result.status === 'success') {
-                            updateCalibrationStatus(true);
-                        }
-                    });
-            }
-            
-            function disableCalibration() {
-                fetch('/api/calibration/disable', {method: 'POST'})
-                    .then(response => response.json())
-                    .then(result => {
-                        if (result.status === 'success') {
-                            updateCalibrationStatus(false);
-                        }
-                    });
-            }
-            
-            function clearCalibration() {
-                if (confirm('Clear all calibration data?')) {
-                    fetch('/api/calibration/clear', {method: 'POST'})
-                        .then(response => response.json())
-                        .then(result => {
-                            if (result.status === 'success') {
-                                loadCalibrationData();
-                            }
-                        });
-                }
-            }
-            
-         
-
-function loadCalibrationData() {
-    fetch('/api/calibration/data')
-        .then(response => response.json())
-        .then(data => {
-            const container = document.getElementById('referencePoints');
-            container.innerHTML = '';
-            
-            if (data.reference_points && data.reference_points.length > 0) {
-                data.reference_points.forEach((point, index) => {
-                    const div = document.createElement('div');
-                    div.className = 'reference-point';
-                    div.innerHTML = `
-                        <strong>Point ${index + 1}:</strong><br>
-                        Pixel: (${point.pixel_x}, ${point.pixel_y})<br>
-                        Printer: X${point.printer_x} Y${point.printer_y} Z${point.printer_z}
-                    `;
-                    container.appendChild(div);
-                });
-            } else {
-                container.innerHTML = '<div class="reference-point">No reference points set</div>';
-            }
-            
-            updateCalibrationStatus(data.enabled);
-            referencePointsData = data.reference_points || []; // ADD THIS LINE
-            if (calibrationMode) {
-                setTimeout(showReferenceLabels, 100); // ADD THIS LINE
-            }
-        });
-}
-
-
-
-
-function updateCalibrationStatus(enabled) {
-    const statusElement = document.getElementById('calibrationStatus');
-    if (statusElement) {  // Add this null check
-        statusElement.textContent = enabled ? 'ENABLED' : 'DISABLED';
-        statusElement.style.color = enabled ? 'green' : 'red';
-    }
-}
-
-           function updateFocusValue(value) {
-            document.getElementById('focusValue').textContent = value;
-            document.getElementById('focusInput').value = value;
-           } 
-            
-            
-            
-           // Update the setFocusManual function to sync both controls
-function setFocusManual(position) {
-    fetch('/api/focus/manual/' + position)
-        .then(response => response.json())
-        .then(data => {
-            if (data.status === 'success') {
-                // Update both the slider and input to match
-                document.getElementById('focusSlider').value = position;
-                document.getElementById('focusInput').value = position;
-                document.getElementById('focusValue').textContent = position;
-                
-                // Visual feedback
-                const focusValue = document.getElementById('focusValue');
-                const originalColor = focusValue.style.color;
-                focusValue.style.color = '#4CAF50';
-                setTimeout(() => {
-                    focusValue.style.color = originalColor;
-                }, 500);
-            }
-        });
-} 
-
-
-
-
-let measuringLine = false;
-let lineStart = null;
-let currentLine = null;
-let isDrawingLine = false;
-
-
-
-function startLineMeasurement() {
-    measuringLine = true;
-    lineStart = null;
-    isDrawingLine = false;
-    currentLine = null;
-    console.log('Line measurement mode enabled');
-    alert('Click and drag to draw a measurement line on the image.');
-}
-
-
-function measureClick(event) {
-    if (!measuringLine) return;
-    
-    if (event.type === 'mousedown') {
-        startDrawingLine(event);
-    } else if (event.type === 'mousemove' && isDrawingLine) {
-        updateLine(event);
-    } else if (event.type === 'mouseup' && isDrawingLine) {
-        finishLine(event);
-    }
-}
-
-function startDrawingLine(event) {
-    event.preventDefault();
-    const rect = event.target.getBoundingClientRect();
-    lineStart = {
-        x: event.clientX - rect.left,
-        y: event.clientY - rect.top
-    };
-    
-    isDrawingLine = true;
-    
-    // Create line element positioned absolutely on the page
-    currentLine = document.createElement('div');
-    currentLine.style.position = 'fixed'; // Use fixed positioning
-    currentLine.style.backgroundColor = '#ff4444';
-    currentLine.style.height = '2px';
-    currentLine.style.transformOrigin = '0 0';
-    currentLine.style.pointerEvents = 'none';
-    currentLine.style.zIndex = '1000';
-    currentLine.style.left = (rect.left + lineStart.x) + 'px';
-    currentLine.style.top = (rect.top + lineStart.y) + 'px';
-    
-    // Add to body for fixed positioning
-    document.body.appendChild(currentLine);
-}
-
-function updateLine(event) {
-    if (!isDrawingLine || !currentLine || !lineStart) return;
-    
-    const rect = event.target.getBoundingClientRect();
-    const currentX = event.clientX - rect.left;
-    const currentY = event.clientY - rect.top;
-    
-    const deltaX = currentX - lineStart.x;
-    const deltaY = currentY - lineStart.y;
-    const distance = Math.sqrt(deltaX * deltaX + deltaY * deltaY);
-    const angle = Math.atan2(deltaY, deltaX) * 180 / Math.PI;
-    
-    // Update line width and rotation only - position is set in startDrawingLine
-    currentLine.style.width = distance + 'px';
-    currentLine.style.transform = 'rotate(' + angle + 'deg)';
-}
-
-
-function finishLine(event) {
-    if (!isDrawingLine || !currentLine || !lineStart) return;
-    
-    const rect = event.target.getBoundingClientRect();
-    const endX = event.clientX - rect.left;
-    const endY = event.clientY - rect.top;
-    
-    const deltaX = endX - lineStart.x;
-    const deltaY = endY - lineStart.y;
-    const distance = Math.sqrt(deltaX * deltaX + deltaY * deltaY);
-    
-    if (distance < 10) {
-        // Line too short, remove it
-        currentLine.remove();
-        isDrawingLine = false;
-        return;
-    }
-    
-    const actualMM = prompt('Line is ' + Math.round(distance) + ' pixels long.\\nWhat is the actual length in mm?');
-    
-    if (actualMM && !isNaN(actualMM)) {
-        const micronsPerPixel = (parseFloat(actualMM) * 1000) / distance;
-        
-        fetch('/api/scaler/calculate', {
-            method: 'POST',
-            headers: {'Content-Type': 'application/json'},
-            body: JSON.stringify({
-                width_mm: actualMM,
-                height_mm: actualMM,
-                pixel_width: distance,
-                pixel_height: distance
-            })
-        }).then(() => {
-            alert('Calculated: ' + micronsPerPixel.toFixed(2) + ' μm/pixel\\nCalibration updated!');
-            location.reload();
-        });
-    }
-    
-    // Clean up
-    currentLine.remove();
-    measuringLine = false;
-    lineStart = null;
-    isDrawingLine = false;
-}
-
-
-//Tool management javascript
-// Tool management state
-let tools = [
-    {id: 0, name: "Camera Tool (C0)", type: "camera", offsetX: 0, offsetY: 0, offsetZ: 0, preciseX: 0, preciseY: 0, preciseZ: 0},
-    {id: 1, name: "Extruder 1 (E0)", type: "extruder", offsetX: 0, offsetY: 0, offsetZ: 0, preciseX: 0, preciseY: 0, preciseZ: 0},
-    {id: 2, name: "Extruder 2 (E1)", type: "extruder", offsetX: 0, offsetY: 0, offsetZ: 0, preciseX: 0, preciseY: 0, preciseZ: 0},
-    {id: 3, name: "Liquid Dispenser (L0)", type: "dispenser", offsetX: 0, offsetY: 0, offsetZ: 0, preciseX: 0, preciseY: 0, preciseZ: 0}
-];
-
-let cameraReference = null;
-let currentEditingTool = null;
-
-function toggleToolManagement() {
-    const content = document.getElementById('tool-management-content');
-    const arrow = document.getElementById('tool-arrow');
-    
-    if (content.style.display === 'none') {
-        content.style.display = 'block';
-        arrow.classList.add('tool-arrow-up');
-    } else {
-        content.style.display = 'none';
-        arrow.classList.remove('tool-arrow-up');
-    }
-}
-
-
-
-
-
-
-
-
-
-
-function selectTool() {
-    const toolId = document.getElementById('currentTool').value;
-    let toolCommand;
-    
-    switch(toolId) {
-        case '0': toolCommand = 'C0'; break;
-        case '1': toolCommand = 'E0'; break;
-        case '2': toolCommand = 'E1'; break;
-        case '3': toolCommand = 'L0'; break;
-        default: toolCommand = 'C0';
-    }
-    
-    fetch('/api/printer/select_tool', {
-        method: 'POST',
-        headers: {'Content-Type': 'application/json'},
-        body: JSON.stringify({tool_command: toolCommand})
-    })
-    .then(response => response.json())
-    .then(data => {
-        if (data.status === 'success') {
-            alert(`Tool ${toolCommand} selected`);
-        } else {
-            alert('Failed to select tool: ' + data.message);
-        }
-    });
-}
-
-function getCurrentPosition() {
-    fetch('/api/printer/get_position')
-    .then(response => response.json())
-    .then(data => {
-        if (data.status === 'success') {
-            alert(`Current Position: X${data.x} Y${data.y} Z${data.z}`);
-        } else {
-            alert('Failed to get position: ' + data.message);
-        }
-    });
-}
-
-
-
-
-
-//For testing
-function testModal() {
-    const modal = document.getElementById('toolModal');
-    console.log('Modal element:', modal);
-    if (modal) {
-        modal.style.display = 'block';
-        console.log('Modal should be visible now');
-    } else {
-        console.log('Modal element not found!');
-    }
-}
-
-//For testing
-function debugTools() {
-    console.log('Tools array:', tools);
-    console.log('Tools length:', tools.length);
-    console.log('Current tool value:', document.getElementById('currentTool').value);
-}
-
-function editTool(toolId) {
-    console.log('editTool called with toolId:', toolId);
-    
-    const tool = tools.find(t => t.id === toolId);
-    console.log('Found tool:', tool);
-    
-    if (!tool) {
-        console.log('Tool not found!');
-        return;
-    }
-    
-    const modal = document.getElementById('toolModal');
-    console.log('Modal element:', modal);
-    
-    if (!modal) {
-        console.log('Modal element not found!');
-        return;
-    }
-    
-    currentEditingTool = toolId;
-    document.getElementById('modalTitle').textContent = 'Edit Tool';
-    document.getElementById('toolName').value = tool.name;
-    document.getElementById('toolId').value = tool.id;
-    document.getElementById('toolType').value = tool.type;
-    document.getElementById('isReference').checked = tool.isReference || false;
-    
-    // Check if the new form elements exist
-    const programmedX = document.getElementById('programmedX');
-    const actualX = document.getElementById('actualX');
-    console.log('programmedX element:', programmedX);
-    console.log('actualX element:', actualX);
-    
-    // Load position data with fallback to old property names
-    if (programmedX) programmedX.value = tool.programmedX || tool.fiducialX || 0;
-    if (document.getElementById('programmedY')) document.getElementById('programmedY').value = tool.programmedY || tool.fiducialY || 0;
-    if (document.getElementById('programmedZ')) document.getElementById('programmedZ').value = tool.programmedZ || tool.fiducialZ || 0;
-    
-    if (actualX) actualX.value = tool.actualX || 0;
-    if (document.getElementById('actualY')) document.getElementById('actualY').value = tool.actualY || 0;
-
-    // Load Z offset
-    const zOffset = document.getElementById('zOffset');
-    if (zOffset) zOffset.value = tool.zOffset || 0;
-
-    
-    // Load dispenser-specific data
-    const linearActuator = document.getElementById('linearActuator');
-    if (linearActuator) linearActuator.value = tool.linearActuator || 0;
-    
-    console.log('About to call updateFormFields');
-    updateFormFields();
-    
-    console.log('About to show modal');
-    modal.style.display = 'block';
-    console.log('Modal display style set to block');
-}
-
-
-function saveTool() {
-    console.log('saveTool called');
-    
-    // Check if required elements exist first
-    const requiredElements = ['toolId', 'toolName', 'toolType', 'isReference'];
-    for (let elementId of requiredElements) {
-        const element = document.getElementById(elementId);
-        if (!element) {
-            console.error(`Required element missing: ${elementId}`);
-            alert(`Form error: ${elementId} element not found`);
-            return;
-        }
-    }
-    
-    const toolData = {
-        id: parseInt(document.getElementById('toolId').value),
-        name: document.getElementById('toolName').value,
-        type: document.getElementById('toolType').value,
-        isReference: document.getElementById('isReference').checked
-    };
-    
-    console.log('Basic tool data:', toolData);
-    
-    // Validate required fields
-    if (!toolData.name || toolData.name.trim() === '') {
-        alert('Please enter a tool name');
-        return;
-    }
-    
-    // Handle camera tools differently
-    if (toolData.type === 'camera') {
-        if (toolData.isReference) {
-            // Camera reference tool - save fiducial positions
-            const programmedElements = ['programmedX', 'programmedY', 'programmedZ'];
-            for (let elementId of programmedElements) {
-                const element = document.getElementById(elementId);
-                if (element) {
-                    // For camera reference tools, save as both programmed and fiducial
-                    const value = parseFloat(element.value) || 0;
-                    toolData[elementId] = value;
-                    toolData[elementId.replace('programmed', 'fiducial')] = value;
-                    console.log(`Set camera ${elementId} and fiducial to:`, value);
-                } else {
-                    console.warn(`Element ${elementId} not found`);
-                }
-            }
-        }
-        // Non-reference camera tools don't need position data
-    } else {
-        // Non-camera tools
-        // Add programmed position data
-        const programmedElements = ['programmedX', 'programmedY', 'programmedZ'];
-        for (let elementId of programmedElements) {
-            const element = document.getElementById(elementId);
-            if (element) {
-                toolData[elementId] = parseFloat(element.value) || 0;
-                console.log(`Set ${elementId} to:`, toolData[elementId]);
-            } else {
-                console.warn(`Element ${elementId} not found`);
-            }
-        }
-        
-        // Add actual position data for non-reference tools (Technique 1)
-        if (!toolData.isReference) {
-            // Check if camera is reference (Technique 2 vs Technique 1)
-            const cameraReference = tools.find(t => t.type === 'camera' && t.isReference);
-            
-            if (!cameraReference) {
-                // Technique 1: Save actual positions
-                const actualElements = ['actualX', 'actualY'];
-                for (let elementId of actualElements) {
-                    const element = document.getElementById(elementId);
-                    if (element) {
-                        toolData[elementId] = parseFloat(element.value) || 0;
-                        console.log(`Set ${elementId} to:`, toolData[elementId]);
-                    } else {
-                        console.warn(`Element ${elementId} not found`);
-                    }
-                }
-                
-                // Handle Z offset separately
-                const zOffsetElement = document.getElementById('zOffset');
-                if (zOffsetElement) {
-                    toolData.zOffset = parseFloat(zOffsetElement.value) || 0;
-                    console.log('Set zOffset to:', toolData.zOffset);
-                }
-            }
-            // If camera is reference (Technique 2), we don't save actual positions
-        }
-        
-        // Add dispenser-specific data
-        if (toolData.type === 'dispenser') {
-            const linearActuator = document.getElementById('linearActuator');
-            
-            if (linearActuator) {
-                toolData.linearActuator = parseFloat(linearActuator.value) || 0;
-                console.log('Set linearActuator to:', toolData.linearActuator);
-            }
-        }
-    }
-    
-    console.log('Final tool data before saving:', toolData);
-    
-    // If this tool is set as reference, unset all others
-    if (toolData.isReference) {
-        tools.forEach(tool => {
-            if (tool.id !== toolData.id) {
-                tool.isReference = false;
-            }
-        });
-    }
-    
-    // Update tools array
-    if (currentEditingTool !== null) {
-        const index = tools.findIndex(t => t.id === currentEditingTool);
-        if (index !== -1) {
-            tools[index] = toolData;
-            console.log('Updated existing tool at index:', index);
-        }
-    } else {
-        const existingIndex = tools.findIndex(t => t.id === toolData.id);
-        if (existingIndex !== -1) {
-            tools[existingIndex] = toolData;
-            console.log('Replaced tool at index:', existingIndex);
-        } else {
-            tools.push(toolData);
-            console.log('Added new tool');
-        }
-    }
-    
-    console.log('Updated tools array:', tools);
-    
-    updateToolDropdown();
-    closeToolModal();
-    
-    // Save to backend
-    fetch('/api/tools/save', {
-        method: 'POST',
-        headers: {'Content-Type': 'application/json'},
-        body: JSON.stringify({tools: tools})
-    })
-    .then(response => response.json())
-    .then(data => {
-        console.log('Backend save response:', data);
-        if (data.status === 'success') {
-            console.log('Tools saved successfully');
-            loadToolsFromBackend();
-        } else {
-            alert('Error saving tools: ' + data.message);
-        }
-    })
-    .catch(error => {
-        console.error('Error saving tools:', error);
-        alert('Error saving tools: ' + error);
-    });
-}
-
-
-
-
-// Enhanced loadToolsFromBackend function
-function loadToolsFromBackend() {
-    console.log('Loading tools from backend...');
-    
-    fetch('/api/tools/load')
-        .then(response => {
-            console.log('Backend response status:', response.status);
-            return response.json();
-        })
-        .then(data => {
-            console.log('Backend response data:', data);
-            
-            if (data.status === 'success') {
-                tools = data.tools || [];
-                cameraReference = data.camera_reference;
-                console.log('Tools loaded from backend:', tools);
-                updateToolDropdown();
-                // Update current tool dropdown
-                const currentToolSelect = document.getElementById('currentTool');
-                if (currentToolSelect) {
-                    const currentValue = currentToolSelect.value;
-                    currentToolSelect.innerHTML = '';
-                    
-                    tools.forEach(tool => {
-                        const option = document.createElement('option');
-                        option.value = tool.id;
-                        option.textContent = tool.name;
-                        currentToolSelect.appendChild(option);
-                    });
-                    
-                    // Restore previous selection if still valid
-                    if (Array.from(currentToolSelect.options).some(opt => opt.value === currentValue)) {
-                        currentToolSelect.value = currentValue;
-                    }
-                }
-            } else {
-                console.error('Failed to load tools:', data.message);
-                // Use default tools if backend fails
-                tools = [
-                    {id: 0, name: "Camera Tool (C0)", type: "camera", offsetX: 0, offsetY: 0, offsetZ: 0, preciseX: 0, preciseY: 0, preciseZ: 0},
-                    {id: 1, name: "Extruder 1 (E0)", type: "extruder", offsetX: 0, offsetY: 0, offsetZ: 0, preciseX: 0, preciseY: 0, preciseZ: 0},
-                    {id: 2, name: "Extruder 2 (E1)", type: "extruder", offsetX: 0, offsetY: 0, offsetZ: 0, preciseX: 0, preciseY: 0, preciseZ: 0},
-                    {id: 3, name: "Liquid Dispenser (L0)", type: "dispenser", offsetX: 0, offsetY: 0, offsetZ: 0, preciseX: 0, preciseY: 0, preciseZ: 0}
-                ];
-                updateToolDropdown();
-            }
-        })
-        .catch(error => {
-            console.error('Error loading tools:', error);
-            // Use default tools if request fails
-            tools = [
-                {id: 0, name: "Camera Tool (C0)", type: "camera", offsetX: 0, offsetY: 0, offsetZ: 0, preciseX: 0, preciseY: 0, preciseZ: 0},
-                {id: 1, name: "Extruder 1 (E0)", type: "extruder", offsetX: 0, offsetY: 0, offsetZ: 0, preciseX: 0, preciseY: 0, preciseZ: 0},
-                {id: 2, name: "Extruder 2 (E1)", type: "extruder", offsetX: 0, offsetY: 0, offsetZ: 0, preciseX: 0, preciseY: 0, preciseZ: 0},
-                {id: 3, name: "Liquid Dispenser (L0)", type: "dispenser", offsetX: 0, offsetY: 0, offsetZ: 0, preciseX: 0, preciseY: 0, preciseZ: 0}
-            ];
-            updateToolDropdown();
-        });
-}
-
-
-
-// Test function to debug tool list
-function debugToolList() {
-    console.log('=== TOOL DEBUG INFO ===');
-    console.log('Current tools array:', tools);
-    console.log('Tools array length:', tools.length);
-    console.log('Tools array type:', typeof tools);
-    console.log('Is tools an array?', Array.isArray(tools));
-    
-    const toolListElement = document.getElementById('toolList');
-    console.log('Tool list element exists?', !!toolListElement);
-    console.log('Tool list innerHTML:', toolListElement ? toolListElement.innerHTML : 'N/A');
-    
-    tools.forEach((tool, index) => {
-        console.log(`Tool ${index}:`, tool);
-    });
-    console.log('=== END DEBUG INFO ===');
-}
-
-
-
-
-function deleteTool(toolId) {
-    if (confirm('Are you sure you want to delete this tool?')) {
-        tools = tools.filter(t => t.id !== toolId);
-        updateToolDropdown();
-
-        fetch('/api/tools/save', {
-            method: 'POST',
-            headers: {'Content-Type': 'application/json'},
-            body: JSON.stringify({tools: tools})
-        });
-    }
-}
-
-
-function closeToolModal() {
-    document.getElementById('toolModal').style.display = 'none';
-    currentEditingTool = null;
-    
-    // Clear basic form fields - check if they exist first
-    const basicFields = [
-        { id: 'toolName', value: '' },
-        { id: 'toolId', value: '' },
-        { id: 'toolType', value: 'extruder' }
-    ];
-    
-    basicFields.forEach(field => {
-        const element = document.getElementById(field.id);
-        if (element) {
-            element.value = field.value;
-        }
-    });
-    
-    // Clear checkbox
-    const isReferenceElement = document.getElementById('isReference');
-    if (isReferenceElement) {
-        isReferenceElement.checked = false;
-    }
-    
-    // Clear position fields if they exist
-    const positionFields = ['programmedX', 'programmedY', 'programmedZ', 'actualX', 'actualY', 'zOffset', 'linearActuator'];
-    positionFields.forEach(fieldId => {
-        const element = document.getElementById(fieldId);
-        if (element) {
-            element.value = '0';
-        }
-    });
-    
-    // Reset offset display if elements exist
-    const offsetElements = ['calcOffsetX', 'calcOffsetY', 'calcOffsetZ'];
-    offsetElements.forEach(elementId => {
-        const element = document.getElementById(elementId);
-        if (element) {
-            element.textContent = '0.000';
-        }
-    });
-}
-
-
-
-        </script>
-    </head>
-    <body>
-        <div class="container">
-            <h1>Rister Camera Controller with Calibration</h1>
-            
-            
-            <div class="controls">
-                <button onclick="startStream()">Start Stream</button>
-                <button onclick="stopStream()" class="stop">Stop Stream</button>
-                <button onclick="capturePhoto()" class="photo">Take Photo</button>
-                <button onclick="startLineMeasurement()" class="calibration pixel-calibrate">Calibrate Pixel Size</button>
-                <!--<button onclick="startCameraCentering()" class="calibration camera-center">Center Camera</button>-->
-                <button id="calibrationToggle" onclick="toggleCalibrationMode()" class="calibration">Image Mapper</button>
-                <button onclick="openOrientationModal()" class="calibration">Camera Orientation</button>
-            </div>
-           
-
-
-
-<!-- Camera Calibration Tutorial Dropdown -->
-<!-- Camera Calibration Tutorial Dropdown -->
-<div class="tutorial-container">
-    <button onclick="toggleTutorial()" class="tutorial-toggle">
-        📖 Image Mapper Tutorial
-        <span id="tutorial-arrow">▼</span>
-    </button>
-    
-    <div id="tutorial-content" class="tutorial-content" style="display: none;">
-        <div class="tutorial-steps">
-            <h3>🎯 Image Mapper Process</h3>
-            <p>Follow these steps to map pixel coordinates to real printer positions:</p>
-            
-            <div class="step-section">
-                <h4>Step 1: Print & Place Calibration Target</h4>
-                <ul>
-                    <li><strong>Copy the calibration target code below:</strong></li>
-                    <li>Save it as <code>calibration_target.svg</code> on your computer</li>
-                    <li>Open the SVG file and print at <strong>100% scale</strong> - Do not scale to fit page!</li>
-                    <li>Verify the 50mm scale bar measures exactly 50mm with a ruler</li>
-                    <li>Place the printed target on your print bed within camera view</li>
-                </ul>
-                
-                <div class="svg-code-container">
-                    <h5>Calibration Target SVG Code:</h5>
-                    <textarea readonly style="width: 100%; height: 100px; font-family: monospace; font-size: 12px; resize: vertical;" onclick="this.select()">
-&lt;svg width="210mm" height="297mm" viewBox="0 0 210 297" xmlns="http://www.w3.org/2000/svg"&gt;
-  &lt;text x="105" y="25" text-anchor="middle" font-family="Arial" font-size="6" font-weight="bold"&gt;CAMERA CALIBRATION TARGET&lt;/text&gt;
-  &lt;text x="105" y="32" text-anchor="middle" font-family="Arial" font-size="4"&gt;Print at 100% scale - Do not scale to fit&lt;/text&gt;
-  &lt;g transform="translate(105, 150)"&gt;
-    &lt;g stroke="black" stroke-width="0.3" fill="none"&gt;
-      &lt;line x1="-25" y1="0" x2="25" y2="0"/&gt;
-      &lt;line x1="0" y1="-25" x2="0" y2="25"/&gt;
-      &lt;line x1="-20" y1="-2" x2="-20" y2="2"/&gt;
-      &lt;line x1="-10" y1="-2" x2="-10" y2="2"/&gt;
-      &lt;line x1="10" y1="-2" x2="10" y2="2"/&gt;
-      &lt;line x1="20" y1="-2" x2="20" y2="2"/&gt;
-      &lt;line x1="-2" y1="-20" x2="2" y2="-20"/&gt;
-      &lt;line x1="-2" y1="-10" x2="2" y2="-10"/&gt;
-      &lt;line x1="-2" y1="10" x2="2" y2="10"/&gt;
-      &lt;line x1="-2" y1="20" x2="2" y2="20"/&gt;
-    &lt;/g&gt;
-    &lt;circle cx="0" cy="0" r="2" fill="none" stroke="black" stroke-width="0.3"/&gt;
-    &lt;circle cx="0" cy="0" r="1" fill="black"/&gt;
-    &lt;g fill="black" stroke="black" stroke-width="0.2"&gt;
-      &lt;g transform="translate(-40, -40)"&gt;
-        &lt;circle cx="0" cy="0" r="1.5" fill="none" stroke="black" stroke-width="0.3"/&gt;
-        &lt;circle cx="0" cy="0" r="0.5" fill="black"/&gt;
-        &lt;text x="0" y="-5" text-anchor="middle" font-family="Arial" font-size="3"&gt;TL&lt;/text&gt;
-      &lt;/g&gt;
-      &lt;g transform="translate(40, -40)"&gt;
-        &lt;circle cx="0" cy="0" r="1.5" fill="none" stroke="black" stroke-width="0.3"/&gt;
-        &lt;circle cx="0" cy="0" r="0.5" fill="black"/&gt;
-        &lt;text x="0" y="-5" text-anchor="middle" font-family="Arial" font-size="3"&gt;TR&lt;/text&gt;
-      &lt;/g&gt;
-      &lt;g transform="translate(-40, 40)"&gt;
-        &lt;circle cx="0" cy="0" r="1.5" fill="none" stroke="black" stroke-width="0.3"/&gt;
-        &lt;circle cx="0" cy="0" r="0.5" fill="black"/&gt;
-        &lt;text x="0" y="8" text-anchor="middle" font-family="Arial" font-size="3"&gt;BL&lt;/text&gt;
-      &lt;/g&gt;
-      &lt;g transform="translate(40, 40)"&gt;
-        &lt;circle cx="0" cy="0" r="1.5" fill="none" stroke="black" stroke-width="0.3"/&gt;
-        &lt;circle cx="0" cy="0" r="0.5" fill="black"/&gt;
-        &lt;text x="0" y="8" text-anchor="middle" font-family="Arial" font-size="3"&gt;BR&lt;/text&gt;
-      &lt;/g&gt;
-    &lt;/g&gt;
-    &lt;g font-family="Arial" font-size="3" fill="black"&gt;
-      &lt;text x="-15" y="-6" text-anchor="middle"&gt;10mm&lt;/text&gt;
-      &lt;text x="-5" y="-6" text-anchor="middle"&gt;10mm&lt;/text&gt;
-      &lt;text x="5" y="-6" text-anchor="middle"&gt;10mm&lt;/text&gt;
-      &lt;text x="15" y="-6" text-anchor="middle"&gt;10mm&lt;/text&gt;
-      &lt;text x="0" y="-32" text-anchor="middle" font-weight="bold"&gt;50mm&lt;/text&gt;
-      &lt;text x="32" y="2" text-anchor="middle" font-weight="bold" transform="rotate(-90, 32, 2)"&gt;50mm&lt;/text&gt;
-    &lt;/g&gt;
-  &lt;/g&gt;
-  &lt;g transform="translate(20, 250)" font-family="Arial" font-size="4" fill="black"&gt;
-    &lt;text x="0" y="0" font-weight="bold"&gt;CALIBRATION INSTRUCTIONS:&lt;/text&gt;
-    &lt;text x="0" y="8"&gt;1. Print this page at 100% scale (no scaling!)&lt;/text&gt;
-    &lt;text x="0" y="16"&gt;2. Place on printer bed within camera view&lt;/text&gt;
-    &lt;text x="0" y="24"&gt;3. Use "Calibrate Pixel Size" - draw 50mm line across center crosshair&lt;/text&gt;
-    &lt;text x="0" y="32"&gt;4. Use "Image Mapper" - click on targets to map coordinates&lt;/text&gt;
-    &lt;text x="0" y="40"&gt;5. Use coordinates to manually center camera and add reference points&lt;/text&gt;
-  &lt;/g&gt;
-  &lt;g transform="translate(130, 250)" stroke="black" stroke-width="0.3" fill="black"&gt;
-    &lt;line x1="0" y1="0" x2="50" y2="0"/&gt;
-    &lt;line x1="0" y1="-2" x2="0" y2="2"/&gt;
-    &lt;line x1="50" y1="-2" x2="50" y2="2"/&gt;
-    &lt;text x="25" y="-4" text-anchor="middle" font-family="Arial" font-size="3"&gt;50mm Scale Check&lt;/text&gt;
-    &lt;text x="25" y="8" text-anchor="middle" font-family="Arial" font-size="3"&gt;Measure with ruler to verify&lt;/text&gt;
-    &lt;text x="25" y="16" text-anchor="middle" font-family="Arial" font-size="3"&gt;correct print scale&lt;/text&gt;
-  &lt;/g&gt;
-&lt;/svg&gt;
-</textarea>
-                    <p style="font-size: 12px; color: #666; margin-top: 5px;">
-                        <strong>Instructions:</strong> Select all text above (click in box, then Ctrl+A), copy it (Ctrl+C), 
-                        paste into a text editor, and save as "calibration_target.svg"
-                    </p>
-                </div>
-            </div>
-            
-            <div class="step-section">
-                <h4>Step 2: Calibrate Pixel Scale</h4>
-                <ul>
-                    <li>Click the <strong style="color: #ff6b35;">Calibrate Pixel Size</strong> button</li>
-                    <li>Click and drag to draw a line across a known dimension (like the 50mm crosshair)</li>
-                    <li>Enter the actual measurement in millimeters when prompted</li>
-                    <li>The system calculates microns per pixel automatically</li>
-                </ul>
-            </div>
-            
-            <div class="step-section">
-                <h4>Step 3: Use Image Mapper</h4>
-                <ul>
-                    <li>Click the <strong style="color: #FF9800;">Image Mapper</strong> button</li>
-                    <li>Click on specific features in the image (center dot, corner targets)</li>
-                    <li>Each click shows you both pixel coordinates and current printer position</li>
-                    <li>Use this information to manually move your printer/camera to center targets</li>
-                    <li>Add multiple reference points for better coordinate mapping accuracy</li>
-                </ul>
-            </div>
-            
-            <div class="step-section">
-                <h4>Step 4: Manual Camera Positioning</h4>
-                <ul>
-                    <li>Use the coordinate information from Image Mapper clicks</li>
-                    <li>Manually move your printer to center the camera on targets</li>
-                    <li>Build up reference points at different locations for full-bed accuracy</li>
-                    <li>Use flip buttons if your camera image appears inverted</li>
-                </ul>
-            </div>
-            
-            <div class="step-section success-box">
-                <h4>✅ Mapping Complete!</h4>
-                <p>Your camera coordinates are now mapped. You can:</p>
-                <ul>
-                    <li>Click anywhere in the image to get precise printer coordinates</li>
-                    <li>Use the coordinate data to manually position your camera</li>
-                    <li>Build reference points for accurate coordinate conversion across the bed</li>
-                    <li>Measure distances and positions accurately in your images</li>
-                </ul>
-            </div>
-            
-            <div class="tips-section">
-                <h4>💡 Pro Tips</h4>
-                <ul>
-                    <li><strong>Start with the center target</strong> for initial reference point</li>
-                    <li><strong>Add corner targets</strong> for full-bed coordinate accuracy</li>
-                    <li><strong>Use the flip buttons</strong> if your camera view is inverted</li>
-                    <li><strong>Recalibrate pixel size</strong> if you change camera height or focus</li>
-                    <li><strong>The green crosshair</strong> shows the exact center of your camera view</li>
-                    <li><strong>Manual positioning</strong> gives you full control over camera movement</li>
-                </ul>
-            </div>
-        </div>
-    </div>
-</div>
-
-
-
-
-
-
-
-
-
-
-
-
-
-<!--Tool management html -->
-<!-- Tool Management Interface -->
-<div class="tool-management-container">
-    <button onclick="toggleToolManagement()" class="tool-management-toggle">
-        🔧 Tool Management
-        <span id="tool-arrow">▼</span>
-    </button>
-    
-    <div id="tool-management-content" class="tool-management-content" style="display: none;">
-        <!-- Tool Selection and Management -->
-        <div class="tool-selection-section">
-            <h4>Tool Management</h4>
-            <div class="tool-controls">
-                <label for="currentTool">Select Tool:</label>
-                <select id="currentTool">
-                    <option value="0">Camera Tool (C0)</option>
-                </select>
-                
-                <div class="tool-action-buttons">
-                    <button onclick="editSelectedTool()" class="edit-tool-btn">Edit</button>
-                    <button onclick="deleteSelectedTool()" class="delete-tool-btn">Delete</button>
-                    <button onclick="addNewTool()" class="add-tool-btn">+ Add New</button>
-                </div>
-            </div>
-            
-            <!-- Selected Tool Info Display -->
-            <div id="selectedToolInfo" class="selected-tool-info">
-                <p><strong>Selected:</strong> <span id="selectedToolName">Camera Tool (C0)</span></p>
-                <p><strong>Type:</strong> <span id="selectedToolType">camera</span></p>
-                <p><strong>Offsets:</strong> <span id="selectedToolOffsets">Reference Tool (No Offsets)</span></p>
-            </div>
-        </div>
-    </div>
-</div>
-
-
-
-
-
-
-<style>
-.tool-selection-section {
-    margin-bottom: 20px;
-    padding: 15px;
-    background-color: white;
-    border-radius: 5px;
-    border: 1px solid #e0e0e0;
-}
-
-.tool-controls {
-    display: flex;
-    flex-direction: column;
-    gap: 15px;
-}
-
-.tool-controls label {
-    font-weight: bold;
-    color: #2c3e50;
-}
-
-.tool-controls select {
-    padding: 8px 12px;
-    border: 1px solid #ccc;
-    border-radius: 4px;
-    font-size: 14px;
-    min-width: 200px;
-}
-
-.tool-action-buttons {
-    display: flex;
-    gap: 10px;
-    flex-wrap: wrap;
-}
-
-.tool-action-buttons button {
-    padding: 8px 16px;
-    border: none;
-    border-radius: 4px;
-    cursor: pointer;
-    font-size: 14px;
-    font-weight: bold;
-}
-
-.select-tool-btn {
-    background-color: #007bff;
-    color: white;
-}
-
-.select-tool-btn:hover {
-    background-color: #0056b3;
-}
-
-.edit-tool-btn {
-    background-color: #ffc107;
-    color: black;
-}
-
-.edit-tool-btn:hover {
-    background-color: #e0a800;
-}
-
-.delete-tool-btn {
-    background-color: #dc3545;
-    color: white;
-}
-
-.delete-tool-btn:hover {
-    background-color: #c82333;
-}
-
-.add-tool-btn {
-    background-color: #28a745;
-    color: white;
-}
-
-.add-tool-btn:hover {
-    background-color: #218838;
-}
-
-.selected-tool-info {
-    margin-top: 15px;
-    padding: 10px;
-    background-color: #f8f9fa;
-    border: 1px solid #dee2e6;
-    border-radius: 4px;
-    font-size: 14px;
-}
-
-.selected-tool-info p {
-    margin: 5px 0;
-}
-
-.selected-tool-info span {
-    font-family: monospace;
-    color: #495057;
-}
-.tool-selection-section {
-    margin-bottom: 20px;
-    padding: 15px;
-    background-color: white;
-    border-radius: 5px;
-    border: 1px solid #e0e0e0;
-}
-
-.tool-controls {
-    display: flex;
-    flex-direction: column;
-    gap: 15px;
-}
-
-.tool-action-buttons {
-    display: flex;
-    gap: 10px;
-    flex-wrap: wrap;
-}
-
-.edit-tool-btn {
-    background-color: #ffc107;
-    color: black;
-    padding: 8px 16px;
-    border: none;
-    border-radius: 4px;
-    cursor: pointer;
-}
-
-.delete-tool-btn {
-    background-color: #dc3545;
-    color: white;
-    padding: 8px 16px;
-    border: none;
-    border-radius: 4px;
-    cursor: pointer;
-}
-
-.selected-tool-info {
-    margin-top: 15px;
-    padding: 10px;
-    background-color: #f8f9fa;
-    border: 1px solid #dee2e6;
-    border-radius: 4px;
-    font-size: 14px;
-}
-</style>
-
-<script>
-// Updated JavaScript functions for simplified tool management
-
-function editSelectedTool() {
-    const selectedId = parseInt(document.getElementById('currentTool').value);
-    editTool(selectedId);
-}
-
-function addNewTool() {
-    currentEditingTool = null;
-    document.getElementById('modalTitle').textContent = 'Add New Tool';
-    document.getElementById('toolName').value = '';
-    
-    // Find next available ID
-    const existingIds = tools.map(t => t.id);
-    let nextId = 0;
-    while (existingIds.includes(nextId)) {
-        nextId++;
-    }
-    
-    document.getElementById('toolId').value = nextId;
-    document.getElementById('toolType').value = 'extruder';
-    document.getElementById('isReference').checked = false;
-    document.getElementById('fiducialX').value = '0';
-    document.getElementById('fiducialY').value = '0';
-    document.getElementById('fiducialZ').value = '0';
-    
-    updateOffsetDisplay();
-    document.getElementById('toolModal').style.display = 'block';
-}
-
-
-function updateSelectedToolInfo() {
-    const currentToolSelect = document.getElementById('currentTool');
-    if (!currentToolSelect) {
-        console.error('currentTool select element not found');
-        return;
-    }
-    
-    const selectedId = parseInt(currentToolSelect.value);
-    const selectedTool = tools.find(t => t.id === selectedId);
-    
-    if (selectedTool) {
-        const nameElement = document.getElementById('selectedToolName');
-        const typeElement = document.getElementById('selectedToolType');
-        const offsetsElement = document.getElementById('selectedToolOffsets');
-        
-        if (nameElement) nameElement.textContent = selectedTool.name;
-        if (typeElement) typeElement.textContent = selectedTool.type;
-        
-        if (offsetsElement) {
-            if (selectedTool.type === 'camera' && !selectedTool.isReference) {
-                offsetsElement.textContent = 'Imaging Tool (No Positions)';
-            } else if (selectedTool.isReference) {
-                offsetsElement.textContent = 'Reference Tool (No Offsets)';
-            } else {
-                // Check which technique we're using
-                const cameraReference = tools.find(t => t.type === 'camera' && t.isReference);
-                
-                if (cameraReference) {
-                    // Technique 2: Camera is reference - offsets = tool_programmed - camera_fiducial
-                    const toolProgrammedX = selectedTool.programmedX || selectedTool.fiducialX || 0;
-                    const toolProgrammedY = selectedTool.programmedY || selectedTool.fiducialY || 0;
-                    const toolProgrammedZ = selectedTool.programmedZ || selectedTool.fiducialZ || 0;
-                    
-                    const cameraFiducialX = cameraReference.programmedX || cameraReference.fiducialX || 0;
-                    const cameraFiducialY = cameraReference.programmedY || cameraReference.fiducialY || 0;
-                    const cameraFiducialZ = cameraReference.programmedZ || cameraReference.fiducialZ || 0;
-                    
-                    // Corrected calculation: tool_programmed - camera_fiducial
-                    const offsetX = toolProgrammedX - cameraFiducialX;
-                    const offsetY = toolProgrammedY - cameraFiducialY;
-                    const offsetZ = toolProgrammedZ - cameraFiducialZ;
-                    
-                    offsetsElement.textContent = 
-                        `X${offsetX.toFixed(3)} Y${offsetY.toFixed(3)} Z${offsetZ.toFixed(3)}`;
-                } else {
-                    // Technique 1: Use actual - programmed logic
-                    const programmedX = selectedTool.programmedX || selectedTool.fiducialX || 0;
-                    const programmedY = selectedTool.programmedY || selectedTool.fiducialY || 0;
-                    const programmedZ = selectedTool.programmedZ || selectedTool.fiducialZ || 0;
-                    
-                    const actualX = selectedTool.actualX || 0;
-                    const actualY = selectedTool.actualY || 0;
-                    const zOffsetInput = selectedTool.zOffset || 0;
-                    
-                    const offsetX = actualX - programmedX;
-                    const offsetY = actualY - programmedY;
-                    
-                    const referenceTool = tools.find(t => t.isReference === true);
-                    let offsetZ = zOffsetInput;
-                    
-                    if (referenceTool && (referenceTool.programmedZ !== undefined || referenceTool.fiducialZ !== undefined)) {
-                        const referenceZ = referenceTool.programmedZ || referenceTool.fiducialZ || 0;
-                        offsetZ += (referenceZ - programmedZ);
-                    }
-                    
-                    offsetsElement.textContent = 
-                        `X${offsetX.toFixed(3)} Y${offsetY.toFixed(3)} Z${offsetZ.toFixed(3)}`;
-                }
-            }
-        }
-        
-        // Enable edit button for all tools
-        const editBtn = document.querySelector('.edit-tool-btn');
-        const deleteBtn = document.querySelector('.delete-tool-btn');
-        
-        if (editBtn) {
-            editBtn.disabled = false;
-            editBtn.style.opacity = '1';
-        }
-        
-        if (deleteBtn) {
-            deleteBtn.disabled = selectedTool.isReference;
-            deleteBtn.style.opacity = selectedTool.isReference ? '0.5' : '1';
-        }
-    }
-}
-
-
-
-function deleteSelectedTool() {
-    const selectedId = parseInt(document.getElementById('currentTool').value);
-    const selectedTool = tools.find(t => t.id === selectedId);
-    
-    if (selectedTool && selectedTool.type === 'camera') {
-        alert('Cannot delete the camera tool - it is the reference tool.');
-        return;
-    }
-    
-    if (confirm(`Are you sure you want to delete "${selectedTool.name}"?`)) {
-        deleteTool(selectedId);
-    }
-}
-
-
-function updateToolDropdown() {
-    const currentToolSelect = document.getElementById('currentTool');
-    if (!currentToolSelect) return;
-    
-    const currentValue = currentToolSelect.value;
-    currentToolSelect.innerHTML = '';
-    
-    tools.forEach(tool => {
-        const option = document.createElement('option');
-        option.value = tool.id;
-        option.textContent = tool.name;
-        currentToolSelect.appendChild(option);
-    });
-    
-    if (Array.from(currentToolSelect.options).some(opt => opt.value === currentValue)) {
-        currentToolSelect.value = currentValue;
-    }
-    
-    updateSelectedToolInfo();
-    
-    currentToolSelect.onchange = function() {
-        updateSelectedToolInfo();
-    };
-}
-
-
-function saveTool() {
-    console.log('=== SAVE TOOL DEBUG START ===');
-    
-    const toolData = {
-        id: parseInt(document.getElementById('toolId').value),
-        name: document.getElementById('toolName').value,
-        type: document.getElementById('toolType').value,
-        isReference: document.getElementById('isReference').checked
-    };
-    
-    console.log('Tool type:', toolData.type);
-    console.log('Is reference:', toolData.isReference);
-    
-    if (toolData.type === 'camera' && toolData.isReference) {
-        console.log('Processing camera reference tool');
-        
-        // Check if form elements exist
-        const progX = document.getElementById('programmedX');
-        const progY = document.getElementById('programmedY');
-        const progZ = document.getElementById('programmedZ');
-        
-        console.log('Form elements found:', {
-            programmedX: !!progX,
-            programmedY: !!progY,
-            programmedZ: !!progZ
-        });
-        
-        if (progX) {
-            console.log('programmedX value:', progX.value);
-            toolData.programmedX = parseFloat(progX.value) || 0;
-            toolData.fiducialX = parseFloat(progX.value) || 0;
-        }
-        
-        if (progY) {
-            console.log('programmedY value:', progY.value);
-            toolData.programmedY = parseFloat(progY.value) || 0;
-            toolData.fiducialY = parseFloat(progY.value) || 0;
-        }
-        
-        if (progZ) {
-            console.log('programmedZ value:', progZ.value);
-            toolData.programmedZ = parseFloat(progZ.value) || 0;
-            toolData.fiducialZ = parseFloat(progZ.value) || 0;
-        }
-    }
-    
-    console.log('Final toolData for camera:', toolData);
-    
-    // Continue with rest of save logic...
-    
-    // If this tool is set as reference, unset all others
-    if (toolData.isReference) {
-        tools.forEach(tool => {
-            if (tool.id !== toolData.id) {
-                tool.isReference = false;
-            }
-        });
-    }
-    
-    // Update tools array
-    if (currentEditingTool !== null) {
-        const index = tools.findIndex(t => t.id === currentEditingTool);
-        if (index !== -1) {
-            tools[index] = toolData;
-            console.log('Updated tool in array:', tools[index]);
-        }
-    }
-    
-    console.log('=== SAVE TOOL DEBUG END ===');
     
-    updateToolDropdown();
-    closeToolModal();
+    with tools_config_lock:
+        tools_config_version += 1
+        if tools_save_timer is not None:
+            tools_save_timer.cancel()
+        tools_save_timer = threading.Timer(TOOLS_SAVE_DELAY, flush_tools_config)
+        tools_save_timer.daemon = True
+        tools_save_timer.start()
+    return True
+
+
+def flush_tools_config():
+    """Write the tools configuration now if it changed since the last write
     
-    // Save to backend
-    fetch('/api/tools/save', {
-        method: 'POST',
-        headers: {'Content-Type': 'application/json'},
-        body: JSON.stringify({tools: tools})
-    })
-    .then(response => response.json())
-    .then(data => {
-        console.log('Backend response:', data);
-    });
-}
+    Snapshot, write and rename all happen under tools_write_lock, so an
+    older snapshot can never replace a newer one on disk.
+    """
+    global tools_save_timer, tools_saved_version
+    with tools_write_lock:
+        with tools_config_lock:
+            if tools_save_timer is not None:
+                tools_save_timer.cancel()
+                tools_save_timer = None
+            if tools_saved_version == tools_config_version:
+                return True
+            text = json.dumps(tools_config, indent=2)
+            version = tools_config_version
+        
+        try:
+            _write_file_atomic(TOOLS_CONFIG_FILE, text)
+            tools_saved_version = version
+            logger.info(f"Tools configuration version {version} saved to {TOOLS_CONFIG_FILE}")
+            return True
+        except Exception as e:
+            logger.error(f"Error saving tools config: {e}")
+            return False
 
 
 
-// Updated deleteTool function
-function deleteTool(toolId) {
-    const tool = tools.find(t => t.id === toolId);
-    if (tool && tool.type === 'camera') {
-        alert('Cannot delete the camera tool - it is the reference tool.');
-        return;
-    }
+
+
+class ToolRegistry:
+    """Tools indexed by id and type with a precomputed offset table
     
-    tools = tools.filter(t => t.id !== toolId);
-    updateToolDropdown();
+    Offsets are fiducial minus reference fiducial, or the fiducial itself
+    when no tool is the reference. If several tools are flagged the last one
+    is the reference, as it always was. rebuild() only recomputes the offsets
+    of tools whose fiducial changed, unless the reference itself changed.
+    The registry also tracks whether a push of the offsets to Klipper is
+    already queued, under the same lock.
+    """
     
-    // Save to backend
-    fetch('/api/tools/save', {
-        method: 'POST',
-        headers: {'Content-Type': 'application/json'},
-        body: JSON.stringify({tools: tools})
-    });
-}
+    FIDUCIAL_KEYS = ("fiducialX", "fiducialY", "fiducialZ")
+    
+    def __init__(self):
+        self._lock = threading.RLock()
+        self._by_id = {}
+        self._by_type = {}
+        self._fiducials = {}
+        self._offsets = {}
+        self._reference_id = None
+        self._push_pending = False
+    
+    @classmethod
+    def _fiducial(cls, tool):
+        return tuple(float(tool.get(key, 0) or 0) for key in cls.FIDUCIAL_KEYS)
+    
+    def rebuild(self, tools):
+        """Index a new tools list, returns the ids whose offsets changed"""
+        with self._lock:
+            by_id = OrderedDict((tool["id"], tool) for tool in tools)
+            by_type = {}
+            for tool in by_id.values():
+                by_type.setdefault(tool.get("type"), []).append(tool)
+            reference_id = next((tool["id"] for tool in reversed(tools) if tool.get("isReference", False)), None)
+            fiducials = {tool_id: self._fiducial(tool) for tool_id, tool in by_id.items()}
+            
+            reference_changed = (reference_id != self._reference_id or
+                                 fiducials.get(reference_id) != self._fiducials.get(reference_id))
+            base = fiducials.get(reference_id, (0.0, 0.0, 0.0))
+            offsets = {}
+            changed = []
+            for tool_id, fiducial in fiducials.items():
+                if not reference_changed and self._fiducials.get(tool_id) == fiducial:
+                    offsets[tool_id] = self._offsets[tool_id]
+                    continue
+                offsets[tool_id] = {
+                    "offsetX": round(fiducial[0] - base[0], 3),
+                    "offsetY": round(fiducial[1] - base[1], 3),
+                    "offsetZ": round(fiducial[2] - base[2], 3)
+                }
+                if offsets[tool_id] != self._offsets.get(tool_id):
+                    changed.append(tool_id)
+            
+            self._by_id, self._by_type = by_id, by_type
+            self._fiducials, self._offsets = fiducials, offsets
+            self._reference_id = reference_id
+            return changed
+    
+    @property
+    def reference_id(self):
+        return self._reference_id
+    
+    def get(self, tool_id):
+        return self._by_id.get(tool_id)
+    
+    def by_type(self, tool_type):
+        return list(self._by_type.get(tool_type, []))
+    
+    def request_push(self):
+        """Mark an offset push as queued, False if one already is"""
+        with self._lock:
+            if self._push_pending:
+                return False
+            self._push_pending = True
+            return True
+    
+    def push_started(self):
+        """Clear the queued mark, changes from now on need another push"""
+        with self._lock:
+            self._push_pending = False
+    
+    @property
+    def push_pending(self):
+        with self._lock:
+            return self._push_pending
+    
+    def offsets(self, tool_id):
+        offsets = self._offsets.get(tool_id)
+        return dict(offsets) if offsets else {"offsetX": 0, "offsetY": 0, "offsetZ": 0}
+    
+    def offset_table(self):
+        """Every tool with its offsets, in tools list order"""
+        with self._lock:
+            return [{
+                "id": tool_id,
+                "name": tool.get("name"),
+                "type": tool.get("type"),
+                "klipper_id": klipper_tool_id(tool),
+                "is_reference": tool_id == self._reference_id,
+                **self._offsets[tool_id]
+            } for tool_id, tool in self._by_id.items()]
 
-// Updated loadToolsFromBackend function
-
-
-function loadToolsFromBackend() {
-    fetch('/api/tools/load')
-        .then(response => response.json())
-        .then(data => {
-            if (data.status === 'success') {
-                tools = data.tools || [];
-                updateToolDropdown();
-            } else {
-                // Use default tools with fiducial structure if backend fails
-                tools = [
-                    {id: 0, name: "Camera Tool (C0)", type: "camera", fiducialX: 0, fiducialY: 0, fiducialZ: 0, isReference: true},
-                    {id: 1, name: "Extruder 1 (E0)", type: "extruder", fiducialX: 0, fiducialY: 0, fiducialZ: 0, isReference: false},
-                    {id: 2, name: "Extruder 2 (E1)", type: "extruder", fiducialX: 0, fiducialY: 0, fiducialZ: 0, isReference: false},
-                    {id: 3, name: "Liquid Dispenser (L0)", type: "dispenser", fiducialX: 0, fiducialY: 0, fiducialZ: 0, isReference: false}
-                ];
-                updateToolDropdown();
-            }
-        })
-        .catch(error => {
-            console.error('Error loading tools:', error);
-            // Use default tools with fiducial structure if request fails
-            tools = [
-                {id: 0, name: "Camera Tool (C0)", type: "camera", fiducialX: 0, fiducialY: 0, fiducialZ: 0, isReference: true},
-                {id: 1, name: "Extruder 1 (E0)", type: "extruder", fiducialX: 0, fiducialY: 0, fiducialZ: 0, isReference: false},
-                {id: 2, name: "Extruder 2 (E1)", type: "extruder", fiducialX: 0, fiducialY: 0, fiducialZ: 0, isReference: false},
-                {id: 3, name: "Liquid Dispenser (L0)", type: "dispenser", fiducialX: 0, fiducialY: 0, fiducialZ: 0, isReference: false}
-            ];
-            updateToolDropdown();
-        });
-}
 
+tool_registry = ToolRegistry()
 
 
+def calculate_tool_offsets(tool_id):
+    """Offsets of a tool relative to the reference tool, 0,0,0 if unknown"""
+    return tool_registry.offsets(tool_id)
 
-</script>
 
+def update_tools(tools):
+    """Replace the tools list, track the reference tool and save"""
+    with tools_config_lock:
+        changed = tool_registry.rebuild(tools)
+        tools_config["tools"] = tools
+        tools_config["reference_tool_id"] = tool_registry.reference_id
+        saved = save_tools_config()
+    
+    if changed and KLIPPER_OFFSET_PUSH:
+        schedule_tool_offset_push()
+    return saved
 
 
+def klipper_tool_id(tool):
+    """Klipper tool id ("e0", "c0", ...) for a tools_config entry"""
+    if tool.get("klipperId"):
+        return str(tool["klipperId"]).lower()
+    match = re.search(r"\((\w+)\)", tool.get("name", ""))
+    return match.group(1).lower() if match else None
 
 
+# Tool offsets pushed to Klipper, variable name -> value last written
+klipper_offset_lock = threading.Lock()
+klipper_pushed_offsets = {}
+klipper_offset_push_state = {"last_push": None, "variables": {}, "error": None}
+klipper_offset_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="offset-push")
 
 
+def tool_offset_variables():
+    """save_variables names and values for the current offset table"""
+    variables = {}
+    for entry in tool_registry.offset_table():
+        if entry["klipper_id"]:
+            for axis in ("x", "y", "z"):
+                variables[f"{entry['klipper_id']}_offset_{axis}"] = entry[f"offset{axis.upper()}"]
+    return variables
 
 
-<script>
-function toggleTutorial() {
-    const content = document.getElementById('tutorial-content');
-    const arrow = document.getElementById('tutorial-arrow');
+def push_tool_offsets(force=False):
+    """Write changed tool offsets to Klipper in one G-code script
     
-    if (content.style.display === 'none') {
-        content.style.display = 'block';
-        arrow.classList.add('tutorial-arrow-up');
-    } else {
-        content.style.display = 'none';
-        arrow.classList.remove('tutorial-arrow-up');
-    }
-}
-</script>
+    Each offset is compared against the value Klipper reports in
+    save_variables, or the value last pushed while that is unknown, so
+    unchanged offsets are never re-sent. Returns the variables written.
+    """
+    with klipper_offset_lock:
+        with printer_state_lock:
+            saved = dict(printer_state.get("save_variables", {}).get("variables") or {})
+        
+        changed = {}
+        for name, value in tool_offset_variables().items():
+            current = saved.get(name, klipper_pushed_offsets.get(name))
+            try:
+                unchanged = current is not None and round(float(current), 3) == value
+            except (TypeError, ValueError):
+                unchanged = False
+            if force or not unchanged:
+                changed[name] = value
+        
+        if changed:
+            script = "\n".join(f"SAVE_VARIABLE VARIABLE={name} VALUE={value!r}" for name, value in changed.items())
+            run_gcode_script(script)
+            klipper_pushed_offsets.update(changed)
+            logger.info(f"Pushed {len(changed)} tool offset variables to Klipper")
+        
+        klipper_offset_push_state.update(last_push=datetime.now().isoformat(), variables=changed, error=None)
+        return changed
 
 
+def _push_tool_offsets_job():
+    tool_registry.push_started()
+    try:
+        push_tool_offsets()
+    except Exception as e:
+        with klipper_offset_lock:
+            klipper_offset_push_state["error"] = str(e)
+        logger.error(f"Failed to push tool offsets to Klipper: {e}")
 
 
+def schedule_tool_offset_push():
+    """Push the offsets in the background, coalescing pushes already queued
 
-<div id="focusControls" class="controls" style="display: none;">
-    <div class="focus-container">
-        <label for="focusSlider">Manual Focus: <span id="focusValue">13.5</span></label>
-        <input type="range" min="0" max="30" value="13.5" step="0.1" class="slider" id="focusSlider" 
-               oninput="updateFocusValue(this.value)" onchange="setFocusManual(this.value)">
-        
-        <div class="focus-input-group">
-            <label for="focusInput">Focus Value:</label>
-            <input type="number" id="focusInput" min="0" max="30" step="0.1" value="13.5" 
-                   onchange="setFocusFromInput(this.value)">
-            <button onclick="setFocusFromInput(document.getElementById('focusInput').value)" class="focus">Set Focus</button>
-        </div>
-    </div>
-</div>
-
-
-
-<div id="calibrationPanel" class="calibration-panel" style="display: none;">
-    <h2>Image Mapper - Pixel-to-Printer Coordinate Mapping</h2>
-    <p><strong>Click on image features to record reference points for coordinate mapping.</strong></p>
-    
-    <div class="input-group">
-        <label>Microns per pixel X:</label>
-        <input type="number" id="micronPerPixelX" value="10" step="0.1" min="0.1" max="1000">
-        <label>Microns per pixel Y:</label>
-        <input type="number" id="micronPerPixelY" value="10" step="0.1" min="0.1" max="1000">
-        <button onclick="updateMicronsPerPixel()">Update</button>
-    </div>
-    
-    <div class="controls">
-        <button onclick="clearCalibration()" class="stop">Clear All Points</button>
-        <button onclick="showReferenceLabels()" class="calibration">Refresh Labels</button>
-    </div>
-    
-    <h3>Reference Points</h3>
-    <div id="referencePoints" class="reference-points">
-        <div class="reference-point">No reference points set</div>
-    </div>
-    
-    <p><strong>Instructions:</strong></p>
-    <ul style="text-align: left;">
-        <li>1. Use "Image Mapper" to click on features in the image</li>
-        <li>2. Each click records pixel coordinates and current printer position</li>
-        <li>3. Use the coordinate information to manually position your camera/printer</li>
-        <li>4. Use flip buttons if your camera image is inverted</li>
-        <li>5. Build reference points for accurate coordinate mapping</li>
-        <li>6. Click "Refresh Labels" after moving the printer to update label positions</li>
-    </ul>
-</div>
+    Called from the API and MQTT threads, the check-and-set of the queued
+    mark happens under the registry lock.
+    """
+    if tool_registry.request_push():
+        klipper_offset_executor.submit(_push_tool_offsets_job)
 
 
+# Closed-loop tool offset calibration
+auto_calibration_state = {"state": "idle", "tools": {}, "started": None, "finished": None, "message": ""}
+auto_calibration_lock = threading.Lock()
+auto_calibration_thread = None
+auto_calibration_cancel = threading.Event()
 
-            
-            <div id="streamContainer" class="media-container" style="display: none;">
-                <h3>Live Stream</h3>
 
-<img id="streamImg" class="clickable-image" 
-     onmousedown="measureClick(event)" 
-     onmousemove="measureClick(event); updateCoordinateDisplay(event, this)" 
-     onmouseup="measureClick(event)"
-     onmouseenter="showCoordinateDisplay(this)"
-     onmouseleave="hideCoordinateDisplay(this)"
-     onclick="handleImageClick(event, 'stream'); measureClick(event);"
-     src="data:image/gif;base64,R0lGODlhAQABAAAAACH5BAEKAAEALAAAAAABAAEAAAICTAEAOw==" 
-     alt="Live Stream">
+def _set_auto_calibration(tool_id=None, **fields):
+    with auto_calibration_lock:
+        if tool_id is None:
+            auto_calibration_state.update(fields)
+        else:
+            auto_calibration_state["tools"].setdefault(str(tool_id), {}).update(fields)
+
 
+def get_auto_calibration_state():
+    with auto_calibration_lock:
+        return json.loads(json.dumps(auto_calibration_state))
 
-            </div>
 
+def wait_for_frame_after(timestamp, timeout=3.0):
+    """Return the first stream frame exposed at or after a monotonic timestamp"""
+    deadline = time.monotonic() + timeout
+    last_seq = 0
+    while True:
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            return None
+        frame = stream_frames.wait_for_frame(last_seq, remaining)
+        if frame is None:
+            continue
+        if frame.timestamp >= timestamp:
+            return frame
+        last_seq = frame.seq
 
 
+def measure_fiducial_error(frame, display_size=None):
+    """Offset in mm from the image centre to the detected target
 
-            <div id="photoContainer" class="media-container" style="display: none;">
-                <h3>Latest Photo</h3>
+    Moving the toolhead by the returned (dx, dy) centres the target. Both
+    points go through the calibration model so the sign conventions and
+    scale match manual calibration.
+    """
+    detection = detect_fiducial(frame.array)
+    if not detection["valid"]:
+        raise RuntimeError("Target match is numerically invalid, not using it")
+    if not detection["found"] or detection["score"] < AUTO_CALIBRATION_MIN_SCORE:
+        raise RuntimeError(f"Target not found reliably (score {detection['score']})")
+    
+    camera_pos = get_position_at(frame.timestamp)
+    width, height = detection["frame_width"], detection["frame_height"]
+    pixel_x, pixel_y = detection["pixel_x"], detection["pixel_y"]
+    if display_size:
+        pixel_x *= display_size[0] / float(width)
+        pixel_y *= display_size[1] / float(height)
+        width, height = display_size
+    
+    points = pixel_to_printer_batch([[pixel_x, pixel_y], [width / 2.0, height / 2.0]],
+                                    camera_pos["x"], camera_pos["y"])
+    if points is None:
+        raise RuntimeError("Calibration not available")
+    
+    (target_x, target_y), (centre_x, centre_y) = points
+    return target_x - centre_x, target_y - centre_y, camera_pos, detection
 
-<img id="photoImg" class="clickable-image"
-     onmousedown="measureClick(event)" 
-     onmousemove="measureClick(event); updateCoordinateDisplay(event, this)" 
-     onmouseup="measureClick(event)"
-     onmouseenter="showCoordinateDisplay(this)"
-     onmouseleave="hideCoordinateDisplay(this)"
-     onclick="handleImageClick(event, 'snapshot'); measureClick(event);"
-     src="/latest_photo" 
-     alt="Latest Captured Photo">
 
-            </div>
+def _tool_fiducial(tool):
+    """(x, y) fiducial estimate of a tool as floats, None when not set
+    
+    The tools UI may send the coordinates as strings, 0.0 is a valid value.
+    """
+    x, y = tool.get("fiducialX"), tool.get("fiducialY")
+    if x is None or y is None or x == "" or y == "":
+        return None
+    try:
+        return float(x), float(y)
+    except (TypeError, ValueError):
+        raise ValueError(f"Tool {tool.get('id')} has a non-numeric fiducial ({x!r}, {y!r})")
+
+
+def check_auto_calibration_tools(tools):
+    """Refuse tools whose offset the camera geometry cannot measure"""
+    if not tools:
+        raise ValueError("No tools to calibrate")
+    for tool in tools:
+        is_camera = tool.get("type") == "camera"
+        if AUTO_CALIBRATION_FIXED_CAMERA and is_camera:
+            raise ValueError(f"Tool {tool['id']} is a camera, a fixed camera cannot calibrate it")
+        if not AUTO_CALIBRATION_FIXED_CAMERA and not is_camera:
+            raise ValueError(f"Tool {tool['id']} is not on the carriage with the camera, "
+                             f"enable AUTO_CALIBRATION_FIXED_CAMERA to calibrate it")
+        _tool_fiducial(tool)
+
+
+def _auto_calibrate_tool(tool, options, at_estimate=False):
+    """Centre one tool on the target, returns the converged (x, y, z)
+
+    Move, settle, capture and analyse are strictly sequential, each move
+    depends on the previous frame. at_estimate skips the first move when the
+    tool change already went to the tool's starting estimate.
+    """
+    tool_id = tool["id"]
+    position = get_cached_printer_position()[0]
+    target = list(_tool_fiducial(tool) or (position["x"], position["y"]))
+    
+    for iteration in range(1, options["max_iterations"] + 1):
+        if auto_calibration_cancel.is_set():
+            raise RuntimeError("Cancelled")
+        
+        if iteration > 1 or not at_estimate:
+            _set_auto_calibration(tool_id, state="moving")
+            run_gcode_script(f"G90\nG1 X{target[0]:.3f} Y{target[1]:.3f} F{options['feedrate']}\nM400")
+        settled_at = time.monotonic() + options["settle_time"]
+        
+        _set_auto_calibration(tool_id, state="capturing", iteration=iteration)
+        frame = luma_frames.wait_for_frame_after(settled_at)
+        if frame is None:
+            raise RuntimeError("No stream frame after move")
+        
+        _set_auto_calibration(tool_id, state="analysing")
+        dx, dy, camera_pos, detection = measure_fiducial_error(frame, options["display_size"])
+        residual = (dx * dx + dy * dy) ** 0.5
+        _set_auto_calibration(tool_id, residual_mm=round(residual, 4), score=detection["score"])
+        logger.info(f"Auto calibration tool {tool_id} iteration {iteration}: residual {residual:.4f} mm")
+        
+        # A carriage camera moves onto the target, with a fixed camera the
+        # nozzle is the target and moves the opposite way in the image
+        if AUTO_CALIBRATION_FIXED_CAMERA:
+            target = [camera_pos["x"] - dx, camera_pos["y"] - dy]
+        else:
+            target = [camera_pos["x"] + dx, camera_pos["y"] + dy]
+        if residual <= options["tolerance"]:
+            return target[0], target[1], camera_pos["z"]
+    
+    raise RuntimeError(f"Did not converge below {options['tolerance']} mm in {options['max_iterations']} iterations")
 
 
+def _tool_change_and_move(tool, feedrate):
+    """Load a tool and move it to its starting estimate in one script"""
+    lines = []
+    klipper_id = klipper_tool_id(tool)
+    if klipper_id:
+        lines.append(f"LOAD_TOOL TOOL_ID={klipper_id}")
+    fiducial = _tool_fiducial(tool)
+    if fiducial is not None:
+        lines.append("G90")
+        lines.append(f"G1 X{fiducial[0]:.3f} Y{fiducial[1]:.3f} F{feedrate}")
+    lines.append("M400")
+    return run_gcode_script("\n".join(lines))
 
-        </div>
 
+def auto_calibration_worker(tool_ids, options):
+    """Run the closed-loop calibration over the selected tools one by one
 
-<!-- Tool Details Modal - ADD THIS if it's missing -->
-<!-- Tool Details Modal -->
-<!-- Tool Details Modal -->
-<div id="toolModal" class="modal" style="display: none;">
-    <div class="modal-content">
-        <span class="close" onclick="closeToolModal()">&times;</span>
-        <h3 id="modalTitle">Tool Configuration</h3>
+    A tool's result is only known once its last frame is analysed, so the
+    next tool change waits for it rather than docking a tool that may still
+    need another correction.
+    """
+    results = {}
+    try:
+        if not STREAM_ACTIVE and not start_stream():
+            raise RuntimeError("Could not start the camera stream")
         
-        <div class="tool-form">
-            <label>Tool Name:</label>
-            <input type="text" id="toolName" placeholder="e.g., Extruder 1 (E0)">
-            
-            <label>Tool ID:</label>
-            <input type="number" id="toolId" placeholder="1" min="0" max="99">
-            
-            <label>Tool Type:</label>
-            <select id="toolType" onchange="updateFormFields()">
-                <option value="camera">Camera</option>
-                <option value="extruder">Extruder</option>
-                <option value="dispenser">Liquid Dispenser</option>
-                <option value="probe">Probe</option>
-                <option value="other">Other</option>
-            </select>
-            
-            <div class="reference-checkbox-container">
-                <input type="checkbox" id="isReference" onchange="updateFormFields()">
-                <label for="isReference">Set as Reference Tool</label>
-            </div>
-            
-            <!-- Programmed Position Section -->
-            <div id="programmedSection">
-                <h4>Programmed Position (mm)</h4>
-                <div class="coordinate-inputs">
-                    <div class="input-group">
-                        <label>Programmed X</label>
-                        <input type="number" id="programmedX" step="0.001" placeholder="0.000">
-                    </div>
-                    
-                    <div class="input-group">
-                        <label>Programmed Y</label>
-                        <input type="number" id="programmedY" step="0.001" placeholder="0.000">
-                    </div>
-                    
-                    <div class="input-group">
-                        <label>Programmed Z</label>
-                        <input type="number" id="programmedZ" step="0.001" placeholder="0.000">
-                    </div>
-                </div>
-            </div>
+        tools = [tool_registry.get(tool_id) for tool_id in tool_ids if tool_registry.get(tool_id)]
+        # The reference tool goes first so the other offsets have a base
+        tools.sort(key=lambda t: not t.get("isReference", False))
+        
+        for tool in tools:
+            tool_id = tool["id"]
+            try:
+                at_estimate = False
+                if not options["skip_tool_change"]:
+                    _set_auto_calibration(tool_id, state="changing_tool")
+                    _tool_change_and_move(tool, options["feedrate"])
+                    at_estimate = _tool_fiducial(tool) is not None
+                x, y, z = _auto_calibrate_tool(tool, options, at_estimate)
+            except Exception as e:
+                _set_auto_calibration(tool_id, state="failed", message=str(e))
+                logger.error(f"Auto calibration failed for tool {tool_id}: {e}")
+                if auto_calibration_cancel.is_set():
+                    raise
+                continue
             
+            results[tool_id] = (round(x, 3), round(y, 3), round(z, 3))
+            _set_auto_calibration(tool_id, state="converged",
+                                  fiducial={"x": results[tool_id][0], "y": results[tool_id][1],
+                                            "z": results[tool_id][2]})
+        
+        # Write every measured fiducial at once, then report the offsets
+        updated_tools = []
+        for tool in tools_config["tools"]:
+            tool = dict(tool)
+            if tool["id"] in results:
+                tool["fiducialX"], tool["fiducialY"], tool["fiducialZ"] = results[tool["id"]]
+            updated_tools.append(tool)
+        if results:
+            update_tools(updated_tools)
+        for tool_id in results:
+            _set_auto_calibration(tool_id, offsets=calculate_tool_offsets(tool_id))
+        
+        state = "complete" if len(results) == len(tools) else "partial"
+        _set_auto_calibration(state=state, finished=datetime.now().isoformat(),
+                              message=f"Calibrated {len(results)} of {len(tools)} tools")
+    except Exception as e:
+        logger.error(f"Auto calibration aborted: {e}")
+        _set_auto_calibration(state="cancelled" if auto_calibration_cancel.is_set() else "failed",
+                              finished=datetime.now().isoformat(), message=str(e))
+    finally:
+        publish_status()
 
 
+def start_auto_calibration(tool_ids=None, tolerance=None, max_iterations=None,
+                           display_size=None, skip_tool_change=False):
+    """Start the closed-loop calibration in the background, returns False if one is running"""
+    global auto_calibration_thread
+    
+    if auto_calibration_thread and auto_calibration_thread.is_alive():
+        return False
+    
+    if tool_ids is None:
+        tool_ids = [t["id"] for t in tools_config["tools"]
+                    if (t.get("type") == "camera") != AUTO_CALIBRATION_FIXED_CAMERA]
+    check_auto_calibration_tools([tool_registry.get(t) for t in tool_ids if tool_registry.get(t)])
+    options = {
+        "tolerance": float(tolerance or AUTO_CALIBRATION_TOLERANCE_MM),
+        "max_iterations": int(max_iterations or AUTO_CALIBRATION_MAX_ITERATIONS),
+        "feedrate": AUTO_CALIBRATION_FEEDRATE,
+        "settle_time": AUTO_CALIBRATION_SETTLE_TIME,
+        "display_size": display_size,
+        "skip_tool_change": skip_tool_change
+    }
+    
+    auto_calibration_cancel.clear()
+    with auto_calibration_lock:
+        auto_calibration_state.clear()
+        auto_calibration_state.update({
+            "state": "running", "tools": {str(t): {"state": "pending"} for t in tool_ids},
+            "started": datetime.now().isoformat(), "finished": None, "message": ""
+        })
+    
+    auto_calibration_thread = threading.Thread(target=auto_calibration_worker, args=(tool_ids, options))
+    auto_calibration_thread.daemon = True
+    auto_calibration_thread.start()
+    return True
 
 
-<!-- Actual Position Section (hidden for camera and reference tools) -->
-<div id="actualSection">
-    <h4>Actual Position (mm)</h4>
-    <p style="font-size: 12px; color: #666; margin: 5px 0 15px 0;">X and Y positions measured using camera system. Z offset calculated from reference tool.</p>
-    <div class="coordinate-inputs">
-        <div class="input-group">
-            <label>Actual X</label>
-            <input type="number" id="actualX" step="0.001" placeholder="0.000">
-        </div>
-        
-        <div class="input-group">
-            <label>Actual Y</label>
-            <input type="number" id="actualY" step="0.001" placeholder="0.000">
-        </div>
-        
-        <div class="input-group">
-            <label>Z Offset</label>
-            <input type="number" id="zOffset" step="0.001" placeholder="0.000" 
-                   title="Z offset relative to reference tool">
-        </div>
-    </div>
-</div>
+#Tool management functions @app.routes
+#tools configuration
+@app.route('/api/tools/save', methods=['POST'])
+def api_save_tools():
+    """Save tools configuration"""
+    try:
+        data = request.json
+        # An explicit save goes to disk before answering, other updates are debounced
+        if not update_tools(data.get("tools", [])) or not flush_tools_config():
+            return jsonify({"status": "error", "message": "Failed to write tools configuration"})
+        return jsonify({"status": "success", "message": "Tools configuration saved"})
+    except Exception as e:
+        logger.error(f"Error saving tools: {e}")
+        return jsonify({"status": "error", "message": str(e)})
+
+
+@app.route('/api/tools/load', methods=['GET'])
+def api_load_tools():
+    """Load tools configuration, served from memory with the version as ETag"""
+    try:
+        with tools_config_lock:
+            version = tools_config_version
+            etag = f'"tools-{version}"'
+            if etag in [t.strip().lstrip("W/") for t in request.headers.get("If-None-Match", "").split(",")]:
+                return Response(status=304, headers={"ETag": etag, "Cache-Control": "no-cache"})
+            response = jsonify({
+                "status": "success", 
+                "tools": tools_config["tools"],
+                "reference_tool_id": tools_config.get("reference_tool_id"),
+                "version": version
+            })
+        response.headers["ETag"] = etag
+        response.headers["Cache-Control"] = "no-cache"
+        return response
+    except Exception as e:
+        logger.error(f"Error loading tools: {e}")
+        return jsonify({"status": "error", "message": str(e)})
 
 
 
 
+@app.route('/api/tools/offsets', methods=['GET'])
+def api_tool_offsets():
+    """Offsets of every tool relative to the reference tool"""
+    with tools_config_lock:
+        return jsonify({
+            "status": "success",
+            "reference_tool_id": tool_registry.reference_id,
+            "version": tools_config_version,
+            "tools": tool_registry.offset_table()
+        })
+
 
-<!-- Liquid Dispenser Specific Fields -->
-<div id="dispenserSection" style="display: none;">
-    <h4>Dispenser Settings</h4>
-    <div class="coordinate-inputs">
-        <div class="input-group">
-            <label>Linear Actuator</label>
-            <input type="number" id="linearActuator" step="0.1" placeholder="0.0" min="0" max="100">
-        </div>
-    </div>
-</div>
+@app.route('/api/tools/offsets/push', methods=['GET', 'POST'])
+def api_push_tool_offsets():
+    """Push the offset table to Klipper now (POST) or report the last push (GET)"""
+    if request.method == 'GET':
+        return jsonify({"status": "success", "pending": tool_registry.push_pending, **klipper_offset_push_state})
+    try:
+        force = request.args.get('force', '').lower() in ('1', 'true', 'yes')
+        changed = push_tool_offsets(force=force)
+        return jsonify({"status": "success", "variables": changed})
+    except Exception as e:
+        logger.error(f"Error pushing tool offsets: {e}")
+        return jsonify({"status": "error", "message": str(e)})
 
 
+@app.route('/api/tools/auto_calibrate', methods=['POST'])
+def api_tools_auto_calibrate():
+    """Start closed-loop offset calibration for all or selected tools"""
+    try:
+        data = request.get_json(silent=True) or {}
+        display_size = None
+        if "display_width" in data and "display_height" in data:
+            display_size = (float(data["display_width"]), float(data["display_height"]))
+        
+        started = start_auto_calibration(
+            tool_ids=data.get("tools"),
+            tolerance=data.get("tolerance"),
+            max_iterations=data.get("max_iterations"),
+            display_size=display_size,
+            skip_tool_change=bool(data.get("skip_tool_change", False))
+        )
+        if not started:
+            return jsonify({"status": "error", "message": "Calibration already running"})
+        return jsonify({"status": "success", "calibration": get_auto_calibration_state()})
+    except Exception as e:
+        logger.error(f"Error starting auto calibration: {e}")
+        return jsonify({"status": "error", "message": str(e)})
 
 
-            <h4>Calculated Offsets</h4>
-            <div id="offsetDisplay" class="offset-display">
-                <div>X Offset: <span id="calcOffsetX">0.000</span>mm</div>
-                <div>Y Offset: <span id="calcOffsetY">0.000</span>mm</div>
-                <div>Z Offset: <span id="calcOffsetZ">0.000</span>mm</div>
-            </div>
-            
-            <div class="modal-buttons">
-                <button onclick="saveTool()" class="save-btn">Save Tool</button>
-                <button onclick="closeToolModal()" class="cancel-btn">Cancel</button>
-            </div>
-        </div>
-    </div>
-</div>
+@app.route('/api/tools/auto_calibrate/status', methods=['GET'])
+def api_tools_auto_calibrate_status():
+    return jsonify({"status": "success", "calibration": get_auto_calibration_state()})
 
 
+@app.route('/api/tools/auto_calibrate/cancel', methods=['POST'])
+def api_tools_auto_calibrate_cancel():
+    auto_calibration_cancel.set()
+    return jsonify({"status": "success"})
 
 
-<!-- Camera Orientation Modal -->
-<div id="orientationModal" class="modal" style="display: none;">
-    <div class="modal-content">
-        <span class="close" onclick="closeOrientationModal()">&times;</span>
-        <h3>Camera Orientation Settings</h3>
+@app.route('/api/printer/get_position', methods=['GET'])
+def api_get_printer_position():
+    """Get current printer position from the printer state snapshot"""
+    try:
+        if not request_printer_position():
+            return jsonify({"status": "error", "message": "Failed to get position from printer"})
         
-        <div class="orientation-controls">
-            <p style="margin-bottom: 20px; color: #666;">Adjust camera orientation if the image appears flipped or rotated incorrectly.</p>
-            
-            <div class="orientation-buttons">
-                <button onclick="flipImageHorizontal()" class="orientation-btn">Flip Horizontal</button>
-                <button onclick="flipImageVertical()" class="orientation-btn">Flip Vertical</button>
-                <button onclick="resetImageFlip()" class="orientation-btn reset">Reset to Normal</button>
-            </div>
+        position, age_ms = get_cached_printer_position()
+        return jsonify({
+            "status": "success",
+            "x": position["x"],
+            "y": position["y"],
+            "z": position["z"],
+            "age_ms": round(age_ms, 1)
+        })
             
-            <div class="current-state">
-                <p><strong>Current State:</strong></p>
-                <p>Horizontal: <span id="flipStateH">Normal</span></p>
-                <p>Vertical: <span id="flipStateV">Normal</span></p>
-            </div>
-        </div>
-    </div>
-</div>
+    except Exception as e:
+        logger.error(f"Error getting printer position: {e}")
+        return jsonify({"status": "error", "message": str(e)})
+
+
+@app.route('/api/printer/state', methods=['GET'])
+def api_printer_state():
+    """Return the printer state snapshot maintained by the Moonraker subscription"""
+    return jsonify({
+        "status": "success",
+        "live": position_push_live,
+        "summary": get_printer_state_summary(),
+        "objects": get_printer_state()
+    })
+
+
+
 
+StaticAsset = namedtuple("StaticAsset", ["etag", "mimetype", "variants"])
+static_assets = {}
+static_index = None
 
 
+def _build_static_asset(data, mimetype):
+    """Precompress an asset once, variants maps content-encoding -> bytes"""
+    digest = hashlib.sha256(data).hexdigest()[:16]
+    variants = {"identity": data, "gzip": gzip.compress(data, 9, mtime=0)}
+    if brotli:
+        variants["br"] = brotli.compress(data, quality=11)
+    return StaticAsset(digest, mimetype, variants)
 
 
-   </body>
-    </html>
+def load_static_assets():
+    """Hash and precompress the UI assets, rewriting index.html to the hashed names
+
+    Runs once at startup, so page loads do no templating or compression.
     """
-    return html
+    global static_assets, static_index
+    
+    assets = {}
+    with open(os.path.join(STATIC_DIR, "index.html"), "rb") as f:
+        index_html = f.read()
+    
+    for name in STATIC_ASSETS:
+        with open(os.path.join(STATIC_DIR, name), "rb") as f:
+            data = f.read()
+        base, ext = os.path.splitext(name)
+        asset = _build_static_asset(data, STATIC_MIMETYPES[ext])
+        hashed_name = f"{base}.{asset.etag}{ext}"
+        assets[hashed_name] = asset
+        index_html = index_html.replace(f"/static/{name}".encode(), f"/static/{hashed_name}".encode())
+    
+    static_assets = assets
+    static_index = _build_static_asset(index_html, STATIC_MIMETYPES[".html"])
+    logger.info(f"Loaded UI assets: {', '.join(sorted(assets))} (brotli {'on' if brotli else 'off'})")
+
+
+def _accepted_encodings():
+    accepted = set()
+    for part in request.headers.get("Accept-Encoding", "").split(","):
+        fields = part.strip().split(";")
+        coding = fields[0].strip().lower()
+        if any(f.strip().replace(" ", "") in ("q=0", "q=0.0", "q=0.00", "q=0.000") for f in fields[1:]):
+            continue
+        if coding:
+            accepted.add(coding)
+    return accepted
+
+
+def serve_static_asset(asset, cache_control):
+    """Respond with the best precompressed variant, or 304 when the ETag matches"""
+    accepted = _accepted_encodings()
+    encoding = "identity"
+    for candidate in ("br", "gzip"):
+        if candidate in asset.variants and (candidate in accepted or "*" in accepted):
+            encoding = candidate
+            break
+    
+    # Each encoding is a different representation, so it gets its own strong ETag
+    etag = asset.etag if encoding == "identity" else f"{asset.etag}-{encoding}"
+    headers = {"ETag": f'"{etag}"', "Cache-Control": cache_control, "Vary": "Accept-Encoding"}
+    
+    if_none_match = request.headers.get("If-None-Match", "")
+    if if_none_match.strip() == "*" or f'"{etag}"' in [t.strip().lstrip("W/") for t in if_none_match.split(",")]:
+        return Response(status=304, headers=headers)
+    
+    if encoding != "identity":
+        headers["Content-Encoding"] = encoding
+    return Response(asset.variants[encoding], content_type=asset.mimetype, headers=headers)
+
+
+# Enhanced Flask routes with calibration functionality
+@app.route('/')
+def index():
+    """Enhanced camera control interface with calibration tools"""
+    # Always revalidated, so a new deploy's hashed asset names are picked up
+    return serve_static_asset(static_index, "no-cache")
+
+
+@app.route('/static/<name>')
+def static_asset(name):
+    """Content-hashed UI assets, immutable for their cache lifetime"""
+    asset = static_assets.get(name)
+    if asset is None:
+        return jsonify({"status": "error", "message": "Not found"}), 404
+    return serve_static_asset(asset, f"public, max-age={STATIC_MAX_AGE}, immutable")
 
 
 
@@ -3920,18 +4648,21 @@ def api_printer_position():
     try:
         logger.debug("Getting printer position for calibration...")
         
-        # Try to get fresh position
-        success = request_printer_position()
+        max_age_ms = request.args.get('max_age_ms', POSITION_MAX_AGE_MS, type=float)
         
-        with position_lock:
-            position = current_printer_position.copy()
+        # Only goes to Klipper if the cached position is older than the budget
+        success = request_printer_position(max_age_ms)
         
-        logger.info(f"Returning position: {position}")
+        position, age_ms = get_cached_printer_position()
+        age_ms = round(age_ms, 1) if age_ms != float("inf") else None
+        
+        logger.debug(f"Returning position: {position} (age {age_ms} ms)")
         
         if success:
             return jsonify({
                 "status": "success",
                 "position": position,
+                "age_ms": age_ms,
                 "message": "Position retrieved successfully"
             })
         else:
@@ -3939,6 +4670,7 @@ def api_printer_position():
             return jsonify({
                 "status": "timeout", 
                 "position": position,
+                "age_ms": age_ms,
                 "message": "Using last known position (API timeout)"
             })
             
@@ -3952,8 +4684,6 @@ def api_printer_position():
         })
 
 
-# Add this route to your camera_flask_mqtt.py file
-
 @app.route('/api/calibration/add_point', methods=['POST'])
 def api_calibration_add_point():
     """Add a reference point for calibration"""
@@ -3961,17 +4691,26 @@ def api_calibration_add_point():
         data = request.json
         logger.info(f"Adding calibration point: {data}")
         
+        # Camera position the point was taken at, lets the model fit offsets
+        # relative to the camera instead of absolute coordinates
+        if "camera_x" in data and "camera_y" in data:
+            camera_pos = {"x": float(data["camera_x"]), "y": float(data["camera_y"])}
+        else:
+            camera_pos = get_cached_printer_position()[0]
+        
         point = {
             "pixel_x": int(data["pixel_x"]),
             "pixel_y": int(data["pixel_y"]),
             "printer_x": float(data["printer_x"]),
             "printer_y": float(data["printer_y"]),
             "printer_z": float(data["printer_z"]),
+            "camera_x": camera_pos["x"],
+            "camera_y": camera_pos["y"],
             "timestamp": datetime.now().isoformat()
         }
         
-        calibration_data["reference_points"].append(point)
-        save_calibration_data()
+        if not add_calibration_history("reference_point", point):
+            return jsonify({"status": "error", "message": "Failed to save calibration point"})
         
         logger.info(f"Added calibration point: {point}")
         
@@ -4010,8 +4749,10 @@ def api_calibration_disable():
 @app.route('/api/calibration/clear', methods=['POST'])
 def api_calibration_clear():
     """Clear all calibration data"""
-    calibration_data["reference_points"] = []
+    with calibration_history_lock:
+        calibration_data["reference_points"] = []
     calibration_data["enabled"] = False
+    compact_calibration_history()
     save_calibration_data()
     return jsonify({"status": "success"})
 
@@ -4026,38 +4767,154 @@ def api_calibration_data():
     })
 
 
+def _conversion_camera_position(params):
+    """Camera position to convert pixels against
+
+    An explicit camera_x/camera_y wins, then the position at exposure time of
+    a buffered stream frame (frame_seq) or saved capture (capture), then the
+    current position.
+    """
+    if "camera_x" in params and "camera_y" in params:
+        return {"x": float(params["camera_x"]), "y": float(params["camera_y"])}
+    if "frame_seq" in params:
+        frame = stream_frames.get(int(params["frame_seq"]))
+        if frame is None:
+            raise ValueError("Frame no longer buffered")
+        return get_position_at(frame.timestamp)
+    if "capture" in params:
+        metadata = load_capture_metadata(params["capture"])
+        if metadata and metadata["position"]:
+            return metadata["position"]
+    return get_cached_printer_position()[0]
+
+
+def decode_float32_pairs(payload):
+    """Decode little-endian float32 x, y pairs into an (N, 2) array"""
+    if len(payload) % 8:
+        raise ValueError("Binary payload must contain float32 x, y pairs")
+    return np.frombuffer(payload, dtype='<f4').reshape(-1, 2)
+
+
 @app.route('/api/calibration/convert', methods=['POST'])
 def api_calibration_convert():
-    """Convert pixel coordinates to printer coordinates"""
+    """Convert pixel coordinates to printer coordinates
+
+    Accepts a single pixel_x/pixel_y pair, arrays as JSON ("pixels": [[x, y],
+    ...] or list-valued pixel_x/pixel_y), or a body of little-endian float32
+    x, y pairs with Content-Type application/octet-stream. Binary requests
+    take their options from the query string and get the printer coordinates
+    back in the same binary layout.
+    """
     try:
-        data = request.json
-        pixel_x = int(data["pixel_x"])
-        pixel_y = int(data["pixel_y"])
+        if request.mimetype == 'application/octet-stream':
+            if np is None:
+                return jsonify({"status": "error", "message": "Binary conversion requires NumPy"})
+            params = request.args
+            pixels = decode_float32_pairs(request.get_data())
+            binary = True
+        else:
+            params = request.json
+            binary = False
+            if "pixels" in params:
+                pixels = params["pixels"]
+            elif isinstance(params.get("pixel_x"), list):
+                pixels = list(zip(params["pixel_x"], params["pixel_y"]))
+            else:
+                pixels = None
         
-        with position_lock:
-            current_pos = current_printer_position.copy()
+        # Use the position at exposure time when the pixels came from a
+        # specific stream frame or saved capture
+        current_pos = _conversion_camera_position(params)
         
-        result = pixel_to_printer_coordinates(
-            pixel_x, pixel_y,
-            current_pos["x"],
-            current_pos["y"]
-        )
+        if pixels is None:
+            result = pixel_to_printer_coordinates(
+                int(params["pixel_x"]), int(params["pixel_y"]),
+                current_pos["x"],
+                current_pos["y"]
+            )
+            if result:
+                result["camera_position"] = current_pos
+                return jsonify({"status": "success", "conversion": result})
+            return jsonify({"status": "error", "message": "Calibration not available"})
         
-        if result:
-            return jsonify({"status": "success", "conversion": result})
-        else:
+        points = pixel_to_printer_batch(pixels, current_pos["x"], current_pos["y"], as_array=binary)
+        if points is None:
             return jsonify({"status": "error", "message": "Calibration not available"})
+        
+        model_kind = calibration_model.kind if calibration_model.fitted else "legacy"
+        if binary:
+            return Response(np.asarray(points, dtype='<f4').tobytes(),
+                            mimetype='application/octet-stream',
+                            headers={'X-Camera-Position': json.dumps(current_pos),
+                                     'X-Calibration-Model': model_kind})
+        
+        return jsonify({
+            "status": "success",
+            "points": points,
+            "camera_position": current_pos,
+            "model": model_kind
+        })
             
     except Exception as e:
         return jsonify({"status": "error", "message": str(e)})
 
 
 
-# Add this route to your camera_flask_mqtt.py file - it's the missing piece!
+@app.route('/api/calibration/model')
+def api_calibration_model():
+    """Fitted calibration model with per-point residuals"""
+    model = get_calibration_model()
+    if model is None:
+        return jsonify({
+            "status": "success",
+            "model": {"kind": "legacy", "residuals": []},
+            "message": "Fewer than 3 usable reference points or NumPy unavailable, using legacy conversion"
+        })
+    
+    model_info = model.to_dict()
+    points = calibration_data["reference_points"]
+    for residual in model_info["residuals"]:
+        if residual["index"] < len(points):
+            residual["timestamp"] = points[residual["index"]].get("timestamp")
+    return jsonify({"status": "success", "model": model_info})
+
+
+@app.route('/api/calibration/convert_batch', methods=['POST'])
+def api_calibration_convert_batch():
+    """Alias of /api/calibration/convert for batch requests"""
+    return api_calibration_convert()
+
+
+
+@app.route('/api/fiducial/detect', methods=['GET', 'POST'])
+def api_fiducial_detect():
+    """Detect the fiducial in the newest stream frame
+
+    Optional parameters: roi as [x, y, width, height] in frame pixels, radius
+    in frame pixels, polarity "dark" or "light", and display_width /
+    display_height when the calibration was clicked on a scaled image.
+    """
+    try:
+        params = request.get_json(silent=True) or {}
+        for key in ("radius", "polarity", "display_width", "display_height"):
+            if key in request.args:
+                params[key] = request.args[key]
+        
+        radius = float(params["radius"]) if "radius" in params else None
+        display_size = None
+        if "display_width" in params and "display_height" in params:
+            display_size = (float(params["display_width"]), float(params["display_height"]))
+        
+        result = detect_fiducial_in_stream(params.get("roi"), radius, params.get("polarity"), display_size)
+        return jsonify({"status": "success", "detection": result})
+    except Exception as e:
+        logger.error(f"Fiducial detection failed: {e}")
+        return jsonify({"status": "error", "message": str(e)})
+
 
 @app.route('/api/scaler/calculate', methods=['POST'])
 def api_scaler_calculate():
-    """Calculate microns per pixel from line measurement - THE MISSING ENDPOINT!"""
+    """Calculate microns per pixel from line measurement"""
     try:
         data = request.json
         logger.info(f"Scaler calculate request: {data}")
@@ -4087,10 +4944,9 @@ def api_scaler_calculate():
             "microns_per_pixel_y": microns_per_pixel_y,
             "timestamp": datetime.now().isoformat()
         }
-        calibration_data["scaler_measurements"].append(measurement)
         
-        # Save calibration data
-        if save_calibration_data():
+        # Append to the history and save the new scale
+        if add_calibration_history("scaler_measurement", measurement) and save_calibration_data():
             logger.info(f"Pixel scale calibrated and saved: X={microns_per_pixel_x:.2f} Y={microns_per_pixel_y:.2f} μm/pixel")
             publish_status()
             return jsonify({
@@ -4111,56 +4967,58 @@ def api_scaler_calculate():
 
 
 # Keep all existing routes
+BLANK_GIF = b'GIF89a\x01\x00\x01\x00\x80\x00\x00\xff\xff\xff\x00\x00\x00!\xf9\x04\x01\x00\x00\x00\x00,\x00\x00\x00\x00\x01\x00\x01\x00\x00\x02\x02D\x01\x00;'
+STREAM_MIMETYPE = 'multipart/x-mixed-replace; boundary=frame'
+STREAM_HEADERS = {
+    'Cache-Control': 'no-cache, no-store, must-revalidate',
+    'Pragma': 'no-cache',
+    'Expires': '0',
+    'Connection': 'close',
+    'X-Accel-Buffering': 'no'
+}
+
 @app.route('/stream')
 def stream():
     """Safari-compatible MJPEG stream endpoint"""
-    global STREAM_ACTIVE, current_frame, frame_count
+    global STREAM_ACTIVE
     
     if not STREAM_ACTIVE:
-        blank_gif = b'GIF89a\x01\x00\x01\x00\x80\x00\x00\xff\xff\xff\x00\x00\x00!\xf9\x04\x01\x00\x00\x00\x00,\x00\x00\x00\x00\x01\x00\x01\x00\x00\x02\x02D\x01\x00;'
-        return Response(blank_gif, mimetype='image/gif')
+        return Response(BLANK_GIF, mimetype='image/gif')
+    
+    viewer = StreamViewer(request.args.get('quality', 'auto'))
     
     def generate_frames():
-        global STREAM_ACTIVE, current_frame, frame_count
-        last_frame_count = 0
+        # Acquired on the first iteration, the finally below then always runs
+        tier = viewer.open()
+        last_seq = 0
         
-        if not STREAM_ACTIVE:
-            return
-        
-        attempts = 0
-        while current_frame is None and STREAM_ACTIVE and attempts < 20:
-            time.sleep(0.1)
-            attempts += 1
-        
-        while STREAM_ACTIVE:
-            with frame_lock:
-                frame = current_frame
-                current_count = frame_count
-            
-            if frame and current_count > last_frame_count:
-                yield (b'--frame\r\n'
-                       b'Content-Type: image/jpeg\r\n'
-                       b'Content-Length: ' + str(len(frame)).encode() + b'\r\n'
-                       b'Cache-Control: no-cache, no-store, must-revalidate\r\n'
-                       b'Pragma: no-cache\r\n'
-                       b'Expires: 0\r\n'
-                       b'\r\n' + frame + b'\r\n')
+        try:
+            while STREAM_ACTIVE:
+                frame = tier.frames.wait_for_frame(last_seq, timeout=1.0)
+                if frame is None:
+                    continue
                 
-                last_frame_count = current_count
-                time.sleep(1/12)
-            else:
-                time.sleep(0.05)
+                # Header and JPEG are yielded separately so the shared frame
+                # buffer is handed to the socket without a per-client copy.
+                # The server writes each chunk before resuming the generator,
+                # so the time across the yields is the send time.
+                last_seq = frame.seq
+                send_started = time.monotonic()
+                yield frame.part_header
+                yield frame.data.obj
+                send_seconds = time.monotonic() - send_started
+                yield b'\r\n'
+                
+                next_tier = viewer.record(len(frame.data), send_seconds)
+                if next_tier is not tier:
+                    tier, last_seq = next_tier, 0
+        finally:
+            viewer.close()
     
     response = Response(
         generate_frames(),
-        mimetype='multipart/x-mixed-replace; boundary=frame',
-        headers={
-            'Cache-Control': 'no-cache, no-store, must-revalidate',
-            'Pragma': 'no-cache',
-            'Expires': '0',
-            'Connection': 'close',
-            'X-Accel-Buffering': 'no'
-        }
+        mimetype=STREAM_MIMETYPE,
+        headers=STREAM_HEADERS
     )
     return response
 
@@ -4168,20 +5026,119 @@ def stream():
 def latest_photo():
     """Serve the most recently captured photo"""
     try:
-        photos = [os.path.join(CAPTURE_DIR, f) for f in os.listdir(CAPTURE_DIR) 
-                 if f.startswith("capture_") and f.endswith(".jpg")]
-        
-        if not photos:
+        latest = get_capture_store().latest()
+        if not latest:
             return "No photos available", 404
         
-        photos.sort(key=lambda x: os.path.getmtime(x), reverse=True)
-        latest = photos[0]
-        
-        return send_file(latest, mimetype='image/jpeg')
+        return send_file(os.path.join(CAPTURE_DIR, latest["filename"]), mimetype=capture_mimetype(latest["filename"]))
     except Exception as e:
         logger.error(f"Error serving latest photo: {e}")
         return "Error retrieving photo", 500
 
+@app.route('/api/captures')
+def api_captures():
+    """List indexed captures, newest first, optionally within a time range
+
+    start/end are epoch seconds or ISO timestamps.
+    """
+    def parse_time(value):
+        if value is None:
+            return None
+        try:
+            return float(value)
+        except ValueError:
+            return datetime.fromisoformat(value).timestamp()
+    
+    try:
+        captures = get_capture_store().query(
+            start=parse_time(request.args.get('start')),
+            end=parse_time(request.args.get('end')),
+            limit=min(int(request.args.get('limit', 100)), 1000),
+            tool=request.args.get('tool'),
+            series=request.args.get('series'),
+            newest_first=request.args.get('order', 'desc') != 'asc'
+        )
+        return jsonify({"status": "success", "captures": captures})
+    except ValueError as e:
+        return jsonify({"status": "error", "message": str(e)}), 400
+
+@app.route('/api/captures/<capture_id>')
+def api_capture_info(capture_id):
+    """Metadata for one capture, by id or filename"""
+    capture = load_capture_metadata(capture_id)
+    if capture is None:
+        return jsonify({"status": "error", "message": "Capture not found"}), 404
+    return jsonify({"status": "success", "capture": capture})
+
+@app.route('/api/captures/<capture_id>/image')
+def api_capture_image(capture_id):
+    capture = load_capture_metadata(capture_id)
+    if capture is None:
+        return jsonify({"status": "error", "message": "Capture not found"}), 404
+    return send_file(os.path.join(CAPTURE_DIR, capture["filename"]), mimetype=capture_mimetype(capture["filename"]),
+                     max_age=STATIC_MAX_AGE)
+
+@app.route('/api/captures/<capture_id>/thumb', defaults={'tier': 'thumb'})
+@app.route('/api/captures/<capture_id>/preview', defaults={'tier': 'preview'})
+def api_capture_thumbnail(capture_id, tier):
+    """Downscaled capture, captures never change so these cache for long"""
+    capture = load_capture_metadata(capture_id)
+    if capture is None:
+        return jsonify({"status": "error", "message": "Capture not found"}), 404
+    
+    path = get_thumbnail(capture["filename"], tier)
+    if path is None:
+        return jsonify({"status": "error", "message": "Thumbnail not available"}), 503
+    return send_file(path, mimetype='image/jpeg', max_age=STATIC_MAX_AGE)
+
+@app.route('/api/captures/<capture_id>', methods=['DELETE'])
+def api_capture_delete(capture_id):
+    capture = load_capture_metadata(capture_id)
+    if capture is None:
+        return jsonify({"status": "error", "message": "Capture not found"}), 404
+    delete_capture(capture["filename"])
+    return jsonify({"status": "success"})
+
+@app.route('/api/captures/retention', methods=['GET', 'POST'])
+def api_capture_retention():
+    """Retention quotas and usage, POST runs a retention pass now"""
+    if request.method == 'POST':
+        deleted = retention_manager.enforce()
+        return jsonify({"status": "success", "deleted": deleted, "retention": retention_manager.status()})
+    return jsonify({"status": "success", "retention": retention_manager.status()})
+
+@app.route('/api/stream/frame')
+def api_stream_frame():
+    """Latest stream frame tagged with the printer position at exposure time"""
+    frame = stream_frames.latest()
+    if frame is None:
+        return jsonify({"status": "error", "message": "No frame available"}), 404
+    
+    position = get_position_at(frame.timestamp)
+    return Response(frame.data.obj, mimetype='image/jpeg', headers={
+        'X-Frame-Seq': str(frame.seq),
+        'X-Printer-Position': json.dumps(position),
+        'Cache-Control': 'no-cache, no-store, must-revalidate'
+    })
+
+@app.route('/api/stream/luma')
+def api_stream_luma():
+    """Newest luma plane as raw 8-bit grayscale, size in X-Frame-Width/Height"""
+    if np is None:
+        return jsonify({"status": "error", "message": "NumPy is not installed"}), 503
+    frame = latest_luma_frame()
+    if frame is None:
+        return jsonify({"status": "error", "message": "No frame available"}), 404
+    
+    height, width = frame.array.shape
+    return Response(frame.array.tobytes(), mimetype='application/octet-stream', headers={
+        'X-Frame-Width': str(width),
+        'X-Frame-Height': str(height),
+        'X-Luma-Seq': str(frame.seq),
+        'X-Printer-Position': json.dumps(get_position_at(frame.timestamp)),
+        'Cache-Control': 'no-cache, no-store, must-revalidate'
+    })
+
 @app.route('/api/stream/start')
 def api_stream_start():
     result = start_stream()
@@ -4192,10 +5149,126 @@ def api_stream_stop():
     result = stop_stream()
     return jsonify({"status": "success", "streaming": STREAM_ACTIVE})
 
-@app.route('/api/capture')
+def request_wait_seconds():
+    """?wait=<seconds> clamped to 0..CAPTURE_MAX_WAIT, None when not given
+    
+    Raises ValueError for a value that is not a number.
+    """
+    raw = request.args.get('wait')
+    if raw is None or raw == '':
+        return None
+    wait = request.args.get('wait', type=float)
+    if wait is None or wait != wait:
+        raise ValueError(f"Invalid wait value {raw!r}, expected seconds")
+    return min(max(wait, 0.0), CAPTURE_MAX_WAIT)
+
+
+def acquire_wait_slot(wait):
+    """Reserve a ?wait slot when the request waits, False when all are taken"""
+    return not wait or capture_wait_slots.acquire(blocking=False)
+
+
+def release_wait_slot(wait):
+    if wait:
+        capture_wait_slots.release()
+
+
+def wait_slots_busy_response():
+    return jsonify({"status": "error", "message": f"{CAPTURE_MAX_WAITERS} requests are already waiting, "
+                                                  f"retry without ?wait and poll the job"}), 503
+
+
+@app.route('/api/capture', methods=['GET', 'POST'])
 def api_capture():
-    result = capture_image()
-    return jsonify({"status": "success" if result else "error", "result": result})
+    """Queue a still capture and return its job id straight away
+
+    With ?wait=<seconds> (at most CAPTURE_MAX_WAIT) the response is held
+    until the job finishes or the wait runs out.
+    """
+    try:
+        wait = request_wait_seconds()
+    except ValueError as e:
+        return jsonify({"status": "error", "message": str(e)}), 400
+    if not acquire_wait_slot(wait):
+        return wait_slots_busy_response()
+    try:
+        job = submit_capture(tag=request.args.get('tag'), profile=request.args.get('profile'))
+        if wait:
+            job = capture_jobs.wait(job["id"], timeout=wait)
+    except ValueError as e:
+        return jsonify({"status": "error", "message": str(e)}), 400
+    finally:
+        release_wait_slot(wait)
+    return jsonify({"status": "error" if job["state"] == "failed" else "success", "job": job})
+
+@app.route('/api/capture/profiles', methods=['GET'])
+def api_capture_profiles():
+    return jsonify({"status": "success", "profiles": CAPTURE_PROFILES,
+                    "capture_profile": CAPTURE_PROFILE, "stream_profile": STREAM_PROFILE})
+
+@app.route('/api/capture/profiles/<name>', methods=['POST'])
+def api_capture_profile_save(name):
+    """Create or replace a capture profile"""
+    try:
+        profile = save_capture_profile(name, request.get_json(silent=True) or {})
+    except (TypeError, ValueError) as e:
+        return jsonify({"status": "error", "message": str(e)}), 400
+    return jsonify({"status": "success", "profile": profile})
+
+@app.route('/api/capture/burst', methods=['POST'])
+def api_capture_burst():
+    """Queue a burst of stream frames: {"count": 10, "interval": 0.2, "series": "..."}"""
+    data = request.get_json(silent=True) or {}
+    try:
+        job = submit_burst(data.get("count", 5), float(data.get("interval", 0.0)),
+                           data.get("series"), tag=data.get("tag"))
+    except (TypeError, ValueError) as e:
+        return jsonify({"status": "error", "message": str(e)}), 400
+    return jsonify({"status": "success", "job": job})
+
+@app.route('/api/timelapse', methods=['GET'])
+def api_timelapse_status():
+    return jsonify({"status": "success", "timelapse": timelapse.status()})
+
+@app.route('/api/timelapse/start', methods=['POST'])
+def api_timelapse_start():
+    """Start a timelapse: {"mode": "layer"|"event", "series": "...", "every_n_layers": 1}"""
+    data = request.get_json(silent=True) or {}
+    try:
+        status = timelapse.start(data.get("mode", "layer"), data.get("series"),
+                                 data.get("every_n_layers", TIMELAPSE_LAYER_INTERVAL))
+    except Exception as e:
+        return jsonify({"status": "error", "message": str(e)}), 400
+    return jsonify({"status": "success", "timelapse": status})
+
+@app.route('/api/timelapse/stop', methods=['POST'])
+def api_timelapse_stop():
+    return jsonify({"status": "success", "timelapse": timelapse.stop()})
+
+@app.route('/api/timelapse/frame', methods=['POST'])
+def api_timelapse_frame():
+    data = request.get_json(silent=True) or {}
+    job = timelapse.take_frame(layer=data.get("layer"), tag=data.get("tag"))
+    if job is None:
+        return jsonify({"status": "error", "message": "No timelapse running"}), 409
+    return jsonify({"status": "success", "job": job})
+
+@app.route('/api/capture/<job_id>')
+def api_capture_job(job_id):
+    """State of a capture job, ?wait=<seconds> long-polls until it finishes"""
+    try:
+        wait = request_wait_seconds()
+    except ValueError as e:
+        return jsonify({"status": "error", "message": str(e)}), 400
+    if not acquire_wait_slot(wait):
+        return wait_slots_busy_response()
+    try:
+        job = capture_jobs.wait(job_id, timeout=wait) if wait else capture_jobs.get(job_id)
+    finally:
+        release_wait_slot(wait)
+    if job is None:
+        return jsonify({"status": "error", "message": "Unknown job"}), 404
+    return jsonify({"status": "success", "job": job})
 
 @app.route('/api/focus/auto')
 def api_focus_auto():
@@ -4211,6 +5284,39 @@ def api_focus_manual(position):
     except ValueError:
         return jsonify({"status": "error", "message": "Invalid position value"})
 
+@app.route('/api/focus/cache', methods=['GET', 'DELETE'])
+def api_focus_cache():
+    """Cached lens positions, DELETE clears everything or ?tool=<id>"""
+    if request.method == 'DELETE':
+        removed = focus_cache.invalidate(tool=request.args.get('tool'))
+        return jsonify({"status": "success", "removed": removed})
+    return jsonify({"status": "success", "cache": focus_cache.to_dict()})
+
+@app.route('/api/focus/sweep', methods=['POST'])
+def api_focus_sweep():
+    """Queue an autofocus sweep: {"start": 0, "stop": 30, "steps": 11, "roi": [x, y, w, h], "stack": false}
+
+    ?wait=<seconds> holds the response until the sweep finishes.
+    """
+    data = request.get_json(silent=True) or {}
+    try:
+        wait = request_wait_seconds()
+    except ValueError as e:
+        return jsonify({"status": "error", "message": str(e)}), 400
+    if not acquire_wait_slot(wait):
+        return wait_slots_busy_response()
+    try:
+        job = submit_focus_sweep(tag=data.get("tag"), start=data.get("start"), stop=data.get("stop"),
+                                 steps=data.get("steps"), roi=data.get("roi"),
+                                 refine=bool(data.get("refine", True)), stack=bool(data.get("stack", False)))
+        if wait:
+            job = capture_jobs.wait(job["id"], timeout=wait)
+    except (TypeError, ValueError) as e:
+        return jsonify({"status": "error", "message": str(e)}), 400
+    finally:
+        release_wait_slot(wait)
+    return jsonify({"status": "error" if job["state"] == "failed" else "success", "job": job})
+
 @app.route('/api/status')
 def api_status():
     """API endpoint to get camera status with calibration info"""
@@ -4237,11 +5343,187 @@ def api_status():
         "capture_width": CAPTURE_WIDTH,
         "capture_height": CAPTURE_HEIGHT,
         "stream_quality": STREAM_QUALITY,
+        "stream_tiers": get_stream_tier_summary(),
         "frame_count": frame_count,
         "calibration": calibration_data,
-        "printer_position": current_pos
+        "printer_position": current_pos,
+        "printer_state": get_printer_state_summary(),
+        "last_capture": last_capture_info
     })
 
+# ASGI serving mode
+# The MJPEG stream is served natively as an async generator fed by the frame
+# ring buffer, every other route runs the unchanged Flask app on a small
+# bounded thread pool. Idle viewers cost one coroutine instead of one thread.
+asgi_executor = None
+
+
+def _asgi_environ(scope, body):
+    """Build a WSGI environ for the Flask app from an ASGI HTTP scope"""
+    server = scope.get("server") or ("localhost", HTTP_PORT)
+    environ = {
+        "REQUEST_METHOD": scope["method"],
+        "SCRIPT_NAME": scope.get("root_path", "").encode("utf8").decode("latin1"),
+        "PATH_INFO": scope["path"].encode("utf8").decode("latin1"),
+        "QUERY_STRING": scope.get("query_string", b"").decode("latin1"),
+        "SERVER_NAME": server[0],
+        "SERVER_PORT": str(server[1]),
+        "SERVER_PROTOCOL": f"HTTP/{scope.get('http_version', '1.1')}",
+        "wsgi.version": (1, 0),
+        "wsgi.url_scheme": scope.get("scheme", "http"),
+        "wsgi.input": io.BytesIO(body),
+        "wsgi.errors": sys.stderr,
+        "wsgi.multithread": True,
+        "wsgi.multiprocess": False,
+        "wsgi.run_once": False,
+    }
+    if scope.get("client"):
+        environ["REMOTE_ADDR"] = scope["client"][0]
+
+    for name, value in scope.get("headers", []):
+        name = name.decode("latin1")
+        value = value.decode("latin1")
+        if name == "content-type":
+            key = "CONTENT_TYPE"
+        elif name == "content-length":
+            key = "CONTENT_LENGTH"
+        else:
+            key = "HTTP_" + name.upper().replace("-", "_")
+        if key in environ:
+            value = environ[key] + "," + value
+        environ[key] = value
+    return environ
+
+
+def _run_wsgi_request(environ):
+    """Run one request through the Flask app and collect the full response"""
+    response = {}
+    chunks = []
+
+    def start_response(status, headers, exc_info=None):
+        response["status"] = int(status.split(" ", 1)[0])
+        response["headers"] = [(k.lower().encode("latin1"), v.encode("latin1")) for k, v in headers]
+        return chunks.append
+
+    result = app(environ, start_response)
+    try:
+        for chunk in result:
+            chunks.append(chunk)
+    finally:
+        if hasattr(result, "close"):
+            result.close()
+    return response["status"], response["headers"], b"".join(chunks)
+
+
+async def _asgi_stream(scope, receive, send):
+    """Async MJPEG stream, one coroutine per viewer"""
+    if not STREAM_ACTIVE:
+        await send({"type": "http.response.start", "status": 200,
+                    "headers": [(b"content-type", b"image/gif")]})
+        await send({"type": "http.response.body", "body": BLANK_GIF})
+        return
+
+    headers = [(b"content-type", STREAM_MIMETYPE.encode())]
+    headers.extend((k.lower().encode(), v.encode()) for k, v in STREAM_HEADERS.items())
+    await send({"type": "http.response.start", "status": 200, "headers": headers})
+
+    disconnected = asyncio.Event()
+
+    async def watch_disconnect():
+        while True:
+            message = await receive()
+            if message["type"] == "http.disconnect":
+                disconnected.set()
+                return
+
+    query = dict(part.split("=", 1) for part in scope.get("query_string", b"").decode().split("&") if "=" in part)
+    viewer = StreamViewer(query.get("quality", "auto"))
+    watcher = asyncio.ensure_future(watch_disconnect())
+    tier = viewer.open()
+    try:
+        last_seq = 0
+        while STREAM_ACTIVE and not disconnected.is_set():
+            frame = await tier.frames.wait_for_frame_async(last_seq, timeout=1.0)
+            if frame is None:
+                continue
+            last_seq = frame.seq
+            # send() waits for the transport to drain, which measures the viewer
+            send_started = time.monotonic()
+            await send({"type": "http.response.body", "body": frame.part_header, "more_body": True})
+            await send({"type": "http.response.body", "body": frame.data.obj, "more_body": True})
+            await send({"type": "http.response.body", "body": b"\r\n", "more_body": True})
+            
+            next_tier = viewer.record(len(frame.data), time.monotonic() - send_started)
+            if next_tier is not tier:
+                tier, last_seq = next_tier, 0
+        if not disconnected.is_set():
+            await send({"type": "http.response.body", "body": b""})
+    finally:
+        watcher.cancel()
+        viewer.close()
+
+
+async def _asgi_wsgi_bridge(scope, receive, send):
+    """Run a Flask route on the bounded executor"""
+    body = bytearray()
+    while True:
+        message = await receive()
+        if message["type"] == "http.disconnect":
+            return
+        body.extend(message.get("body", b""))
+        if not message.get("more_body", False):
+            break
+
+    environ = _asgi_environ(scope, bytes(body))
+    loop = asyncio.get_running_loop()
+    status, headers, content = await loop.run_in_executor(asgi_executor, _run_wsgi_request, environ)
+    await send({"type": "http.response.start", "status": status, "headers": headers})
+    await send({"type": "http.response.body", "body": content})
+
+
+async def asgi_app(scope, receive, send):
+    """ASGI entry point exposing the camera web app"""
+    global asgi_executor
+
+    if scope["type"] == "lifespan":
+        while True:
+            message = await receive()
+            if message["type"] == "lifespan.startup":
+                if asgi_executor is None:
+                    asgi_executor = ThreadPoolExecutor(max_workers=ASGI_EXECUTOR_WORKERS + CAPTURE_MAX_WAITERS,
+                                                       thread_name_prefix="asgi-worker")
+                await send({"type": "lifespan.startup.complete"})
+            elif message["type"] == "lifespan.shutdown":
+                if asgi_executor is not None:
+                    asgi_executor.shutdown(wait=False)
+                    asgi_executor = None
+                await send({"type": "lifespan.shutdown.complete"})
+                return
+
+    if scope["type"] != "http":
+        return
+
+    if asgi_executor is None:
+        asgi_executor = ThreadPoolExecutor(max_workers=ASGI_EXECUTOR_WORKERS + CAPTURE_MAX_WAITERS,
+                                           thread_name_prefix="asgi-worker")
+
+    if scope["path"] == "/stream":
+        await _asgi_stream(scope, receive, send)
+    else:
+        await _asgi_wsgi_bridge(scope, receive, send)
+
+
+def run_asgi_server():
+    """Serve the app with uvicorn, returns False if uvicorn is unavailable"""
+    if uvicorn is None:
+        logger.error("SERVER_MODE is 'asgi' but uvicorn is not installed, using threaded Flask server")
+        return False
+
+    logger.info(f"Starting ASGI server on port {HTTP_PORT} with "
+                f"{ASGI_EXECUTOR_WORKERS + CAPTURE_MAX_WAITERS} worker threads")
+    uvicorn.run(asgi_app, host='0.0.0.0', port=HTTP_PORT, log_level="info")
+    return True
+
 # Initialize tools configuration on startup
 load_tools_config()
 
@@ -4253,12 +5535,31 @@ if __name__ == '__main__':
         calibration_data["enabled"] = True
         save_calibration_data()  # Save it back with enabled=True
         
+        # Hash and precompress the web UI once
+        load_static_assets()
+        load_capture_profiles()
+        
+        # Open the capture index, importing older captures on first run
+        get_capture_store()
+        retention_manager = RetentionManager()
+        retention_manager.start()
+        
         # Setup MQTT client
         setup_mqtt_client()
+        status_publisher.start()
+        
+        # Keep the printer state pushed from Moonraker, polling covers the
+        # time the subscription is unavailable
+        printer_subscriber = MoonrakerSubscriber()
+        printer_subscriber.add_listener(record_live_position)
+        printer_subscriber.add_listener(timelapse.on_printer_status)
+        printer_subscriber.start()
+        position_client.start_polling(POSITION_POLL_INTERVAL)
         
-        # Start the Flask application
-        logger.info(f"Starting Flask server on port {HTTP_PORT}")
-        app.run(host='0.0.0.0', port=HTTP_PORT, threaded=True)
+        # Start the web server
+        if SERVER_MODE != "asgi" or not run_asgi_server():
+            logger.info(f"Starting Flask server on port {HTTP_PORT}")
+            app.run(host='0.0.0.0', port=HTTP_PORT, threaded=True)
     except KeyboardInterrupt:
         logger.info("Application stopping due to keyboard interrupt")
         stop_stream()
@@ -4271,3 +5572,5 @@ if __name__ == '__main__':
         if mqtt_client:
             mqtt_client.loop_stop()
             mqtt_client.disconnect()
+    finally:
+        flush_tools_config()
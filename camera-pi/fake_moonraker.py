@@ -0,0 +1,316 @@
+#!/usr/bin/env python3
+"""
+Fake Moonraker server for testing the camera service without a printer
+Speaks enough of the Moonraker websocket JSON-RPC and HTTP API for the
+camera service: object list/query/subscribe, status update notifications
+and G-code scripts with simple G0/G1 moves and SAVE_VARIABLE.
+
+Usage:
+    python3 fake_moonraker.py --port 7125
+Then point the camera service at it, e.g. KLIPPER_API_HOST = "localhost:7125"
+"""
+
+import argparse
+import base64
+import hashlib
+import json
+import logging
+import re
+import socket
+import socketserver
+import struct
+import threading
+import time
+from urllib.parse import urlparse, parse_qs
+
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+)
+logger = logging.getLogger("fake_moonraker")
+
+WEBSOCKET_GUID = "258EAFA5-E914-47DA-95CA-C5AB0DC85B11"
+
+
+class FakePrinter:
+    """Minimal simulated Klipper object state"""
+
+    def __init__(self, atc_switches=("e0_dock", "e1_dock", "c0_dock", "l0_dock")):
+        self.lock = threading.Lock()
+        self.objects = {
+            "toolhead": {"position": [0.0, 0.0, 0.0, 0.0], "homed_axes": "xyz",
+                         "extruder": "extruder", "print_time": 0.0},
+            "gcode_move": {"gcode_position": [0.0, 0.0, 0.0, 0.0],
+                           "position": [0.0, 0.0, 0.0, 0.0],
+                           "homing_origin": [0.0, 0.0, 0.0, 0.0]},
+            "motion_report": {"live_position": [0.0, 0.0, 0.0, 0.0],
+                              "live_velocity": 0.0},
+            "print_stats": {"state": "standby", "filename": "",
+                            "info": {"current_layer": None, "total_layer": None}},
+            "save_variables": {"variables": {}}
+        }
+        for name in atc_switches:
+            self.objects[f"atc_switch {name}"] = {"state": "RELEASED"}
+        self.listeners = []
+        self.gcode_log = []
+
+    def query(self, objects):
+        """Return the requested objects, objects maps name -> field list or None"""
+        with self.lock:
+            result = {}
+            for name, fields in objects.items():
+                if name not in self.objects:
+                    continue
+                state = self.objects[name]
+                if fields:
+                    result[name] = {f: state[f] for f in fields if f in state}
+                else:
+                    result[name] = dict(state)
+            return json.loads(json.dumps(result))
+
+    def update(self, changes):
+        """Apply object changes and notify subscribers"""
+        with self.lock:
+            for name, fields in changes.items():
+                self.objects.setdefault(name, {}).update(fields)
+        for listener in list(self.listeners):
+            listener(changes)
+
+    def move_to(self, x=None, y=None, z=None):
+        with self.lock:
+            pos = list(self.objects["gcode_move"]["gcode_position"])
+        for axis, value in enumerate((x, y, z)):
+            if value is not None:
+                pos[axis] = float(value)
+        self.update({
+            "toolhead": {"position": pos},
+            "gcode_move": {"gcode_position": pos, "position": pos},
+            "motion_report": {"live_position": pos}
+        })
+
+    def run_gcode(self, script):
+        """Execute a G-code script, returns the response text"""
+        for line in script.splitlines():
+            line = line.split(";", 1)[0].strip()
+            if not line:
+                continue
+            self.gcode_log.append(line)
+            words = line.split()
+            command = words[0].upper()
+
+            if command in ("G0", "G1"):
+                axes = {}
+                for word in words[1:]:
+                    if word[0].upper() in "XYZ":
+                        axes[word[0].lower()] = float(word[1:])
+                self.move_to(**axes)
+            elif command == "SAVE_VARIABLE":
+                params = dict(re.findall(r"(\w+)=(\S+)", line))
+                with self.lock:
+                    variables = dict(self.objects["save_variables"]["variables"])
+                try:
+                    value = json.loads(params.get("VALUE", "null"))
+                except ValueError:
+                    value = params.get("VALUE")
+                variables[params.get("VARIABLE", "").lower()] = value
+                self.update({"save_variables": {"variables": variables}})
+            elif command == "SET_LAYER":
+                layer = int(dict(re.findall(r"(\w+)=(\S+)", line)).get("LAYER", 0))
+                self.update({"print_stats": {"info": {"current_layer": layer, "total_layer": None}}})
+        return "ok"
+
+
+class FakeMoonrakerHandler(socketserver.StreamRequestHandler):
+    """Serves one HTTP request or websocket session"""
+
+    def handle(self):
+        request_line = self.rfile.readline().decode("latin1").strip()
+        if not request_line:
+            return
+        method, target, _ = request_line.split(" ", 2)
+        headers = {}
+        while True:
+            line = self.rfile.readline().decode("latin1").strip()
+            if not line:
+                break
+            key, value = line.split(":", 1)
+            headers[key.strip().lower()] = value.strip()
+
+        if headers.get("upgrade", "").lower() == "websocket":
+            self.handle_websocket(headers)
+        else:
+            body = b""
+            if "content-length" in headers:
+                body = self.rfile.read(int(headers["content-length"]))
+            self.handle_http(method, target, body)
+
+    # -- HTTP API --
+
+    def handle_http(self, method, target, body):
+        url = urlparse(target)
+        params = parse_qs(url.query, keep_blank_values=True)
+        printer = self.server.printer
+
+        if url.path == "/printer/objects/query":
+            objects = {name: (values[0].split(",") if values[0] else None)
+                       for name, values in params.items()}
+            result = {"eventtime": time.monotonic(), "status": printer.query(objects)}
+            self.send_json(200, {"result": result})
+        elif url.path == "/printer/gcode/script" and method == "POST":
+            script = params.get("script", [""])[0]
+            if not script and body:
+                script = json.loads(body).get("script", "")
+            self.send_json(200, {"result": printer.run_gcode(script)})
+        else:
+            self.send_json(404, {"error": {"code": 404, "message": "Not Found"}})
+
+    def send_json(self, code, payload):
+        body = json.dumps(payload).encode()
+        self.wfile.write(f"HTTP/1.1 {code} OK\r\n".encode())
+        self.wfile.write(b"Content-Type: application/json\r\n")
+        self.wfile.write(f"Content-Length: {len(body)}\r\n\r\n".encode())
+        self.wfile.write(body)
+
+    # -- Websocket JSON-RPC --
+
+    def handle_websocket(self, headers):
+        accept = base64.b64encode(hashlib.sha1(
+            (headers["sec-websocket-key"] + WEBSOCKET_GUID).encode()).digest()).decode()
+        self.wfile.write(("HTTP/1.1 101 Switching Protocols\r\n"
+                          "Upgrade: websocket\r\nConnection: Upgrade\r\n"
+                          f"Sec-WebSocket-Accept: {accept}\r\n\r\n").encode())
+
+        self.send_lock = threading.Lock()
+        self.subscription = {}
+        printer = self.server.printer
+        printer.listeners.append(self.on_printer_update)
+        self.server.sessions.add(self.request)
+        try:
+            while True:
+                message = self.read_frame()
+                if message is None:
+                    break
+                self.handle_rpc(json.loads(message))
+        except (ConnectionError, OSError):
+            pass
+        finally:
+            self.server.sessions.discard(self.request)
+            printer.listeners.remove(self.on_printer_update)
+
+    def handle_rpc(self, message):
+        method = message.get("method")
+        params = message.get("params") or {}
+        printer = self.server.printer
+
+        if method == "printer.objects.list":
+            with printer.lock:
+                result = {"objects": list(printer.objects)}
+        elif method == "printer.objects.query":
+            result = {"eventtime": time.monotonic(), "status": printer.query(params["objects"])}
+        elif method == "printer.objects.subscribe":
+            self.subscription = params.get("objects", {})
+            result = {"eventtime": time.monotonic(), "status": printer.query(self.subscription)}
+        elif method == "printer.gcode.script":
+            result = printer.run_gcode(params.get("script", ""))
+        elif method == "server.info":
+            result = {"klippy_connected": True, "klippy_state": "ready"}
+        else:
+            self.send_message({"jsonrpc": "2.0", "id": message.get("id"),
+                               "error": {"code": -32601, "message": f"Method not found: {method}"}})
+            return
+        self.send_message({"jsonrpc": "2.0", "id": message.get("id"), "result": result})
+
+    def on_printer_update(self, changes):
+        status = {}
+        for name, fields in changes.items():
+            if name not in self.subscription:
+                continue
+            wanted = self.subscription[name]
+            status[name] = {f: v for f, v in fields.items() if not wanted or f in wanted}
+        if status:
+            try:
+                self.send_message({"jsonrpc": "2.0", "method": "notify_status_update",
+                                   "params": [status, time.monotonic()]})
+            except OSError:
+                pass
+
+    def read_frame(self):
+        """Read one client frame, returns the text payload or None on close"""
+        header = self.rfile.read(2)
+        if len(header) < 2:
+            return None
+        opcode = header[0] & 0x0F
+        length = header[1] & 0x7F
+        if length == 126:
+            length = struct.unpack("!H", self.rfile.read(2))[0]
+        elif length == 127:
+            length = struct.unpack("!Q", self.rfile.read(8))[0]
+        mask = self.rfile.read(4) if header[1] & 0x80 else b"\x00\x00\x00\x00"
+        payload = bytes(b ^ mask[i % 4] for i, b in enumerate(self.rfile.read(length)))
+
+        if opcode == 0x8:
+            return None
+        if opcode == 0x9:
+            self.send_frame(0xA, payload)
+            return self.read_frame()
+        return payload.decode()
+
+    def send_message(self, message):
+        self.send_frame(0x1, json.dumps(message).encode())
+
+    def send_frame(self, opcode, payload):
+        length = len(payload)
+        if length < 126:
+            header = struct.pack("!BB", 0x80 | opcode, length)
+        elif length < 65536:
+            header = struct.pack("!BBH", 0x80 | opcode, 126, length)
+        else:
+            header = struct.pack("!BBQ", 0x80 | opcode, 127, length)
+        with self.send_lock:
+            self.wfile.write(header + payload)
+            self.wfile.flush()
+
+
+class FakeMoonrakerServer(socketserver.ThreadingMixIn, socketserver.TCPServer):
+    allow_reuse_address = True
+    daemon_threads = True
+
+    def __init__(self, address, printer=None):
+        self.printer = printer or FakePrinter()
+        self.sessions = set()
+        super().__init__(address, FakeMoonrakerHandler)
+
+    def drop_sessions(self):
+        """Cut every websocket connection, like a Moonraker restart"""
+        for sock in list(self.sessions):
+            try:
+                sock.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+
+
+def start_fake_moonraker(host="127.0.0.1", port=0, printer=None):
+    """Start a fake Moonraker in a background thread, returns the server
+
+    The bound port is available as server.server_address[1].
+    """
+    server = FakeMoonrakerServer((host, port), printer)
+    thread = threading.Thread(target=server.serve_forever)
+    thread.daemon = True
+    thread.start()
+    return server
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Fake Moonraker server for camera service tests")
+    parser.add_argument("--host", default="0.0.0.0")
+    parser.add_argument("--port", type=int, default=7125)
+    args = parser.parse_args()
+
+    server = FakeMoonrakerServer((args.host, args.port))
+    logger.info(f"Fake Moonraker listening on {args.host}:{args.port}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        logger.info("Fake Moonraker stopping")
+        server.shutdown()
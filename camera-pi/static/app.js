@@ -0,0 +1,1646 @@
+// Global variable to store reference points
+
+let lastKnownPosition = {x: 0, y: 0};
+
+function showReferenceLabels() {
+    // Remove existing labels
+    document.querySelectorAll('.reference-label').forEach(label => label.remove());
+
+    if (!calibrationMode || !referencePointsData || referencePointsData.length === 0) {
+        return;
+    }
+
+    const streamImg = document.getElementById('streamImg');
+    const photoImg = document.getElementById('photoImg');
+    let activeImage = null;
+
+    if (streamImg && streamImg.offsetParent && document.getElementById('streamContainer').style.display !== 'none') {
+        activeImage = streamImg;
+    } else if (photoImg && photoImg.offsetParent && document.getElementById('photoContainer').style.display !== 'none') {
+        activeImage = photoImg;
+    }
+
+    if (!activeImage) return;
+
+    const rect = activeImage.getBoundingClientRect();
+
+    // Simple static labels only - no API calls, no dynamic positioning
+    referencePointsData.forEach((point, index) => {
+        let displayX = point.pixel_x;
+        let displayY = point.pixel_y;
+
+        if (imageFlipH) {
+            displayX = rect.width - displayX;
+        }
+        if (imageFlipV) {
+            displayY = rect.height - displayY;
+        }
+
+        const label = document.createElement('div');
+        label.className = 'reference-label';
+        label.textContent = `P${index + 1}`;
+        label.title = `Point ${index + 1}: X${point.printer_x} Y${point.printer_y}`;
+
+        label.style.left = (rect.left + displayX) + 'px';
+        label.style.top = (rect.top + displayY) + 'px';
+
+        document.body.appendChild(label);
+    });
+}
+
+function updateLabelsWithPosition(printerPos) {
+    // Remove existing labels
+    document.querySelectorAll('.reference-label').forEach(label => label.remove());
+
+    const streamImg = document.getElementById('streamImg');
+    const photoImg = document.getElementById('photoImg');
+    let activeImage = null;
+
+    if (streamImg && streamImg.offsetParent && document.getElementById('streamContainer').style.display !== 'none') {
+        activeImage = streamImg;
+    } else if (photoImg && photoImg.offsetParent && document.getElementById('photoContainer').style.display !== 'none') {
+        activeImage = photoImg;
+    }
+
+    if (!activeImage) return;
+
+    const rect = activeImage.getBoundingClientRect();
+    const currentPrinterX = printerPos.x || 0;
+    const currentPrinterY = printerPos.y || 0;
+
+    const micronsPerPixelX = parseFloat(document.getElementById('micronPerPixelX')?.value) || 58.98;
+    const micronsPerPixelY = parseFloat(document.getElementById('micronPerPixelY')?.value) || 58.98;
+
+    referencePointsData.forEach((point, index) => {
+        const deltaX = point.printer_x - currentPrinterX;
+        const deltaY = point.printer_y - currentPrinterY;
+
+        const pixelOffsetX = (deltaX * 1000) / micronsPerPixelX;
+        const pixelOffsetY = (deltaY * 1000) / micronsPerPixelY;
+
+        const imageCenterX = rect.width / 2;
+        const imageCenterY = rect.height / 2;
+
+        let displayX = imageCenterX - pixelOffsetX;
+        let displayY = imageCenterY + pixelOffsetY;
+
+        if (imageFlipH) {
+            displayX = rect.width - displayX;
+        }
+        if (imageFlipV) {
+            displayY = rect.height - displayY;
+        }
+
+        if (displayX >= 0 && displayX <= rect.width && displayY >= 0 && displayY <= rect.height) {
+            const label = document.createElement('div');
+            label.className = 'reference-label';
+            label.textContent = `P${index + 1}`;
+            label.title = `Point ${index + 1}: X${point.printer_x} Y${point.printer_y} Z${point.printer_z}`;
+
+            label.style.left = (rect.left + displayX) + 'px';
+            label.style.top = (rect.top + displayY) + 'px';
+
+            document.body.appendChild(label);
+        }
+    });
+}
+
+
+function setFocusFromInput(inputValue) {
+    const position = parseFloat(inputValue);
+    if (isNaN(position) || position < 0 || position > 30) {
+        alert('Please enter a valid focus position between 0 and 30');
+        return;
+    }
+
+    // Update both slider and input to match
+    document.getElementById('focusSlider').value = position;
+    document.getElementById('focusInput').value = position;
+    document.getElementById('focusValue').textContent = position;
+
+    // Call the API to actually set the focus
+    fetch('/api/focus/manual/' + position)
+        .then(response => response.json())
+        .then(data => {
+            if (data.status === 'success') {
+                // Visual feedback
+                const focusValue = document.getElementById('focusValue');
+                const originalColor = focusValue.style.color;
+                focusValue.style.color = '#4CAF50';
+                setTimeout(() => {
+                    focusValue.style.color = originalColor;
+                }, 500);
+            } else {
+                alert('Failed to set focus: ' + (data.message || 'Unknown error'));
+            }
+        })
+        .catch(error => {
+            console.error('Error setting focus:', error);
+            alert('Error setting focus: ' + error);
+        });
+}
+
+
+// Add this missing function - it's causing all the console errors
+function updateDebugPanel(status) {
+    const debugElement = document.getElementById('debugPanel');
+    if (debugElement) {
+        if (typeof status === 'string') {
+            debugElement.innerHTML = `<p>Error: ${status}</p>`;
+        } else if (typeof status === 'object') {
+            debugElement.innerHTML = `<pre>${JSON.stringify(status, null, 2)}</pre>`;
+        }
+    }
+    // Don't create debug panel if it doesn't exist - just silently handle it
+}
+
+// Add missing tutorial toggle function
+
+// Fix the updateToolDropdown function
+
+function openOrientationModal() {
+    console.log('openOrientationModal called'); // Debug line
+    updateFlipStateDisplay();
+    const modal = document.getElementById('orientationModal');
+    console.log('Modal element found:', modal); // Debug line
+    if (modal) {
+        modal.style.display = 'block';
+        console.log('Modal display set to block'); // Debug line
+    } else {
+        console.error('orientationModal element not found!');
+    }
+}
+
+
+function closeOrientationModal() {
+    document.getElementById('orientationModal').style.display = 'none';
+}
+
+function updateFlipStateDisplay() {
+    document.getElementById('flipStateH').textContent = imageFlipH ? 'Flipped' : 'Normal';
+    document.getElementById('flipStateV').textContent = imageFlipV ? 'Flipped' : 'Normal';
+}
+
+// Update the existing flip functions to also update the display
+
+
+function updateFormFields() {
+    const toolType = document.getElementById('toolType').value;
+    const isReference = document.getElementById('isReference').checked;
+
+    const programmedSection = document.getElementById('programmedSection');
+    const actualSection = document.getElementById('actualSection');
+    const dispenserSection = document.getElementById('dispenserSection');
+
+    // Show/hide sections based on tool type and reference status
+    if (toolType === 'camera' && !isReference) {
+        // Camera tools (not reference) don't need position inputs
+        programmedSection.style.display = 'none';
+        actualSection.style.display = 'none';
+        dispenserSection.style.display = 'none';
+    } else if (toolType === 'camera' && isReference) {
+        // Camera reference tools need fiducial positions (rename labels)
+        programmedSection.style.display = 'block';
+        actualSection.style.display = 'none';
+        dispenserSection.style.display = 'none';
+
+        // Update labels for camera reference
+        const labels = programmedSection.querySelectorAll('label');
+        if (labels[0]) labels[0].textContent = 'Fiducial X';
+        if (labels[1]) labels[1].textContent = 'Fiducial Y';
+        if (labels[2]) labels[2].textContent = 'Fiducial Z';
+    } else if (isReference) {
+        // Non-camera reference tools only need programmed position
+        programmedSection.style.display = 'block';
+        actualSection.style.display = 'none';
+        dispenserSection.style.display = toolType === 'dispenser' ? 'block' : 'none';
+
+        // Reset labels for non-camera tools
+        const labels = programmedSection.querySelectorAll('label');
+        if (labels[0]) labels[0].textContent = 'Programmed X';
+        if (labels[1]) labels[1].textContent = 'Programmed Y';
+        if (labels[2]) labels[2].textContent = 'Programmed Z';
+    } else {
+        // Non-reference tools need both programmed positions
+        programmedSection.style.display = 'block';
+        dispenserSection.style.display = toolType === 'dispenser' ? 'block' : 'none';
+
+        // Check if camera is reference tool to determine if we show actual positions
+        const cameraReference = tools.find(t => t.type === 'camera' && t.isReference);
+        if (cameraReference) {
+            // Technique 2: Camera is reference, hide actual positions
+            actualSection.style.display = 'none';
+        } else {
+            // Technique 1: Show actual positions for offset measurement
+            actualSection.style.display = 'block';
+        }
+
+        // Reset labels
+        const labels = programmedSection.querySelectorAll('label');
+        if (labels[0]) labels[0].textContent = 'Programmed X';
+        if (labels[1]) labels[1].textContent = 'Programmed Y';
+        if (labels[2]) labels[2].textContent = 'Programmed Z';
+    }
+
+    updateOffsetDisplay();
+}
+
+
+function updateOffsetDisplay() {
+    const toolTypeElement = document.getElementById('toolType');
+    const isReferenceElement = document.getElementById('isReference');
+
+    if (!toolTypeElement || !isReferenceElement) {
+        // Fall back to old system logic
+        // (keep existing fallback code)
+        return;
+    }
+
+    const toolType = toolTypeElement.value;
+    const isReference = isReferenceElement.checked;
+
+    // Reference tools have no offsets
+    if (isReference) {
+        document.getElementById('calcOffsetX').textContent = '0.000';
+        document.getElementById('calcOffsetY').textContent = '0.000';
+        document.getElementById('calcOffsetZ').textContent = '0.000';
+        return;
+    }
+
+    // Check if camera is the reference tool (Technique 2)
+    const cameraReference = tools.find(t => t.type === 'camera' && t.isReference);
+
+    if (cameraReference) {
+        // Technique 2: Offsets = camera_fiducial - tool_programmed
+        const programmedXElement = document.getElementById('programmedX');
+        const programmedYElement = document.getElementById('programmedY');
+        const programmedZElement = document.getElementById('programmedZ');
+
+        if (!programmedXElement) return;
+
+        const programmedX = parseFloat(programmedXElement.value) || 0;
+        const programmedY = parseFloat(programmedYElement.value) || 0;
+        const programmedZ = parseFloat(programmedZElement.value) || 0;
+
+        const cameraFiducialX = cameraReference.programmedX || cameraReference.fiducialX || 0;
+        const cameraFiducialY = cameraReference.programmedY || cameraReference.fiducialY || 0;
+        const cameraFiducialZ = cameraReference.programmedZ || cameraReference.fiducialZ || 0;
+
+        const offsetX = programmedX - cameraFiducialX;
+        const offsetY = programmedY - cameraFiducialY;
+        const offsetZ = programmedZ - cameraFiducialZ;
+
+
+        document.getElementById('calcOffsetX').textContent = offsetX.toFixed(3);
+        document.getElementById('calcOffsetY').textContent = offsetY.toFixed(3);
+        document.getElementById('calcOffsetZ').textContent = offsetZ.toFixed(3);
+    } else {
+        // Technique 1: Use existing actual - programmed logic
+        const programmedXElement = document.getElementById('programmedX');
+        const actualXElement = document.getElementById('actualX');
+
+        if (!programmedXElement || !actualXElement) return;
+
+        const programmedX = parseFloat(programmedXElement.value) || 0;
+        const programmedY = parseFloat(document.getElementById('programmedY').value) || 0;
+        const programmedZ = parseFloat(document.getElementById('programmedZ').value) || 0;
+
+        const actualX = parseFloat(actualXElement.value) || 0;
+        const actualY = parseFloat(document.getElementById('actualY').value) || 0;
+        const zOffsetInput = parseFloat(document.getElementById('zOffset')?.value) || 0;
+
+        const offsetX = actualX - programmedX;
+        const offsetY = actualY - programmedY;
+
+        const referenceTool = tools.find(t => t.isReference === true);
+        let offsetZ = zOffsetInput;
+
+        if (referenceTool && (referenceTool.programmedZ !== undefined || referenceTool.fiducialZ !== undefined)) {
+            const referenceZ = referenceTool.programmedZ || referenceTool.fiducialZ || 0;
+            offsetZ += (referenceZ - programmedZ);
+        }
+
+        document.getElementById('calcOffsetX').textContent = offsetX.toFixed(3);
+        document.getElementById('calcOffsetY').textContent = offsetY.toFixed(3);
+        document.getElementById('calcOffsetZ').textContent = offsetZ.toFixed(3);
+    }
+}
+
+
+function hideCoordinateDisplay(imageElement) {
+    const overlay = imageElement.parentElement.querySelector('.coordinate-overlay');
+    if (overlay) {
+        overlay.style.display = 'none';
+    }
+}
+
+function showCoordinateDisplay(imageElement) {
+    const overlay = imageElement.parentElement.querySelector('.coordinate-overlay');
+    if (overlay) {
+        overlay.style.display = 'block';
+    }
+}
+
+
+// Add these variables at the top of your script section
+let imageFlipH = true;
+let imageFlipV = true;
+
+// Add these functions
+function flipImageHorizontal() {
+    imageFlipH = !imageFlipH;
+    applyImageTransforms();
+}
+
+function flipImageVertical() {
+    imageFlipV = !imageFlipV;
+    applyImageTransforms();
+}
+
+function resetImageFlip() {
+    imageFlipH = false;
+    imageFlipV = false;
+    applyImageTransforms();
+}
+
+
+function applyImageTransforms() {
+    const images = document.querySelectorAll('.clickable-image');
+    let transform = '';
+
+    if (imageFlipH && imageFlipV) {
+        transform = 'scaleX(-1) scaleY(-1)';
+    } else if (imageFlipH) {
+        transform = 'scaleX(-1)';
+    } else if (imageFlipV) {
+        transform = 'scaleY(-1)';
+    } else {
+        transform = 'none';
+    }
+
+    images.forEach(img => {
+        img.style.transform = transform;
+        img.style.transformOrigin = 'center';
+    });
+
+    // Only update crosshair, not labels
+    setTimeout(updateCrosshairPosition, 50);
+}
+
+
+function getCorrectCoordinates(event, imageElement) {
+    const rect = imageElement.getBoundingClientRect();
+    let x = Math.round(event.clientX - rect.left);
+    let y = Math.round(event.clientY - rect.top);
+
+    // Apply coordinate transformation based on flip state
+    if (imageFlipH) {
+        x = rect.width - x;
+    }
+    if (imageFlipV) {
+        y = rect.height - y;
+    }
+
+    return { x, y };
+}
+
+
+function handleImageClick(event, imageType) {
+    if (!calibrationMode) return;
+
+    console.log('Image clicked in calibration mode - OFFSET VERSION');
+
+    const coords = getCorrectCoordinates(event, event.target);
+    console.log(`Pixel coordinates: (${coords.x}, ${coords.y})`);
+
+    // Get current printer position
+    fetch('/api/printer/position')
+        .then(response => response.json())
+        .then(data => {
+            if (data.status === 'success' || data.status === 'timeout') {
+                const currentX = data.position.x;
+                const currentY = data.position.y;
+                const currentZ = data.position.z;
+
+                // Get calibration values
+                const micronsPerPixelX = parseFloat(document.getElementById('micronPerPixelX').value) || 58.98;
+                const micronsPerPixelY = parseFloat(document.getElementById('micronPerPixelY').value) || 58.98;
+
+                // Calculate offset from image center
+                const imageElement = event.target;
+                const centerX = imageElement.clientWidth / 2;
+                const centerY = imageElement.clientHeight / 2;
+
+                const pixelOffsetX = coords.x - centerX;
+                const pixelOffsetY = coords.y - centerY;
+
+                // Convert to mm offset (fix X direction)
+                const mmOffsetX = -(pixelOffsetX * micronsPerPixelX) / 1000;  // Left = negative, Right = positive
+                const mmOffsetY = (pixelOffsetY * micronsPerPixelY) / 1000;   // Down = positive
+
+                // Calculate target coordinates
+                const targetX = currentX + mmOffsetX;
+                const targetY = currentY + mmOffsetY;
+
+                console.log(`Current position: X${currentX} Y${currentY}`);
+                console.log(`Offset: X${mmOffsetX.toFixed(3)} Y${mmOffsetY.toFixed(3)}`);
+                console.log(`Target coordinates: X${targetX.toFixed(3)} Y${targetY.toFixed(3)}`);
+
+                // Save the reference point with calculated coordinates
+                addReferencePoint(coords.x, coords.y, targetX, targetY, currentZ);
+            }
+        });
+}
+
+
+function updateCoordinateDisplay(event, imageElement) {
+    let overlay = imageElement.parentElement.querySelector('.coordinate-overlay');
+    if (!overlay) {
+        overlay = document.createElement('div');
+        overlay.className = 'coordinate-overlay';
+        imageElement.parentElement.appendChild(overlay);
+    }
+
+    // Get corrected coordinates
+    const coords = getCorrectCoordinates(event, imageElement);
+
+    const micronsPerPixelX = parseFloat(document.getElementById('micronPerPixelX').value) || 200.77730819;
+    const micronsPerPixelY = parseFloat(document.getElementById('micronPerPixelY').value) || 200.77730819;
+
+    // Calculate offset from center of image (489.5, 275.5)
+    const centerX = 489.5;
+    const centerY = 275.5;
+    const pixelOffsetX = coords.x - centerX;
+    const pixelOffsetY = coords.y - centerY;
+
+    // Convert to mm offset - FIX THE X-AXIS DIRECTION
+    const mmOffsetX = -(pixelOffsetX * micronsPerPixelX) / 1000;  // Negative sign to flip X direction
+    const mmOffsetY = (pixelOffsetY * micronsPerPixelY) / 1000;   // Y direction stays the same
+
+    // Get current printer position
+    const currentPrinterX = debugInfo.printer_position?.x || 227.7;
+    const currentPrinterY = debugInfo.printer_position?.y || 150;
+
+    // Calculate target printer coordinates
+    const targetX = currentPrinterX + mmOffsetX;
+    const targetY = currentPrinterY + mmOffsetY;
+
+    // Update overlay display
+    overlay.innerHTML = `
+        Pixel: (${coords.x}, ${coords.y})<br>
+        Offset: (${mmOffsetX > 0 ? '+' : ''}${mmOffsetX.toFixed(2)}mm, ${mmOffsetY > 0 ? '+' : ''}${mmOffsetY.toFixed(2)}mm)
+    `;
+}
+
+
+// Camera centering functionality
+let centeringMode = false;
+
+function addFiducialCrosshair(imageElement) {
+    // Remove existing crosshair
+    const existing = document.querySelector('.fiducial-crosshair-fixed');
+    if (existing) existing.remove();
+
+    const rect = imageElement.getBoundingClientRect();
+
+    const crosshair = document.createElement('div');
+    crosshair.className = 'fiducial-crosshair-fixed';
+    crosshair.innerHTML = '+';
+    crosshair.style.cssText = `
+        position: fixed;
+        left: ${rect.left + rect.width / 2}px;
+        top: ${rect.top + rect.height / 2}px;
+        transform: translate(-50%, -50%);
+        pointer-events: none;
+        z-index: 999;
+        color: #00ff00;
+        font-size: 20px;
+        font-weight: bold;
+        text-shadow: 1px 1px 2px rgba(0,0,0,0.8);
+    `;
+
+    document.body.appendChild(crosshair);
+}
+
+
+function updateCrosshairPosition() {
+    const crosshair = document.querySelector('.fiducial-crosshair-fixed');
+    const streamImg = document.getElementById('streamImg');
+    const photoImg = document.getElementById('photoImg');
+
+    if (crosshair && streamImg && streamImg.offsetParent) {
+        const rect = streamImg.getBoundingClientRect();
+        crosshair.style.left = (rect.left + rect.width / 2) + 'px';
+        crosshair.style.top = (rect.top + rect.height / 2) + 'px';
+    } else if (crosshair && photoImg && photoImg.offsetParent) {
+        const rect = photoImg.getBoundingClientRect();
+        crosshair.style.left = (rect.left + rect.width / 2) + 'px';
+        crosshair.style.top = (rect.top + rect.height / 2) + 'px';
+    }
+}
+
+
+function debugCrosshairPosition() {
+    const img = document.getElementById('streamImg');
+    if (img) {
+        console.log(`Image dimensions: ${img.width} x ${img.height}`);
+        console.log(`Natural dimensions: ${img.naturalWidth} x ${img.naturalHeight}`);
+        console.log(`Mathematical center should be: (${img.width/2}, ${img.height/2})`);
+
+        // Test click at mathematical center
+        const rect = img.getBoundingClientRect();
+        const centerX = img.width / 2;
+        const centerY = img.height / 2;
+        console.log(`Click at center would give coordinates: (${centerX}, ${centerY})`);
+    }
+}
+
+
+// Add this function to load tools from the backend
+
+// Update the existing DOMContentLoaded event listener
+document.addEventListener('DOMContentLoaded', function() {
+    // Hide photo container on page load
+    document.getElementById('photoContainer').style.display = 'none';
+
+    // Apply default flips immediately
+    applyImageTransforms();
+
+    // Load tools from backend instead of just rendering the default list
+    loadToolsFromBackend();
+
+// Initialize crosshair when images load
+const streamImg = document.getElementById('streamImg');
+const photoImg = document.getElementById('photoImg');
+
+if (streamImg) {
+    // Handle both load event and already-loaded images
+    streamImg.addEventListener('load', () => {
+        if (document.getElementById('streamContainer').style.display !== 'none') {
+            applyImageTransforms();
+            setTimeout(() => {
+                addFiducialCrosshair(streamImg);
+                updateCrosshairPosition();
+            }, 100);
+        }
+    });
+
+    // If image is already loaded, trigger immediately
+    if (streamImg.complete && streamImg.naturalWidth > 0) {
+        setTimeout(() => {
+            if (document.getElementById('streamContainer').style.display !== 'none') {
+                applyImageTransforms();
+                addFiducialCrosshair(streamImg);
+                updateCrosshairPosition();
+            }
+        }, 100);
+    }
+}
+
+if (photoImg) {
+    photoImg.addEventListener('load', () => {
+        if (document.getElementById('photoContainer').style.display !== 'none') {
+            applyImageTransforms();
+            setTimeout(() => {
+                addFiducialCrosshair(photoImg);
+                updateCrosshairPosition();
+            }, 100);
+        }
+    });
+
+    // If image is already loaded, trigger immediately
+    if (photoImg.complete && photoImg.naturalWidth > 0) {
+        setTimeout(() => {
+            if (document.getElementById('photoContainer').style.display !== 'none') {
+                applyImageTransforms();
+                addFiducialCrosshair(photoImg);
+                updateCrosshairPosition();
+            }
+        }, 100);
+    }
+}
+
+
+    // Add event listeners for fiducial inputs to update offset display
+    const fiducialInputs = ['fiducialX', 'fiducialY', 'fiducialZ', 'isReference'];
+    fiducialInputs.forEach(id => {
+        const element = document.getElementById(id);
+        if (element) {
+            element.addEventListener('input', updateOffsetDisplay);
+            element.addEventListener('change', updateOffsetDisplay);
+        }
+    });
+
+    // ADD THIS: Event listeners for the new position inputs
+    // Event listeners for the new position inputs
+const positionInputs = ['programmedX', 'programmedY', 'programmedZ', 'actualX', 'actualY', 'zOffset'];
+    positionInputs.forEach(id => {
+        const element = document.getElementById(id);
+        if (element) {
+            element.addEventListener('input', updateOffsetDisplay);
+            element.addEventListener('change', updateOffsetDisplay);
+        }
+    });
+
+    window.addEventListener('resize', showReferenceLabels);
+    window.addEventListener('scroll', showReferenceLabels);
+
+});
+
+
+            let calibrationMode = false;
+            let currentImageType = 'stream';
+            let debugInfo = {};
+
+            window.onload = function() {
+                checkStatus();
+                loadCalibrationData();
+                setInterval(checkStatus, 3000);
+            };
+
+
+let consecutiveErrors = 0;
+
+function checkStatus() {
+    fetch('/api/status')
+        .then(response => {
+            if (!response.ok) {
+                throw new Error(`HTTP ${response.status}: ${response.statusText}`);
+            }
+            return response.json();
+        })
+        .then(data => {
+            consecutiveErrors = 0; // Reset error counter on success
+            debugInfo = data;
+            updateDebugPanel();
+
+            if (data.streaming) {
+                document.getElementById('streamContainer').style.display = 'block';
+                document.getElementById('focusControls').style.display = 'flex';
+                refreshStreamImage();
+                setTimeout(() => {
+                    const streamImg = document.getElementById('streamImg');
+                    if (streamImg.complete) {
+                        addFiducialCrosshair(streamImg);
+                        updateCrosshairPosition();
+                    }
+                }, 100);
+            } else {
+                document.getElementById('streamContainer').style.display = 'none';
+                document.getElementById('focusControls').style.display = 'none';
+            }
+
+            if (data.calibration) {
+                document.getElementById('micronPerPixelX').value = data.calibration.microns_per_pixel_x || 10;
+                document.getElementById('micronPerPixelY').value = data.calibration.microns_per_pixel_y || 10;
+                //updateCalibrationStatus(data.calibration.enabled);
+            }
+        })
+        .catch(error => {
+            consecutiveErrors++;
+            // Only log every 10th error to reduce console spam, but with more detail
+            if (consecutiveErrors % 10 === 1) {
+                console.error('Server connection error details:', {
+                    error: error.message,
+                    consecutiveErrors: consecutiveErrors,
+                    timestamp: new Date().toLocaleTimeString()
+                });
+            }
+            updateDebugPanel('Server connection lost');
+        });
+}
+
+
+
+            function refreshStreamImage() {
+                const img = document.getElementById('streamImg');
+                img.src = '/stream?t=' + new Date().getTime();
+            }
+
+
+
+function startStream() {
+    fetch('/api/stream/start')
+        .then(response => response.json())
+        .then(data => {
+            if (data.streaming) {
+                document.getElementById('streamContainer').style.display = 'block';
+                document.getElementById('focusControls').style.display = 'flex';
+                document.getElementById('photoContainer').style.display = 'none';
+                setTimeout(() => {
+                    refreshStreamImage();
+                    // Add crosshair after stream starts
+                    const streamImg = document.getElementById('streamImg');
+                    if (streamImg) {
+                        addFiducialCrosshair(streamImg);
+                        updateCrosshairPosition();
+                    }
+                }, 1000);
+            }
+        });
+}
+
+
+            function stopStream() {
+                fetch('/api/stream/stop')
+                    .then(response => response.json())
+                    .then(data => {
+                        document.getElementById('streamContainer').style.display = 'none';
+                        document.getElementById('focusControls').style.display = 'none';
+                    });
+            }
+
+
+function capturePhoto() {
+    // Hide stream container when taking photo
+    document.getElementById('streamContainer').style.display = 'none';
+
+    // Captures are queued, poll the job until this one has finished
+    fetch('/api/capture')
+        .then(response => response.json())
+        .then(data => data.status === 'success' ? waitForCaptureJob(data.job, 60) : null)
+        .then(job => {
+            if (job && job.state === 'done') {
+                document.getElementById('photoContainer').style.display = 'block';
+                document.getElementById('photoImg').src = '/api/captures/' + job.result.filename + '/image';
+                currentImageType = 'snapshot';
+
+                // Add crosshair to photo after it loads
+                const photoImg = document.getElementById('photoImg');
+                photoImg.onload = function() {
+                    addFiducialCrosshair(photoImg);
+                };
+            }
+        })
+        .catch(error => {
+            console.error('Error capturing photo:', error);
+        });
+}
+
+
+// Short polls instead of ?wait, so a pending capture never holds a server thread
+function waitForCaptureJob(job, attempts) {
+    if ((job.state !== 'queued' && job.state !== 'running') || attempts <= 0) {
+        return Promise.resolve(job);
+    }
+    return new Promise(resolve => setTimeout(resolve, 500))
+        .then(() => fetch('/api/capture/' + job.id))
+        .then(response => response.json())
+        .then(data => data.status === 'success' ? waitForCaptureJob(data.job, attempts - 1) : null);
+}
+
+let labelUpdateInterval = null;
+
+function toggleCalibrationMode() {
+    calibrationMode = !calibrationMode;
+    document.getElementById('calibrationToggle').textContent =
+        calibrationMode ? 'Disable Image Mapper' : 'Enable Image Mapper';
+    document.getElementById('calibrationPanel').style.display =
+        calibrationMode ? 'block' : 'none';
+
+    // Update cursor style
+    const images = document.querySelectorAll('.clickable-image');
+    images.forEach(img => {
+        img.style.cursor = calibrationMode ? 'crosshair' : 'default';
+    });
+
+    // Stop any existing intervals
+    if (labelUpdateInterval) {
+        clearInterval(labelUpdateInterval);
+        labelUpdateInterval = null;
+    }
+
+    if (calibrationMode) {
+        // Show crosshair immediately
+        const streamImg = document.getElementById('streamImg');
+        const photoImg = document.getElementById('photoImg');
+
+        if (streamImg && document.getElementById('streamContainer').style.display !== 'none') {
+            addFiducialCrosshair(streamImg);
+        } else if (photoImg && document.getElementById('photoContainer').style.display !== 'none') {
+            addFiducialCrosshair(photoImg);
+        }
+
+        // Show labels if we have data
+        if (referencePointsData && referencePointsData.length > 0) {
+            showReferenceLabels();
+        }
+    } else {
+        // Remove everything when disabled
+        document.querySelectorAll('.reference-label').forEach(label => label.remove());
+        document.querySelectorAll('.fiducial-crosshair-fixed').forEach(crosshair => crosshair.remove());
+    }
+}
+
+
+
+            function showCoordinates(imgElement, x, y) {
+                // Remove existing coordinate display
+                const existing = imgElement.parentElement.querySelector('.coordinates-display');
+                if (existing) existing.remove();
+
+                // Create new coordinate display
+                const coordDiv = document.createElement('div');
+                coordDiv.className = 'coordinates-display';
+                coordDiv.textContent = `Pixel: (${x}, ${y})`;
+                imgElement.parentElement.appendChild(coordDiv);
+
+                // Remove after 3 seconds
+                setTimeout(() => {
+                    if (coordDiv.parentElement) {
+                        coordDiv.remove();
+                    }
+                }, 3000);
+            }
+
+            function addReferencePoint(pixelX, pixelY, printerX, printerY, printerZ) {
+                console.log(`Adding reference point: Pixel(${pixelX}, ${pixelY}) -> Printer(${printerX}, ${printerY}, ${printerZ})`);
+
+                const data = {
+                    pixel_x: pixelX,
+                    pixel_y: pixelY,
+                    printer_x: printerX,
+                    printer_y: printerY,
+                    printer_z: printerZ
+                };
+
+                fetch('/api/calibration/add_point', {
+                    method: 'POST',
+                    headers: {'Content-Type': 'application/json'},
+                    body: JSON.stringify(data)
+                })
+                .then(response => response.json())
+                .then(result => {
+                    console.log('Add point result:', result);
+                    if (result.status === 'success') {
+                        loadCalibrationData();
+                        alert(`Reference point added successfully!\nPixel: (${pixelX}, ${pixelY})\nPrinter: X${printerX} Y${printerY} Z${printerZ}`);
+                    } else {
+                        alert('Failed to add reference point: ' + (result.message || 'Unknown error'));
+                    }
+                })
+                .catch(error => {
+                    console.error('Error adding reference point:', error);
+                    alert('Error adding reference point: ' + error);
+                });
+            }
+
+            function updateMicronsPerPixel() {
+                const x = parseFloat(document.getElementById('micronPerPixelX').value);
+                const y = parseFloat(document.getElementById('micronPerPixelY').value);
+
+                fetch('/api/calibration/set_microns', {
+                    method: 'POST',
+                    headers: {'Content-Type': 'application/json'},
+                    body: JSON.stringify({microns_per_pixel_x: x, microns_per_pixel_y: y})
+                })
+                .then(response => response.json())
+                .then(result => {
+                    if (result.status === 'success') {
+                        alert('Microns per pixel updated');
+                    }
+                });
+            }
+
+            function enableCalibration() {
+                fetch('/api/calibration/enable', {method: 'POST'})
+                    .then(response => response.json())
+                    .then(result => {
+                        if (result.status === 'success') {
+                            updateCalibrationStatus(true);
+                        }
+                    });
+            }
+
+            function disableCalibration() {
+                fetch('/api/calibration/disable', {method: 'POST'})
+                    .then(response => response.json())
+                    .then(result => {
+                        if (result.status === 'success') {
+                            updateCalibrationStatus(false);
+                        }
+                    });
+            }
+
+            function clearCalibration() {
+                if (confirm('Clear all calibration data?')) {
+                    fetch('/api/calibration/clear', {method: 'POST'})
+                        .then(response => response.json())
+                        .then(result => {
+                            if (result.status === 'success') {
+                                loadCalibrationData();
+                            }
+                        });
+                }
+            }
+
+
+
+function loadCalibrationData() {
+    fetch('/api/calibration/data')
+        .then(response => response.json())
+        .then(data => {
+            const container = document.getElementById('referencePoints');
+            container.innerHTML = '';
+
+            if (data.reference_points && data.reference_points.length > 0) {
+                data.reference_points.forEach((point, index) => {
+                    const div = document.createElement('div');
+                    div.className = 'reference-point';
+                    div.innerHTML = `
+                        <strong>Point ${index + 1}:</strong><br>
+                        Pixel: (${point.pixel_x}, ${point.pixel_y})<br>
+                        Printer: X${point.printer_x} Y${point.printer_y} Z${point.printer_z}
+                    `;
+                    container.appendChild(div);
+                });
+            } else {
+                container.innerHTML = '<div class="reference-point">No reference points set</div>';
+            }
+
+            updateCalibrationStatus(data.enabled);
+            referencePointsData = data.reference_points || []; // ADD THIS LINE
+            if (calibrationMode) {
+                setTimeout(showReferenceLabels, 100); // ADD THIS LINE
+            }
+        });
+}
+
+
+function updateCalibrationStatus(enabled) {
+    const statusElement = document.getElementById('calibrationStatus');
+    if (statusElement) {  // Add this null check
+        statusElement.textContent = enabled ? 'ENABLED' : 'DISABLED';
+        statusElement.style.color = enabled ? 'green' : 'red';
+    }
+}
+
+           function updateFocusValue(value) {
+            document.getElementById('focusValue').textContent = value;
+            document.getElementById('focusInput').value = value;
+           }
+
+
+
+           // Update the setFocusManual function to sync both controls
+function setFocusManual(position) {
+    fetch('/api/focus/manual/' + position)
+        .then(response => response.json())
+        .then(data => {
+            if (data.status === 'success') {
+                // Update both the slider and input to match
+                document.getElementById('focusSlider').value = position;
+                document.getElementById('focusInput').value = position;
+                document.getElementById('focusValue').textContent = position;
+
+                // Visual feedback
+                const focusValue = document.getElementById('focusValue');
+                const originalColor = focusValue.style.color;
+                focusValue.style.color = '#4CAF50';
+                setTimeout(() => {
+                    focusValue.style.color = originalColor;
+                }, 500);
+            }
+        });
+}
+
+
+let measuringLine = false;
+let lineStart = null;
+let currentLine = null;
+let isDrawingLine = false;
+
+
+function startLineMeasurement() {
+    measuringLine = true;
+    lineStart = null;
+    isDrawingLine = false;
+    currentLine = null;
+    console.log('Line measurement mode enabled');
+    alert('Click and drag to draw a measurement line on the image.');
+}
+
+
+function measureClick(event) {
+    if (!measuringLine) return;
+
+    if (event.type === 'mousedown') {
+        startDrawingLine(event);
+    } else if (event.type === 'mousemove' && isDrawingLine) {
+        updateLine(event);
+    } else if (event.type === 'mouseup' && isDrawingLine) {
+        finishLine(event);
+    }
+}
+
+function startDrawingLine(event) {
+    event.preventDefault();
+    const rect = event.target.getBoundingClientRect();
+    lineStart = {
+        x: event.clientX - rect.left,
+        y: event.clientY - rect.top
+    };
+
+    isDrawingLine = true;
+
+    // Create line element positioned absolutely on the page
+    currentLine = document.createElement('div');
+    currentLine.style.position = 'fixed'; // Use fixed positioning
+    currentLine.style.backgroundColor = '#ff4444';
+    currentLine.style.height = '2px';
+    currentLine.style.transformOrigin = '0 0';
+    currentLine.style.pointerEvents = 'none';
+    currentLine.style.zIndex = '1000';
+    currentLine.style.left = (rect.left + lineStart.x) + 'px';
+    currentLine.style.top = (rect.top + lineStart.y) + 'px';
+
+    // Add to body for fixed positioning
+    document.body.appendChild(currentLine);
+}
+
+function updateLine(event) {
+    if (!isDrawingLine || !currentLine || !lineStart) return;
+
+    const rect = event.target.getBoundingClientRect();
+    const currentX = event.clientX - rect.left;
+    const currentY = event.clientY - rect.top;
+
+    const deltaX = currentX - lineStart.x;
+    const deltaY = currentY - lineStart.y;
+    const distance = Math.sqrt(deltaX * deltaX + deltaY * deltaY);
+    const angle = Math.atan2(deltaY, deltaX) * 180 / Math.PI;
+
+    // Update line width and rotation only - position is set in startDrawingLine
+    currentLine.style.width = distance + 'px';
+    currentLine.style.transform = 'rotate(' + angle + 'deg)';
+}
+
+
+function finishLine(event) {
+    if (!isDrawingLine || !currentLine || !lineStart) return;
+
+    const rect = event.target.getBoundingClientRect();
+    const endX = event.clientX - rect.left;
+    const endY = event.clientY - rect.top;
+
+    const deltaX = endX - lineStart.x;
+    const deltaY = endY - lineStart.y;
+    const distance = Math.sqrt(deltaX * deltaX + deltaY * deltaY);
+
+    if (distance < 10) {
+        // Line too short, remove it
+        currentLine.remove();
+        isDrawingLine = false;
+        return;
+    }
+
+    const actualMM = prompt('Line is ' + Math.round(distance) + ' pixels long.\nWhat is the actual length in mm?');
+
+    if (actualMM && !isNaN(actualMM)) {
+        const micronsPerPixel = (parseFloat(actualMM) * 1000) / distance;
+
+        fetch('/api/scaler/calculate', {
+            method: 'POST',
+            headers: {'Content-Type': 'application/json'},
+            body: JSON.stringify({
+                width_mm: actualMM,
+                height_mm: actualMM,
+                pixel_width: distance,
+                pixel_height: distance
+            })
+        }).then(() => {
+            alert('Calculated: ' + micronsPerPixel.toFixed(2) + ' μm/pixel\nCalibration updated!');
+            location.reload();
+        });
+    }
+
+    // Clean up
+    currentLine.remove();
+    measuringLine = false;
+    lineStart = null;
+    isDrawingLine = false;
+}
+
+
+//Tool management javascript
+// Tool management state
+let tools = [
+    {id: 0, name: "Camera Tool (C0)", type: "camera", offsetX: 0, offsetY: 0, offsetZ: 0, preciseX: 0, preciseY: 0, preciseZ: 0},
+    {id: 1, name: "Extruder 1 (E0)", type: "extruder", offsetX: 0, offsetY: 0, offsetZ: 0, preciseX: 0, preciseY: 0, preciseZ: 0},
+    {id: 2, name: "Extruder 2 (E1)", type: "extruder", offsetX: 0, offsetY: 0, offsetZ: 0, preciseX: 0, preciseY: 0, preciseZ: 0},
+    {id: 3, name: "Liquid Dispenser (L0)", type: "dispenser", offsetX: 0, offsetY: 0, offsetZ: 0, preciseX: 0, preciseY: 0, preciseZ: 0}
+];
+
+let cameraReference = null;
+let currentEditingTool = null;
+
+function toggleToolManagement() {
+    const content = document.getElementById('tool-management-content');
+    const arrow = document.getElementById('tool-arrow');
+
+    if (content.style.display === 'none') {
+        content.style.display = 'block';
+        arrow.classList.add('tool-arrow-up');
+    } else {
+        content.style.display = 'none';
+        arrow.classList.remove('tool-arrow-up');
+    }
+}
+
+
+function selectTool() {
+    const toolId = document.getElementById('currentTool').value;
+    let toolCommand;
+
+    switch(toolId) {
+        case '0': toolCommand = 'C0'; break;
+        case '1': toolCommand = 'E0'; break;
+        case '2': toolCommand = 'E1'; break;
+        case '3': toolCommand = 'L0'; break;
+        default: toolCommand = 'C0';
+    }
+
+    fetch('/api/printer/select_tool', {
+        method: 'POST',
+        headers: {'Content-Type': 'application/json'},
+        body: JSON.stringify({tool_command: toolCommand})
+    })
+    .then(response => response.json())
+    .then(data => {
+        if (data.status === 'success') {
+            alert(`Tool ${toolCommand} selected`);
+        } else {
+            alert('Failed to select tool: ' + data.message);
+        }
+    });
+}
+
+function getCurrentPosition() {
+    fetch('/api/printer/get_position')
+    .then(response => response.json())
+    .then(data => {
+        if (data.status === 'success') {
+            alert(`Current Position: X${data.x} Y${data.y} Z${data.z}`);
+        } else {
+            alert('Failed to get position: ' + data.message);
+        }
+    });
+}
+
+
+//For testing
+function testModal() {
+    const modal = document.getElementById('toolModal');
+    console.log('Modal element:', modal);
+    if (modal) {
+        modal.style.display = 'block';
+        console.log('Modal should be visible now');
+    } else {
+        console.log('Modal element not found!');
+    }
+}
+
+//For testing
+function debugTools() {
+    console.log('Tools array:', tools);
+    console.log('Tools length:', tools.length);
+    console.log('Current tool value:', document.getElementById('currentTool').value);
+}
+
+function editTool(toolId) {
+    console.log('editTool called with toolId:', toolId);
+
+    const tool = tools.find(t => t.id === toolId);
+    console.log('Found tool:', tool);
+
+    if (!tool) {
+        console.log('Tool not found!');
+        return;
+    }
+
+    const modal = document.getElementById('toolModal');
+    console.log('Modal element:', modal);
+
+    if (!modal) {
+        console.log('Modal element not found!');
+        return;
+    }
+
+    currentEditingTool = toolId;
+    document.getElementById('modalTitle').textContent = 'Edit Tool';
+    document.getElementById('toolName').value = tool.name;
+    document.getElementById('toolId').value = tool.id;
+    document.getElementById('toolType').value = tool.type;
+    document.getElementById('isReference').checked = tool.isReference || false;
+
+    // Check if the new form elements exist
+    const programmedX = document.getElementById('programmedX');
+    const actualX = document.getElementById('actualX');
+    console.log('programmedX element:', programmedX);
+    console.log('actualX element:', actualX);
+
+    // Load position data with fallback to old property names
+    if (programmedX) programmedX.value = tool.programmedX || tool.fiducialX || 0;
+    if (document.getElementById('programmedY')) document.getElementById('programmedY').value = tool.programmedY || tool.fiducialY || 0;
+    if (document.getElementById('programmedZ')) document.getElementById('programmedZ').value = tool.programmedZ || tool.fiducialZ || 0;
+
+    if (actualX) actualX.value = tool.actualX || 0;
+    if (document.getElementById('actualY')) document.getElementById('actualY').value = tool.actualY || 0;
+
+    // Load Z offset
+    const zOffset = document.getElementById('zOffset');
+    if (zOffset) zOffset.value = tool.zOffset || 0;
+
+
+    // Load dispenser-specific data
+    const linearActuator = document.getElementById('linearActuator');
+    if (linearActuator) linearActuator.value = tool.linearActuator || 0;
+
+    console.log('About to call updateFormFields');
+    updateFormFields();
+
+    console.log('About to show modal');
+    modal.style.display = 'block';
+    console.log('Modal display style set to block');
+}
+
+
+// Enhanced loadToolsFromBackend function
+
+
+// Test function to debug tool list
+function debugToolList() {
+    console.log('=== TOOL DEBUG INFO ===');
+    console.log('Current tools array:', tools);
+    console.log('Tools array length:', tools.length);
+    console.log('Tools array type:', typeof tools);
+    console.log('Is tools an array?', Array.isArray(tools));
+
+    const toolListElement = document.getElementById('toolList');
+    console.log('Tool list element exists?', !!toolListElement);
+    console.log('Tool list innerHTML:', toolListElement ? toolListElement.innerHTML : 'N/A');
+
+    tools.forEach((tool, index) => {
+        console.log(`Tool ${index}:`, tool);
+    });
+    console.log('=== END DEBUG INFO ===');
+}
+
+
+function closeToolModal() {
+    document.getElementById('toolModal').style.display = 'none';
+    currentEditingTool = null;
+
+    // Clear basic form fields - check if they exist first
+    const basicFields = [
+        { id: 'toolName', value: '' },
+        { id: 'toolId', value: '' },
+        { id: 'toolType', value: 'extruder' }
+    ];
+
+    basicFields.forEach(field => {
+        const element = document.getElementById(field.id);
+        if (element) {
+            element.value = field.value;
+        }
+    });
+
+    // Clear checkbox
+    const isReferenceElement = document.getElementById('isReference');
+    if (isReferenceElement) {
+        isReferenceElement.checked = false;
+    }
+
+    // Clear position fields if they exist
+    const positionFields = ['programmedX', 'programmedY', 'programmedZ', 'actualX', 'actualY', 'zOffset', 'linearActuator'];
+    positionFields.forEach(fieldId => {
+        const element = document.getElementById(fieldId);
+        if (element) {
+            element.value = '0';
+        }
+    });
+
+    // Reset offset display if elements exist
+    const offsetElements = ['calcOffsetX', 'calcOffsetY', 'calcOffsetZ'];
+    offsetElements.forEach(elementId => {
+        const element = document.getElementById(elementId);
+        if (element) {
+            element.textContent = '0.000';
+        }
+    });
+}
+
+
+
+
+// Updated JavaScript functions for simplified tool management
+
+function editSelectedTool() {
+    const selectedId = parseInt(document.getElementById('currentTool').value);
+    editTool(selectedId);
+}
+
+function addNewTool() {
+    currentEditingTool = null;
+    document.getElementById('modalTitle').textContent = 'Add New Tool';
+    document.getElementById('toolName').value = '';
+
+    // Find next available ID
+    const existingIds = tools.map(t => t.id);
+    let nextId = 0;
+    while (existingIds.includes(nextId)) {
+        nextId++;
+    }
+
+    document.getElementById('toolId').value = nextId;
+    document.getElementById('toolType').value = 'extruder';
+    document.getElementById('isReference').checked = false;
+    document.getElementById('fiducialX').value = '0';
+    document.getElementById('fiducialY').value = '0';
+    document.getElementById('fiducialZ').value = '0';
+
+    updateOffsetDisplay();
+    document.getElementById('toolModal').style.display = 'block';
+}
+
+
+function updateSelectedToolInfo() {
+    const currentToolSelect = document.getElementById('currentTool');
+    if (!currentToolSelect) {
+        console.error('currentTool select element not found');
+        return;
+    }
+
+    const selectedId = parseInt(currentToolSelect.value);
+    const selectedTool = tools.find(t => t.id === selectedId);
+
+    if (selectedTool) {
+        const nameElement = document.getElementById('selectedToolName');
+        const typeElement = document.getElementById('selectedToolType');
+        const offsetsElement = document.getElementById('selectedToolOffsets');
+
+        if (nameElement) nameElement.textContent = selectedTool.name;
+        if (typeElement) typeElement.textContent = selectedTool.type;
+
+        if (offsetsElement) {
+            if (selectedTool.type === 'camera' && !selectedTool.isReference) {
+                offsetsElement.textContent = 'Imaging Tool (No Positions)';
+            } else if (selectedTool.isReference) {
+                offsetsElement.textContent = 'Reference Tool (No Offsets)';
+            } else {
+                // Check which technique we're using
+                const cameraReference = tools.find(t => t.type === 'camera' && t.isReference);
+
+                if (cameraReference) {
+                    // Technique 2: Camera is reference - offsets = tool_programmed - camera_fiducial
+                    const toolProgrammedX = selectedTool.programmedX || selectedTool.fiducialX || 0;
+                    const toolProgrammedY = selectedTool.programmedY || selectedTool.fiducialY || 0;
+                    const toolProgrammedZ = selectedTool.programmedZ || selectedTool.fiducialZ || 0;
+
+                    const cameraFiducialX = cameraReference.programmedX || cameraReference.fiducialX || 0;
+                    const cameraFiducialY = cameraReference.programmedY || cameraReference.fiducialY || 0;
+                    const cameraFiducialZ = cameraReference.programmedZ || cameraReference.fiducialZ || 0;
+
+                    // Corrected calculation: tool_programmed - camera_fiducial
+                    const offsetX = toolProgrammedX - cameraFiducialX;
+                    const offsetY = toolProgrammedY - cameraFiducialY;
+                    const offsetZ = toolProgrammedZ - cameraFiducialZ;
+
+                    offsetsElement.textContent =
+                        `X${offsetX.toFixed(3)} Y${offsetY.toFixed(3)} Z${offsetZ.toFixed(3)}`;
+                } else {
+                    // Technique 1: Use actual - programmed logic
+                    const programmedX = selectedTool.programmedX || selectedTool.fiducialX || 0;
+                    const programmedY = selectedTool.programmedY || selectedTool.fiducialY || 0;
+                    const programmedZ = selectedTool.programmedZ || selectedTool.fiducialZ || 0;
+
+                    const actualX = selectedTool.actualX || 0;
+                    const actualY = selectedTool.actualY || 0;
+                    const zOffsetInput = selectedTool.zOffset || 0;
+
+                    const offsetX = actualX - programmedX;
+                    const offsetY = actualY - programmedY;
+
+                    const referenceTool = tools.find(t => t.isReference === true);
+                    let offsetZ = zOffsetInput;
+
+                    if (referenceTool && (referenceTool.programmedZ !== undefined || referenceTool.fiducialZ !== undefined)) {
+                        const referenceZ = referenceTool.programmedZ || referenceTool.fiducialZ || 0;
+                        offsetZ += (referenceZ - programmedZ);
+                    }
+
+                    offsetsElement.textContent =
+                        `X${offsetX.toFixed(3)} Y${offsetY.toFixed(3)} Z${offsetZ.toFixed(3)}`;
+                }
+            }
+        }
+
+        // Enable edit button for all tools
+        const editBtn = document.querySelector('.edit-tool-btn');
+        const deleteBtn = document.querySelector('.delete-tool-btn');
+
+        if (editBtn) {
+            editBtn.disabled = false;
+            editBtn.style.opacity = '1';
+        }
+
+        if (deleteBtn) {
+            deleteBtn.disabled = selectedTool.isReference;
+            deleteBtn.style.opacity = selectedTool.isReference ? '0.5' : '1';
+        }
+    }
+}
+
+
+function deleteSelectedTool() {
+    const selectedId = parseInt(document.getElementById('currentTool').value);
+    const selectedTool = tools.find(t => t.id === selectedId);
+
+    if (selectedTool && selectedTool.type === 'camera') {
+        alert('Cannot delete the camera tool - it is the reference tool.');
+        return;
+    }
+
+    if (confirm(`Are you sure you want to delete "${selectedTool.name}"?`)) {
+        deleteTool(selectedId);
+    }
+}
+
+
+function updateToolDropdown() {
+    const currentToolSelect = document.getElementById('currentTool');
+    if (!currentToolSelect) return;
+
+    const currentValue = currentToolSelect.value;
+    currentToolSelect.innerHTML = '';
+
+    tools.forEach(tool => {
+        const option = document.createElement('option');
+        option.value = tool.id;
+        option.textContent = tool.name;
+        currentToolSelect.appendChild(option);
+    });
+
+    if (Array.from(currentToolSelect.options).some(opt => opt.value === currentValue)) {
+        currentToolSelect.value = currentValue;
+    }
+
+    updateSelectedToolInfo();
+
+    currentToolSelect.onchange = function() {
+        updateSelectedToolInfo();
+    };
+}
+
+
+function saveTool() {
+    console.log('=== SAVE TOOL DEBUG START ===');
+
+    const toolData = {
+        id: parseInt(document.getElementById('toolId').value),
+        name: document.getElementById('toolName').value,
+        type: document.getElementById('toolType').value,
+        isReference: document.getElementById('isReference').checked
+    };
+
+    console.log('Tool type:', toolData.type);
+    console.log('Is reference:', toolData.isReference);
+
+    if (toolData.type === 'camera' && toolData.isReference) {
+        console.log('Processing camera reference tool');
+
+        // Check if form elements exist
+        const progX = document.getElementById('programmedX');
+        const progY = document.getElementById('programmedY');
+        const progZ = document.getElementById('programmedZ');
+
+        console.log('Form elements found:', {
+            programmedX: !!progX,
+            programmedY: !!progY,
+            programmedZ: !!progZ
+        });
+
+        if (progX) {
+            console.log('programmedX value:', progX.value);
+            toolData.programmedX = parseFloat(progX.value) || 0;
+            toolData.fiducialX = parseFloat(progX.value) || 0;
+        }
+
+        if (progY) {
+            console.log('programmedY value:', progY.value);
+            toolData.programmedY = parseFloat(progY.value) || 0;
+            toolData.fiducialY = parseFloat(progY.value) || 0;
+        }
+
+        if (progZ) {
+            console.log('programmedZ value:', progZ.value);
+            toolData.programmedZ = parseFloat(progZ.value) || 0;
+            toolData.fiducialZ = parseFloat(progZ.value) || 0;
+        }
+    }
+
+    console.log('Final toolData for camera:', toolData);
+
+    // Continue with rest of save logic...
+
+    // If this tool is set as reference, unset all others
+    if (toolData.isReference) {
+        tools.forEach(tool => {
+            if (tool.id !== toolData.id) {
+                tool.isReference = false;
+            }
+        });
+    }
+
+    // Update tools array
+    if (currentEditingTool !== null) {
+        const index = tools.findIndex(t => t.id === currentEditingTool);
+        if (index !== -1) {
+            tools[index] = toolData;
+            console.log('Updated tool in array:', tools[index]);
+        }
+    }
+
+    console.log('=== SAVE TOOL DEBUG END ===');
+
+    updateToolDropdown();
+    closeToolModal();
+
+    // Save to backend
+    fetch('/api/tools/save', {
+        method: 'POST',
+        headers: {'Content-Type': 'application/json'},
+        body: JSON.stringify({tools: tools})
+    })
+    .then(response => response.json())
+    .then(data => {
+        console.log('Backend response:', data);
+    });
+}
+
+
+// Updated deleteTool function
+function deleteTool(toolId) {
+    const tool = tools.find(t => t.id === toolId);
+    if (tool && tool.type === 'camera') {
+        alert('Cannot delete the camera tool - it is the reference tool.');
+        return;
+    }
+
+    tools = tools.filter(t => t.id !== toolId);
+    updateToolDropdown();
+
+    // Save to backend
+    fetch('/api/tools/save', {
+        method: 'POST',
+        headers: {'Content-Type': 'application/json'},
+        body: JSON.stringify({tools: tools})
+    });
+}
+
+// Updated loadToolsFromBackend function
+
+
+function loadToolsFromBackend() {
+    fetch('/api/tools/load')
+        .then(response => response.json())
+        .then(data => {
+            if (data.status === 'success') {
+                tools = data.tools || [];
+                updateToolDropdown();
+            } else {
+                // Use default tools with fiducial structure if backend fails
+                tools = [
+                    {id: 0, name: "Camera Tool (C0)", type: "camera", fiducialX: 0, fiducialY: 0, fiducialZ: 0, isReference: true},
+                    {id: 1, name: "Extruder 1 (E0)", type: "extruder", fiducialX: 0, fiducialY: 0, fiducialZ: 0, isReference: false},
+                    {id: 2, name: "Extruder 2 (E1)", type: "extruder", fiducialX: 0, fiducialY: 0, fiducialZ: 0, isReference: false},
+                    {id: 3, name: "Liquid Dispenser (L0)", type: "dispenser", fiducialX: 0, fiducialY: 0, fiducialZ: 0, isReference: false}
+                ];
+                updateToolDropdown();
+            }
+        })
+        .catch(error => {
+            console.error('Error loading tools:', error);
+            // Use default tools with fiducial structure if request fails
+            tools = [
+                {id: 0, name: "Camera Tool (C0)", type: "camera", fiducialX: 0, fiducialY: 0, fiducialZ: 0, isReference: true},
+                {id: 1, name: "Extruder 1 (E0)", type: "extruder", fiducialX: 0, fiducialY: 0, fiducialZ: 0, isReference: false},
+                {id: 2, name: "Extruder 2 (E1)", type: "extruder", fiducialX: 0, fiducialY: 0, fiducialZ: 0, isReference: false},
+                {id: 3, name: "Liquid Dispenser (L0)", type: "dispenser", fiducialX: 0, fiducialY: 0, fiducialZ: 0, isReference: false}
+            ];
+            updateToolDropdown();
+        });
+}
+
+function toggleTutorial() {
+    const content = document.getElementById('tutorial-content');
+    const arrow = document.getElementById('tutorial-arrow');
+
+    if (content.style.display === 'none') {
+        content.style.display = 'block';
+        arrow.classList.add('tutorial-arrow-up');
+    } else {
+        content.style.display = 'none';
+        arrow.classList.remove('tutorial-arrow-up');
+    }
+}
@@ -0,0 +1,16 @@
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+for module in ("flask", "paho.mqtt.client", "requests", "numpy"):
+    pytest.importorskip(module)
+
+
+@pytest.fixture(scope="session")
+def camera():
+    """The camera service module, imported once for the whole run"""
+    import camera_flask_mqtt
+    return camera_flask_mqtt
@@ -0,0 +1,166 @@
+"""Closed-loop tool offset calibration with a simulated printer and camera"""
+import re
+import types
+
+import pytest
+
+
+class FakeRig:
+    """Toolhead that follows G1 moves and a camera that measures its error"""
+
+    def __init__(self, targets, score=0.95):
+        self.targets = targets
+        self.score = score
+        self.position = {"x": 0.0, "y": 0.0, "z": 3.0}
+        self.loaded = None
+        self.events = []
+
+    def run_gcode_script(self, script, timeout=None):
+        for line in script.splitlines():
+            if line.startswith("LOAD_TOOL"):
+                self.loaded = line.split("=")[1]
+                self.events.append(("load", self.loaded))
+            elif line.startswith("G1"):
+                for axis, value in re.findall(r"([XY])(-?[\d.]+)", line):
+                    self.position[axis.lower()] = float(value)
+                self.events.append(("move", self.loaded))
+        return True
+
+    def wait_for_frame_after(self, timestamp, timeout=3.0):
+        self.events.append(("frame", self.loaded))
+        return types.SimpleNamespace(array=None, timestamp=timestamp)
+
+    def measure_fiducial_error(self, frame, display_size=None):
+        self.events.append(("analyse", self.loaded))
+        if self.score < 0.8:
+            raise RuntimeError(f"Target not found reliably (score {self.score})")
+        target_x, target_y = self.targets[self.loaded]
+        # Fixed camera geometry, the nozzle is seen offset the other way
+        dx = self.position["x"] - target_x
+        dy = self.position["y"] - target_y
+        return dx, dy, dict(self.position), {"score": self.score}
+
+
+TOOLS = [
+    {"id": 1, "name": "Extruder (E0)", "type": "extruder", "isReference": True,
+     "fiducialX": "100.0", "fiducialY": "50", "fiducialZ": 3.0},
+    {"id": 2, "name": "Extruder (E1)", "type": "extruder", "isReference": False,
+     "fiducialX": 0.0, "fiducialY": 0.0, "fiducialZ": 3.0},
+]
+
+
+@pytest.fixture
+def rig(camera, monkeypatch):
+    rig = FakeRig({"e0": (100.4, 49.7), "e1": (120.25, 60.5)})
+    registry = camera.ToolRegistry()
+    registry.rebuild(TOOLS)
+    saved = []
+    monkeypatch.setattr(camera, "AUTO_CALIBRATION_FIXED_CAMERA", True)
+    monkeypatch.setattr(camera, "STREAM_ACTIVE", True)
+    monkeypatch.setattr(camera, "tool_registry", registry)
+    monkeypatch.setattr(camera, "tools_config", {"tools": [dict(t) for t in TOOLS], "reference_tool_id": 1})
+    monkeypatch.setattr(camera, "update_tools", saved.append)
+    monkeypatch.setattr(camera, "publish_status", lambda *a, **k: None)
+    monkeypatch.setattr(camera, "run_gcode_script", rig.run_gcode_script)
+    monkeypatch.setattr(camera, "luma_frames", rig)
+    monkeypatch.setattr(camera, "measure_fiducial_error", rig.measure_fiducial_error)
+    monkeypatch.setattr(camera, "get_cached_printer_position", lambda: (dict(rig.position), 0.0))
+    rig.saved = saved
+    camera.auto_calibration_cancel.clear()
+    return rig
+
+
+def _options(**overrides):
+    options = {"tolerance": 0.02, "max_iterations": 6, "feedrate": 6000, "settle_time": 0.0,
+               "display_size": None, "skip_tool_change": False}
+    options.update(overrides)
+    return options
+
+
+def test_worker_converges_each_tool_in_order(camera, rig):
+    camera.auto_calibration_worker([2, 1], _options())
+
+    state = camera.get_auto_calibration_state()
+    assert state["state"] == "complete"
+    fiducials = {tool["id"]: (tool["fiducialX"], tool["fiducialY"]) for tool in rig.saved[0]}
+    assert fiducials == {1: (100.4, 49.7), 2: (120.25, 60.5)}
+
+    # Reference tool first, and the next tool change only after the
+    # previous tool's last frame was analysed
+    loads = [i for i, event in enumerate(rig.events) if event[0] == "load"]
+    assert [rig.events[i][1] for i in loads] == ["e0", "e1"]
+    last_e0 = max(i for i, event in enumerate(rig.events) if event[1] == "e0")
+    assert rig.events[last_e0] == ("analyse", "e0")
+    assert last_e0 < loads[1]
+
+
+def test_tool_change_goes_to_the_estimate(camera, rig):
+    camera.auto_calibration_worker([1], _options())
+
+    # LOAD_TOOL plus the move to the string fiducial, then one correction
+    assert rig.events[:4] == [("load", "e0"), ("move", "e0"), ("frame", "e0"), ("analyse", "e0")]
+    assert rig.events[4] == ("move", "e0")
+
+
+def test_low_score_fails_the_tool_without_saving(camera, rig):
+    rig.score = 0.5
+    camera.auto_calibration_worker([1, 2], _options())
+
+    state = camera.get_auto_calibration_state()
+    assert state["state"] == "partial"
+    assert state["tools"]["1"]["state"] == "failed"
+    assert "score" in state["tools"]["1"]["message"]
+    assert rig.saved == []
+
+
+def test_measure_fiducial_error_rejects_weak_and_invalid_matches(camera, monkeypatch):
+    frame = types.SimpleNamespace(array=None, timestamp=0.0)
+    detection = {"found": True, "valid": True, "score": 0.6, "pixel_x": 1, "pixel_y": 1,
+                 "frame_width": 2, "frame_height": 2}
+    monkeypatch.setattr(camera, "detect_fiducial", lambda array: dict(detection))
+    with pytest.raises(RuntimeError, match="not found reliably"):
+        camera.measure_fiducial_error(frame)
+
+    detection.update(score=1.0, valid=False)
+    with pytest.raises(RuntimeError, match="invalid"):
+        camera.measure_fiducial_error(frame)
+
+
+def test_tool_fiducial_coerces_strings_and_keeps_zero(camera):
+    assert camera._tool_fiducial({"fiducialX": "12.5", "fiducialY": "0"}) == (12.5, 0.0)
+    assert camera._tool_fiducial({"fiducialX": 0.0, "fiducialY": 0.0}) == (0.0, 0.0)
+    assert camera._tool_fiducial({"fiducialX": "", "fiducialY": 4}) is None
+    assert camera._tool_fiducial({}) is None
+    with pytest.raises(ValueError, match="non-numeric"):
+        camera._tool_fiducial({"id": 3, "fiducialX": "abc", "fiducialY": 1})
+
+
+def test_geometry_checks(camera, monkeypatch):
+    extruder = {"id": 1, "type": "extruder"}
+    camera_tool = {"id": 2, "type": "camera"}
+
+    with pytest.raises(ValueError, match="No tools"):
+        camera.check_auto_calibration_tools([])
+
+    monkeypatch.setattr(camera, "AUTO_CALIBRATION_FIXED_CAMERA", False)
+    camera.check_auto_calibration_tools([camera_tool])
+    with pytest.raises(ValueError, match="not on the carriage"):
+        camera.check_auto_calibration_tools([extruder])
+
+    monkeypatch.setattr(camera, "AUTO_CALIBRATION_FIXED_CAMERA", True)
+    camera.check_auto_calibration_tools([extruder])
+    with pytest.raises(ValueError, match="is a camera"):
+        camera.check_auto_calibration_tools([camera_tool])
+
+
+def test_api_refuses_tools_the_camera_cannot_see(camera, monkeypatch):
+    registry = camera.ToolRegistry()
+    registry.rebuild(TOOLS)
+    monkeypatch.setattr(camera, "tool_registry", registry)
+    monkeypatch.setattr(camera, "AUTO_CALIBRATION_FIXED_CAMERA", False)
+    client = camera.app.test_client()
+
+    response = client.post("/api/tools/auto_calibrate", json={"tools": [1]})
+    assert response.get_json()["status"] == "error"
+    assert "not on the carriage" in response.get_json()["message"]
+    assert camera.auto_calibration_thread is None or not camera.auto_calibration_thread.is_alive()
@@ -0,0 +1,47 @@
+"""Calibration settings file and append-only history log"""
+import json
+
+import pytest
+
+
+@pytest.fixture
+def calibration_files(camera, tmp_path, monkeypatch):
+    settings = tmp_path / "calibration.json"
+    history = tmp_path / "calibration_history.jsonl"
+    monkeypatch.setattr(camera, "CALIBRATION_FILE", str(settings))
+    monkeypatch.setattr(camera, "CALIBRATION_HISTORY_FILE", str(history))
+    monkeypatch.setattr(camera, "calibration_data", {
+        "microns_per_pixel_x": 10.0, "microns_per_pixel_y": 10.0,
+        "reference_points": [], "enabled": True, "scaler_measurements": []
+    })
+    return settings, history
+
+
+def _point(index):
+    return {"pixel_x": index, "pixel_y": index, "printer_x": index / 10, "printer_y": index / 10}
+
+
+def test_history_replayed_without_settings_file(camera, calibration_files):
+    settings, history = calibration_files
+    history.write_text("".join(json.dumps({"type": "reference_point", "data": _point(i)}) + "\n"
+                               for i in range(3)))
+    assert not settings.exists()
+
+    camera.load_calibration_data()
+
+    assert camera.calibration_data["reference_points"] == [_point(i) for i in range(3)]
+    assert camera.calibration_data["enabled"] is True
+
+
+def test_history_appends_survive_reload(camera, calibration_files):
+    settings, history = calibration_files
+    assert camera.add_calibration_history("reference_point", _point(1))
+    assert camera.add_calibration_history("scaler_measurement", {"microns_per_pixel": 9.5})
+    assert camera.save_calibration_data()
+
+    camera.calibration_data = {"reference_points": [], "scaler_measurements": []}
+    camera.load_calibration_data()
+
+    assert camera.calibration_data["reference_points"] == [_point(1)]
+    assert camera.calibration_data["scaler_measurements"] == [{"microns_per_pixel": 9.5}]
+    assert "reference_points" not in json.loads(settings.read_text())
@@ -0,0 +1,117 @@
+"""?wait parsing and waiter limits on the capture job routes"""
+import asyncio
+
+import pytest
+
+
+@pytest.fixture
+def waits(camera, monkeypatch):
+    """Fake capture jobs, records the timeout every wait was called with"""
+    calls = []
+    job = {"id": "job1", "state": "done"}
+    
+    def wait(job_id, timeout=None):
+        calls.append(timeout)
+        return job
+    
+    monkeypatch.setattr(camera, "submit_capture", lambda tag=None, profile=None: dict(job, state="queued"))
+    monkeypatch.setattr(camera, "submit_focus_sweep", lambda **kwargs: dict(job, state="queued"))
+    monkeypatch.setattr(camera.capture_jobs, "wait", wait)
+    monkeypatch.setattr(camera.capture_jobs, "get", lambda job_id: job)
+    return calls
+
+
+@pytest.fixture
+def client(camera):
+    return camera.app.test_client()
+
+
+@pytest.mark.parametrize("url", ["/api/capture", "/api/capture/job1", "/api/focus/sweep"])
+@pytest.mark.parametrize("value", ["abc", "nan", "1,5"])
+def test_invalid_wait_is_rejected(client, waits, url, value):
+    method = client.post if url == "/api/focus/sweep" else client.get
+    response = method(f"{url}?wait={value}")
+    assert response.status_code == 400
+    assert response.get_json()["status"] == "error"
+    assert waits == []
+
+
+@pytest.mark.parametrize("value, expected", [("2.5", 2.5), ("1e9", 60.0), ("inf", 60.0), ("-3", None)])
+def test_wait_is_clamped(camera, client, waits, value, expected):
+    response = client.get(f"/api/capture?wait={value}")
+    assert response.status_code == 200
+    # A clamped wait of zero answers straight away without waiting
+    assert waits == ([] if expected is None else [expected])
+    assert expected is None or expected <= camera.CAPTURE_MAX_WAIT
+
+
+def test_no_wait_returns_immediately(client, waits):
+    response = client.get("/api/capture/job1")
+    assert response.status_code == 200
+    assert waits == []
+
+
+def test_extra_waiters_are_rejected(camera, client, waits, monkeypatch):
+    slots = camera.threading.BoundedSemaphore(1)
+    monkeypatch.setattr(camera, "capture_wait_slots", slots)
+    monkeypatch.setattr(camera, "CAPTURE_MAX_WAITERS", 1)
+    assert slots.acquire(blocking=False)
+    try:
+        for url, method in (("/api/capture", client.get), ("/api/capture/job1", client.get),
+                            ("/api/focus/sweep", client.post)):
+            response = method(f"{url}?wait=5")
+            assert response.status_code == 503
+        # Requests without ?wait never need a slot
+        assert client.get("/api/capture/job1").status_code == 200
+    finally:
+        slots.release()
+
+    assert client.get("/api/capture?wait=5").status_code == 200
+    # The slot is handed back after the wait
+    assert slots.acquire(blocking=False)
+    slots.release()
+
+
+async def _asgi_get(camera, path, query=b""):
+    sent = []
+
+    async def receive():
+        return {"type": "http.request", "body": b"", "more_body": False}
+
+    async def send(message):
+        sent.append(message)
+
+    scope = {"type": "http", "method": "GET", "path": path, "query_string": query,
+             "headers": [], "server": ("localhost", 8080)}
+    await camera.asgi_app(scope, receive, send)
+    return sent[0]["status"]
+
+
+def test_asgi_routes_answer_while_waiters_block(camera, monkeypatch):
+    release = camera.threading.Event()
+    monkeypatch.setattr(camera, "ASGI_EXECUTOR_WORKERS", 1)
+    monkeypatch.setattr(camera, "CAPTURE_MAX_WAITERS", 2)
+    monkeypatch.setattr(camera, "capture_wait_slots", camera.threading.BoundedSemaphore(2))
+    monkeypatch.setattr(camera, "asgi_executor", None)
+    monkeypatch.setattr(camera.capture_jobs, "wait", lambda job_id, timeout=None: release.wait(5) and {"id": job_id})
+    monkeypatch.setattr(camera.capture_jobs, "get", lambda job_id: {"id": job_id, "state": "done"})
+
+    async def scenario():
+        waiters = [asyncio.ensure_future(_asgi_get(camera, "/api/capture/job1", b"wait=30"))
+                   for _ in range(3)]
+        await asyncio.sleep(0.2)
+        # The third waiter is turned away, a plain request still gets a thread
+        rejected = [w for w in waiters if w.done()]
+        quick = await asyncio.wait_for(_asgi_get(camera, "/api/capture/job1"), timeout=2.0)
+        release.set()
+        statuses = await asyncio.gather(*waiters)
+        return [w.result() for w in rejected], quick, sorted(statuses)
+
+    try:
+        rejected, quick, statuses = asyncio.run(scenario())
+    finally:
+        release.set()
+        camera.asgi_executor.shutdown(wait=True)
+    assert rejected == [503]
+    assert quick == 200
+    assert statuses == [200, 200, 503]
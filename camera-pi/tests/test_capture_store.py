@@ -0,0 +1,104 @@
+"""Capture file naming, the SQLite capture index and capture profile storage"""
+import json
+import threading
+import types
+
+import pytest
+
+
+def test_capture_timestamps_are_unique_and_ordered(camera):
+    stamps = []
+    lock = threading.Lock()
+
+    def take():
+        for _ in range(200):
+            stamp = camera.capture_timestamp()
+            with lock:
+                stamps.append(stamp)
+
+    threads = [threading.Thread(target=take) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert len(set(stamps)) == len(stamps)
+    single = [camera.capture_timestamp() for _ in range(50)]
+    assert single == sorted(single)
+
+
+def test_stream_frames_in_the_same_second_get_their_own_files(camera, tmp_path, monkeypatch):
+    monkeypatch.setattr(camera, "CAPTURE_DIR", str(tmp_path))
+    store = camera.CaptureStore(str(tmp_path / "index.db"), str(tmp_path))
+    monkeypatch.setattr(camera, "save_capture_metadata",
+                        lambda filename, ts, **kw: store.add({"filename": filename.rsplit("/", 1)[-1],
+                                                              "timestamp": "now"}))
+    for seq in range(5):
+        frame = types.SimpleNamespace(data=b"jpeg%d" % seq, seq=7, timestamp=0.0)
+        camera.save_stream_frame(frame)
+
+    files = sorted(p.name for p in tmp_path.glob("capture_*.jpg"))
+    assert len(files) == 5
+    assert len(store.query(limit=10)) == 5
+
+
+@pytest.fixture
+def store(camera, tmp_path, monkeypatch):
+    monkeypatch.setattr(camera, "CAPTURE_DIR", str(tmp_path))
+    store = camera.CaptureStore(str(tmp_path / "index.db"), str(tmp_path))
+    monkeypatch.setattr(camera, "capture_store", store)
+    return store
+
+
+def _add(store, name, size, created):
+    return store.add({"filename": name, "timestamp": "t"}, created=created, size=size)
+
+
+def _summed(store):
+    return store._db.execute("SELECT COALESCE(SUM(size), 0) FROM captures").fetchone()[0]
+
+
+def test_total_size_tracks_add_replace_and_remove(camera, store, tmp_path):
+    _add(store, "capture_a.jpg", 100, 1.0)
+    _add(store, "capture_b.jpg", 250, 2.0)
+    _add(store, "capture_a.jpg", 40, 3.0)
+    assert store.total_size() == _summed(store) == 290
+
+    store.remove("capture_b.jpg")
+    store.remove("capture_missing.jpg")
+    assert store.total_size() == _summed(store) == 40
+
+    reopened = camera.CaptureStore(str(tmp_path / "index.db"), str(tmp_path))
+    assert reopened.total_size() == 40
+
+
+def test_retention_deletes_oldest_until_under_quota(camera, store):
+    for index in range(6):
+        _add(store, f"capture_{index}.jpg", 100, float(index + 1))
+    manager = camera.RetentionManager(max_bytes=350, max_age_days=0)
+
+    assert manager.enforce() == 3
+    assert store.total_size() == _summed(store) == 300
+    assert [c["filename"] for c in store.oldest()] == ["capture_3.jpg", "capture_4.jpg", "capture_5.jpg"]
+    assert manager.enforce() == 0
+
+
+def test_capture_profiles_saved_atomically(camera, tmp_path, monkeypatch):
+    path = tmp_path / "capture_profiles.json"
+    monkeypatch.setattr(camera, "CAPTURE_PROFILES_FILE", str(path))
+    monkeypatch.setattr(camera, "CAPTURE_PROFILES", {k: dict(v) for k, v in camera.CAPTURE_PROFILES.items()})
+
+    def writer(worker):
+        for step in range(20):
+            camera.save_capture_profile(f"p{worker}", {"quality": 50 + step, "roi": [0, 0, 0.5, 0.5]})
+
+    threads = [threading.Thread(target=writer, args=(i,)) for i in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert [p.name for p in tmp_path.iterdir()] == ["capture_profiles.json"]
+    saved = json.loads(path.read_text())
+    assert sorted(saved) == ["p0", "p1", "p2", "p3"]
+    assert all(profile["quality"] == 69 for profile in saved.values())
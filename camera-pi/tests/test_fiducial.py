@@ -0,0 +1,46 @@
+"""Fiducial detection on the NumPy matcher used when OpenCV is missing"""
+import io
+
+import numpy as np
+import pytest
+
+TRUE_X, TRUE_Y = 650.3, 371.7
+
+
+@pytest.fixture
+def no_opencv(camera, monkeypatch):
+    monkeypatch.setattr(camera, "cv2", None)
+
+
+def noisy_frame(seed=1):
+    rng = np.random.default_rng(seed)
+    yy, xx = np.mgrid[0:720, 0:1280]
+    distance = np.hypot(xx - TRUE_X, yy - TRUE_Y)
+    # Dark disk of FIDUCIAL_RADIUS_PX with an anti-aliased edge on a bright bed
+    image = 200.0 - 120.0 * np.clip(20.5 - distance, 0.0, 1.0) + rng.normal(0.0, 8.0, distance.shape)
+    return np.clip(image, 0, 255).astype(np.uint8)
+
+
+def assert_located(result):
+    assert result["found"]
+    assert result["valid"]
+    assert 0.0 < result["score"] <= 1.0
+    assert abs(result["pixel_x"] - TRUE_X) < 0.5
+    assert abs(result["pixel_y"] - TRUE_Y) < 0.5
+
+
+def test_detect_fiducial_noisy_frame(camera, no_opencv):
+    assert_located(camera.detect_fiducial(noisy_frame()))
+
+
+def test_detect_fiducial_jpeg_frame(camera, no_opencv):
+    Image = pytest.importorskip("PIL.Image")
+    buffer = io.BytesIO()
+    Image.fromarray(noisy_frame(seed=2)).save(buffer, "JPEG", quality=80)
+    assert_located(camera.detect_fiducial(buffer.getvalue()))
+
+
+def test_flat_frame_is_not_a_match(camera, no_opencv):
+    result = camera.detect_fiducial(np.full((720, 1280), 128, dtype=np.uint8))
+    assert not result["found"]
+    assert -1.0 <= result["score"] <= 1.0
@@ -0,0 +1,85 @@
+"""Focus sweep range checks, focus mode handling and the focus cache file"""
+import threading
+import types
+
+import pytest
+
+
+@pytest.fixture
+def lens(camera, monkeypatch):
+    """Lens whose sharpness peaks at 7.3, frames carry the lens position"""
+    cached = []
+    monkeypatch.setattr(camera, "FOCUS_MODE", "auto")
+    monkeypatch.setattr(camera, "FOCUS_POSITION", 10)
+    monkeypatch.setattr(camera, "apply_stream_focus", lambda: None)
+    monkeypatch.setattr(camera, "ensure_stream_running", lambda: True)
+    monkeypatch.setattr(camera, "luma_frames", types.SimpleNamespace(
+        wait_for_frame_after=lambda ts, timeout=3.0: types.SimpleNamespace(array=camera.FOCUS_POSITION,
+                                                                            timestamp=ts)))
+    monkeypatch.setattr(camera, "frame_sharpness", lambda array, roi=None: 100 - (array - 7.3) ** 2)
+    monkeypatch.setattr(camera, "current_focus_target", lambda: ("e0", 1.0))
+    monkeypatch.setattr(camera.focus_cache, "put", lambda tool, z, position, *a: cached.append(position))
+    return cached
+
+
+def test_sweep_restores_auto_mode_and_caches_best(camera, lens):
+    result = camera.focus_sweep(start=0, stop=20, steps=5)
+
+    assert abs(result["best_position"] - 7.3) < 0.2
+    assert lens == [result["best_position"]]
+    assert camera.FOCUS_MODE == "auto"
+
+
+def test_sweep_keeps_manual_mode_at_best_position(camera, lens, monkeypatch):
+    monkeypatch.setattr(camera, "FOCUS_MODE", "manual")
+    result = camera.focus_sweep(start=0, stop=20, steps=2)
+
+    assert camera.FOCUS_MODE == "manual"
+    assert camera.FOCUS_POSITION == result["best_position"]
+
+
+def test_failed_sweep_restores_auto_mode(camera, lens, monkeypatch):
+    monkeypatch.setattr(camera, "luma_frames", types.SimpleNamespace(
+        wait_for_frame_after=lambda ts, timeout=3.0: None))
+    with pytest.raises(RuntimeError):
+        camera.focus_sweep(start=0, stop=20, steps=5)
+    assert camera.FOCUS_MODE == "auto"
+
+
+@pytest.mark.parametrize("start, stop, steps", [(10, 10, 5), (20, 5, 5), (0, 20, 1), (0, 20, 0)])
+def test_degenerate_sweeps_are_rejected(camera, monkeypatch, start, stop, steps):
+    with pytest.raises(ValueError):
+        camera.focus_sweep_range(start, stop, steps)
+
+    submitted = []
+    monkeypatch.setattr(camera.capture_jobs, "submit", lambda *a, **k: submitted.append(a))
+    response = camera.app.test_client().post("/api/focus/sweep",
+                                             json={"start": start, "stop": stop, "steps": steps})
+    assert response.status_code == 400
+    assert submitted == []
+
+
+def test_sweep_range_defaults_and_clamps(camera):
+    assert camera.focus_sweep_range() == (camera.FOCUS_MIN, camera.FOCUS_MAX, camera.FOCUS_SWEEP_STEPS)
+    assert camera.focus_sweep_range(-5, 99, "2") == (camera.FOCUS_MIN, camera.FOCUS_MAX, 2)
+
+
+def test_focus_cache_writes_are_atomic(camera, tmp_path):
+    path = tmp_path / "focus_cache.json"
+    cache = camera.FocusCache(str(path))
+
+    def writer(tool):
+        for step in range(30):
+            cache.put(tool, step * 0.5, step)
+            if step % 7 == 0:
+                cache.invalidate(tool=tool, z=step * 0.5)
+
+    threads = [threading.Thread(target=writer, args=(f"t{i}",)) for i in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert [p.name for p in tmp_path.iterdir()] == ["focus_cache.json"]
+    reloaded = camera.FocusCache(str(path))
+    assert reloaded.to_dict()["entries"] == cache.to_dict()["entries"]
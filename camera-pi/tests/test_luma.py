@@ -0,0 +1,64 @@
+"""Shared-memory luma ring: resizing and isolation from the stream"""
+import types
+
+import numpy as np
+import pytest
+
+
+def _plane(width, height, value):
+    return np.full((height, width), value, dtype=np.uint8)
+
+
+@pytest.mark.parametrize("shared", [True, False])
+def test_resize_keeps_publishing_and_old_frames_valid(camera, tmp_path, shared):
+    path = tmp_path / "luma" if shared else tmp_path / "missing" / "luma"
+    buffer = camera.LumaFrameBuffer(path=str(path), slots=3)
+
+    buffer.publish(_plane(1280, 720, 11))
+    held = buffer.latest()
+    buffer.publish(_plane(640, 360, 22))
+    buffer.publish(_plane(640, 360, 33))
+    buffer.publish(_plane(1280, 720, 44))
+
+    latest = buffer.latest()
+    assert latest.array.shape == (720, 1280)
+    assert latest.array[0, 0] == 44 and latest.seq == 4
+    # A frame handed out before the resize still reads its own pixels
+    assert held.array.shape == (720, 1280) and int(held.array.mean()) == 11
+
+    if shared:
+        header = camera.LumaFrameBuffer.HEADER.unpack_from(path.read_bytes())
+        assert header[:4] == (b"LUMA", 3, 1280, 720)
+        assert header[5] == 4
+
+
+def test_luma_failure_does_not_fail_the_stream_frame(camera, monkeypatch):
+    backend = types.SimpleNamespace(provides_luma=False, is_running=lambda: True,
+                                    read_frame=lambda timeout=2.0: b"jpeg-bytes")
+    monkeypatch.setattr(camera, "stream_backend", backend)
+    monkeypatch.setattr(camera.luma_frames, "wanted", lambda: True)
+
+    def broken_decode(data, dtype=None):
+        raise BufferError("cannot close exported pointers exist")
+
+    monkeypatch.setattr(camera, "decode_jpeg_gray", broken_decode)
+    frames = camera.FrameRingBuffer(4)
+    monkeypatch.setattr(camera, "stream_frames", frames)
+    monkeypatch.setattr(camera, "current_frame", None)
+
+    assert camera.capture_frame() is True
+    assert camera.current_frame == b"jpeg-bytes"
+    assert bytes(frames.wait_for_frame(0, timeout=0.1).data) == b"jpeg-bytes"
+
+
+def test_restart_clears_luma_frames(camera, monkeypatch):
+    buffer = camera.LumaFrameBuffer(path="/nonexistent/luma", slots=2)
+    buffer.publish(_plane(64, 48, 5))
+    restarted = []
+    monkeypatch.setattr(camera, "luma_frames", buffer)
+    monkeypatch.setattr(camera, "stream_backend", types.SimpleNamespace(
+        is_running=lambda: True, restart=lambda: restarted.append(True) or True))
+
+    assert camera.restart_stream_backend()
+    assert restarted == [True]
+    assert buffer.latest() is None
@@ -0,0 +1,102 @@
+"""Moonraker subscription against fake_moonraker and position history lookups"""
+import time
+
+import pytest
+
+websocket = pytest.importorskip("websocket")
+
+import fake_moonraker
+
+
+def wait_for(condition, timeout=5.0):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if condition():
+            return True
+        time.sleep(0.02)
+    return False
+
+
+@pytest.fixture
+def history(camera):
+    return camera.PositionHistory(capacity=8)
+
+
+def test_position_history_interpolates_between_samples(history):
+    history.record(10.0, 0.0, 0.0, 1.0)
+    history.record(12.0, 20.0, -4.0, 1.0)
+
+    assert history.position_at(11.0) == {"x": 10.0, "y": -2.0, "z": 1.0}
+    assert history.position_at(11.5) == {"x": 15.0, "y": -3.0, "z": 1.0}
+
+
+def test_position_history_holds_outside_recorded_range(history):
+    assert history.position_at(1.0) is None
+    history.record(10.0, 1.0, 2.0, 3.0)
+    history.record(11.0, 4.0, 5.0, 6.0)
+
+    assert history.position_at(5.0) == {"x": 1.0, "y": 2.0, "z": 3.0}
+    assert history.position_at(20.0) == {"x": 4.0, "y": 5.0, "z": 6.0}
+
+
+def test_position_history_ignores_out_of_order_and_trims(history):
+    for step in range(20):
+        history.record(float(step), step, 0, 0)
+    history.record(3.0, 99.0, 0, 0)
+
+    assert history.position_at(19.0)["x"] == 19.0
+    assert history.position_at(18.5)["x"] == 18.5
+    # Only the newest samples are kept, older lookups clamp to the oldest one
+    assert history.position_at(0.0)["x"] >= 20 - 2 * 8
+
+
+@pytest.fixture
+def moonraker(camera, monkeypatch):
+    monkeypatch.setattr(camera, "MOONRAKER_RECONNECT_DELAY", 0.05)
+    monkeypatch.setattr(camera, "position_history", camera.PositionHistory())
+    server = fake_moonraker.start_fake_moonraker()
+    subscriber = camera.MoonrakerSubscriber(f"ws://127.0.0.1:{server.server_address[1]}/websocket")
+    subscriber.add_listener(camera.record_live_position)
+    assert subscriber.start()
+    yield server, subscriber
+    subscriber.stop()
+    server.shutdown()
+    server.server_close()
+    camera.position_push_live = False
+    with camera.printer_state_lock:
+        camera.printer_state.clear()
+
+
+def test_subscriber_tracks_moves_with_timestamps(camera, moonraker):
+    server, subscriber = moonraker
+    assert wait_for(lambda: subscriber.subscribed)
+
+    server.printer.move_to(x=10.0, y=20.0, z=5.0)
+    assert wait_for(lambda: camera.get_cached_printer_position()[0]["x"] == 10.0)
+    between = time.monotonic()
+    time.sleep(0.05)
+    # Dwell sample, the toolhead stood at X10 until now
+    server.printer.move_to(x=10.0)
+    time.sleep(0.05)
+    server.printer.move_to(x=30.0)
+    assert wait_for(lambda: camera.get_cached_printer_position()[0]["x"] == 30.0)
+
+    assert camera.position_push_live
+    assert camera.get_cached_printer_position() == ({"x": 30.0, "y": 20.0, "z": 5.0}, 0.0)
+    # A frame exposed before the second move maps to the first position
+    assert camera.get_position_at(between) == {"x": 10.0, "y": 20.0, "z": 5.0}
+    assert camera.get_position_at(time.monotonic())["x"] == 30.0
+
+
+def test_subscriber_reconnects_and_resubscribes(camera, moonraker):
+    server, subscriber = moonraker
+    assert wait_for(lambda: subscriber.subscribed)
+
+    server.drop_sessions()
+    assert wait_for(lambda: not camera.position_push_live)
+    assert wait_for(lambda: subscriber.subscribed and server.sessions)
+
+    server.printer.move_to(x=42.0, y=1.0)
+    assert wait_for(lambda: camera.get_cached_printer_position()[0]["x"] == 42.0)
+    assert subscriber.call("printer.gcode.script", {"script": "G1 X7"}) == "ok"
+    assert wait_for(lambda: camera.get_cached_printer_position()[0]["x"] == 7.0)
@@ -0,0 +1,120 @@
+"""Still captures while the stream is running, against stub camera binaries
+
+The stubs share a lock file the way libcamera shares the sensor: a
+libcamera-still started while libcamera-vid holds it fails.
+"""
+import os
+import stat
+import sys
+import threading
+import time
+
+import pytest
+
+VID_STUB = r'''#!{python}
+import os, signal, sys, time
+lock, log = os.environ["STUB_CAMERA_LOCK"], os.environ["STUB_CAMERA_LOG"]
+with open(log, "a") as f:
+    f.write("vid\n")
+if os.path.exists(lock):
+    sys.exit("camera busy")
+open(lock, "w").close()
+
+def release(*args):
+    if os.path.exists(lock):
+        os.remove(lock)
+    sys.exit(0)
+
+signal.signal(signal.SIGTERM, release)
+frame = b"\xff\xd8" + b"\x00" * 256 + b"\xff\xd9"
+try:
+    while True:
+        sys.stdout.buffer.write(frame)
+        sys.stdout.buffer.flush()
+        time.sleep(1 / 30.0)
+finally:
+    release()
+'''
+
+STILL_STUB = r'''#!{python}
+import os, sys, time
+lock, log = os.environ["STUB_CAMERA_LOCK"], os.environ["STUB_CAMERA_LOG"]
+if os.path.exists(lock):
+    with open(log, "a") as f:
+        f.write("still-busy\n")
+    sys.exit("camera busy")
+open(lock, "w").close()
+with open(log, "a") as f:
+    f.write("still\n")
+time.sleep(1.0)
+with open(sys.argv[sys.argv.index("--output") + 1], "wb") as f:
+    f.write(b"\xff\xd8still\xff\xd9")
+os.remove(lock)
+'''
+
+
+@pytest.fixture
+def stub_camera(camera, tmp_path, monkeypatch):
+    bin_dir = tmp_path / "bin"
+    bin_dir.mkdir()
+    for name, source in (("libcamera-vid", VID_STUB), ("libcamera-still", STILL_STUB)):
+        path = bin_dir / name
+        path.write_text(source.replace("{python}", sys.executable))
+        path.chmod(path.stat().st_mode | stat.S_IEXEC)
+    log = tmp_path / "camera.log"
+    monkeypatch.setenv("PATH", f"{bin_dir}{os.pathsep}{os.environ['PATH']}")
+    monkeypatch.setenv("STUB_CAMERA_LOCK", str(tmp_path / "camera.lock"))
+    monkeypatch.setenv("STUB_CAMERA_LOG", str(log))
+    monkeypatch.setattr(camera, "STREAM_BACKEND", camera.LibcameraVidBackend.name)
+    yield log
+    camera.stop_stream()
+
+
+def wait_for_new_frame(camera, after_seq, timeout=5.0):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        frame = camera.stream_frames.wait_for_frame(after_seq, timeout=0.2)
+        if frame is not None:
+            return frame
+    return None
+
+
+def test_still_capture_while_streaming(camera, stub_camera, tmp_path):
+    assert camera.start_stream()
+    frame = wait_for_new_frame(camera, 0)
+    assert frame is not None
+    
+    for index in range(3):
+        filename = str(tmp_path / f"still_{index}.jpg")
+        ok, _, _ = camera._run_still(filename, 100, [])
+        assert ok
+        assert os.path.exists(filename)
+        # The stream comes back on its own after every still
+        frame = wait_for_new_frame(camera, frame.seq)
+        assert frame is not None
+    
+    log = stub_camera.read_text().split()
+    assert log.count("still") == 3
+    assert "still-busy" not in log
+    # One start, then exactly one resume per still, never a restart mid-capture
+    assert log.count("vid") == 4
+
+
+def test_concurrent_backend_start_spawns_one_process(camera, stub_camera):
+    backend = camera.LibcameraVidBackend()
+    barrier = threading.Barrier(8)
+    
+    def start():
+        barrier.wait()
+        backend.start()
+    
+    threads = [threading.Thread(target=start) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    try:
+        assert backend.read_frame(timeout=5.0) is not None
+        assert stub_camera.read_text().split().count("vid") == 1
+    finally:
+        backend.stop()
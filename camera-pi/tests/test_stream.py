@@ -0,0 +1,43 @@
+"""MJPEG stream viewers and their tier reference counts"""
+import pytest
+
+
+@pytest.fixture
+def full_tier(camera, monkeypatch):
+    frames = camera.FrameRingBuffer(4)
+    tier = camera.StreamTier("full", 1, None)
+    tier.frames = frames
+    monkeypatch.setattr(camera, "stream_tiers", [tier])
+    monkeypatch.setattr(camera, "STREAM_ACTIVE", True)
+    frames.publish(b"jpeg-frame", 0.0)
+    return tier
+
+
+def test_unread_stream_response_holds_no_tier(camera, full_tier):
+    # A client gone before the first chunk, the body is never iterated
+    with camera.app.test_request_context("/stream"):
+        response = camera.stream()
+    assert full_tier.viewers == 0
+    response.close()
+    assert full_tier.viewers == 0
+
+
+def test_stream_viewer_released_when_response_closes(camera, full_tier):
+    response = camera.app.test_client().get("/stream", buffered=False)
+    body = response.response
+    first = next(iter(body))
+
+    assert first.startswith(b"--frame")
+    assert full_tier.viewers == 1
+    response.close()
+    assert full_tier.viewers == 0
+
+
+def test_viewer_close_without_open_is_harmless(camera, full_tier):
+    viewer = camera.StreamViewer()
+    viewer.close()
+    assert full_tier.viewers == 0
+    assert viewer.open() is full_tier
+    viewer.close()
+    viewer.close()
+    assert full_tier.viewers == 0
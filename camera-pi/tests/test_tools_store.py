@@ -0,0 +1,88 @@
+"""Debounced, atomic tools configuration writes"""
+import json
+import threading
+
+import pytest
+
+
+@pytest.fixture
+def tools_file(camera, tmp_path, monkeypatch):
+    path = tmp_path / "tools_config.json"
+    monkeypatch.setattr(camera, "TOOLS_CONFIG_FILE", str(path))
+    monkeypatch.setattr(camera, "TOOLS_SAVE_DELAY", 0.001)
+    monkeypatch.setattr(camera, "KLIPPER_OFFSET_PUSH", False)
+    monkeypatch.setattr(camera, "tools_config", {"tools": [], "reference_tool_id": None})
+    yield path
+    camera.flush_tools_config()
+
+
+def test_concurrent_flushes_leave_newest_config(camera, tools_file):
+    errors = []
+    
+    def writer(worker):
+        try:
+            for step in range(25):
+                tools = [{"id": worker, "name": f"Tool {worker}.{step}", "fiducialX": step,
+                          "fiducialY": 0, "fiducialZ": 0, "isReference": True}]
+                assert camera.update_tools(tools)
+                assert camera.flush_tools_config()
+        except Exception as e:
+            errors.append(e)
+    
+    threads = [threading.Thread(target=writer, args=(worker,)) for worker in range(6)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    
+    assert not errors
+    assert camera.flush_tools_config()
+    with camera.tools_config_lock:
+        expected = json.loads(json.dumps(camera.tools_config))
+    assert json.loads(tools_file.read_text()) == expected
+    assert camera.tools_saved_version == camera.tools_config_version
+    # Every writer used and renamed its own temp file
+    assert [p.name for p in tools_file.parent.iterdir()] == [tools_file.name]
+
+
+def test_debounced_save_reaches_disk(camera, tools_file):
+    assert camera.update_tools([{"id": 1, "name": "Extruder 1 (E0)", "isReference": False}])
+    camera.tools_save_timer.join(timeout=5)
+    assert json.loads(tools_file.read_text())["tools"][0]["id"] == 1
+
+
+def test_last_flagged_tool_is_the_reference(camera):
+    registry = camera.ToolRegistry()
+    registry.rebuild([
+        {"id": 0, "name": "Camera Tool (C0)", "type": "camera", "fiducialX": 1, "isReference": True},
+        {"id": 1, "name": "Extruder 1 (E0)", "type": "extruder", "fiducialX": 5, "isReference": True},
+        {"id": 2, "name": "Extruder 2 (E1)", "type": "extruder", "fiducialX": 8},
+    ])
+    assert registry.reference_id == 1
+    assert registry.offsets(2)["offsetX"] == 3.0
+
+
+def test_concurrent_push_requests_queue_one_push(camera, monkeypatch):
+    registry = camera.ToolRegistry()
+    submitted = []
+    monkeypatch.setattr(camera, "tool_registry", registry)
+    monkeypatch.setattr(camera.klipper_offset_executor, "submit", submitted.append)
+    start = threading.Barrier(8)
+
+    def schedule():
+        start.wait()
+        for _ in range(200):
+            camera.schedule_tool_offset_push()
+
+    threads = [threading.Thread(target=schedule) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert submitted == [camera._push_tool_offsets_job]
+    assert registry.push_pending
+    # Once the queued push starts, a new change needs its own push
+    registry.push_started()
+    camera.schedule_tool_offset_push()
+    assert len(submitted) == 2
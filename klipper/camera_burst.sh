@@ -0,0 +1,27 @@
+#!/bin/bash
+# Script: /home/pi/camera_burst.sh
+# Usage: camera_burst.sh COUNT [INTERVAL]
+# gcode_shell_command only appends PARAMS to the command line, so the burst
+# command JSON is built here from the arguments.
+
+COUNT="${1:-5}"
+INTERVAL="${2:-0.2}"
+
+# Validate the arguments before they end up in the JSON payload
+if ! [[ "$COUNT" =~ ^[0-9]+$ ]] || [ "$COUNT" -lt 1 ]; then
+    echo "Error: COUNT must be a positive integer, got '$COUNT'" >&2
+    exit 1
+fi
+if ! [[ "$INTERVAL" =~ ^[0-9]*\.?[0-9]+$ ]]; then
+    echo "Error: INTERVAL must be a number of seconds, got '$INTERVAL'" >&2
+    exit 1
+fi
+
+# Publish to MQTT
+mosquitto_pub -h 192.168.1.215 -t "dakash/camera/command" -m "{\"command\":\"burst\",\"count\":$COUNT,\"interval\":$INTERVAL}"
+
+# Check if the publish was successful
+if [ $? -ne 0 ]; then
+    echo "Error: Failed to publish to MQTT" >&2
+    exit 1
+fi